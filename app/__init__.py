@@ -31,6 +31,10 @@ def create_app(config_name=None):
     CORS(app)
     Session(app)
     
+    # Submissions rejected by fair-share admission control get a 429
+    from .admission import AdmissionRejected, admission_rejected_response
+    app.register_error_handler(AdmissionRejected, admission_rejected_response)
+    
     # Initialize managers (these don't need app context)
     from .session_manager import SessionManager
     from .storage_manager import StorageManager
@@ -0,0 +1,350 @@
+"""
+Cost-aware admission control for RobustRepo v2.0
+
+Jobs used to share one Celery queue and a flat rate limit, so a small repo
+waited behind a monorepo and cheap jobs were throttled as hard as expensive
+ones. Before a job is enqueued we estimate its cost from a file listing
+and:
+
+- route it to the small, medium or large queue, each served by workers with
+  their own concurrency
+- charge it against the submitting client's fair share. Clients with heavy
+  recent usage get a lower broker priority, and a client whose in-flight cost
+  exceeds its cap is rejected until earlier jobs finish.
+
+Inputs the submitter did not measure (remote repositories, local paths) are
+measured in the background (CostEstimateCache), so a submit request never
+waits on a clone or a tree walk.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import redis
+from redis.exceptions import RedisError
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+SMALL, MEDIUM, LARGE = 'small', 'medium', 'large'
+
+# Celery queue per size tier
+TIER_QUEUES = {
+    SMALL: 'repo_small',
+    MEDIUM: 'repo_medium',
+    LARGE: 'repo_large',
+}
+
+# Fair-share units charged per tier
+TIER_COSTS = {
+    SMALL: 1,
+    MEDIUM: 5,
+    LARGE: 25,
+}
+
+# Lowest broker priority (the Redis transport treats 0 as the highest)
+LOWEST_PRIORITY = 9
+
+
+class AdmissionRejected(Exception):
+    """Raised when a client has too much work in flight"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def admission_rejected_response(error: AdmissionRejected):
+    """Flask error handler answering a rejected submission with 429 and Retry-After"""
+    from flask import jsonify
+    return (jsonify({'error': str(error), 'retry_after': error.retry_after}), 429,
+            {'Retry-After': str(error.retry_after)})
+
+
+@dataclass
+class CostEstimate:
+    """Pre-flight size of a repository"""
+    file_count: Optional[int] = None
+    total_bytes: Optional[int] = None
+    source: str = 'unknown'
+
+    @property
+    def tier(self) -> str:
+        # Without a listing assume the middle tier rather than starving or flooding small workers
+        if self.file_count is None and self.total_bytes is None:
+            return MEDIUM
+        files = self.file_count or 0
+        size = self.total_bytes or 0
+        if files <= Config.ADMISSION_SMALL_MAX_FILES and size <= Config.ADMISSION_SMALL_MAX_BYTES:
+            return SMALL
+        if files <= Config.ADMISSION_MEDIUM_MAX_FILES and size <= Config.ADMISSION_MEDIUM_MAX_BYTES:
+            return MEDIUM
+        return LARGE
+
+    @property
+    def queue(self) -> str:
+        return TIER_QUEUES[self.tier]
+
+    @property
+    def cost(self) -> int:
+        return TIER_COSTS[self.tier]
+
+
+def estimate_directory(path: str) -> CostEstimate:
+    """Count files and bytes under a local directory, skipping .git"""
+    file_count = 0
+    total_bytes = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for name in files:
+            try:
+                total_bytes += os.path.getsize(os.path.join(root, name))
+                file_count += 1
+            except OSError:
+                continue
+    return CostEstimate(file_count, total_bytes, 'listing')
+
+
+def estimate_remote_repository(repo_url: str, branch: Optional[str] = None,
+                               timeout: Optional[int] = None) -> CostEstimate:
+    """Estimate a remote repository from `git ls-tree -l` on a blobless clone
+
+    The clone fetches commits and trees only, so this costs a fraction of a
+    full clone. Returns an unknown estimate if git fails or times out.
+    """
+    timeout = timeout or Config.ADMISSION_ESTIMATE_TIMEOUT
+    temp_dir = tempfile.mkdtemp(prefix='repo2file_estimate_')
+    try:
+        clone_cmd = ['git', 'clone', '--filter=blob:none', '--no-checkout', '--depth', '1', '--quiet']
+        if branch:
+            clone_cmd.extend(['--branch', branch])
+        clone_cmd.extend([repo_url, temp_dir])
+
+        deadline = time.monotonic() + timeout
+        subprocess.run(clone_cmd, capture_output=True, check=True, timeout=timeout)
+        result = subprocess.run(
+            ['git', '-C', temp_dir, 'ls-tree', '-r', '-l', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            timeout=max(1, deadline - time.monotonic())
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"Could not estimate size of {repo_url}: {e}")
+        return CostEstimate()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    file_count = 0
+    total_bytes = 0
+    for line in result.stdout.splitlines():
+        # <mode> <type> <object> <size>\t<path>; submodules report size '-'
+        meta = line.split('\t', 1)[0].split()
+        if len(meta) == 4 and meta[1] == 'blob':
+            file_count += 1
+            if meta[3].isdigit():
+                total_bytes += int(meta[3])
+    return CostEstimate(file_count, total_bytes, 'ls-tree')
+
+
+def measure_input(input_repo_type: str, input_repo_ref: str,
+                  github_branch: Optional[str] = None) -> CostEstimate:
+    """Estimate an input by cloning or walking it; takes seconds on large inputs"""
+    if input_repo_type == 'github_url':
+        return estimate_remote_repository(input_repo_ref, github_branch)
+    if input_repo_type == 'local_path' and os.path.isdir(input_repo_ref):
+        return estimate_directory(input_repo_ref)
+    return CostEstimate()
+
+
+class CostEstimateCache:
+    """Input size estimates, measured off the request path and shared through Redis
+
+    A blobless clone or a walk of a large tree is too slow to run inside a
+    submit request. On a miss, estimate() schedules the measurement on a
+    background thread and returns an unknown estimate, which is admitted on
+    the middle tier; later submissions of the same input are routed by the
+    stored result. A pending marker keeps web workers from measuring the
+    same input at once.
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cost_estimate')
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 prefix: str = 'betterrepo2file:cost_estimate:'):
+        self._redis = redis_client
+        self.prefix = prefix
+        self.ttl = Config.ADMISSION_ESTIMATE_CACHE_TTL
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.from_url(Config.REDIS_URL)
+        return self._redis
+
+    def _key(self, input_repo_type: str, input_repo_ref: str, github_branch: Optional[str]) -> str:
+        digest = hashlib.sha256(
+            f"{input_repo_type}\0{input_repo_ref}\0{github_branch or ''}".encode('utf-8')).hexdigest()
+        return f"{self.prefix}{digest}"
+
+    def estimate(self, input_repo_type: str, input_repo_ref: str,
+                 github_branch: Optional[str] = None) -> CostEstimate:
+        """The stored estimate of an input, or an unknown one while it is being measured"""
+        key = self._key(input_repo_type, input_repo_ref, github_branch)
+        try:
+            raw = self.redis.get(key)
+            if raw:
+                return CostEstimate(**json.loads(raw))
+            # The marker outlives a measurement that hits its timeout
+            if not self.redis.set(f"{key}:pending", 1, nx=True, ex=2 * Config.ADMISSION_ESTIMATE_TIMEOUT):
+                return CostEstimate()
+        except RedisError as e:
+            logger.warning(f"Cost estimate cache unavailable: {e}")
+            return CostEstimate()
+
+        self._executor.submit(self._measure, key, input_repo_type, input_repo_ref, github_branch)
+        return CostEstimate()
+
+    def _measure(self, key: str, input_repo_type: str, input_repo_ref: str, github_branch: Optional[str]):
+        try:
+            estimate = measure_input(input_repo_type, input_repo_ref, github_branch)
+            if estimate.source != 'unknown':
+                self.redis.set(key, json.dumps(asdict(estimate)), ex=self.ttl)
+            self.redis.delete(f"{key}:pending")
+        except Exception as e:
+            logger.warning(f"Could not measure {input_repo_ref}: {e}")
+
+
+def estimate_job_cost(input_repo_type: str, input_repo_ref: str, github_branch: Optional[str] = None,
+                      estimate_cache: Optional[CostEstimateCache] = None) -> CostEstimate:
+    """Estimate for inputs whose size the caller did not measure, without blocking on it"""
+    if input_repo_type not in ('github_url', 'local_path'):
+        return CostEstimate()
+    return (estimate_cache or CostEstimateCache()).estimate(input_repo_type, input_repo_ref, github_branch)
+
+
+def request_owner() -> Optional[str]:
+    """Identify the client behind the current Flask request for fair sharing"""
+    from flask import has_request_context, request
+    if not has_request_context():
+        return None
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    return f"addr:{request.remote_addr or 'unknown'}"
+
+
+class FairShareLimiter:
+    """Per-client in-flight cost cap and usage-based priority, tracked in Redis
+
+    Each client has a hash of in-flight job costs and a sorted set of their
+    deadlines, so jobs whose worker died without releasing stop counting
+    once the deadline passes. Recent usage is a counter that expires after
+    the usage window and sets the broker priority of new jobs.
+    """
+
+    # KEYS: costs hash, deadlines zset, usage counter
+    # ARGV: job_id, cost, now, deadline, max_inflight, usage_window, units_per_priority_step, ttl
+    _ADMIT_SCRIPT = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+    for _, job in ipairs(expired) do
+        redis.call('HDEL', KEYS[1], job)
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+
+    local inflight = 0
+    for _, cost in ipairs(redis.call('HVALS', KEYS[1])) do
+        inflight = inflight + tonumber(cost)
+    end
+
+    local cost = tonumber(ARGV[2])
+    if inflight > 0 and inflight + cost > tonumber(ARGV[5]) then
+        local earliest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+        return {-1, inflight, earliest[2] or ARGV[4]}
+    end
+
+    redis.call('HSET', KEYS[1], ARGV[1], cost)
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[8])
+    redis.call('EXPIRE', KEYS[2], ARGV[8])
+
+    local usage = redis.call('INCRBY', KEYS[3], cost)
+    if usage == cost then
+        redis.call('EXPIRE', KEYS[3], ARGV[6])
+    end
+    return {math.floor((usage - cost) / tonumber(ARGV[7])), inflight + cost, 0}
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 prefix: str = 'betterrepo2file:fair_share:'):
+        self._redis = redis_client
+        self.prefix = prefix
+        self.max_inflight_cost = Config.FAIR_SHARE_MAX_INFLIGHT_COST
+        self.usage_window = Config.FAIR_SHARE_USAGE_WINDOW
+        self.units_per_priority_step = Config.FAIR_SHARE_UNITS_PER_PRIORITY_STEP
+        # A job stops counting against its owner after this long even if never released
+        self.job_deadline = Config.FAIR_SHARE_JOB_DEADLINE
+        # Jobs usually finish long before their deadline, so rejected clients retry sooner
+        self.retry_after = Config.FAIR_SHARE_RETRY_AFTER
+        self._admit = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.from_url(Config.REDIS_URL)
+        return self._redis
+
+    def _keys(self, owner: str):
+        return [
+            f"{self.prefix}costs:{owner}",
+            f"{self.prefix}deadlines:{owner}",
+            f"{self.prefix}usage:{owner}",
+        ]
+
+    def admit(self, owner: str, job_id: str, cost: int) -> int:
+        """Charge a job to its owner and return its broker priority
+
+        Raises AdmissionRejected if the owner already has too much in flight.
+        A client with nothing in flight is always admitted, however large
+        the job.
+        """
+        if self._admit is None:
+            self._admit = self.redis.register_script(self._ADMIT_SCRIPT)
+
+        now = time.time()
+        try:
+            status, inflight, earliest = self._admit(
+                keys=self._keys(owner),
+                args=[job_id, cost, now, now + self.job_deadline, self.max_inflight_cost,
+                      self.usage_window, self.units_per_priority_step, self.job_deadline]
+            )
+        except RedisError as e:
+            logger.warning(f"Fair-share accounting unavailable, admitting without limits: {e}")
+            return 0
+
+        if int(status) < 0:
+            retry_after = max(1, min(int(float(earliest) - now), self.retry_after))
+            raise AdmissionRejected(
+                f"Too much work in flight ({int(inflight)} of {self.max_inflight_cost} units); "
+                f"retry when earlier jobs finish",
+                retry_after=retry_after
+            )
+        return min(int(status), LOWEST_PRIORITY)
+
+    def release(self, owner: str, job_id: str):
+        """Stop counting a finished job against its owner"""
+        costs_key, deadlines_key, _ = self._keys(owner)
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hdel(costs_key, job_id)
+            pipe.zrem(deadlines_key, job_id)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to release fair-share slot for {job_id}: {e}")
@@ -7,6 +7,7 @@ import shutil
 import time
 import atexit
 import json
+import html
 from pathlib import Path
 
 # Add parent directory to Python path for module imports
@@ -27,15 +28,27 @@ if __name__ == '__main__':
     from test_executor import test_executor, detect_test_framework, run_tests
     from job_manager import JobManager
     from storage_manager import StorageManager
+    from registry import create_registry, END_OF_STREAM
+    from result_cache import hash_directory
+    from admission import AdmissionRejected, admission_rejected_response, estimate_directory
+    from output_download import output_download_response
 else:
     from .logger import iteration_logger, log_iteration_start, log_step, log_error, log_metric, log_iteration_end
     from .diff_visualizer import diff_visualizer, get_file_diff, get_git_diff
     from .test_executor import test_executor, detect_test_framework, run_tests
     from .job_manager import JobManager
     from .storage_manager import StorageManager
+    from .registry import create_registry, END_OF_STREAM
+    from .result_cache import hash_directory
+    from .admission import AdmissionRejected, admission_rejected_response, estimate_directory
+    from .output_download import output_download_response
+
+from repo2file.cancellation import CancellationToken, ProcessingCancelled, run_process
+from repo2file.output_index import OutputIndex
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
+app.register_error_handler(AdmissionRejected, admission_rejected_response)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size
 app.config['UPLOAD_FOLDER'] = os.path.join(tempfile.gettempdir(), 'repo2file_uploads')
 app.config['JOBS_FOLDER'] = os.path.join(tempfile.gettempdir(), 'repo2file_jobs')
@@ -49,37 +62,32 @@ app.config['EXCLUDE_FILE'] = os.path.join(os.path.dirname(os.path.dirname(os.pat
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['JOBS_FOLDER'], exist_ok=True)
 
-# Job storage
-jobs = {}
-job_queues = {}
-
-# Session storage for Vibe Coder Loop
-sessions = {}
+# Job, progress queue and Vibe Coder Loop session storage, shared by all web workers
+registry = create_registry(os.environ.get('REDIS_URL'))
 
 def save_session_data(session_id: str, session_data: dict):
-    """Save session data to file"""
-    session_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'session_{session_id}')
-    os.makedirs(session_dir, exist_ok=True)
-    
-    session_file = os.path.join(session_dir, 'session_data.json')
-    with open(session_file, 'w') as f:
-        json.dump(session_data, f, indent=2)
+    """Save session data to the shared registry"""
+    registry.save_session(session_id, session_data)
 
 def load_session_data(session_id: str) -> dict:
-    """Load session data from file"""
+    """Load session data from the shared registry, falling back to legacy session files"""
+    session_data = registry.get_session(session_id)
+    if session_data:
+        return session_data
+    
     session_file = os.path.join(app.config['UPLOAD_FOLDER'], f'session_{session_id}', 'session_data.json')
     if os.path.exists(session_file):
         with open(session_file, 'r') as f:
-            return json.load(f)
+            session_data = json.load(f)
+        registry.save_session(session_id, session_data)
+        return session_data
     return None
 
 def send_progress(job_id, phase, current=0, total=0):
     """Send progress update to the job queue"""
-    if job_id in job_queues:
-        jobs[job_id]['phase'] = phase
-        jobs[job_id]['current'] = current
-        jobs[job_id]['total'] = total
-        job_queues[job_id].put({
+    if registry.job_exists(job_id):
+        registry.update_job(job_id, phase=phase, current=current, total=total)
+        registry.progress_queue(job_id).put({
             'phase': phase,
             'current': current,
             'total': total
@@ -93,6 +101,11 @@ def process_job(job_id, job_folder, vibe, stage, repo_file, planner_output, prev
     iteration_description = f"Stage {stage} - {repo_url or repo_path_input or 'unknown repo'}"
     log_iteration_start(job_id, iteration_description)
     
+    # Set by /api/cancel/<job_id>, possibly on another web worker
+    cancel_token = CancellationToken(
+        check=lambda: bool((registry.get_job(job_id) or {}).get('cancel_requested'))
+    )
+    
     try:
         send_progress(job_id, 'extracting', 0, 0)
         log_step("Starting extraction phase", {
@@ -126,12 +139,12 @@ def process_job(job_id, job_folder, vibe, stage, repo_file, planner_output, prev
                 if repo_branch:
                     # Clone specific branch
                     print(f"Cloning branch: {repo_branch}")
-                    result = subprocess.run(['git', 'clone', '-b', repo_branch, repo_url, repo_path], 
-                                  check=True, capture_output=True, text=True)
+                    result = run_process(['git', 'clone', '-b', repo_branch, repo_url, repo_path],
+                                         cancel_token, check=True, text=True)
                 else:
                     # Clone default branch
-                    result = subprocess.run(['git', 'clone', repo_url, repo_path], 
-                                  check=True, capture_output=True, text=True)
+                    result = run_process(['git', 'clone', repo_url, repo_path],
+                                         cancel_token, check=True, text=True)
                 print(f"Clone successful: {result}")
                 log_step("Repository cloned successfully", {"stdout": result.stdout[:500]})
             except subprocess.CalledProcessError as e:
@@ -243,10 +256,10 @@ def process_job(job_id, job_folder, vibe, stage, repo_file, planner_output, prev
             else:
                 # Try to find a previous output file
                 # Check if there's an existing Stage B output in the same session
-                session_id = jobs.get(job_id, {}).get('session_id')
+                session_id = (registry.get_job(job_id) or {}).get('session_id')
                 if session_id:
-                    for other_job_id, job_data in jobs.items():
-                        if job_data.get('session_id') == session_id and other_job_id != job_id:
+                    for other_job_id in registry.job_ids_for_session(session_id):
+                        if other_job_id != job_id:
                             other_job_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'job_{other_job_id}')
                             stage_b_file = os.path.join(other_job_folder, f'output_{other_job_id}.txt')
                             if os.path.exists(stage_b_file):
@@ -304,40 +317,25 @@ def process_job(job_id, job_folder, vibe, stage, repo_file, planner_output, prev
         working_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
         try:
-            # Use subprocess with separate pipes to avoid buffer issues
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=working_dir,
-                bufsize=1
-            )
+            # Killed along with its children on cancellation or timeout
+            completed = run_process(cmd, cancel_token, timeout=600, text=True, cwd=working_dir)
             
-            # Read output in real-time to avoid buffer overflow
             stdout_lines = []
             stderr_lines = []
-            
-            # Use communicate() to avoid deadlock
-            stdout, stderr = process.communicate(timeout=600)
+            stdout, stderr = completed.stdout, completed.stderr
             
             if stdout:
                 stdout_lines = stdout.splitlines()
             if stderr:
                 stderr_lines = stderr.splitlines()
             
-            process_return_code = process.returncode
+            process_return_code = completed.returncode
             
         except subprocess.TimeoutExpired:
             log_error("Command timed out after 10 minutes", None)
-            process.terminate()
-            process.wait()
             raise Exception("Process timed out after 10 minutes")
         except Exception as e:
             log_error(f"Failed to run command: {str(e)}", e)
-            if 'process' in locals():
-                process.terminate()
-                process.wait()
             raise Exception(f"Failed to run process: {str(e)}")
         
         # Create a result object similar to subprocess.run
@@ -413,34 +411,42 @@ def process_job(job_id, job_folder, vibe, stage, repo_file, planner_output, prev
             print(f"Error reading output file: {e}")
             raise Exception(f"Failed to read output file: {e}")
         
-        # Parse sections (simplified for now)
+        # Parse sections; indexed outputs are read by offset rather than scanned
+        output_index = OutputIndex.load(Path(output_file))
         sections = {
             'copy_text': extract_copy_section(full_content, stage),
-            'manifest_html': extract_manifest(full_content),
-            'skipped_md': extract_skipped_report(full_content),
-            'stats': extract_token_stats(full_content)
+            'manifest_html': extract_manifest(full_content, output_index),
+            'skipped_md': extract_skipped_report(full_content, output_index),
+            'stats': extract_token_stats(full_content, output_index)
         }
         
         # Update job result
-        jobs[job_id]['status'] = 'completed'
-        jobs[job_id]['result'] = sections
+        registry.update_job(job_id, status='completed', result=sections)
         
         # Send completed phase before ending
         print(f"Job {job_id} completed successfully, sending completed signal")
         send_progress(job_id, 'completed', 100, 100)
         log_iteration_end('completed')
+    
+    except ProcessingCancelled:
+        print(f"Job {job_id} cancelled")
+        registry.update_job(job_id, status='cancelled')
+        send_progress(job_id, 'cancelled', 0, 0)
+        log_iteration_end('cancelled')
+        # Free the disk used by a clone or extracted upload right away
+        if repo_path and repo_path != repo_path_input:
+            shutil.rmtree(repo_path, ignore_errors=True)
         
     except Exception as e:
         print(f"Job {job_id} failed with error: {str(e)}")
-        jobs[job_id]['status'] = 'error'
-        jobs[job_id]['error'] = str(e)
+        registry.update_job(job_id, status='error', error=str(e))
         send_progress(job_id, 'error', 0, 0)
         log_error(f"Job {job_id} failed", e)
         log_iteration_end('failed')
     
     finally:
-        if job_id in job_queues:
-            job_queues[job_id].put('END')
+        if registry.job_exists(job_id):
+            registry.progress_queue(job_id).put(END_OF_STREAM)
 
 def extract_copy_section(content, stage):
     """Extract the section that should be copied to AI"""
@@ -455,13 +461,19 @@ def extract_copy_section(content, stage):
         # Extract iteration section
         return content
 
-def extract_manifest(content):
+def extract_manifest(content, output_index=None):
     """Extract and format the manifest as HTML"""
-    # Simple extraction for now
+    manifest = output_index.section('manifest') if output_index else None
+    if manifest is not None:
+        return "<pre>" + html.escape(manifest) + "</pre>"
+    # Outputs without an index or manifest: show the start of the output
     return "<pre>" + content[:5000] + "</pre>"
 
-def extract_skipped_report(content):
+def extract_skipped_report(content, output_index=None):
     """Extract the skipped files report"""
+    if output_index is not None:
+        return (output_index.section('skipped_files') or "No files were skipped.").strip()
+    
     # Look for skip report section
     if "SKIPPED FILES REPORT" in content:
         start = content.find("SKIPPED FILES REPORT")
@@ -469,18 +481,20 @@ def extract_skipped_report(content):
         return content[start:end] if end > start else content[start:]
     return "No files were skipped."
 
-def extract_token_stats(content):
+def extract_token_stats(content, output_index=None):
     """Extract token usage statistics"""
-    # Simple extraction for now
     stats = {
         'used': 0,
         'budget': 2000000
     }
     
-    # Look for token stats
-    if "Token usage:" in content:
-        # Parse actual stats from output
-        pass
+    # Recorded in the output's index
+    processing_stats = output_index.get('stats') if output_index else None
+    if processing_stats:
+        stats['used'] = processing_stats['tokens_used']
+        stats['budget'] = processing_stats['token_budget']
+        stats['files_processed'] = processing_stats['files_processed']
+        stats['total_files'] = processing_stats['total_files']
     
     return stats
 
@@ -514,8 +528,6 @@ def loop_dashboard():
 def analyze():
     """Start a new analysis job"""
     job_id = str(uuid.uuid4())
-    job_queue = queue.Queue()
-    job_queues[job_id] = job_queue
     
     # Get form data
     vibe = request.form.get('vibe', '')
@@ -536,7 +548,7 @@ def analyze():
     if not session_id and vibe and (stage == 'A' or (stage == 'B' and not previous_output)):
         # Create new session for vibe coder workflow
         session_id = str(uuid.uuid4())
-        sessions[session_id] = {
+        new_session = {
             'id': session_id,
             'feature_vibe': vibe,
             'repo_type': repo_type,
@@ -555,17 +567,19 @@ def analyze():
             try:
                 import git
                 repo = git.Repo(repo_path)
-                sessions[session_id]['initial_sha'] = repo.head.commit.hexsha
-                sessions[session_id]['current_sha'] = repo.head.commit.hexsha
+                new_session['initial_sha'] = repo.head.commit.hexsha
+                new_session['current_sha'] = repo.head.commit.hexsha
             except Exception as e:
                 print(f"Warning: Could not get git SHA: {e}")
+        
+        registry.save_session(session_id, new_session)
     
     # Create job folder
     job_folder = os.path.join(app.config['JOBS_FOLDER'], job_id)
     os.makedirs(job_folder, exist_ok=True)
     
     # Initialize job status
-    jobs[job_id] = {
+    registry.create_job(job_id, {
         'status': 'processing',
         'phase': 'initializing',
         'current': 0,
@@ -573,12 +587,14 @@ def analyze():
         'error': None,
         'result': None,
         'session_id': session_id if session_id else None
-    }
+    })
     
     # Update session if exists
-    if session_id and session_id in sessions:
-        sessions[session_id]['current_phase'] = f'processing_{stage}'
-        sessions[session_id]['latest_job_id'] = job_id
+    if session_id and registry.session_exists(session_id):
+        registry.update_session(session_id, {
+            'current_phase': f'processing_{stage}',
+            'latest_job_id': job_id
+        })
     
     # Start processing in background thread
     thread = threading.Thread(target=process_job, args=(job_id, job_folder, vibe, stage, repo_file, planner_output, previous_output, feedback_log, repo_type, repo_path, repo_url, repo_branch))
@@ -593,15 +609,15 @@ def analyze():
 def status(job_id):
     """Server-sent events for job progress"""
     def generate():
-        if job_id not in job_queues:
+        if not registry.job_exists(job_id):
             yield f"data: {json.dumps({'error': 'Invalid job ID'})}\n\n"
             return
             
-        q = job_queues[job_id]
+        q = registry.progress_queue(job_id)
         while True:
             try:
                 event = q.get(timeout=30)  # 30 second timeout
-                if event == 'END':
+                if event == END_OF_STREAM:
                     break
                 yield f"data: {json.dumps(event)}\n\n"
             except queue.Empty:
@@ -609,6 +625,18 @@ def status(job_id):
     
     return Response(generate(), mimetype='text/event-stream')
 
+@app.route('/api/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    """Ask a running job to stop; its worker thread kills the repo2file process"""
+    job = registry.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Invalid job ID'}), 404
+    if job.get('status') in ('completed', 'error', 'cancelled'):
+        return jsonify({'error': f"Job already {job['status']}"}), 409
+    
+    registry.update_job(job_id, cancel_requested=True)
+    return jsonify({'job_id': job_id, 'status': 'cancelling'}), 202
+
 @app.route('/api/result/<job_id>')
 def result(job_id):
     """Get the final result of a Celery job with MinIO output file references"""
@@ -662,13 +690,7 @@ def result(job_id):
 @app.route('/api/v1/loop/status/<session_id>')
 def loop_status(session_id):
     """Get the current status of a vibe coder loop session"""
-    # Try to load from memory first, then from file
-    session = sessions.get(session_id)
-    if not session:
-        session = load_session_data(session_id)
-        if session:
-            sessions[session_id] = session  # Cache in memory
-    
+    session = load_session_data(session_id)
     if not session:
         return jsonify({'error': 'Invalid session ID'}), 404
     
@@ -703,11 +725,10 @@ def loop_status(session_id):
 @app.route('/api/v1/loop/analyze_changes/<session_id>', methods=['POST'])
 def analyze_changes(session_id):
     """Analyze recent commits and changes for a vibe coder loop session"""
-    if session_id not in sessions:
+    session = load_session_data(session_id)
+    if not session:
         return jsonify({'error': 'Invalid session ID'}), 404
     
-    session = sessions[session_id]
-    
     # Only analyze if we have a local repository
     if session['repo_type'] != 'local' or not session.get('repo_path'):
         return jsonify({'error': 'Only local repositories supported for analysis'}), 400
@@ -719,6 +740,7 @@ def analyze_changes(session_id):
     try:
         # Update the current phase
         session['current_phase'] = 'analyzing_changes'
+        registry.update_session(session_id, {'current_phase': 'analyzing_changes'})
         
         # Get the diff summary
         from repo2file.git_analyzer import GitAnalyzer
@@ -806,11 +828,10 @@ def analyze_changes(session_id):
 @app.route('/api/v1/loop/generate_section_c/<session_id>', methods=['POST'])
 def generate_section_c(session_id):
     """Generate Section C (Iteration Brief) for a vibe coder loop session"""
-    if session_id not in sessions:
+    session = load_session_data(session_id)
+    if not session:
         return jsonify({'error': 'Invalid session ID'}), 404
     
-    session = sessions[session_id]
-    
     # Ensure we have at least one iteration
     if not session.get('iterations'):
         return jsonify({'error': 'No iterations available. Run /analyze_changes first.'}), 400
@@ -820,12 +841,30 @@ def generate_section_c(session_id):
         planner_output = data.get('planner_output')
         user_feedback = data.get('user_feedback')
         
-        # Create an instance of RepoToFileGenerator
-        from repo2file.dump_ultra import RepoToFileGenerator
-        repo2file_gen = RepoToFileGenerator()
+        if session['repo_type'] != 'local' or not session.get('repo_path'):
+            return jsonify({'error': 'Only local repositories supported for iteration briefs'}), 400
+        
+        # Scope the brief to the diff of the latest analyzed iteration
+        from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+        from repo2file.git_analyzer import GitAnalyzer
+        latest_iteration = session['iterations'][-1]
+        processor = UltraRepo2File(ProcessingProfile(
+            name="iteration",
+            token_budget=None,
+            model="gemini-1.5-pro",
+            enable_git_insights=True
+        ))
+        repo_path = Path(session['repo_path'])
+        processor.git_analyzer = GitAnalyzer(repo_path)
         
         # Generate the iteration brief (Section C)
-        section_c_content = repo2file_gen.generate_iteration_brief(session, planner_output, user_feedback)
+        section_c_content = processor.generate_iteration_brief(
+            repo_path,
+            {'feature_vibe': session.get('feature_vibe'), 'planner_output': planner_output},
+            user_feedback or "",
+            base_sha=latest_iteration.get('old_sha'),
+            head_sha=latest_iteration.get('new_sha')
+        )
         
         # Save Section C to file  
         iteration_num = len(session['iterations'])
@@ -855,22 +894,16 @@ def generate_section_c(session_id):
         
     except Exception as e:
         app.logger.error(f"Error generating Section C: {str(e)}")
-        session['current_phase'] = 'error_generating_section_c'
+        registry.update_session(session_id, {'current_phase': 'error_generating_section_c'})
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/v1/loop/status/<session_id>', methods=['GET'])
 def get_loop_status(session_id):
     """Get the current status of a vibe coder loop session"""
-    if session_id not in sessions:
+    session = load_session_data(session_id)
+    if not session:
         return jsonify({'error': 'Invalid session ID'}), 404
     
-    session = sessions[session_id]
-    
-    # Load full session data from file if available
-    session_data = load_session_data(session_id)
-    if session_data:
-        session = session_data
-    
     # Prepare response data
     response_data = {
         'session_id': session_id,
@@ -919,6 +952,8 @@ def process():
         storage_manager = StorageManager()
         
         github_branch = None  # Initialize variable
+        content_hash = None  # Set for uploads, used as the result cache address
+        cost_estimate = None  # Set for uploads, used for queue routing
         
         # Determine input type and prepare input reference
         if 'files[]' in request.files:
@@ -939,6 +974,8 @@ def process():
                     file.save(file_path)
             
             # Upload to MinIO
+            content_hash = hash_directory(temp_dir)
+            cost_estimate = estimate_directory(temp_dir)
             zip_path = shutil.make_archive(temp_dir, 'zip', temp_dir)
             minio_key = storage_manager.upload_data_stream(
                 object_name=f"uploads/{os.path.basename(zip_path)}",
@@ -1005,7 +1042,9 @@ def process():
             github_branch=github_branch if input_repo_type == 'github_url' else None,
             processing_mode=processing_mode,
             output_format='text',
-            additional_options=additional_options
+            additional_options=additional_options,
+            content_hash=content_hash,
+            cost_estimate=cost_estimate
         )
         
         return jsonify({
@@ -1014,6 +1053,8 @@ def process():
             "processing_mode": processing_mode
         })
     
+    except AdmissionRejected:
+        raise  # Answered by admission_rejected_response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1044,14 +1085,7 @@ def download(job_id):
             minio_key = list(output_files.values())[0]
         
         # Download from MinIO and stream to client
-        stream = storage_manager.download_stream(minio_key)
-        return Response(
-            stream,
-            mimetype='text/plain',
-            headers={
-                'Content-Disposition': 'attachment; filename=repo2file_output.txt'
-            }
-        )
+        return output_download_response(storage_manager, minio_key)
         
     except Exception as e:
         abort(404)
@@ -1347,9 +1381,8 @@ def run_tests():
                 ]
                 
                 # Also check all job folders for matching session_id
-                for job_id, job_data in jobs.items():
-                    if job_data.get('session_id') == session_id:
-                        folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
+                for job_id in registry.job_ids_for_session(session_id):
+                    folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
                 
                 # Check each folder for repo
                 for folder in folders_to_check:
@@ -1925,9 +1958,8 @@ def get_commits():
                 ]
                 
                 # Also check all job folders for matching session_id
-                for job_id, job_data in jobs.items():
-                    if job_data.get('session_id') == session_id:
-                        folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
+                for job_id in registry.job_ids_for_session(session_id):
+                    folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
                 
                 # Check each folder for repo
                 for folder in folders_to_check:
@@ -2014,10 +2046,9 @@ def get_diff():
                 ]
                 
                 # Also check all job folders for matching session_id
-                for job_id, job_data in jobs.items():
-                    if job_data.get('session_id') == session_id:
-                        folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
-                        folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}', 'repo'))
+                for job_id in registry.job_ids_for_session(session_id):
+                    folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
+                    folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}', 'repo'))
                 
                 # Check each folder for repo
                 for folder in folders_to_check:
@@ -2097,6 +2128,8 @@ def generate_context():
             'session_id': session_id
         })
         
+    except AdmissionRejected:
+        raise  # Answered by admission_rejected_response
     except Exception as e:
         print(f"Error in generate_context: {e}")
         import traceback
@@ -2233,15 +2266,14 @@ def check_session_repo():
     }
     
     # Check which jobs have this session ID
-    for job_id, job_data in jobs.items():
-        if job_data.get('session_id') == session_id:
-            result['jobs_with_session'].append(job_id)
-            
-            # Check if repo exists
-            job_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}')
-            repo_path = os.path.join(job_folder, 'repo')
-            if os.path.exists(repo_path):
-                result['repos_found'].append(repo_path)
+    for job_id in registry.job_ids_for_session(session_id):
+        result['jobs_with_session'].append(job_id)
+        
+        # Check if repo exists
+        job_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}')
+        repo_path = os.path.join(job_folder, 'repo')
+        if os.path.exists(repo_path):
+            result['repos_found'].append(repo_path)
     
     return jsonify(result)
 
@@ -2264,9 +2296,8 @@ def detect_docker():
                 os.path.join(app.config['UPLOAD_FOLDER'], f'job_{session_id}')
             ]
             
-            for job_id, job_data in jobs.items():
-                if job_data.get('session_id') == session_id:
-                    folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
+            for job_id in registry.job_ids_for_session(session_id):
+                folders_to_check.append(os.path.join(app.config['UPLOAD_FOLDER'], f'job_{job_id}'))
             
             for folder in folders_to_check:
                 potential_repo = os.path.join(folder, 'repo')
@@ -2593,7 +2624,7 @@ def get_file_diff_api():
 def get_session_metrics(session_id):
     """Get detailed metrics for a session"""
     try:
-        session = sessions.get(session_id)
+        session = load_session_data(session_id)
         if not session:
             return jsonify({'error': 'Session not found'}), 404
         
@@ -0,0 +1,56 @@
+"""
+Job cancellation for RobustRepo v2.0
+
+Revoking a Celery task with terminate=True killed the worker process
+mid-flight: child processes were orphaned, temp dirs and MinIO shard
+artifacts leaked, and result-cache and fair-share claims were held until
+they expired. Cancellation is now cooperative. JobManager.cancel_job sets a
+flag in Redis, and every task for the job polls it through a
+CancellationToken (see repo2file/cancellation.py). Queued tasks exit as soon
+as they start, and running ones stop within a poll interval, killing their
+child processes and cleaning up on the way out.
+"""
+import logging
+from typing import Optional
+
+import redis
+from redis.exceptions import RedisError
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancellation:
+    """Per-job cancellation flags shared by the web app and all workers"""
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 prefix: str = 'betterrepo2file:cancel:'):
+        self._redis = redis_client
+        self.prefix = prefix
+        self.ttl = Config.CANCELLATION_TTL
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.from_url(Config.REDIS_URL)
+        return self._redis
+
+    def request(self, job_id: str):
+        """Ask every task of a job to stop; raises RedisError if Redis is unreachable"""
+        self.redis.set(f"{self.prefix}{job_id}", 1, ex=self.ttl)
+
+    def is_requested(self, job_id: str) -> bool:
+        try:
+            return bool(self.redis.exists(f"{self.prefix}{job_id}"))
+        except RedisError as e:
+            logger.warning(f"Could not check cancellation of {job_id}: {e}")
+            return False
+
+    def token(self, job_id: str):
+        """CancellationToken that is cancelled once cancellation of the job is requested"""
+        from repo2file.cancellation import CancellationToken
+        return CancellationToken(
+            check=lambda: self.is_requested(job_id),
+            poll_interval=Config.CANCELLATION_POLL_INTERVAL
+        )
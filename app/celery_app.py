@@ -10,7 +10,7 @@ def create_celery_app():
         'robusterepo',
         broker=Config.CELERY_BROKER_URL,
         backend=Config.CELERY_RESULT_BACKEND,
-        include=['app.tasks']
+        include=['app.tasks', 'app.sharded_tasks']
     )
     
     # Configure Celery
@@ -31,15 +31,31 @@ def create_celery_app():
         task_always_eager=False,
         task_store_eager_result=True,
         result_backend_transport_options={'master_name': 'mymaster'},
+        # Honour per-message priorities (0 is highest) set by fair-share admission control
+        broker_transport_options={'queue_order_strategy': 'priority', 'priority_steps': list(range(10))},
         beat_schedule={},  # No scheduled tasks for now
         task_routes={
             'app.tasks.process_repository_task': {'queue': 'celery'},
         },
+        # Repository jobs are sent to repo_small/repo_medium/repo_large by JobManager
+        # (see app/admission.py); per-client fair share replaces a global rate limit
         task_annotations={
             'app.tasks.process_repository_task': {
-                'rate_limit': '10/m',  # Max 10 repository processing tasks per minute
                 'time_limit': 300,     # 5 minute hard time limit
                 'soft_time_limit': 240  # 4 minute soft time limit
+            },
+            # Sharded ultra-mode pipeline; each task handles a bounded slice of the work
+            'plan_repository_shards_task': {
+                'time_limit': 300,
+                'soft_time_limit': 240
+            },
+            'scan_shard_task': {
+                'time_limit': 300,
+                'soft_time_limit': 240
+            },
+            'reduce_shards_task': {
+                'time_limit': 300,
+                'soft_time_limit': 240
             }
         }
     )
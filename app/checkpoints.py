@@ -0,0 +1,46 @@
+"""
+MinIO-backed stage checkpoints for RobustRepo v2.0
+
+Celery redelivers a job whose worker died (acks_late with
+reject_on_worker_lost) and tasks retry after a soft time limit. Keeping the
+UltraRepo2File stage checkpoints in MinIO under the job ID lets the next
+attempt resume on any worker instead of starting over.
+"""
+import json
+import logging
+from typing import Any, Optional
+
+from repo2file.checkpoint import CheckpointStore
+
+logger = logging.getLogger(__name__)
+
+# MinIO prefix for per-job checkpoints
+CHECKPOINT_PREFIX = 'checkpoints/'
+
+
+class MinioCheckpointStore(CheckpointStore):
+    """Checkpoints as JSON objects under checkpoints/<job_id>/"""
+
+    def __init__(self, storage_manager, job_id: str):
+        self.storage_manager = storage_manager
+        self.prefix = f"{CHECKPOINT_PREFIX}{job_id}/"
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}.json"
+
+    def load(self, name: str) -> Optional[Any]:
+        key = self._key(name)
+        try:
+            if not self.storage_manager.object_exists(key):
+                return None
+            return json.loads(self.storage_manager.download_data(key))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {key}: {e}")
+            return None
+
+    def save(self, name: str, data: Any):
+        payload = json.dumps(data, default=str).encode('utf-8')
+        self.storage_manager.upload_data(payload, self._key(name), content_type='application/json')
+
+    def clear(self):
+        self.storage_manager.delete_directory(self.prefix)
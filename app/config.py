@@ -1,5 +1,6 @@
 """Configuration module for BetterRepo2File v2.0 with Redis and Celery support"""
 import os
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -63,6 +64,8 @@ class Config:
     MINIO_SECRET_KEY = os.environ.get('MINIO_SECRET_KEY', 'minioadmin')
     MINIO_SECURE = os.environ.get('MINIO_SECURE', 'false').lower() == 'true'
     MINIO_BUCKET_NAME = os.environ.get('MINIO_BUCKET_NAME', 'betterrepo2file')
+    MINIO_PART_SIZE = int(os.environ.get('MINIO_PART_SIZE', str(16 * 1024 * 1024)))  # Multipart part size (>= 5 MiB)
+    MINIO_PARALLEL_UPLOADS = int(os.environ.get('MINIO_PARALLEL_UPLOADS', '4'))
     
     # Presigned URL settings
     PRESIGNED_URL_EXPIRATION = int(os.environ.get('PRESIGNED_URL_EXPIRATION', '3600'))  # 1 hour default
@@ -76,6 +79,43 @@ class Config:
     JOB_CLEANUP_INTERVAL = 3600  # 1 hour
     JOB_RETENTION_TIME = 3600  # Keep job data for 1 hour
     
+    # Result cache settings (content-addressed reuse of finished job outputs)
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', str(24 * 3600)))  # 24 hours
+    RESULT_CACHE_INFLIGHT_TTL = 10 * 60  # Longer than the processing task hard time limit
+    
+    # Sharded (map-reduce) processing for ultra mode: a planner splits the file
+    # list into shards that are scanned in parallel and reduced into one output
+    SHARDED_PROCESSING_ENABLED = os.environ.get('SHARDED_PROCESSING_ENABLED', 'true').lower() == 'true'
+    SHARD_MAX_BYTES = int(os.environ.get('SHARD_MAX_BYTES', str(8 * 1024 * 1024)))  # 8MB of source per shard
+    SHARD_MAX_FILES = int(os.environ.get('SHARD_MAX_FILES', '500'))
+    
+    # Admission control: jobs are routed to repo_small/repo_medium/repo_large
+    # queues by a pre-flight size estimate and charged against a per-client fair share
+    ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+    ADMISSION_SMALL_MAX_FILES = int(os.environ.get('ADMISSION_SMALL_MAX_FILES', '500'))
+    ADMISSION_SMALL_MAX_BYTES = int(os.environ.get('ADMISSION_SMALL_MAX_BYTES', str(5 * 1024 * 1024)))
+    ADMISSION_MEDIUM_MAX_FILES = int(os.environ.get('ADMISSION_MEDIUM_MAX_FILES', '5000'))
+    ADMISSION_MEDIUM_MAX_BYTES = int(os.environ.get('ADMISSION_MEDIUM_MAX_BYTES', str(100 * 1024 * 1024)))
+    ADMISSION_ESTIMATE_TIMEOUT = int(os.environ.get('ADMISSION_ESTIMATE_TIMEOUT', '20'))  # seconds
+    ADMISSION_ESTIMATE_CACHE_TTL = int(os.environ.get('ADMISSION_ESTIMATE_CACHE_TTL', '3600'))  # seconds
+    FAIR_SHARE_MAX_INFLIGHT_COST = int(os.environ.get('FAIR_SHARE_MAX_INFLIGHT_COST', '50'))  # small=1, medium=5, large=25
+    FAIR_SHARE_USAGE_WINDOW = int(os.environ.get('FAIR_SHARE_USAGE_WINDOW', '900'))  # 15 minutes
+    FAIR_SHARE_UNITS_PER_PRIORITY_STEP = int(os.environ.get('FAIR_SHARE_UNITS_PER_PRIORITY_STEP', '10'))
+    FAIR_SHARE_JOB_DEADLINE = 60 * 60  # Unreleased jobs stop counting after an hour
+    FAIR_SHARE_RETRY_AFTER = int(os.environ.get('FAIR_SHARE_RETRY_AFTER', '30'))  # Longest Retry-After on rejection, seconds
+    
+    # Stage checkpoints: a redelivered or retried ultra-mode job resumes from the
+    # last completed stage. In-process runs checkpoint to MinIO, subprocess runs
+    # to a local directory (which only survives on the same host)
+    CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', os.path.join(tempfile.gettempdir(), 'repo2file_checkpoints'))
+    CHECKPOINT_INTERVAL = int(os.environ.get('CHECKPOINT_INTERVAL', '30'))  # seconds between output checkpoints
+    CHECKPOINT_MAX_RETRIES = int(os.environ.get('CHECKPOINT_MAX_RETRIES', '3'))  # retries after a soft time limit
+    
+    # Cooperative cancellation: tasks poll a per-job Redis flag set by JobManager.cancel_job
+    CANCELLATION_POLL_INTERVAL = float(os.environ.get('CANCELLATION_POLL_INTERVAL', '0.5'))  # seconds
+    CANCELLATION_TTL = 60 * 60  # Longer than any task of the job can still be queued or running
+    
     # Security headers
     SECURITY_HEADERS = {
         'X-Content-Type-Options': 'nosniff',
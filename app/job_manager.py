@@ -4,14 +4,86 @@ Job Manager for RobustRepo v2.0 - Manages Celery task submission and tracking
 import uuid
 from typing import Optional, Dict, Any
 from .celery_app import celery_app
+from .config import Config
 from .logger import logger
+from .result_cache import ResultCache, build_cache_key, resolve_remote_commit
+from .admission import CostEstimate, CostEstimateCache, FairShareLimiter, estimate_job_cost, request_owner
+from .cancellation import JobCancellation
 from celery.result import AsyncResult
 
 class JobManager:
     """Manages asynchronous job submission and tracking via Celery"""
     
-    def __init__(self):
+    def __init__(self, result_cache: Optional[ResultCache] = None,
+                 fair_share: Optional[FairShareLimiter] = None,
+                 cost_estimates: Optional[CostEstimateCache] = None):
         self.celery_app = celery_app
+        self.result_cache = result_cache or (ResultCache() if Config.RESULT_CACHE_ENABLED else None)
+        self.fair_share = fair_share or (FairShareLimiter() if Config.ADMISSION_CONTROL_ENABLED else None)
+        self.cost_estimates = cost_estimates or CostEstimateCache()
+        self._storage_manager = None
+    
+    @property
+    def storage_manager(self):
+        """Storage manager used to check that cached outputs still exist"""
+        if self._storage_manager is None:
+            from .storage_manager import StorageManager
+            self._storage_manager = StorageManager(config={
+                'MINIO_ENDPOINT': Config.MINIO_ENDPOINT,
+                'MINIO_ACCESS_KEY': Config.MINIO_ACCESS_KEY,
+                'MINIO_SECRET_KEY': Config.MINIO_SECRET_KEY,
+                'MINIO_SECURE': Config.MINIO_SECURE,
+                'MINIO_BUCKET_NAME': Config.MINIO_BUCKET_NAME
+            })
+        return self._storage_manager
+    
+    def _resolve_snapshot_id(
+        self,
+        input_repo_type: str,
+        input_repo_ref: str,
+        github_branch: Optional[str],
+        content_hash: Optional[str]
+    ) -> Optional[str]:
+        """Identify the exact input snapshot, or None if it cannot be pinned down"""
+        if content_hash:
+            return f"content:{content_hash}"
+        if input_repo_type == 'github_url':
+            sha = resolve_remote_commit(input_repo_ref, github_branch)
+            return f"commit:{input_repo_ref}@{sha}" if sha else None
+        # Local paths can change underneath us; never cache them
+        return None
+    
+    def _outputs_available(self, result: Dict[str, Any]) -> bool:
+        try:
+            return all(
+                self.storage_manager.object_exists(key)
+                for key in result.get('output_files', {}).values()
+            )
+        except Exception as e:
+            logger.warning(f"Could not verify cached outputs: {e}")
+            return False
+    
+    def _lookup_cached_result(self, cache_key: str, job_id: str, session_id: Optional[str] = None) -> bool:
+        """Complete `job_id` immediately from the result cache; returns True on a hit"""
+        cached = self.result_cache.get(cache_key)
+        if not cached:
+            return False
+        
+        if not self._outputs_available(cached):
+            logger.info(f"Cached outputs for {cache_key[:12]} are gone, invalidating")
+            self.result_cache.invalidate(cache_key)
+            return False
+        
+        result = dict(cached)
+        result['source_job_id'] = cached.get('job_id')
+        result['job_id'] = job_id
+        result['cached'] = True
+        if session_id:
+            result['session_id'] = session_id
+        else:
+            result.pop('session_id', None)
+        self.celery_app.backend.store_result(job_id, result, 'SUCCESS')
+        return True
     
     def submit_repo_processing_job(
         self,
@@ -20,11 +92,19 @@ class JobManager:
         github_branch: Optional[str] = None,
         processing_mode: str = 'standard',
         output_format: str = 'text',
-        additional_options: Optional[Dict[str, Any]] = None
+        additional_options: Optional[Dict[str, Any]] = None,
+        content_hash: Optional[str] = None,
+        cost_estimate: Optional[CostEstimate] = None,
+        owner: Optional[str] = None
     ) -> str:
         """
         Submit a repository processing job to Celery
         
+        Identical requests (same commit or upload content, mode and options)
+        are served from the result cache, and concurrent identical requests
+        share a single in-flight job. Jobs that do run are routed to a queue
+        by their estimated size and charged against the owner's fair share.
+        
         Args:
             input_repo_type: Type of input ('github_url', 'local_path', 'minio_file')
             input_repo_ref: Reference to the input (URL, path, or MinIO key)
@@ -32,27 +112,89 @@ class JobManager:
             processing_mode: Processing mode ('standard', 'smart', 'token', 'ultra', 'context_generation')
             output_format: Output format ('text', 'json', 'markdown')
             additional_options: Additional processing options
+            content_hash: Content hash of uploaded input, used as the cache address
+            cost_estimate: Size of the input if the caller already measured it
+            owner: Client to charge for fair sharing (defaults to the current request's client)
             
         Returns:
-            str: Job ID for tracking
+            str: Job ID for tracking (an existing job's ID if one is already running)
+            
+        Raises:
+            AdmissionRejected: If the owner already has too much work in flight
         """
+        job_id = str(uuid.uuid4())
+        cache_key = None
+        admitted_owner = None
         try:
-            # Generate unique job ID
-            job_id = str(uuid.uuid4())
+            additional_options = dict(additional_options or {})
+            
+            # A profiling run has to actually run, and its result carries
+            # profiles of that run only, so it neither reads nor fills the cache
+            if (self.result_cache and not additional_options.get('force_refresh')
+                    and not additional_options.get('profiling')):
+                snapshot_id = self._resolve_snapshot_id(
+                    input_repo_type, input_repo_ref, github_branch, content_hash
+                )
+                if snapshot_id:
+                    cache_key = build_cache_key(
+                        snapshot_id, processing_mode, output_format, additional_options
+                    )
+            
+            if cache_key:
+                if self._lookup_cached_result(cache_key, job_id, additional_options.get('session_id')):
+                    logger.info(f"Served job {job_id} from result cache")
+                    return job_id
+                
+                running_job_id = self.result_cache.claim(cache_key, job_id)
+                if running_job_id:
+                    logger.info(f"Joined in-flight job {running_job_id} instead of submitting a duplicate")
+                    return running_job_id
+                
+                # The task stores its result under this key and releases the claim
+                additional_options['cache_key'] = cache_key
+                if input_repo_type == 'github_url' and not content_hash:
+                    # Pin the clone to the commit the key was computed for
+                    additional_options['expected_commit'] = snapshot_id.rsplit('@', 1)[1]
+            
+            queue = 'celery'
+            priority = 0
+            if Config.ADMISSION_CONTROL_ENABLED:
+                # Never blocks: unmeasured inputs go to the middle tier until their estimate is stored
+                estimate = cost_estimate or estimate_job_cost(
+                    input_repo_type, input_repo_ref, github_branch, self.cost_estimates)
+                queue = estimate.queue
+                owner = owner or request_owner()
+                if owner and self.fair_share:
+                    priority = self.fair_share.admit(owner, job_id, estimate.cost)
+                    admitted_owner = owner
+                    # The task releases the owner's share when it finishes
+                    additional_options['admission_owner'] = owner
+                logger.info(
+                    f"Job {job_id} estimated at {estimate.file_count} files / {estimate.total_bytes} bytes "
+                    f"({estimate.source}): queue {queue}, priority {priority}"
+                )
+            
+            # Ultra mode fans out across workers so large repositories stay within task time limits;
+            # profiled runs stay in one process so a single profile covers every stage
+            task_name = 'process_repository_task'
+            if (processing_mode == 'ultra' and Config.SHARDED_PROCESSING_ENABLED
+                    and not additional_options.get('profiling')):
+                task_name = 'plan_repository_shards_task'
             
             # Submit task to Celery
             task = self.celery_app.send_task(
-                'process_repository_task',
+                task_name,
                 args=[
                     input_repo_type,
                     input_repo_ref,
                     github_branch,
                     processing_mode,
                     output_format,
-                    additional_options or {}
+                    additional_options
                 ],
                 task_id=job_id,
-                queue='celery'
+                queue=queue,
+                priority=priority
             )
             
             logger.info(f"Submitted job {job_id} for processing")
@@ -60,6 +202,10 @@ class JobManager:
             
         except Exception as e:
             logger.error(f"Failed to submit job: {e}")
+            if cache_key:
+                self.result_cache.release(cache_key, job_id)
+            if admitted_owner:
+                self.fair_share.release(admitted_owner, job_id)
             raise
     
     def get_job_status(self, job_id: str) -> Dict[str, Any]:
@@ -147,12 +293,23 @@ class JobManager:
         """
         Cancel a job
         
+        The job's tasks stop cooperatively (see app/cancellation.py) so that
+        they can kill child processes and release temp dirs and claims. If the
+        cancellation flag cannot be set, the task is revoked and terminated.
+        
         Args:
             job_id: Job ID to cancel
             
         Returns:
             bool: True if successfully cancelled
         """
+        try:
+            JobCancellation().request(job_id)
+            logger.info(f"Requested cancellation of job {job_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not request cooperative cancellation of {job_id}, revoking: {e}")
+        
         try:
             result = AsyncResult(job_id, app=self.celery_app)
             result.revoke(terminate=True)
@@ -4,8 +4,10 @@ Provides OpenTelemetry instrumentation for distributed tracing,
 metrics collection, and enhanced logging capabilities.
 """
 
-from .tracing import TracingManager, trace_operation, create_span, initialize_tracing
-from .metrics import MetricsManager, record_metric, create_counter, create_histogram, initialize_metrics
+from .tracing import TracingManager, trace_operation, create_span, initialize_tracing, trace_engine_stage
+from .metrics import (
+    MetricsManager, record_metric, create_counter, create_histogram, initialize_metrics, record_engine_stats
+)
 from .logging import ObservabilityLogger, create_logger, log_http_request, log_error
 from .health import HealthCheckManager, register_health_check
 
@@ -14,11 +16,13 @@ __all__ = [
     'trace_operation',
     'create_span',
     'initialize_tracing',
+    'trace_engine_stage',
     'MetricsManager',
     'record_metric',
     'create_counter',
     'create_histogram',
     'initialize_metrics',
+    'record_engine_stats',
     'ObservabilityLogger',
     'create_logger',
     'log_http_request',
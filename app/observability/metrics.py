@@ -156,6 +156,20 @@ class MetricsManager:
             description="Repository processing time",
             unit="s"
         )
+        
+        # Processing engine metrics (repo2file.instrumentation summaries)
+        for name, kind, description, unit in (
+            ("robustrepo.engine.stage.duration", 'histogram', "Time spent per engine stage in one run", "s"),
+            ("robustrepo.engine.tokens.encoded", 'counter', "Tokens produced by the tokenizer", "tokens"),
+            ("robustrepo.engine.encode.calls", 'counter', "Tokenizer invocations", "1"),
+            ("robustrepo.engine.bytes.read", 'counter', "Source bytes read by the engine", "bytes"),
+            ("robustrepo.engine.cache.lookups", 'counter', "Engine cache lookups by cache and result", "1"),
+            ("robustrepo.engine.scan.rate", 'histogram', "Files scanned per second", "files/s"),
+        ):
+            if kind == 'counter':
+                self._metrics[name] = self.meter.create_counter(name=name, description=description, unit=unit)
+            else:
+                self._metrics[name] = self.meter.create_histogram(name=name, description=description, unit=unit)
     
     def get_metric(self, name: str):
         """Get a metric by name."""
@@ -373,4 +387,41 @@ def record_repository_processing(
     }
     
     record_metric("robustrepo.repo.files.processed", files_processed, attributes)
-    record_metric("robustrepo.repo.processing.time", processing_time_s, attributes)
\ No newline at end of file
+    record_metric("robustrepo.repo.processing.time", processing_time_s, attributes)
+
+
+def record_engine_stats(summary: Dict[str, Any], mode: str):
+    """Record an Instrumentation summary from the processing engine.
+    
+    A no-op until metrics are initialized, so workers can always call it.
+    """
+    if not metrics_manager._initialized:
+        return
+    
+    counters = summary.get('counters', {})
+    for stage, stats in summary.get('stages', {}).items():
+        record_metric("robustrepo.engine.stage.duration", stats['total_s'], {
+            "engine.stage": stage,
+            "processing.mode": mode,
+        })
+    
+    attributes = {"processing.mode": mode}
+    for counter, metric_name in (("tokens_encoded", "robustrepo.engine.tokens.encoded"),
+                                 ("encode_calls", "robustrepo.engine.encode.calls"),
+                                 ("bytes_read", "robustrepo.engine.bytes.read")):
+        if counters.get(counter):
+            record_metric(metric_name, counters[counter], attributes)
+    
+    for cache in ('file_cache', 'token_cache'):
+        for result in ('hits', 'misses'):
+            value = counters.get(f"{cache}_{result}")
+            if value:
+                record_metric("robustrepo.engine.cache.lookups", value, {
+                    "engine.cache": cache,
+                    "engine.cache.result": result,
+                    "processing.mode": mode,
+                })
+    
+    files_per_second = summary.get('rates', {}).get('files_per_second')
+    if files_per_second is not None:
+        record_metric("robustrepo.engine.scan.rate", files_per_second, attributes)
@@ -278,4 +278,21 @@ def trace_storage_operation(
         attributes["storage.size_bytes"] = size
     
     with create_span(f"storage.{operation}", attributes) as span:
-        yield span
\ No newline at end of file
+        yield span
+
+@contextmanager
+def trace_engine_stage(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None
+):
+    """Trace one processing engine stage.
+    
+    Used as the repo2file Instrumentation span factory; a no-op until
+    tracing is initialized.
+    """
+    if not tracing_manager._initialized:
+        yield None
+        return
+    
+    with create_span(name, attributes) as span:
+        yield span
@@ -0,0 +1,109 @@
+"""
+HTTP responses for downloading job outputs from MinIO
+
+Shared by the download endpoints in app.py, the job API blueprint and the
+public v1 API so that content negotiation, conditional requests and range
+requests behave the same everywhere.
+"""
+from typing import Any, Dict, Optional
+
+from flask import Response, request
+
+
+def client_accepts_gzip() -> bool:
+    """Whether the current request accepts a gzip Content-Encoding"""
+    return request.accept_encodings.quality('gzip') > 0
+
+
+def _entity_tag(info: Dict[str, Any], gzip_representation: bool) -> str:
+    """Strong ETag for the representation being served
+
+    Derived from the SHA-256 of the uncompressed content when available, and
+    distinct for the gzip and identity representations as HTTP requires.
+    Objects uploaded before content hashes were recorded fall back to the
+    storage ETag.
+    """
+    tag = info.get('content_sha256') or f"s3-{info['etag']}"
+    return f"{tag}-gzip" if gzip_representation else tag
+
+
+def _not_modified(etag: str, last_modified) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since for the current request"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _range_applies(etag: str, last_modified) -> bool:
+    """A Range is honoured unless an If-Range validator no longer matches"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return last_modified is not None and last_modified.replace(microsecond=0) <= if_range.date
+    return True
+
+
+def output_download_response(storage_manager, object_name: str,
+                             download_name: str = 'repo2file_output.txt',
+                             mimetype: str = 'text/plain') -> Response:
+    """Stream an output object to the client
+
+    Outputs compressed at rest are sent as-is with `Content-Encoding: gzip`
+    when the client accepts it, and decompressed on the fly otherwise.
+    Conditional GETs are answered with 304, and single byte ranges over the
+    selected representation are answered with 206.
+    """
+    info = storage_manager.get_object_info(object_name)
+    gzip_representation = info['encoding'] == 'gzip' and client_accepts_gzip()
+    representation_size: Optional[int] = info['size'] if gzip_representation or not info['encoding'] \
+        else info['uncompressed_size']
+
+    etag = _entity_tag(info, gzip_representation)
+    last_modified = info['last_modified']
+
+    def with_validators(response: Response) -> Response:
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Vary'] = 'Accept-Encoding'
+        if representation_size is not None:
+            response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    if _not_modified(etag, last_modified):
+        return with_validators(Response(status=304))
+
+    byte_range = None
+    if request.range and representation_size is not None and _range_applies(etag, last_modified):
+        # Multi-range requests are served as a full 200 response
+        if len(request.range.ranges) == 1:
+            byte_range = request.range.range_for_length(representation_size)
+            if byte_range is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{representation_size}'
+                return with_validators(response)
+
+    stream, encoding, length = storage_manager.open_download_stream(
+        object_name,
+        accept_gzip=gzip_representation,
+        byte_range=byte_range,
+        object_info=info
+    )
+
+    headers = {
+        'Content-Disposition': f'attachment; filename={download_name}'
+    }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if length is not None:
+        headers['Content-Length'] = str(length)
+
+    status = 200
+    if byte_range is not None:
+        status = 206
+        headers['Content-Range'] = f'bytes {byte_range[0]}-{byte_range[1] - 1}/{representation_size}'
+
+    return with_validators(Response(stream, status=status, mimetype=mimetype, headers=headers))
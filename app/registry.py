@@ -0,0 +1,258 @@
+"""
+Shared job/session registry for RobustRepo v2.0
+
+Job state, progress events and Vibe Coder loop sessions used to live in
+module-level dicts inside app.py, so only the web worker that started a job
+could report on it. The registry moves that state to Redis so that any worker
+can serve status, result and loop endpoints. An in-memory implementation with
+the same interface is used for tests and single-process development.
+"""
+import json
+import os
+import queue
+import threading
+import logging
+from datetime import timedelta
+from typing import Dict, Any, Optional, List
+
+import redis
+from redis.exceptions import RedisError
+
+from .session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+# Sentinel pushed onto a progress queue when a job finishes
+END_OF_STREAM = 'END'
+
+
+class ProgressQueue:
+    """Queue of progress events for a single job"""
+
+    def put(self, event: Any):
+        raise NotImplementedError
+
+    def get(self, timeout: float = 30) -> Any:
+        """Return the next event, raising queue.Empty after `timeout` seconds"""
+        raise NotImplementedError
+
+
+class JobRegistry:
+    """Interface for job state, progress queues and loop sessions"""
+
+    # Jobs
+    def create_job(self, job_id: str, job_data: Dict[str, Any]):
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update_job(self, job_id: str, **fields):
+        raise NotImplementedError
+
+    def job_exists(self, job_id: str) -> bool:
+        return self.get_job(job_id) is not None
+
+    def job_ids_for_session(self, session_id: str) -> List[str]:
+        raise NotImplementedError
+
+    def progress_queue(self, job_id: str) -> ProgressQueue:
+        raise NotImplementedError
+
+    # Loop sessions
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_session(self, session_id: str, session_data: Dict[str, Any]):
+        raise NotImplementedError
+
+    def update_session(self, session_id: str, fields: Dict[str, Any]):
+        raise NotImplementedError
+
+    def session_exists(self, session_id: str) -> bool:
+        return self.get_session(session_id) is not None
+
+
+class InMemoryProgressQueue(ProgressQueue):
+    """Progress queue backed by queue.Queue"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, event: Any):
+        self._queue.put(event)
+
+    def get(self, timeout: float = 30) -> Any:
+        return self._queue.get(timeout=timeout)
+
+
+class InMemoryJobRegistry(JobRegistry):
+    """Process-local registry, equivalent to the old app.py dicts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queues: Dict[str, InMemoryProgressQueue] = {}
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    def create_job(self, job_id: str, job_data: Dict[str, Any]):
+        with self._lock:
+            self._jobs[job_id] = dict(job_data)
+            self._queues.setdefault(job_id, InMemoryProgressQueue())
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update_job(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def job_ids_for_session(self, session_id: str) -> List[str]:
+        with self._lock:
+            return [job_id for job_id, job in self._jobs.items()
+                    if job.get('session_id') == session_id]
+
+    def progress_queue(self, job_id: str) -> ProgressQueue:
+        with self._lock:
+            return self._queues.setdefault(job_id, InMemoryProgressQueue())
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session_data = self._sessions.get(session_id)
+            return json.loads(json.dumps(session_data)) if session_data is not None else None
+
+    def save_session(self, session_id: str, session_data: Dict[str, Any]):
+        with self._lock:
+            self._sessions[session_id] = json.loads(json.dumps(session_data))
+
+    def update_session(self, session_id: str, fields: Dict[str, Any]):
+        with self._lock:
+            self._sessions.setdefault(session_id, {}).update(json.loads(json.dumps(fields)))
+
+
+class RedisProgressQueue(ProgressQueue):
+    """Progress queue backed by a Redis list (RPUSH/BLPOP)"""
+
+    def __init__(self, redis_client: redis.Redis, key: str, ttl: timedelta):
+        self.redis = redis_client
+        self.key = key
+        self.ttl = ttl
+
+    def put(self, event: Any):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(self.key, json.dumps(event))
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def get(self, timeout: float = 30) -> Any:
+        item = self.redis.blpop(self.key, timeout=max(1, int(timeout)))
+        if item is None:
+            raise queue.Empty
+        return json.loads(item[1])
+
+
+class RedisJobRegistry(JobRegistry):
+    """Registry shared by all web workers through Redis
+
+    Jobs are hashes (`job:<id>`) with JSON-encoded fields, and each session
+    keeps a set of its job IDs so lookups by session never scan all jobs.
+    Loop sessions are stored through SessionManager, so each top-level key
+    of the session dict is its own hash field.
+    """
+
+    # KEYS: job hash; ARGV: ttl, then field/value pairs
+    # Updating a job that has expired must not recreate it without a TTL
+    _UPDATE_JOB_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, redis_client: redis.Redis, prefix: str = 'betterrepo2file:',
+                 ttl: timedelta = timedelta(hours=24)):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.sessions = SessionManager(redis_client, prefix=f"{prefix}loop_session:")
+        self.sessions.ttl = ttl
+        self._update_job = redis_client.register_script(self._UPDATE_JOB_SCRIPT)
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _session_jobs_key(self, session_id: str) -> str:
+        return f"{self.prefix}session_jobs:{session_id}"
+
+    def create_job(self, job_id: str, job_data: Dict[str, Any]):
+        key = self._job_key(job_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in job_data.items()})
+        pipe.expire(key, self.ttl)
+        session_id = job_data.get('session_id')
+        if session_id:
+            pipe.sadd(self._session_jobs_key(session_id), job_id)
+            pipe.expire(self._session_jobs_key(session_id), self.ttl)
+        pipe.execute()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        fields = self.redis.hgetall(self._job_key(job_id))
+        if not fields:
+            return None
+        return {SessionManager._to_str(k): json.loads(v) for k, v in fields.items()}
+
+    def update_job(self, job_id: str, **fields):
+        if not fields:
+            return
+        args = [int(self.ttl.total_seconds())]
+        for k, v in fields.items():
+            args.extend((k, json.dumps(v)))
+        self._update_job(keys=[self._job_key(job_id)], args=args)
+
+    def job_ids_for_session(self, session_id: str) -> List[str]:
+        members = self.redis.smembers(self._session_jobs_key(session_id))
+        return [SessionManager._to_str(m) for m in members]
+
+    def progress_queue(self, job_id: str) -> ProgressQueue:
+        return RedisProgressQueue(self.redis, f"{self.prefix}job_events:{job_id}", self.ttl)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session_data = self.sessions.get_session(session_id)
+        return session_data['data'] if session_data else None
+
+    def save_session(self, session_id: str, session_data: Dict[str, Any]):
+        self.sessions.replace_session(session_id, session_data)
+
+    def update_session(self, session_id: str, fields: Dict[str, Any]):
+        self.sessions.update_session(session_id, fields)
+
+
+def create_registry(redis_url: Optional[str] = None) -> JobRegistry:
+    """Create the registry configured by JOB_REGISTRY_BACKEND ('redis' or 'memory')
+
+    Falls back to the in-memory registry when Redis is unreachable, which
+    keeps single-process development working but is not safe with several
+    web workers.
+    """
+    backend = os.environ.get('JOB_REGISTRY_BACKEND', 'redis').lower()
+    if backend == 'memory':
+        return InMemoryJobRegistry()
+
+    if redis_url is None:
+        from .config import Config
+        redis_url = Config.REDIS_URL
+
+    try:
+        client = redis.from_url(redis_url)
+        client.ping()
+        logger.info("Using Redis job registry")
+        return RedisJobRegistry(client)
+    except RedisError as e:
+        logger.warning(f"Redis unavailable ({e}); falling back to in-memory job registry")
+        return InMemoryJobRegistry()
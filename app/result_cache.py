@@ -0,0 +1,192 @@
+"""
+Content-addressed result cache for RobustRepo v2.0
+
+Repository processing is deterministic for a given input snapshot, mode and
+option set, so a finished job's MinIO outputs can be handed to any later
+identical submission. Entries are keyed by:
+
+    (commit SHA or upload content hash, mode, normalized options, engine version)
+
+The cache also provides single-flight deduplication: while a job for a key is
+running, identical submissions are pointed at that job instead of enqueueing
+another one.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import logging
+from typing import Dict, Any, Optional
+
+import redis
+from redis.exceptions import RedisError
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Options that do not change the produced output
+NON_OUTPUT_OPTIONS = {'session_id', 'force_refresh', 'cache_key', 'expected_commit', 'admission_owner'}
+
+
+def _compute_engine_version() -> str:
+    """Hash of the app version and the repo2file sources, so code changes invalidate entries"""
+    digest = hashlib.sha256(Config.VERSION.encode('utf-8'))
+    engine_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'repo2file')
+    try:
+        for name in sorted(os.listdir(engine_dir)):
+            if name.endswith('.py'):
+                with open(os.path.join(engine_dir, name), 'rb') as f:
+                    digest.update(name.encode('utf-8'))
+                    digest.update(f.read())
+    except OSError as e:
+        logger.warning(f"Could not hash repo2file sources for engine version: {e}")
+    return f"{Config.VERSION}-{digest.hexdigest()[:12]}"
+
+
+ENGINE_VERSION = _compute_engine_version()
+
+
+def hash_directory(path: str) -> str:
+    """Content hash of a directory tree (relative paths and file bytes, order independent)"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+            digest.update(b'\0')
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def resolve_remote_commit(repo_url: str, branch: Optional[str] = None, timeout: int = 15) -> Optional[str]:
+    """Resolve a branch of a remote repository to a commit SHA without cloning"""
+    ref = branch or 'HEAD'
+    try:
+        result = subprocess.run(
+            ['git', 'ls-remote', repo_url, ref],
+            capture_output=True, text=True, timeout=timeout
+        )
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.warning(f"git ls-remote failed for {repo_url}: {e}")
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    # Prefer an exact branch match over tags/other refs that share the name
+    wanted = {ref, f"refs/heads/{ref}"}
+    lines = [line.split('\t') for line in result.stdout.splitlines() if '\t' in line]
+    for sha, name in lines:
+        if name in wanted:
+            return sha
+    return lines[0][0] if lines else None
+
+
+def normalize_options(options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Drop options that do not affect output and canonicalize order-insensitive lists
+
+    Empty values and False are dropped as well: every boolean option is an
+    opt-in flag, so sending its default produces the same output as omitting it.
+    """
+    normalized = {}
+    for key, value in (options or {}).items():
+        if key in NON_OUTPUT_OPTIONS or value is False or value in (None, '', [], {}):
+            continue
+        if key in ('file_types', 'file_extensions') and isinstance(value, list):
+            value = sorted(value)
+        normalized[key] = value
+    return normalized
+
+
+def build_cache_key(snapshot_id: str, processing_mode: str, output_format: str,
+                    options: Optional[Dict[str, Any]]) -> str:
+    """Build the content address for a processing request"""
+    payload = json.dumps({
+        'snapshot': snapshot_id,
+        'mode': processing_mode,
+        'format': output_format,
+        'options': normalize_options(options),
+        'engine': ENGINE_VERSION
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Redis-backed result cache with single-flight deduplication"""
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None,
+                 prefix: str = 'betterrepo2file:result_cache:',
+                 ttl: Optional[int] = None, inflight_ttl: Optional[int] = None):
+        self._redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl or Config.RESULT_CACHE_TTL
+        # In-flight markers outlive the task hard time limit so a crashed worker cannot wedge a key
+        self.inflight_ttl = inflight_ttl or Config.RESULT_CACHE_INFLIGHT_TTL
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.from_url(Config.REDIS_URL)
+        return self._redis
+
+    def _result_key(self, cache_key: str) -> str:
+        return f"{self.prefix}result:{cache_key}"
+
+    def _inflight_key(self, cache_key: str) -> str:
+        return f"{self.prefix}inflight:{cache_key}"
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for a key, if any"""
+        try:
+            raw = self.redis.get(self._result_key(cache_key))
+        except RedisError as e:
+            logger.warning(f"Result cache lookup failed: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def store(self, cache_key: str, result: Dict[str, Any]):
+        """Cache a successful job result"""
+        try:
+            self.redis.set(self._result_key(cache_key), json.dumps(result), ex=self.ttl)
+        except RedisError as e:
+            logger.warning(f"Failed to store result cache entry: {e}")
+
+    def invalidate(self, cache_key: str):
+        try:
+            self.redis.delete(self._result_key(cache_key))
+        except RedisError as e:
+            logger.warning(f"Failed to invalidate result cache entry: {e}")
+
+    def claim(self, cache_key: str, job_id: str) -> Optional[str]:
+        """Register `job_id` as the in-flight job for a key
+
+        Returns None if the claim succeeded, otherwise the ID of the job that
+        is already running for this key.
+        """
+        key = self._inflight_key(cache_key)
+        try:
+            for _ in range(3):
+                if self.redis.set(key, job_id, nx=True, ex=self.inflight_ttl):
+                    return None
+                owner = self.redis.get(key)
+                if owner is not None:
+                    return owner.decode('utf-8') if isinstance(owner, bytes) else owner
+                # Owner finished between SET NX and GET; try again
+        except RedisError as e:
+            logger.warning(f"Single-flight claim failed, running without dedup: {e}")
+        return None
+
+    def release(self, cache_key: str, job_id: str):
+        """Clear the in-flight marker if it is still owned by `job_id`"""
+        key = self._inflight_key(cache_key)
+        try:
+            owner = self.redis.get(key)
+            if owner is not None and (owner.decode('utf-8') if isinstance(owner, bytes) else owner) == job_id:
+                self.redis.delete(key)
+        except RedisError as e:
+            logger.warning(f"Failed to release in-flight marker: {e}")
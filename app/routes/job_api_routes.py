@@ -11,6 +11,10 @@ import shutil
 import json
 import time
 
+from ..output_download import output_download_response
+from ..result_cache import hash_directory
+from ..admission import AdmissionRejected, estimate_directory
+
 job_api_bp = Blueprint('job_api', __name__, url_prefix='/api')
 
 
@@ -22,6 +26,8 @@ def process():
         storage_manager = current_app.storage_manager
         
         github_branch = None  # Initialize variable
+        content_hash = None  # Set for uploads, used as the result cache address
+        cost_estimate = None  # Set for uploads, used for queue routing
         
         # Determine input type and prepare input reference
         if 'files[]' in request.files:
@@ -42,6 +48,8 @@ def process():
                     file.save(file_path)
             
             # Upload to MinIO
+            content_hash = hash_directory(temp_dir)
+            cost_estimate = estimate_directory(temp_dir)
             zip_path = shutil.make_archive(temp_dir, 'zip', temp_dir)
             minio_key = storage_manager.upload_data_stream(
                 object_name=f"uploads/{os.path.basename(zip_path)}",
@@ -98,7 +106,8 @@ def process():
                 'token_budget': int(request.form.get('token_budget', '500000')),
                 'intended_query': request.form.get('intended_query', '').strip(),
                 'vibe_statement': request.form.get('vibe_statement', '').strip(),
-                'planner_output': request.form.get('planner_output', '').strip()
+                'planner_output': request.form.get('planner_output', '').strip(),
+                'profiling': request.form.get('profiling', 'false').lower() in ('true', 't', 'yes', 'y', '1', 'on')
             })
         
         # Submit job to Celery
@@ -108,7 +117,9 @@ def process():
             github_branch=github_branch if input_repo_type == 'github_url' else None,
             processing_mode=processing_mode,
             output_format='text',
-            additional_options=additional_options
+            additional_options=additional_options,
+            content_hash=content_hash,
+            cost_estimate=cost_estimate
         )
         
         return jsonify({
@@ -117,6 +128,8 @@ def process():
             "processing_mode": processing_mode
         })
     
+    except AdmissionRejected:
+        raise  # Answered by admission_rejected_response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -163,6 +176,8 @@ def generate_context():
             'session_id': session_id
         })
         
+    except AdmissionRejected:
+        raise  # Answered by admission_rejected_response
     except Exception as e:
         print(f"Error in generate_context: {e}")
         import traceback
@@ -252,11 +267,30 @@ def result(job_id):
                 'error': f'Failed to generate download URL: {str(e)}'
             }
     
-    return jsonify({
+    response = {
         'status': 'completed',
         'result': result,
         'file_access': file_access
-    }), 200
+    }
+    
+    # Profiled jobs link their CPU and memory profiles next to the output
+    profiling = result.get('profiling')
+    if profiling:
+        profile_access = {}
+        for name, minio_key in profiling.get('artifacts', {}).items():
+            try:
+                profile_access[name] = {
+                    'minio_key': minio_key,
+                    'download_url': storage_manager.generate_presigned_url(minio_key)
+                }
+            except Exception as e:
+                profile_access[name] = {
+                    'minio_key': minio_key,
+                    'error': f'Failed to generate download URL: {str(e)}'
+                }
+        response['profile_access'] = profile_access
+    
+    return jsonify(response), 200
 
 
 @job_api_bp.route('/download/<job_id>')
@@ -286,14 +320,7 @@ def download(job_id):
             minio_key = list(output_files.values())[0]
         
         # Download from MinIO and stream to client
-        stream = storage_manager.download_stream(minio_key)
-        return Response(
-            stream,
-            mimetype='text/plain',
-            headers={
-                'Content-Disposition': 'attachment; filename=repo2file_output.txt'
-            }
-        )
+        return output_download_response(storage_manager, minio_key)
         
     except Exception as e:
         abort(404)
@@ -2,7 +2,7 @@
 Public API v1 Routes Blueprint for BetterRepo2File v2.0
 Provides the standalone REST API for external integrations
 """
-from flask import Blueprint, request, jsonify, Response, current_app, abort
+from flask import Blueprint, request, jsonify, current_app, abort
 from werkzeug.utils import secure_filename
 import os
 import sys
@@ -12,6 +12,10 @@ import base64
 import tempfile
 from datetime import datetime
 
+from ..output_download import output_download_response
+from ..result_cache import hash_directory
+from ..admission import AdmissionRejected, estimate_directory
+
 api_v1_bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
 
@@ -118,6 +122,8 @@ def process():
         
         job_manager = current_app.job_manager
         storage_manager = current_app.storage_manager
+        content_hash = None  # Set for uploads, used as the result cache address
+        cost_estimate = None  # Set for uploads, used for queue routing
         
         # Determine input type
         if 'github_url' in data:
@@ -153,6 +159,8 @@ def process():
                     return jsonify({'error': f'Failed to decode file {file_name}: {str(e)}'}), 400
             
             # Upload to MinIO
+            content_hash = hash_directory(temp_dir)
+            cost_estimate = estimate_directory(temp_dir)
             zip_path = shutil.make_archive(temp_dir, 'zip', temp_dir)
             minio_key = storage_manager.upload_data_stream(
                 object_name=f"api-uploads/{os.path.basename(zip_path)}",
@@ -184,7 +192,8 @@ def process():
                 'llm_model': options.get('model', 'gpt-4'),
                 'token_budget': options.get('token_budget', 500000),
                 'intended_query': options.get('intended_query', ''),
-                'generate_manifest': options.get('generate_manifest', True)
+                'generate_manifest': options.get('generate_manifest', True),
+                'profiling': bool(options.get('profiling', False))
             })
         
         # Submit job to Celery
@@ -194,7 +203,9 @@ def process():
             github_branch=github_branch if input_repo_type == 'github_url' else None,
             processing_mode=mode,
             output_format='text',
-            additional_options=additional_options
+            additional_options=additional_options,
+            content_hash=content_hash,
+            cost_estimate=cost_estimate
         )
         
         return jsonify({
@@ -202,6 +213,8 @@ def process():
             'status': 'accepted'
         }), 202
         
+    except AdmissionRejected:
+        raise  # Answered by admission_rejected_response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -341,19 +354,33 @@ def download(operation_id):
         minio_key = output_files['output.txt']
         
         # Stream from MinIO
-        stream = storage_manager.download_stream(minio_key)
-        return Response(
-            stream,
-            mimetype='text/plain',
-            headers={
-                'Content-Disposition': 'attachment; filename=repo2file_output.txt'
-            }
-        )
+        return output_download_response(storage_manager, minio_key)
         
     except Exception as e:
         abort(404)
 
 
+@api_v1_bp.route('/cancel/<operation_id>', methods=['POST'])
+def cancel(operation_id):
+    """
+    Cancel a queued or running operation
+    
+    Its workers stop within about a second, killing child processes and
+    releasing temporary files.
+    
+    Returns:
+    {
+        "status": "cancelling"
+    }
+    """
+    job_manager = current_app.job_manager
+    
+    if not job_manager.cancel_job(operation_id):
+        return jsonify({'error': 'Cancellation failed'}), 500
+    
+    return jsonify({'status': 'cancelling'}), 202
+
+
 @api_v1_bp.route('/cleanup/<operation_id>', methods=['DELETE'])
 def cleanup(operation_id):
     """
@@ -1,22 +1,40 @@
 """Session management module using Redis backend"""
+import base64
 import json
 import uuid
+import zlib
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Iterable, Iterator, List
 from flask import session, current_app
 import redis
-from redis.exceptions import RedisError, ConnectionError, TimeoutError
+from redis.exceptions import RedisError, ConnectionError, TimeoutError, ResponseError
 
 logger = logging.getLogger(__name__)
 
+# Hash fields holding session metadata; user data lives under DATA_FIELD_PREFIX
+META_FIELDS = ('id', 'created_at', 'updated_at')
+DATA_FIELD_PREFIX = 'd:'
+# Marker for zlib-compressed, base64-encoded field values
+COMPRESSED_MARKER = 'zlib:'
+
+
 class SessionManager:
-    """Manages user sessions with Redis backend"""
+    """Manages user sessions with Redis backend
+
+    Each session is stored as a Redis hash with one field per data key, so
+    reads and writes touch only the fields involved. Session IDs are also
+    tracked in an index set which is walked with SSCAN when listing.
+    """
     
-    def __init__(self, redis_client: Optional[redis.Redis] = None, prefix: str = "session:"):
+    def __init__(self, redis_client: Optional[redis.Redis] = None, prefix: str = "session:",
+                 compress_threshold: int = 8 * 1024, scan_batch_size: int = 500):
         self._redis = redis_client
         self.prefix = prefix
+        self.index_key = f"{prefix}_index"
         self.ttl = timedelta(hours=24)  # Session TTL
+        self.compress_threshold = compress_threshold  # Compress field values larger than this (bytes)
+        self.scan_batch_size = scan_batch_size
     
     @property
     def redis(self):
@@ -24,26 +42,97 @@ class SessionManager:
         if self._redis is None and current_app:
             self._redis = redis.from_url(current_app.config['REDIS_URL'])
         return self._redis
+    
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+    
+    @staticmethod
+    def _to_str(value) -> str:
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+    
+    def _encode_value(self, value: Any) -> str:
+        """Serialize a data value, compressing it if it is large"""
+        encoded = json.dumps(value)
+        if self.compress_threshold and len(encoded) > self.compress_threshold:
+            compressed = zlib.compress(encoded.encode('utf-8'), 6)
+            return COMPRESSED_MARKER + base64.b64encode(compressed).decode('ascii')
+        return encoded
+    
+    @staticmethod
+    def _decode_value(raw) -> Any:
+        raw = SessionManager._to_str(raw)
+        if raw.startswith(COMPRESSED_MARKER):
+            raw = zlib.decompress(base64.b64decode(raw[len(COMPRESSED_MARKER):])).decode('utf-8')
+        return json.loads(raw)
+    
+    def _build_session(self, fields: Dict) -> Optional[Dict[str, Any]]:
+        """Turn a raw HGETALL result into the session dict returned to callers"""
+        if not fields:
+            return None
+        
+        session_data = {'data': {}}
+        for field, raw in fields.items():
+            field = self._to_str(field)
+            if field.startswith(DATA_FIELD_PREFIX):
+                session_data['data'][field[len(DATA_FIELD_PREFIX):]] = self._decode_value(raw)
+            elif field in META_FIELDS:
+                session_data[field] = self._to_str(raw)
+        return session_data
+    
+    def _migrate_legacy_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Convert a session stored as a JSON string (pre-hash format) in place"""
+        key = self._key(session_id)
+        raw = self.redis.get(key)
+        if not raw:
+            return None
+        
+        legacy = json.loads(raw)
+        self.redis.delete(key)
+        self._write_fields(
+            session_id,
+            legacy.get('data', {}),
+            created_at=legacy.get('created_at'),
+            migrate=False
+        )
+        logger.info(f"Migrated legacy session: {session_id}")
+        return self.get_session(session_id)
+    
+    def _write_fields(self, session_id: str, data: Dict[str, Any], created_at: Optional[str] = None,
+                      migrate: bool = True, delete_keys: Iterable[str] = ()):
+        """Write data fields, delete delete_keys and refresh TTL/index in a single transaction
+        
+        A session still in the old JSON string format is migrated first
+        (unless migrate is False), then the write is retried once.
+        """
+        key = self._key(session_id)
+        now = datetime.utcnow().isoformat()
+        
+        mapping = {f"{DATA_FIELD_PREFIX}{k}": self._encode_value(v) for k, v in data.items()}
+        mapping['updated_at'] = now
+        
+        pipe = self.redis.pipeline(transaction=True)
+        if delete_keys:
+            pipe.hdel(key, *(f"{DATA_FIELD_PREFIX}{k}" for k in delete_keys))
+        pipe.hsetnx(key, 'id', session_id)
+        pipe.hsetnx(key, 'created_at', created_at or now)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        pipe.sadd(self.index_key, session_id)
+        try:
+            pipe.execute()
+        except ResponseError:
+            # WRONGTYPE: session still in the old JSON string format
+            if not migrate or self._migrate_legacy_session(session_id) is None:
+                raise
+            self._write_fields(session_id, data, created_at, migrate=False, delete_keys=delete_keys)
         
     def create_session(self, session_id: Optional[str] = None) -> str:
         """Create a new session"""
         try:
             if not session_id:
                 session_id = str(uuid.uuid4())
-                
-            session_data = {
-                'id': session_id,
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
-                'data': {}
-            }
             
-            key = f"{self.prefix}{session_id}"
-            self.redis.setex(
-                key, 
-                self.ttl, 
-                json.dumps(session_data)
-            )
+            self._write_fields(session_id, {})
             
             logger.info(f"Created session: {session_id}")
             return session_id
@@ -57,68 +146,114 @@ class SessionManager:
         
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get session data"""
-        key = f"{self.prefix}{session_id}"
-        data = self.redis.get(key)
-        
-        if data:
-            session_data = json.loads(data)
-            # Update TTL on access
-            self.redis.expire(key, self.ttl)
-            return session_data
-            
-        return None
+        key = self._key(session_id)
+        
+        # Read and refresh TTL on access in one round trip
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.expire(key, self.ttl)
+        try:
+            fields, _ = pipe.execute()
+        except ResponseError:
+            # WRONGTYPE: session still in the old JSON string format
+            return self._migrate_legacy_session(session_id)
+        
+        return self._build_session(fields)
         
     def update_session(self, session_id: str, data: Dict[str, Any]):
-        """Update session data"""
-        session_data = self.get_session(session_id)
-        
-        if not session_data:
-            session_data = {
-                'id': session_id,
-                'created_at': datetime.utcnow().isoformat(),
-                'data': {}
-            }
-            
-        session_data['updated_at'] = datetime.utcnow().isoformat()
-        session_data['data'].update(data)
-        
-        key = f"{self.prefix}{session_id}"
-        self.redis.setex(
-            key,
-            self.ttl,
-            json.dumps(session_data)
-        )
+        """Update session data
+        
+        Only the given keys are written, so concurrent updates to different
+        keys of the same session no longer overwrite each other.
+        """
+        self._write_fields(session_id, data)
+    
+    def replace_session(self, session_id: str, data: Dict[str, Any]):
+        """Replace session data: keys missing from data are deleted"""
+        key = self._key(session_id)
+        try:
+            fields = self.redis.hkeys(key)
+        except ResponseError:
+            # WRONGTYPE: session still in the old JSON string format
+            self._migrate_legacy_session(session_id)
+            fields = self.redis.hkeys(key)
+        
+        stale = [field[len(DATA_FIELD_PREFIX):] for field in map(self._to_str, fields)
+                 if field.startswith(DATA_FIELD_PREFIX) and field[len(DATA_FIELD_PREFIX):] not in data]
+        self._write_fields(session_id, data, delete_keys=stale)
         
     def delete_session(self, session_id: str):
         """Delete a session"""
-        key = f"{self.prefix}{session_id}"
-        self.redis.delete(key)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._key(session_id))
+        pipe.srem(self.index_key, session_id)
+        pipe.execute()
+    
+    def iter_sessions(self, batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Iterate over active sessions without blocking Redis
+        
+        Walks the index set with SSCAN and fetches each batch of hashes in a
+        single pipeline. IDs whose hash has expired are pruned from the index.
+        """
+        batch_size = batch_size or self.scan_batch_size
+        batch: List[str] = []
+        
+        for session_id in self.redis.sscan_iter(self.index_key, count=batch_size):
+            batch.append(self._to_str(session_id))
+            if len(batch) >= batch_size:
+                yield from self._fetch_batch(batch)
+                batch = []
+        
+        if batch:
+            yield from self._fetch_batch(batch)
+    
+    def _fetch_batch(self, session_ids: List[str]) -> Iterator[Dict[str, Any]]:
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.hgetall(self._key(session_id))
+        results = pipe.execute(raise_on_error=False)
+        
+        expired = []
+        for session_id, fields in zip(session_ids, results):
+            if isinstance(fields, ResponseError):
+                legacy = self._migrate_legacy_session(session_id)
+                if legacy:
+                    yield legacy
+                continue
+            session_data = self._build_session(fields)
+            if session_data is None:
+                expired.append(session_id)
+            else:
+                yield session_data
+        
+        if expired:
+            self.redis.srem(self.index_key, *expired)
         
     def list_sessions(self) -> list:
         """List all active sessions"""
-        pattern = f"{self.prefix}*"
-        keys = self.redis.keys(pattern)
-        
-        sessions = []
-        for key in keys:
-            data = self.redis.get(key)
-            if data:
-                session_data = json.loads(data)
-                sessions.append(session_data)
-                
-        return sessions
+        return list(self.iter_sessions())
         
     def cleanup_expired_sessions(self):
-        """Clean up expired sessions (handled automatically by Redis TTL)"""
-        # Redis handles expiration automatically
-        pass
+        """Prune index entries for sessions that Redis has already expired"""
+        for _ in self.iter_sessions():
+            pass
         
     def get_session_data(self, session_id: str, key: str, default=None):
         """Get specific data from session"""
-        session_data = self.get_session(session_id)
-        if session_data and 'data' in session_data:
-            return session_data['data'].get(key, default)
-        return default
+        redis_key = self._key(session_id)
+        
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(redis_key, f"{DATA_FIELD_PREFIX}{key}")
+        pipe.expire(redis_key, self.ttl)
+        try:
+            raw, _ = pipe.execute()
+        except ResponseError:
+            session_data = self._migrate_legacy_session(session_id)
+            return session_data['data'].get(key, default) if session_data else default
+        
+        if raw is None:
+            return default
+        return self._decode_value(raw)
         
     def set_session_data(self, session_id: str, key: str, value: Any):
         """Set specific data in session"""
@@ -126,19 +261,29 @@ class SessionManager:
         
     def delete_session_data(self, session_id: str, key: str):
         """Delete specific data from session"""
-        session_data = self.get_session(session_id)
-        if session_data and 'data' in session_data:
-            session_data['data'].pop(key, None)
-            self.update_session(session_id, session_data['data'])
+        redis_key = self._key(session_id)
+        
+        try:
+            removed = self.redis.hdel(redis_key, f"{DATA_FIELD_PREFIX}{key}")
+        except ResponseError:
+            # WRONGTYPE: session still in the old JSON string format
+            if self._migrate_legacy_session(session_id) is None:
+                raise
+            removed = self.redis.hdel(redis_key, f"{DATA_FIELD_PREFIX}{key}")
+        if removed:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hset(redis_key, 'updated_at', datetime.utcnow().isoformat())
+            pipe.expire(redis_key, self.ttl)
+            pipe.execute()
             
     def extend_session(self, session_id: str, additional_time: timedelta):
         """Extend session TTL"""
-        key = f"{self.prefix}{session_id}"
+        key = self._key(session_id)
         self.redis.expire(key, self.ttl + additional_time)
         
     def is_session_active(self, session_id: str) -> bool:
         """Check if session is active"""
-        key = f"{self.prefix}{session_id}"
+        key = self._key(session_id)
         return self.redis.exists(key) > 0
     
     # Flask-Session integration helpers
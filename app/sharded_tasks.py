@@ -0,0 +1,464 @@
+"""
+Sharded (map-reduce) repository processing for RobustRepo v2.0
+
+A single process_repository_task handles the whole repository and runs into
+the Celery time limit on large monorepos. For ultra mode the work is split
+into three kinds of tasks:
+
+    plan_repository_shards_task  prepares the input, lists files and splits
+                                 them into shards bounded by bytes and count
+    scan_shard_task              scans, tokenizes and analyzes one shard on
+                                 any worker
+    reduce_shards_task           builds the codebase analysis, allocates the
+                                 token budget and writes the final output
+
+The planner replaces itself with a chord of shard tasks and the reducer, so
+the reducer's result is stored under the original job ID and the existing
+status, result and download endpoints work unchanged.
+
+Redelivered tasks pick up where the last attempt stopped: a shard whose scan
+result is already in MinIO is not scanned again, and the reducer checkpoints
+its stages to MinIO (see checkpoints.py) and retries after a soft time limit.
+"""
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+import git
+from celery import chord
+from celery.exceptions import SoftTimeLimitExceeded
+
+from .cancellation import JobCancellation
+from .celery_app import celery_app
+from .checkpoints import MinioCheckpointStore
+from .config import Config
+from .logger import logger
+from .tasks import (
+    storage_manager_from_config, prepare_input_repository, engine_span_factory, record_engine_metrics
+)
+
+from repo2file.cancellation import ProcessingCancelled
+from repo2file.instrumentation import Instrumentation
+
+# MinIO prefix for per-job intermediate artifacts (shard archives and scan results)
+SHARD_PREFIX = 'shards/'
+
+
+def _build_profile(additional_options: Dict[str, Any]):
+    """Build the dump_ultra profile from job options"""
+    from repo2file.dump_ultra import ProcessingProfile, DEFAULT_TOKEN_BUDGET
+    return ProcessingProfile(
+        name='default',
+        token_budget=int(additional_options.get('token_budget') or DEFAULT_TOKEN_BUDGET),
+        model=additional_options.get('model') or 'gpt-4'
+    )
+
+
+def _failure(error: str, error_type: str) -> Dict[str, Any]:
+    return {
+        'success': False,
+        'error': error,
+        'error_type': error_type,
+        'status': 'FAILURE'
+    }
+
+
+def _cancelled() -> Dict[str, Any]:
+    return _failure('Job was cancelled', 'ProcessingCancelled')
+
+
+def _publish_shard_source(storage_manager, job_id: str, shard_index: int,
+                          input_repo_type: str, input_path: str, rel_paths: List[str],
+                          temp_dir: str) -> Dict[str, str]:
+    """Make one shard's files reachable from any worker
+
+    Local paths are assumed to be on storage shared by the workers. Other
+    inputs are packed into a per-shard archive so each shard only downloads
+    the files it scans.
+    """
+    if input_repo_type == 'local_path':
+        return {'type': 'local', 'path': input_path}
+
+    archive_path = os.path.join(temp_dir, f'shard-{shard_index}.tar.gz')
+    with tarfile.open(archive_path, 'w:gz') as tar:
+        for rel_path in rel_paths:
+            tar.add(os.path.join(input_path, rel_path), arcname=rel_path, recursive=False)
+
+    key = f"{SHARD_PREFIX}{job_id}/shard-{shard_index}.tar.gz"
+    storage_manager.upload_file(archive_path, key)
+    return {'type': 'minio', 'key': key}
+
+
+def _materialize_shard_source(storage_manager, source: Dict[str, str], repo_dir: str,
+                              download_dir: str) -> str:
+    """Fetch a shard source into `repo_dir`, returning the repository root"""
+    if source['type'] == 'local':
+        return source['path']
+
+    archive_path = os.path.join(download_dir, os.path.basename(source['key']))
+    storage_manager.download_file(source['key'], archive_path)
+    with tarfile.open(archive_path, 'r:gz') as tar:
+        # Only regular files and directories with paths inside the repository
+        members = [
+            member for member in tar.getmembers()
+            if (member.isfile() or member.isdir())
+            and not os.path.isabs(member.name)
+            and not os.path.normpath(member.name).startswith('..')
+        ]
+        tar.extractall(repo_dir, members=members)
+    os.remove(archive_path)
+    return repo_dir
+
+
+@celery_app.task(bind=True, name='plan_repository_shards_task', queue='celery')
+def plan_repository_shards_task(
+    self,
+    input_repo_type: str,
+    input_repo_ref: str,
+    github_branch: Optional[str] = None,
+    processing_mode: str = 'ultra',
+    output_format: str = 'text',
+    additional_options: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Split a repository into shards and fan out scanning across workers
+
+    Takes the same arguments as process_repository_task. On success the task
+    is replaced by a chord of scan_shard_task and reduce_shards_task.
+    """
+    from repo2file.dump_ultra import UltraRepo2File, plan_shards
+
+    storage_manager = storage_manager_from_config()
+    temp_dir = None
+
+    additional_options = dict(additional_options or {})
+    cache_key = additional_options.pop('cache_key', None)
+    expected_commit = additional_options.pop('expected_commit', None)
+    admission_owner = additional_options.pop('admission_owner', None)
+    workflow = None
+    cancel_token = JobCancellation().token(self.request.id)
+
+    try:
+        cancel_token.raise_if_cancelled()
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'phase': 'preparing_input',
+                'current': 5,
+                'total': 100,
+                'message': 'Preparing input repository'
+            }
+        )
+
+        temp_dir = tempfile.mkdtemp(prefix='repo2file_plan_')
+        try:
+            input_path, commit_pinned = prepare_input_repository(
+                storage_manager, temp_dir, input_repo_type, input_repo_ref,
+                github_branch, expected_commit
+            )
+        except git.exc.GitCommandError as e:
+            logger.error(f"Git clone failed: {e}")
+            return _failure(f"Failed to clone repository: {str(e)}", 'GitCommandError')
+
+        if not commit_pinned and cache_key:
+            # The branch moved on; output no longer matches the cache key
+            from .result_cache import ResultCache
+            ResultCache().release(cache_key, self.request.id)
+            cache_key = None
+
+        cancel_token.raise_if_cancelled()
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'phase': 'planning',
+                'current': 10,
+                'total': 100,
+                'message': 'Splitting repository into shards'
+            }
+        )
+
+        processor = UltraRepo2File(_build_profile(additional_options))
+        listing = processor.list_repository_files(Path(input_path))
+        shards = plan_shards(listing, Config.SHARD_MAX_BYTES, Config.SHARD_MAX_FILES)
+        logger.info(f"Job {self.request.id}: {len(listing)} files in {len(shards)} shards")
+
+        sources = [
+            _publish_shard_source(storage_manager, self.request.id, i, input_repo_type,
+                                  input_path, rel_paths, temp_dir)
+            for i, rel_paths in enumerate(shards)
+        ]
+        cancel_token.raise_if_cancelled()
+
+        # Keep the fan-out on the queue admission control picked for this job
+        queue = (self.request.delivery_info or {}).get('routing_key') or 'celery'
+        workflow = chord(
+            [
+                scan_shard_task.s(self.request.id, i, rel_paths, sources[i], additional_options).set(queue=queue)
+                for i, rel_paths in enumerate(shards)
+            ],
+            reduce_shards_task.s(
+                job_id=self.request.id,
+                sources=sources,
+                input_repo_type=input_repo_type,
+                github_branch=github_branch,
+                processing_mode=processing_mode,
+                output_format=output_format,
+                additional_options=additional_options,
+                cache_key=cache_key,
+                admission_owner=admission_owner
+            ).set(queue=queue)
+        )
+
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'phase': 'scanning',
+                'current': 20,
+                'total': 100,
+                'message': f'Scanning {len(listing)} files in {len(shards)} shards'
+            }
+        )
+
+    except ProcessingCancelled:
+        logger.info(f"Job {self.request.id} cancelled while planning")
+        return _cancelled()
+
+    except Exception as e:
+        logger.error(f"Error planning sharded job: {e}")
+        import traceback
+        tb = traceback.format_exc()
+        logger.error(f"Full traceback: {tb}")
+        result = _failure(str(e), type(e).__name__)
+        result['traceback'] = tb
+        return result
+
+    finally:
+        if workflow is None:
+            if cache_key:
+                from .result_cache import ResultCache
+                ResultCache().release(cache_key, self.request.id)
+            if admission_owner:
+                from .admission import FairShareLimiter
+                FairShareLimiter().release(admission_owner, self.request.id)
+            try:
+                storage_manager.delete_directory(f"{SHARD_PREFIX}{self.request.id}/")
+            except Exception as e:
+                logger.error(f"Failed to clean up shard artifacts: {e}")
+
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # The reducer inherits this task's ID, so its result becomes the job result
+    raise self.replace(workflow)
+
+
+@celery_app.task(bind=True, name='scan_shard_task', queue='celery')
+def scan_shard_task(
+    self,
+    job_id: str,
+    shard_index: int,
+    rel_paths: List[str],
+    source: Dict[str, str],
+    additional_options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Scan, tokenize and analyze one shard
+
+    Scan results can be large, so they are uploaded to MinIO and only the
+    object key travels through the result backend. Errors are returned rather
+    than raised so that the reducer always runs and can clean up.
+    """
+    from repo2file.dump_ultra import UltraRepo2File
+
+    storage_manager = storage_manager_from_config()
+    key = f"{SHARD_PREFIX}{job_id}/scan-{shard_index}.json"
+    if storage_manager.object_exists(key):
+        # Redelivered after the upload but before the ack
+        logger.info(f"Job {job_id}: shard {shard_index} already scanned by an earlier attempt")
+        return {'shard': shard_index, 'key': key, 'files': None}
+
+    temp_dir = tempfile.mkdtemp(prefix='repo2file_shard_')
+    cancel_token = JobCancellation().token(job_id)
+
+    try:
+        cancel_token.raise_if_cancelled()
+        repo_path = _materialize_shard_source(
+            storage_manager, source, os.path.join(temp_dir, 'repo'), temp_dir
+        )
+
+        processor = UltraRepo2File(_build_profile(additional_options), cancel_token=cancel_token,
+                                   instrumentation=Instrumentation(engine_span_factory()))
+        scanned = processor.scan_files(Path(repo_path), rel_paths)
+        record_engine_metrics(processor.instrumentation.summary(), 'ultra')
+
+        results_file = os.path.join(temp_dir, 'scan.json')
+        with open(results_file, 'w', encoding='utf-8') as f:
+            json.dump(scanned, f, default=str)
+
+        storage_manager.upload_file_compressed(results_file, key, content_type='application/json')
+
+        logger.info(f"Job {job_id}: shard {shard_index} scanned {len(scanned)}/{len(rel_paths)} files")
+        return {'shard': shard_index, 'key': key, 'files': len(scanned)}
+
+    except ProcessingCancelled:
+        logger.info(f"Job {job_id}: shard {shard_index} cancelled")
+        return {'shard': shard_index, 'error': 'Job was cancelled', 'error_type': 'ProcessingCancelled'}
+
+    except Exception as e:
+        logger.error(f"Job {job_id}: shard {shard_index} failed: {e}")
+        return {'shard': shard_index, 'error': str(e), 'error_type': type(e).__name__}
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@celery_app.task(bind=True, name='reduce_shards_task', queue='celery')
+def reduce_shards_task(
+    self,
+    shard_results: List[Dict[str, Any]],
+    job_id: str,
+    sources: List[Dict[str, str]],
+    input_repo_type: str,
+    github_branch: Optional[str],
+    processing_mode: str,
+    output_format: str,
+    additional_options: Dict[str, Any],
+    cache_key: Optional[str] = None,
+    admission_owner: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Merge shard scan results and write the final output
+
+    Returns the same result shape as process_repository_task.
+    """
+    from repo2file.dump_ultra import UltraRepo2File
+
+    storage_manager = storage_manager_from_config()
+    temp_dir = tempfile.mkdtemp(prefix='repo2file_reduce_')
+    checkpoint_store = MinioCheckpointStore(storage_manager, job_id)
+    retrying = False
+    cancel_token = JobCancellation().token(job_id)
+
+    try:
+        cancel_token.raise_if_cancelled()
+        failed = [r for r in shard_results if r.get('error')]
+        if failed:
+            errors = '; '.join(f"shard {r['shard']}: {r['error']}" for r in failed[:5])
+            return _failure(f"{len(failed)} of {len(shard_results)} shards failed: {errors}", 'ShardError')
+
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'phase': 'reducing',
+                'current': 60,
+                'total': 100,
+                'message': f'Merging {len(shard_results)} shards'
+            }
+        )
+
+        scanned_files = []
+        for shard in shard_results:
+            scanned_files.extend(json.loads(storage_manager.download_data(shard['key'])))
+
+        repo_dir = os.path.join(temp_dir, 'repo')
+        repo_path = repo_dir
+        for source in sources:
+            repo_path = _materialize_shard_source(storage_manager, source, repo_dir, temp_dir)
+
+        output_file = os.path.join(temp_dir, 'output.txt')
+        processor = UltraRepo2File(
+            _build_profile(additional_options),
+            checkpoint_store=checkpoint_store,
+            checkpoint_interval=Config.CHECKPOINT_INTERVAL,
+            cancel_token=cancel_token,
+            instrumentation=Instrumentation(engine_span_factory())
+        )
+        processor.process_scanned_files(Path(repo_path), Path(output_file), scanned_files)
+        engine_stats = processor.instrumentation.summary()
+        record_engine_metrics(engine_stats, processing_mode)
+
+        if not os.path.exists(output_file):
+            raise Exception("Failed to generate output file")
+
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'phase': 'uploading_results',
+                'current': 90,
+                'total': 100,
+                'message': 'Uploading results to storage'
+            }
+        )
+
+        output_key = f"outputs/{self.request.id}/output.txt"
+        storage_manager.upload_file_compressed(output_file, output_key)
+
+        result = {
+            'job_id': self.request.id,
+            'status': 'success',
+            'output_files': {'output.txt': output_key},
+            'additional_files': [],
+            'processing_mode': processing_mode,
+            'output_format': output_format,
+            'metadata': {
+                'input_type': input_repo_type,
+                'branch': github_branch if github_branch else 'default',
+                'shards': len(shard_results),
+                'files_scanned': len(scanned_files),
+                'engine_stats': engine_stats
+            }
+        }
+
+        if 'session_id' in additional_options:
+            result['session_id'] = additional_options['session_id']
+
+        if cache_key:
+            from .result_cache import ResultCache
+            ResultCache().store(cache_key, result)
+
+        logger.info(f"Job {self.request.id} completed successfully from {len(shard_results)} shards")
+        return result
+
+    except ProcessingCancelled:
+        logger.info(f"Job {job_id} cancelled")
+        return _cancelled()
+
+    except SoftTimeLimitExceeded as e:
+        if self.request.retries < Config.CHECKPOINT_MAX_RETRIES:
+            logger.warning(f"Job {job_id} hit the soft time limit, retrying from checkpoint")
+            retrying = True
+            raise self.retry(exc=e, countdown=1, max_retries=Config.CHECKPOINT_MAX_RETRIES)
+        logger.error(f"Job {job_id} hit the soft time limit")
+        return _failure('Processing exceeded the time limit', type(e).__name__)
+
+    except Exception as e:
+        logger.error(f"Error reducing sharded job: {e}")
+        import traceback
+        tb = traceback.format_exc()
+        logger.error(f"Full traceback: {tb}")
+        result = _failure(str(e), type(e).__name__)
+        result['traceback'] = tb
+        return result
+
+    finally:
+        # A retry still needs the shard artifacts, checkpoints and claims
+        if not retrying:
+            if cache_key:
+                from .result_cache import ResultCache
+                ResultCache().release(cache_key, job_id)
+
+            if admission_owner:
+                from .admission import FairShareLimiter
+                FairShareLimiter().release(admission_owner, job_id)
+
+            try:
+                storage_manager.delete_directory(f"{SHARD_PREFIX}{job_id}/")
+                checkpoint_store.clear()
+            except Exception as e:
+                logger.error(f"Failed to clean up shard artifacts: {e}")
+
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -1,17 +1,34 @@
 """Storage management module for MinIO/S3 operations"""
 import os
+import gzip
+import hashlib
 import json
+import shutil
 import tempfile
+import zlib
 import logging
 from datetime import datetime, timedelta
 from io import BytesIO
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from minio import Minio
 from minio.error import S3Error
 from flask import current_app
 
 logger = logging.getLogger(__name__)
 
+# Objects compressed at rest carry their encoding in user metadata. We do not
+# use the S3 Content-Encoding header because HTTP clients (including the MinIO
+# client) would then decode transparently and break gzip passthrough.
+ENCODING_METADATA_KEY = 'x-amz-meta-encoding'
+UNCOMPRESSED_SIZE_METADATA_KEY = 'x-amz-meta-uncompressed-size'
+# SHA-256 of the uncompressed content, used for strong ETags
+CONTENT_SHA256_METADATA_KEY = 'x-amz-meta-content-sha256'
+GZIP_ENCODING = 'gzip'
+
+# Defaults for multipart uploads; S3 requires parts of at least 5 MiB
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_PARALLEL_UPLOADS = 4
+
 class StorageManager:
     """Manages object storage operations using MinIO/S3"""
     
@@ -90,15 +107,23 @@ class StorageManager:
             logger.error(f"Failed to upload data: {e}")
             raise
     
-    def upload_data_stream(self, object_name: str, data_stream, length: int, content_type: str = "application/octet-stream") -> str:
-        """Upload a data stream to storage"""
+    def upload_data_stream(self, object_name: str, data_stream, length: int, content_type: str = "application/octet-stream",
+                           metadata: Optional[Dict[str, str]] = None) -> str:
+        """Upload a data stream to storage
+        
+        Objects larger than the configured part size are sent as a multipart
+        upload with parts uploaded in parallel.
+        """
         try:
             self.client.put_object(
                 self.bucket_name,
                 object_name,
                 data_stream,
                 length=length,
-                content_type=content_type
+                content_type=content_type,
+                metadata=metadata,
+                part_size=self.config.get('MINIO_PART_SIZE', DEFAULT_PART_SIZE),
+                num_parallel_uploads=self.config.get('MINIO_PARALLEL_UPLOADS', DEFAULT_PARALLEL_UPLOADS)
             )
             logger.info(f"Uploaded stream: {object_name}")
             return object_name
@@ -106,14 +131,87 @@ class StorageManager:
             logger.error(f"Failed to upload stream: {e}")
             raise
     
+    def upload_file_compressed(self, file_path: str, object_name: str,
+                               content_type: str = "text/plain; charset=utf-8") -> str:
+        """Upload a file gzip-compressed at rest, recording the encoding in object metadata"""
+        original_size = os.path.getsize(file_path)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(suffix='.gz') as compressed:
+            with open(file_path, 'rb') as src, gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=6, mtime=0) as gz:
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                    gz.write(chunk)
+            compressed_size = compressed.tell()
+            compressed.seek(0)
+            
+            self.upload_data_stream(
+                object_name=object_name,
+                data_stream=compressed,
+                length=compressed_size,
+                content_type=content_type,
+                metadata={
+                    ENCODING_METADATA_KEY: GZIP_ENCODING,
+                    UNCOMPRESSED_SIZE_METADATA_KEY: str(original_size),
+                    CONTENT_SHA256_METADATA_KEY: digest.hexdigest()
+                }
+            )
+        
+        logger.info(f"Uploaded {object_name} compressed {original_size} -> {compressed_size} bytes")
+        return object_name
+    
+    @staticmethod
+    def _encoding_from_headers(headers) -> Optional[str]:
+        if headers is None:
+            return None
+        return headers.get(ENCODING_METADATA_KEY)
+    
+    def get_object_encoding(self, object_name: str) -> Optional[str]:
+        """Return the at-rest encoding of an object ('gzip') or None if stored raw"""
+        try:
+            stat = self.client.stat_object(self.bucket_name, object_name)
+            return self._encoding_from_headers(stat.metadata)
+        except S3Error as e:
+            logger.error(f"Failed to get object encoding: {e}")
+            raise
+    
+    def get_object_info(self, object_name: str) -> Dict[str, Any]:
+        """Stat an object and return what download endpoints need for HTTP caching
+        
+        `size` is the stored (possibly compressed) size; `uncompressed_size`
+        is the size of the decoded content, or None if unknown.
+        """
+        try:
+            stat = self.client.stat_object(self.bucket_name, object_name)
+        except S3Error as e:
+            logger.error(f"Failed to stat object: {e}")
+            raise
+        
+        metadata = stat.metadata or {}
+        encoding = self._encoding_from_headers(metadata)
+        uncompressed_size = metadata.get(UNCOMPRESSED_SIZE_METADATA_KEY)
+        return {
+            'size': stat.size,
+            'etag': stat.etag,
+            'last_modified': stat.last_modified,
+            'encoding': encoding,
+            'uncompressed_size': int(uncompressed_size) if uncompressed_size else (None if encoding else stat.size),
+            'content_sha256': metadata.get(CONTENT_SHA256_METADATA_KEY)
+        }
+    
     def download_file(self, object_name: str, file_path: str):
-        """Download a file from storage"""
+        """Download a file from storage, decompressing it if it is stored compressed"""
         try:
-            self.client.fget_object(
+            stat = self.client.fget_object(
                 self.bucket_name,
                 object_name,
                 file_path
             )
+            if self._encoding_from_headers(getattr(stat, 'metadata', None)) == GZIP_ENCODING:
+                compressed_path = file_path + '.gz'
+                os.replace(file_path, compressed_path)
+                with gzip.open(compressed_path, 'rb') as src, open(file_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.remove(compressed_path)
             logger.info(f"Downloaded file: {object_name} to {file_path}")
         except S3Error as e:
             logger.error(f"Failed to download file: {e}")
@@ -124,8 +222,11 @@ class StorageManager:
         try:
             response = self.client.get_object(self.bucket_name, object_name)
             data = response.read()
+            encoding = self._encoding_from_headers(response.headers)
             response.close()
             response.release_conn()
+            if encoding == GZIP_ENCODING:
+                data = gzip.decompress(data)
             logger.info(f"Downloaded data: {object_name}")
             return data
         except S3Error as e:
@@ -133,34 +234,105 @@ class StorageManager:
             raise
     
     def download_stream(self, object_name: str, chunk_size: int = 1024*1024):
-        """Download data from storage as a stream"""
+        """Download data from storage as a stream, decompressing on the fly if needed"""
+        stream, _, _ = self.open_download_stream(object_name, accept_gzip=False, chunk_size=chunk_size)
+        return stream
+    
+    def open_download_stream(self, object_name: str, accept_gzip: bool = False, chunk_size: int = 1024*1024,
+                             byte_range: Optional[Tuple[int, int]] = None,
+                             object_info: Optional[Dict[str, Any]] = None):
+        """Open an object for streaming to an HTTP client
+        
+        Returns (stream, content_encoding, content_length). Compressed objects
+        are passed through as-is when the client accepts gzip, otherwise they
+        are decompressed on the fly. content_length is None when unknown.
+        
+        `byte_range` is a (start, stop) half-open range over the representation
+        being returned. It maps to a ranged GET when the stored bytes are sent
+        as-is; for on-the-fly decompression the stream is decoded from the
+        start and sliced.
+        """
+        if byte_range is not None and object_info is None:
+            object_info = self.get_object_info(object_name)
+        
+        if object_info is not None:
+            encoding = object_info['encoding']
+            decompress = encoding == GZIP_ENCODING and not accept_gzip
+        else:
+            encoding = decompress = None
+        
+        get_kwargs = {}
+        if byte_range is not None and not decompress:
+            get_kwargs = {'offset': byte_range[0], 'length': byte_range[1] - byte_range[0]}
+        
         try:
-            response = self.client.get_object(self.bucket_name, object_name)
-            
-            def generate():
-                while True:
+            response = self.client.get_object(self.bucket_name, object_name, **get_kwargs)
+        except S3Error as e:
+            logger.error(f"Failed to download stream: {e}")
+            raise
+        
+        if object_info is None:
+            encoding = self._encoding_from_headers(response.headers)
+            decompress = encoding == GZIP_ENCODING and not accept_gzip
+        
+        skip, remaining = 0, None
+        if byte_range is not None and decompress:
+            skip, remaining = byte_range[0], byte_range[1] - byte_range[0]
+        
+        def generate():
+            nonlocal skip, remaining
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+            try:
+                while remaining is None or remaining > 0:
                     chunk = response.read(chunk_size)
                     if not chunk:
-                        break
-                    yield chunk
+                        if decoder:
+                            chunk = decoder.flush()
+                            decoder = None
+                        if not chunk:
+                            break
+                    elif decoder:
+                        chunk = decoder.decompress(chunk)
+                    
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                    if chunk:
+                        yield chunk
+            finally:
                 response.close()
                 response.release_conn()
-            
-            return generate()
-        except S3Error as e:
-            logger.error(f"Failed to download stream: {e}")
-            raise
+        
+        if byte_range is not None:
+            return generate(), (None if decompress else encoding), byte_range[1] - byte_range[0]
+        
+        if decompress:
+            length = response.headers.get(UNCOMPRESSED_SIZE_METADATA_KEY)
+            return generate(), None, int(length) if length else None
+        
+        length = response.headers.get('Content-Length')
+        return generate(), encoding, int(length) if length else None
     
     def get_file_url(self, object_name: str, expires: Optional[int] = None) -> str:
         """Get a public URL for an object"""
         try:
             if expires is None:
                 expires = self.config.get('PRESIGNED_URL_EXPIRATION', 3600)
+            
+            # Compressed objects are served with Content-Encoding so browsers decode them
+            response_headers = None
+            if self.get_object_encoding(object_name) == GZIP_ENCODING:
+                response_headers = {'response-content-encoding': GZIP_ENCODING}
                 
             url = self.client.presigned_get_object(
                 self.bucket_name,
                 object_name,
-                expires=timedelta(seconds=expires)
+                expires=timedelta(seconds=expires),
+                response_headers=response_headers
             )
             return url
         except S3Error as e:
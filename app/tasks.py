@@ -3,10 +3,11 @@ Celery tasks for RobustRepo v2.0
 """
 import os
 import sys
+import json
 import tempfile
 import shutil
-import subprocess
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+from celery.exceptions import SoftTimeLimitExceeded
 from .celery_app import celery_app
 from .storage_manager import StorageManager
 from .logger import logger
@@ -15,6 +16,131 @@ import git
 # Add parent directory to Python path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from repo2file.cancellation import ProcessingCancelled, run_process
+
+def engine_span_factory():
+    """Span factory for repo2file Instrumentation, or None without tracing support"""
+    try:
+        from .observability.tracing import trace_engine_stage
+    except ImportError:
+        return None
+    return trace_engine_stage
+
+def record_engine_metrics(summary: Optional[Dict[str, Any]], processing_mode: str):
+    """Export engine stage timings and counters; never fails the job"""
+    if not summary:
+        return
+    try:
+        from .observability.metrics import record_engine_stats
+        record_engine_stats(summary, processing_mode)
+    except Exception as e:
+        logger.warning(f"Could not record engine metrics: {e}")
+
+def load_engine_summary(metrics_file: str) -> Optional[Dict[str, Any]]:
+    """Read the --metrics-file sidecar written by dump_ultra.py"""
+    try:
+        with open(metrics_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read engine metrics from {metrics_file}: {e}")
+        return None
+
+def storage_manager_from_config() -> StorageManager:
+    """Create a StorageManager from Config in a Celery worker context"""
+    from .config import Config
+    return StorageManager(config={
+        'MINIO_ENDPOINT': Config.MINIO_ENDPOINT,
+        'MINIO_ACCESS_KEY': Config.MINIO_ACCESS_KEY,
+        'MINIO_SECRET_KEY': Config.MINIO_SECRET_KEY,
+        'MINIO_SECURE': Config.MINIO_SECURE,
+        'MINIO_BUCKET_NAME': Config.MINIO_BUCKET_NAME,
+        'MINIO_PART_SIZE': Config.MINIO_PART_SIZE,
+        'MINIO_PARALLEL_UPLOADS': Config.MINIO_PARALLEL_UPLOADS
+    })
+
+
+def upload_profile(storage_manager: StorageManager, profile_dir: str, job_id: str,
+                   top: int = 15) -> Optional[Dict[str, Any]]:
+    """Upload the profiles written by dump_ultra.py --profile-dir next to the job output
+    
+    Returns the artifact keys and the top functions by cumulative time, or
+    None if the run produced no profiles. Profiling never fails the job.
+    """
+    if not os.path.isdir(profile_dir):
+        logger.warning(f"Job {job_id} was profiled but wrote no profiles")
+        return None
+    
+    artifacts = {}
+    top_functions = []
+    try:
+        for name in sorted(os.listdir(profile_dir)):
+            key = f"outputs/{job_id}/profile/{name}"
+            content_type = 'application/json' if name.endswith('.json') else 'text/plain'
+            storage_manager.upload_file_compressed(os.path.join(profile_dir, name), key, content_type=content_type)
+            artifacts[name] = key
+        
+        with open(os.path.join(profile_dir, 'profile.json'), 'r') as f:
+            top_functions = json.load(f).get('top_functions', [])[:top]
+    except Exception as e:
+        logger.warning(f"Could not store profiles for job {job_id}: {e}")
+    
+    return {'artifacts': artifacts, 'top_functions': top_functions} if artifacts else None
+
+
+def prepare_input_repository(
+    storage_manager: StorageManager,
+    temp_dir: str,
+    input_repo_type: str,
+    input_repo_ref: str,
+    github_branch: Optional[str] = None,
+    expected_commit: Optional[str] = None
+) -> Tuple[str, bool]:
+    """
+    Materialize the input repository on local disk
+    
+    Returns:
+        tuple: (input path, whether the checkout matches `expected_commit`)
+    """
+    commit_pinned = True
+    
+    if input_repo_type == 'github_url':
+        # Clone GitHub repository
+        repo_dir = os.path.join(temp_dir, 'repo')
+        logger.info(f"Cloning GitHub repository: {input_repo_ref}")
+        
+        if github_branch:
+            git.Repo.clone_from(input_repo_ref, repo_dir, branch=github_branch)
+        else:
+            git.Repo.clone_from(input_repo_ref, repo_dir)
+        
+        if expected_commit:
+            try:
+                repo = git.Repo(repo_dir)
+                if repo.head.commit.hexsha != expected_commit:
+                    repo.git.checkout(expected_commit)
+            except Exception as e:
+                logger.warning(f"Could not check out {expected_commit}, skipping result cache: {e}")
+                commit_pinned = False
+        
+        return repo_dir, commit_pinned
+    
+    elif input_repo_type == 'minio_file':
+        # Download from MinIO
+        logger.info(f"Downloading from MinIO: {input_repo_ref}")
+        local_file = os.path.join(temp_dir, 'input.zip')
+        storage_manager.download_file(input_repo_ref, local_file)
+        
+        # Extract zip file
+        extract_dir = os.path.join(temp_dir, 'extracted')
+        shutil.unpack_archive(local_file, extract_dir)
+        return extract_dir, commit_pinned
+    
+    elif input_repo_type == 'local_path':
+        return input_repo_ref, commit_pinned
+    
+    raise ValueError(f"Unknown input repository type: {input_repo_type}")
+
+
 @celery_app.task(bind=True, name='process_repository_task', queue='celery')
 def process_repository_task(
     self,
@@ -39,20 +165,29 @@ def process_repository_task(
     Returns:
         dict: Processing result with output file references
     """
-    # Import config directly for Celery worker context
     from .config import Config
-    # Create a config dictionary with the necessary MinIO settings
-    config_dict = {
-        'MINIO_ENDPOINT': Config.MINIO_ENDPOINT,
-        'MINIO_ACCESS_KEY': Config.MINIO_ACCESS_KEY,
-        'MINIO_SECRET_KEY': Config.MINIO_SECRET_KEY,
-        'MINIO_SECURE': Config.MINIO_SECURE,
-        'MINIO_BUCKET_NAME': Config.MINIO_BUCKET_NAME
-    }
-    storage_manager = StorageManager(config=config_dict)
+    
+    storage_manager = storage_manager_from_config()
     temp_dir = None
     
+    # Result cache bookkeeping set up by JobManager.submit_repo_processing_job
+    additional_options = dict(additional_options or {})
+    cache_key = additional_options.pop('cache_key', None)
+    expected_commit = additional_options.pop('expected_commit', None)
+    admission_owner = additional_options.pop('admission_owner', None)
+    
+    # Ultra mode checkpoints its stages here; the task ID is kept across
+    # redeliveries and retries so the next attempt resumes from them
+    checkpoint_dir = os.path.join(Config.CHECKPOINT_DIR, self.request.id)
+    retrying = False
+    
+    from .cancellation import JobCancellation
+    cancel_token = JobCancellation().token(self.request.id)
+    
     try:
+        # A job cancelled while queued exits before doing any work
+        cancel_token.raise_if_cancelled()
+        
         # Update task state to show initialization
         self.update_state(
             state='PROGRESS',
@@ -79,51 +214,27 @@ def process_repository_task(
             }
         )
         
-        if input_repo_type == 'github_url':
-            # Clone GitHub repository
-            repo_dir = os.path.join(temp_dir, 'repo')
-            logger.info(f"Cloning GitHub repository: {input_repo_ref}")
-            
-            try:
-                if github_branch:
-                    git.Repo.clone_from(input_repo_ref, repo_dir, branch=github_branch)
-                else:
-                    git.Repo.clone_from(input_repo_ref, repo_dir)
-            except git.exc.GitCommandError as e:
-                logger.error(f"Git clone failed: {e}")
-                return {
-                    'success': False,
-                    'error': f"Failed to clone repository: {str(e)}",
-                    'error_type': 'GitCommandError',
-                    'status': 'FAILURE'
-                }
-            except Exception as e:
-                logger.error(f"Unexpected error during clone: {e}")
-                return {
-                    'success': False,
-                    'error': f"Unexpected error during clone: {str(e)}",
-                    'error_type': type(e).__name__,
-                    'status': 'FAILURE'
-                }
-            
-            input_path = repo_dir
-            
-        elif input_repo_type == 'minio_file':
-            # Download from MinIO
-            logger.info(f"Downloading from MinIO: {input_repo_ref}")
-            local_file = os.path.join(temp_dir, 'input.zip')
-            storage_manager.download_file(input_repo_ref, local_file)
-            
-            # Extract zip file
-            extract_dir = os.path.join(temp_dir, 'extracted')
-            shutil.unpack_archive(local_file, extract_dir)
-            input_path = extract_dir
-            
-        elif input_repo_type == 'local_path':
-            input_path = input_repo_ref
+        try:
+            input_path, commit_pinned = prepare_input_repository(
+                storage_manager, temp_dir, input_repo_type, input_repo_ref,
+                github_branch, expected_commit
+            )
+        except git.exc.GitCommandError as e:
+            logger.error(f"Git clone failed: {e}")
+            return {
+                'success': False,
+                'error': f"Failed to clone repository: {str(e)}",
+                'error_type': 'GitCommandError',
+                'status': 'FAILURE'
+            }
         
-        else:
-            raise ValueError(f"Unknown input repository type: {input_repo_type}")
+        if not commit_pinned and cache_key:
+            # The branch moved on; output no longer matches the cache key
+            from .result_cache import ResultCache
+            ResultCache().release(cache_key, self.request.id)
+            cache_key = None
+        
+        cancel_token.raise_if_cancelled()
         
         # Step 2: Process repository
         self.update_state(
@@ -172,6 +283,18 @@ def process_repository_task(
                 cmd.append('--include-tests')
             if 'semantic_analysis' in additional_options and additional_options['semantic_analysis']:
                 cmd.append('--semantic-analysis')
+        metrics_file = os.path.join(temp_dir, 'engine_metrics.json')
+        if processing_mode == 'ultra':
+            cmd.extend(['--checkpoint-dir', checkpoint_dir, '--metrics-file', metrics_file])
+        
+        # Per-stage CPU and memory profiles, only ultra mode has stages to profile
+        profile_dir = None
+        if additional_options.get('profiling'):
+            if processing_mode == 'ultra':
+                profile_dir = os.path.join(temp_dir, 'profile')
+                cmd.extend(['--profile-dir', profile_dir])
+            else:
+                logger.warning(f"Profiling is not supported in {processing_mode} mode, ignoring")
         
         # Add file extensions if specified
         if additional_options and 'file_extensions' in additional_options:
@@ -192,9 +315,10 @@ def process_repository_task(
         logger.info(f"Script exists at: {script_full_path}")
         
         try:
-            process = subprocess.run(
+            # Killed along with its children as soon as the job is cancelled
+            process = run_process(
                 cmd,
-                capture_output=True,
+                cancel_token,
                 text=True,
                 cwd=project_root
             )
@@ -230,6 +354,9 @@ def process_repository_task(
         if not os.path.exists(output_file):
             raise Exception("Failed to generate output file")
         
+        engine_stats = load_engine_summary(metrics_file) if processing_mode == 'ultra' else None
+        record_engine_metrics(engine_stats, processing_mode)
+        
         # Step 3: Upload results to MinIO
         self.update_state(
             state='PROGRESS',
@@ -241,14 +368,9 @@ def process_repository_task(
             }
         )
         
-        # Upload main output file
+        # Upload main output file (gzip-compressed at rest)
         output_key = f"outputs/{self.request.id}/output.txt"
-        with open(output_file, 'rb') as f:
-            storage_manager.upload_data_stream(
-                object_name=output_key,
-                data_stream=f,
-                length=os.path.getsize(output_file)
-            )
+        storage_manager.upload_file_compressed(output_file, output_key)
         
         output_files = {'output.txt': output_key}
         
@@ -259,15 +381,14 @@ def process_repository_task(
         manifest_file = os.path.join(temp_dir, 'manifest.json')
         if os.path.exists(manifest_file):
             manifest_key = f"outputs/{self.request.id}/manifest.json"
-            with open(manifest_file, 'rb') as f:
-                storage_manager.upload_data_stream(
-                    object_name=manifest_key,
-                    data_stream=f,
-                    length=os.path.getsize(manifest_file)
-                )
+            storage_manager.upload_file_compressed(
+                manifest_file, manifest_key, content_type='application/json'
+            )
             output_files['manifest.json'] = manifest_key
             additional_files.append('manifest.json')
         
+        profiling = upload_profile(storage_manager, profile_dir, self.request.id) if profile_dir else None
+        
         # Step 4: Prepare final result
         result = {
             'job_id': self.request.id,
@@ -281,6 +402,10 @@ def process_repository_task(
                 'branch': github_branch if github_branch else 'default'
             }
         }
+        if engine_stats:
+            result['metadata']['engine_stats'] = engine_stats
+        if profiling:
+            result['profiling'] = profiling
         
         # Add session ID if provided
         if additional_options and 'session_id' in additional_options:
@@ -297,8 +422,35 @@ def process_repository_task(
             }
         )
         
+        if cache_key:
+            from .result_cache import ResultCache
+            ResultCache().store(cache_key, result)
+        
         logger.info(f"Job {self.request.id} completed successfully")
         return result
+    
+    except ProcessingCancelled:
+        logger.info(f"Job {self.request.id} cancelled")
+        return {
+            'success': False,
+            'error': 'Job was cancelled',
+            'error_type': 'ProcessingCancelled',
+            'status': 'FAILURE'
+        }
+    
+    except SoftTimeLimitExceeded as e:
+        # run_process has killed the child; its checkpoints survive for the retry
+        if processing_mode == 'ultra' and self.request.retries < Config.CHECKPOINT_MAX_RETRIES:
+            logger.warning(f"Job {self.request.id} hit the soft time limit, retrying from checkpoint")
+            retrying = True
+            raise self.retry(exc=e, countdown=1, max_retries=Config.CHECKPOINT_MAX_RETRIES)
+        logger.error(f"Job {self.request.id} hit the soft time limit")
+        return {
+            'success': False,
+            'error': 'Processing exceeded the time limit',
+            'error_type': type(e).__name__,
+            'status': 'FAILURE'
+        }
         
     except Exception as e:
         logger.error(f"Error processing repository: {e}")
@@ -326,6 +478,18 @@ def process_repository_task(
         }
         
     finally:
+        if not retrying:
+            # Let identical submissions that arrive from now on run or hit the cache
+            if cache_key:
+                from .result_cache import ResultCache
+                ResultCache().release(cache_key, self.request.id)
+            
+            if admission_owner:
+                from .admission import FairShareLimiter
+                FairShareLimiter().release(admission_owner, self.request.id)
+            
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        
         # Cleanup temporary directory
         if temp_dir and os.path.exists(temp_dir):
             try:
@@ -371,17 +535,7 @@ def generate_llm_context_task(
     )
     from repo2file.git_analyzer import GitAnalyzer
     
-    # Import config directly for Celery worker context
-    from .config import Config
-    # Create a config dictionary with the necessary MinIO settings
-    config_dict = {
-        'MINIO_ENDPOINT': Config.MINIO_ENDPOINT,
-        'MINIO_ACCESS_KEY': Config.MINIO_ACCESS_KEY,
-        'MINIO_SECRET_KEY': Config.MINIO_SECRET_KEY,
-        'MINIO_SECURE': Config.MINIO_SECURE,
-        'MINIO_BUCKET_NAME': Config.MINIO_BUCKET_NAME
-    }
-    storage_manager = StorageManager(config=config_dict)
+    storage_manager = storage_manager_from_config()
     temp_dir = None
     
     try:
@@ -514,23 +668,13 @@ def generate_llm_context_task(
         
         # Upload to MinIO
         context_key = f"llm_contexts/{self.request.id}/context.{output_format}"
-        with open(output_file, 'rb') as f:
-            storage_manager.upload_data_stream(
-                object_name=context_key,
-                data_stream=f,
-                length=os.path.getsize(output_file)
-            )
+        storage_manager.upload_file_compressed(output_file, context_key)
         
         output_files = {'context': context_key}
         
         if prompt_file:
             prompt_key = f"llm_contexts/{self.request.id}/prompt.txt"
-            with open(prompt_file, 'rb') as f:
-                storage_manager.upload_data_stream(
-                    object_name=prompt_key,
-                    data_stream=f,
-                    length=os.path.getsize(prompt_file)
-                )
+            storage_manager.upload_file_compressed(prompt_file, prompt_key)
             output_files['prompt'] = prompt_key
         
         # Prepare result
@@ -0,0 +1,105 @@
+"""
+Cooperative cancellation for repository processing
+
+A CancellationToken is passed down through UltraRepo2File to the scanner
+pool, the content processor and LLM calls, which check it once per file or
+request. Child processes are run through run_process, which kills the whole
+process group as soon as the token is cancelled.
+"""
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class ProcessingCancelled(BaseException):
+    """Raised when processing is cancelled
+
+    Derives from BaseException, like asyncio.CancelledError, so the many
+    `except Exception` fallbacks in the engine do not swallow it.
+    """
+
+
+class CancellationToken:
+    """Cancellation flag, optionally backed by an external check
+
+    `check` is polled at most once per `poll_interval` seconds, so it can be
+    a network lookup (e.g. a Redis key) without slowing down per-file checks.
+    """
+
+    def __init__(self, check: Optional[Callable[[], bool]] = None, poll_interval: float = 0.5):
+        self._event = threading.Event()
+        self._check = check
+        self.poll_interval = poll_interval
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._check is None:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_poll < self.poll_interval:
+                return False
+            self._last_poll = now
+        try:
+            if self._check():
+                self._event.set()
+        except Exception:
+            # An unreachable cancellation source must not fail the job
+            pass
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise ProcessingCancelled()
+
+
+def run_process(cmd: List[str], cancel_token: Optional[CancellationToken] = None,
+                timeout: Optional[float] = None, check: bool = False,
+                poll_interval: float = 0.5, **popen_kwargs) -> subprocess.CompletedProcess:
+    """Run a command to completion like subprocess.run(capture_output=True)
+
+    The child runs in its own session so that on cancellation, timeout, or
+    any exception in the caller (such as a Celery soft time limit), the child
+    and everything it spawned are killed together.
+    """
+    popen_kwargs.setdefault('stdout', subprocess.PIPE)
+    popen_kwargs.setdefault('stderr', subprocess.PIPE)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    process = subprocess.Popen(cmd, start_new_session=True, **popen_kwargs)
+    try:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        _kill_process_group(process)
+        raise
+
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _kill_process_group(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    # Reap the child and close its pipes
+    process.communicate()
@@ -0,0 +1,89 @@
+"""
+Stage checkpoints for resumable repository processing
+
+UltraRepo2File saves the output of each processing stage (scan index,
+codebase analysis, token allocation and the partially written output) to a
+checkpoint store. A retried run with the same store and profile resumes after
+the last completed stage instead of starting over.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .action_blocks import (
+    ActionBlock, CallGraphNode, GitInsight, TodoItem, PCANote, CodeQualityMetric
+)
+
+ACTION_BLOCK_CLASSES = {
+    cls.__name__: cls for cls in (CallGraphNode, GitInsight, TodoItem, PCANote, CodeQualityMetric)
+}
+
+
+class CheckpointStore:
+    """Key/value store for JSON-serializable stage outputs of one run"""
+
+    def load(self, name: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def save(self, name: str, data: Any):
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all checkpoints, e.g. once the run's output is safely stored"""
+        raise NotImplementedError
+
+
+class LocalCheckpointStore(CheckpointStore):
+    """Checkpoints as JSON files in a local directory"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.json"
+
+    def load(self, name: str) -> Optional[Any]:
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, name: str, data: Any):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a crash mid-write never leaves a truncated checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, default=str)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def profile_fingerprint(profile) -> str:
+    """Hash of a ProcessingProfile; checkpoints from a different profile are stale"""
+    payload = json.dumps(dataclasses.asdict(profile), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def serialize_action_block(block: ActionBlock) -> Dict:
+    fields = {f.name: getattr(block, f.name) for f in dataclasses.fields(block) if f.init}
+    return {'class': type(block).__name__, 'fields': fields}
+
+
+def deserialize_action_block(data: Dict) -> Optional[ActionBlock]:
+    cls = ACTION_BLOCK_CLASSES.get(data.get('class'))
+    if cls is None:
+        return None
+    return cls(**data['fields'])
@@ -388,6 +388,71 @@ def interactive():
         ctx = click.Context(cli)
         cli.invoke(ctx, cmd)
 
+@cli.command()
+@click.argument('pack_file', type=click.Path(exists=True))
+@click.option('--budget', type=int, default=500000, help='Token budget of the rendered output')
+@click.option('--file', 'paths', multiple=True, help='Render only these paths, in this order')
+@click.option('--output', type=click.Path(), help='Write to a file instead of stdout')
+def pack(pack_file, budget, paths, output):
+    """Render a context pack (.r2fpack) to text without rescanning the repository"""
+    from repo2file.context_pack import ContextPack, ContextPackError
+    
+    try:
+        with ContextPack(Path(pack_file)) as context_pack:
+            missing = [path for path in paths if path not in context_pack]
+            if missing:
+                console.print(f"[red]Not in pack:[/red] {', '.join(missing)}")
+                sys.exit(1)
+            text = context_pack.render(budget, paths or None)
+    except ContextPackError as e:
+        console.print(f"[red]Error:[/red] {e}")
+        sys.exit(1)
+    
+    if output:
+        Path(output).write_text(text, encoding='utf-8')
+        console.print(f"[green]✓[/green] Rendered to {output}")
+    else:
+        click.echo(text)
+
+@cli.command()
+@click.argument('path', type=click.Path(exists=True, file_okay=False))
+@click.argument('output', type=click.Path())
+@click.option('--model', default='gpt-4', help='LLM model (gpt-4, gpt-3.5-turbo, claude-3, llama, gemini-1.5-pro)')
+@click.option('--budget', type=int, default=500000, help='Token budget')
+@click.option('--exclude', multiple=True, help='Additional exclusion patterns')
+@click.option('--truncation', type=click.Choice(['semantic', 'basic', 'middle_summarize', 'business_logic']),
+              default='semantic', help='Truncation strategy')
+@click.option('--query', default='', help='Intended LLM query, to prioritize files for it')
+@click.option('--debounce', type=float, default=0.2, help='Seconds without changes before updating')
+def watch(path, output, model, budget, exclude, truncation, query, debounce):
+    """Keep an ultra-mode output up to date as the working tree changes"""
+    from repo2file.dump_ultra import ProcessingProfile
+    from repo2file.watch import WatchSession
+
+    profile = ProcessingProfile(
+        name='watch',
+        token_budget=budget,
+        model=model,
+        exclude_patterns=list(exclude),
+        truncation_strategy=truncation,
+        intended_query=query,
+    )
+    session = WatchSession(Path(path), Path(output), profile)
+    session.start()
+    console.print(f"[green]✓[/green] Wrote {output}; watching {path} (Ctrl+C to stop)")
+
+    def report(result, touched, seconds):
+        if result == 'unchanged':
+            return
+        changes = f"{touched} changed paths" if touched else "lost events, rescanned"
+        console.print(f"{time.strftime('%H:%M:%S')} {result.capitalize()} {output} "
+                      f"({changes}) in {seconds:.2f}s")
+
+    try:
+        session.run(debounce, report)
+    except KeyboardInterrupt:
+        console.print("\nStopped watching")
+
 # Helper functions
 def show_preview(path: Path, file_types: List[str]):
     """Show preview of files to be processed"""
@@ -9,7 +9,7 @@ from dataclasses import dataclass
 import json
 import string
 
-@dataclass
+@dataclass(slots=True)
 class CodeEntity:
     name: str
     type: str  # 'class', 'function', 'method', 'variable'
@@ -87,7 +87,7 @@ class CodeAnalyzer:
                             entity_map[method_entity.name] = method_entity
                             
                             # Find calls within this method
-                            self._extract_calls(item, method_entity, entity_map)
+                            self._extract_calls(item, method_entity)
                     
                     entities.append(entity)
                     entity_map[entity.name] = entity
@@ -106,7 +106,7 @@ class CodeAnalyzer:
                         entity_map[entity.name] = entity
                         
                         # Find calls within this function
-                        self._extract_calls(node, entity, entity_map)
+                        self._extract_calls(node, entity)
                         
                 elif isinstance(node, ast.Import):
                     for alias in node.names:
@@ -119,6 +119,16 @@ class CodeAnalyzer:
                         for alias in node.names:
                             imports.append(f"{node.module}.{alias.name}")
             
+            # Resolve callers once every entity is known, wherever it is defined in the file
+            for entity in entities:
+                owner = entity.name.split('.')[0] if entity.type == 'method' else None
+                for call_name in entity.calls:
+                    if owner and call_name.startswith('self.'):
+                        call_name = f"{owner}.{call_name[5:]}"
+                    callee = entity_map.get(call_name)
+                    if callee is not None and entity.name not in callee.called_by:
+                        callee.called_by.append(entity.name)
+            
             # Analyze dependencies
             for entity in entities:
                 entity.dependencies = self._find_dependencies(
@@ -137,7 +147,7 @@ class CodeAnalyzer:
             'metrics': self._calculate_metrics(entities, content)
         }
     
-    def _extract_calls(self, node: ast.AST, entity: CodeEntity, entity_map: Dict[str, CodeEntity]) -> None:
+    def _extract_calls(self, node: ast.AST, entity: CodeEntity) -> None:
         """Extract function/method calls within an AST node"""
         for child in ast.walk(node):
             if isinstance(child, ast.Call):
@@ -160,10 +170,6 @@ class CodeAnalyzer:
                 
                 if call_name:
                     entity.calls.append(call_name)
-                    
-                    # If this is a call to an entity we know about, update its called_by
-                    if call_name in entity_map:
-                        entity_map[call_name].called_by.append(entity.name)
     
     def _find_dependencies(self, code_block: str, known_imports: List[str]) -> Set[str]:
         """Find dependencies within a code block"""
@@ -0,0 +1,179 @@
+"""
+Random-access context pack
+
+A text output is fixed to the budget it was rendered at, and slicing it
+means reading it whole. A context pack (`<output stem>.r2fpack`) holds every
+file of a run, not only those that fit, as independently compressed blocks
+followed by an index of their offsets and metadata: token count,
+importance, language, entities and action blocks. Reading it memory-maps the
+file and decompresses only the blocks asked for, so a tool can read one
+file by path, or re-render the text format at another budget or for a
+subset of paths, without rescanning the repository.
+
+Layout:
+
+    MAGIC | block ... | index | index offset, index length (u64 LE) | END_MAGIC
+
+Blocks and the index (JSON) are zlib-compressed.
+"""
+import json
+import mmap
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+PACK_VERSION = 1
+MAGIC = b'R2FPACK1'
+END_MAGIC = b'R2FPEND1'
+TRAILER = struct.Struct('<QQ8s')
+COMPRESSION_LEVEL = 6
+# Tokens for a block's FILE_START header and FILE_END marker when
+# rendering from stored counts
+BLOCK_OVERHEAD_TOKENS = 40
+
+
+class ContextPackError(Exception):
+    """Raised for files that are not context packs, or of another version"""
+
+
+class ContextPackWriter:
+    """Streams file blocks into a pack; the index is written on close"""
+
+    def __init__(self, path: Path, preamble: str = '', metadata: Optional[Dict[str, Any]] = None):
+        self.path = Path(path)
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._preamble = preamble
+        self._metadata = dict(metadata or {})
+
+    def __enter__(self) -> 'ContextPackWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self.path.unlink(missing_ok=True)
+
+    def add(self, rel_path: str, content: str, **metadata):
+        """Add a file's full content with its metadata
+
+        Rendering reads 'tokens', 'language', 'size' and 'inline_blocks'
+        (action blocks as text); other keys are kept for readers.
+        """
+        data = zlib.compress(content.encode('utf-8'), COMPRESSION_LEVEL)
+        self._file.write(data)
+        self._files[rel_path] = {'offset': self._offset, 'length': len(data), **metadata}
+        self._offset += len(data)
+
+    def close(self):
+        index = zlib.compress(json.dumps({
+            'version': PACK_VERSION,
+            'preamble': self._preamble,
+            'files': self._files,
+            **self._metadata,
+        }).encode('utf-8'), COMPRESSION_LEVEL)
+        self._file.write(index)
+        self._file.write(TRAILER.pack(self._offset, len(index), END_MAGIC))
+        self._file.close()
+
+
+class ContextPack:
+    """Memory-mapped reader of a context pack"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._file.close()
+            raise ContextPackError(f"{self.path} is not a context pack")
+        try:
+            self.index = self._load_index()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'ContextPack':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.index['files'])
+
+    def __contains__(self, rel_path: str) -> bool:
+        return rel_path in self.index['files']
+
+    @property
+    def paths(self) -> List[str]:
+        """Paths in the order the run ranked them"""
+        return list(self.index['files'])
+
+    def entry(self, rel_path: str) -> Dict[str, Any]:
+        """Metadata of a file; KeyError if it is not in the pack"""
+        return self.index['files'][rel_path]
+
+    def read(self, rel_path: str) -> str:
+        entry = self.entry(rel_path)
+        data = self._map[entry['offset']:entry['offset'] + entry['length']]
+        return zlib.decompress(data).decode('utf-8')
+
+    def render(self, token_budget: int, paths: Optional[Iterable[str]] = None) -> str:
+        """The text format for `paths` (default: all, best first) within token_budget
+
+        Files are taken whole, in order, while their stored token counts fit;
+        files that don't are listed at the end.
+        """
+        parts = [self.index['preamble']] if self.index['preamble'] else []
+        used = self.index.get('preamble_tokens', 0)
+        omitted = []
+        for rel_path in (self.paths if paths is None else paths):
+            entry = self.entry(rel_path)
+            tokens = entry.get('tokens') or 0
+            if used + tokens + BLOCK_OVERHEAD_TOKENS > token_budget:
+                omitted.append(rel_path)
+                continue
+            used += tokens + BLOCK_OVERHEAD_TOKENS
+            parts.append(self._render_block(rel_path, entry))
+
+        if omitted:
+            parts.append(f"\n[{len(omitted)} files omitted to fit {token_budget:,} tokens]")
+            parts.extend(f"  - {rel_path}" for rel_path in omitted)
+        return '\n'.join(parts)
+
+    def _render_block(self, rel_path: str, entry: Dict[str, Any]) -> str:
+        block = f"\n[[FILE_START: {rel_path}]]\n"
+        block += f"File: {rel_path}\n"
+        block += f"Language: {entry.get('language') or 'Unknown'}\n"
+        block += f"Size: {entry.get('size', 0):,} bytes | Tokens: {entry.get('tokens') or 0:,}\n"
+        block += "-" * 40 + "\n"
+        if entry.get('inline_blocks'):
+            block += '\n'.join(entry['inline_blocks']) + '\n\n'
+        block += self.read(rel_path) + "\n"
+        block += f"[[FILE_END: {rel_path}]]\n"
+        return block
+
+    def _load_index(self) -> Dict[str, Any]:
+        size = len(self._map)
+        if size < len(MAGIC) + TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+            raise ContextPackError(f"{self.path} is not a context pack")
+        index_offset, index_length, end_magic = TRAILER.unpack(self._map[size - TRAILER.size:])
+        if end_magic != END_MAGIC or index_offset + index_length > size - TRAILER.size:
+            raise ContextPackError(f"{self.path} is truncated")
+        index = json.loads(zlib.decompress(self._map[index_offset:index_offset + index_length]))
+        if index.get('version') != PACK_VERSION:
+            raise ContextPackError(f"{self.path} has pack version {index.get('version')}, "
+                                   f"expected {PACK_VERSION}")
+        return index
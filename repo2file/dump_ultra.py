@@ -8,14 +8,15 @@ import json
 import ast
 import re
 import time
+import subprocess
 import multiprocessing as mp
-from typing import List, Set, Optional, Dict, Tuple, Any
+from typing import List, Set, Optional, Dict, Tuple, Any, Iterator
 from pathlib import Path
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, asdict, replace
 import fnmatch
 import mimetypes
 import pathspec
-from .incremental_scanner import IncrementalScanner
+from .incremental_scanner import CACHE_DIRECTORY as SCANNER_CACHE_DIRECTORY, IncrementalScanner, in_cache_directory
 try:
     import tiktoken
     TIKTOKEN_AVAILABLE = True
@@ -24,10 +25,33 @@ except ImportError:
     print("Warning: tiktoken not available. Using character-based token estimation.", file=sys.stderr)
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import hashlib
+import difflib
 
 # Import our custom modules
-from .token_manager import TokenManager, TokenBudget
+from .token_manager import TokenManager, TokenBudget, TokenAllocation
+from .cancellation import CancellationToken, ProcessingCancelled
+from .profiling import StageProfiler
+from .instrumentation import (
+    Instrumentation, BYTES_READ, FILES_SCANNED, FILES_PROCESSED,
+    FILE_CACHE_HITS, FILE_CACHE_MISSES, TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES,
+    DUPLICATES_REFERENCED
+)
+from .checkpoint import (
+    CheckpointStore, LocalCheckpointStore, profile_fingerprint,
+    serialize_action_block, deserialize_action_block
+)
 from .code_analyzer import CodeAnalyzer
+from .entity_table import compact_semantic_data, serialize_semantic_data, intern, json_default
+from .iteration_context import MAX_NEIGHBOURS, diff_changes, outline
+from .large_file import LARGE_FILE_BYTES, MappedLines
+from .line_intervals import LineSelection
+from .search_index import SearchIndex
+from .symbol_graph import SymbolGraph
+from .entity_selection import file_units, score_units, select_units
+from .output_index import OutputIndex, block_path, write_output
+from .output_parts import part_path, parts_index, plan_parts
+from .context_pack import ContextPackWriter
+from .near_duplicates import NearDuplicateIndex, MIN_BYTES as MIN_DEDUPE_BYTES, minhash_signature
 from .git_analyzer import GitAnalyzer
 from .llm_augmenter import LLMAugmenter
 from .action_blocks import (
@@ -94,6 +118,18 @@ SUMMARIZE_FILES = {
     'pubspec.lock', 'mix.lock', '.terraform.lock.hcl',
 }
 
+# Languages _middle_summarize_truncate summarizes; others get basic truncation
+MIDDLE_SUMMARIZE_LANGUAGES = {'python', 'javascript', 'typescript', 'java'}
+
+# Values of ProcessingProfile.selection_granularity
+SELECTION_GRANULARITIES = ('file', 'entity')
+
+# Files scored per entity in entity selection mode, best file-level matches first
+MAX_ENTITY_CANDIDATE_FILES = 1000
+
+# Words (lowercase) a line needs for _extract_todos to match it
+TODO_MARKERS = (b'todo', b'fixme', b'hack', b'note')
+
 class ManifestGenerator:
     """Generate hierarchical manifest for large contexts"""
     
@@ -392,7 +428,7 @@ class ManifestGenerator:
         
         return None
 
-@dataclass
+@dataclass(slots=True)
 class FileInfo:
     path: Path
     rel_path: str
@@ -407,6 +443,7 @@ class FileInfo:
     token_count: Optional[int] = None
     semantic_data: Optional[Dict] = None
     query_relevance_score: float = 0.0
+    minhash: Optional[bytes] = None  # Near-duplicate signature, see near_duplicates.py
 
 @dataclass
 class ProcessingProfile:
@@ -444,6 +481,12 @@ class ProcessingProfile:
         'include_private_methods': False
     })
     auto_create_ai_guardrails_file: bool = True  # Auto-create ai_guardrails.md if missing
+    deduplicate_files: bool = True  # Render near-duplicates of an emitted file as a reference or diff
+    graph_importance_weight: float = 0.5  # Share of code file importance from import graph PageRank (0 disables)
+    selection_granularity: str = 'file'  # 'file', or 'entity' to select functions and classes for the query
+    iteration_snapshot_budget: int = 20000  # Tokens of diff hunks in an iteration brief's code snapshot
+    write_context_pack: bool = False  # Also write <output stem>.r2fpack, see context_pack.py
+    output_parts: int = 1  # Split the output into this many parts of token_budget tokens, see output_parts.py
     
     def save(self, path: Path):
         with open(path, 'w') as f:
@@ -455,6 +498,12 @@ class ProcessingProfile:
             data = json.load(f)
         return cls(**data)
 
+@dataclass
+class RenderTarget:
+    """One output of a multi-target run (see render_targets)"""
+    profile: ProcessingProfile
+    output_path: Path
+
 class Cache:
     """File and token count caching system"""
     def __init__(self, cache_dir: Path = CACHE_DIR, profile_key: str = None):
@@ -482,7 +531,8 @@ class Cache:
         with open(self.token_cache_file, 'w') as f:
             json.dump(self.token_cache, f)
         with open(self.file_cache_file, 'w') as f:
-            json.dump(self.file_cache, f)
+            # Entries share their EntityTables with the scanned FileInfos
+            json.dump(self.file_cache, f, default=json_default)
     
     def get_file_hash(self, file_path: Path, profile_hash: str = None) -> str:
         """Get hash of file content and processing parameters"""
@@ -557,12 +607,18 @@ class Cache:
 
 class UltraFileScanner:
     """Advanced file scanner with caching and parallel processing"""
-    def __init__(self, cache: Cache, token_manager: TokenManager, code_analyzer: CodeAnalyzer, profile: ProcessingProfile = None):
+    def __init__(self, cache: Cache, token_manager: TokenManager, code_analyzer: CodeAnalyzer, profile: ProcessingProfile = None,
+                 cancel_token: CancellationToken = None, instrumentation: Instrumentation = None):
         self.cache = cache
         self.token_manager = token_manager
         self.code_analyzer = code_analyzer
         self.profile = profile
+        self.cancel_token = cancel_token or CancellationToken()
+        self.instrumentation = instrumentation or Instrumentation()
         self.executor = ThreadPoolExecutor(max_workers=mp.cpu_count())
+        # Query relevance and similarity indexes, kept up to date by scan_file when set
+        self.search_index: Optional[SearchIndex] = None
+        self.vector_index = None
         # Create a profile hash for cache invalidation
         self.profile_hash = self._get_profile_hash() if profile else None
     
@@ -575,11 +631,22 @@ class UltraFileScanner:
     
     def scan_file(self, file_path: Path, base_path: Path) -> Optional[FileInfo]:
         """Scan a single file with caching"""
+        # Queued scans drain without doing any work once the job is cancelled
+        if self.cancel_token.cancelled:
+            return None
+        
         try:
             # Check cache first with profile awareness
             cached_info = self.cache.get_file_info(file_path, self.profile_hash)
+            self.instrumentation.count(FILES_SCANNED)
             if cached_info:
-                return self._dict_to_fileinfo(cached_info, file_path, base_path)
+                self.instrumentation.count(FILE_CACHE_HITS)
+                info = self._dict_to_fileinfo(cached_info, file_path, base_path)
+                # Share the compacted form instead of keeping the loaded JSON as well
+                cached_info['semantic_data'] = info.semantic_data
+                self.update_indexes(info)
+                return info
+            self.instrumentation.count(FILE_CACHE_MISSES)
             
             # Analyze file
             rel_path = file_path.relative_to(base_path)
@@ -587,7 +654,7 @@ class UltraFileScanner:
             
             info = FileInfo(
                 path=file_path,
-                rel_path=str(rel_path),
+                rel_path=sys.intern(str(rel_path)),
                 size=stat.st_size,
                 is_binary=self._is_binary(file_path),
                 is_generated=self._is_generated(str(rel_path)),
@@ -598,41 +665,67 @@ class UltraFileScanner:
             # Skip binary files for content analysis
             if not info.is_binary and info.size < 10_000_000:  # 10MB limit
                 content = file_path.read_text(encoding='utf-8', errors='ignore')
+                self.instrumentation.count(BYTES_READ, info.size)
                 content_hash = hashlib.md5(content.encode()).hexdigest()
                 info.content_hash = content_hash
                 
                 # Get token count from cache or calculate
                 token_count = self.cache.get_token_count(content_hash)
                 if token_count is None:
+                    self.instrumentation.count(TOKEN_CACHE_MISSES)
                     token_count = self.token_manager.count_tokens(content)
                     self.cache.set_token_count(content_hash, token_count)
+                else:
+                    self.instrumentation.count(TOKEN_CACHE_HITS)
                 info.token_count = token_count
                 
                 # Semantic analysis for code files
+                semantic_data = None
                 if self._is_code_file(file_path):
-                    info.semantic_data = self.code_analyzer.analyze_file(file_path, content)
-                    info.language = info.semantic_data.get('language')
+                    semantic_data = self.code_analyzer.analyze_file(file_path, content)
+                    info.language = intern(semantic_data.get('language'))
                     info.importance_score = self.code_analyzer.calculate_file_importance(
-                        info.semantic_data, file_path
+                        semantic_data, file_path
                     )
-                    # Add query relevance if query is provided
-                    if hasattr(self.profile, 'intended_query') and self.profile.intended_query:
-                        query_relevance = self.code_analyzer.calculate_query_relevance(
-                            self.profile.intended_query, file_path, content, info.semantic_data
-                        )
-                        # Combine importance score with query relevance
-                        # Query relevance can boost score by up to 50%
-                        info.query_relevance_score = query_relevance
-                        info.importance_score = min(1.0, info.importance_score + query_relevance * 0.5)
+                    # Scores are computed; keep only the compact form until output
+                    info.semantic_data = compact_semantic_data(semantic_data)
+                
+                if self.profile and self.profile.deduplicate_files and info.size >= MIN_DEDUPE_BYTES:
+                    info.minhash = minhash_signature(content)
+                
+                # Query relevance is scored over the whole index once the scan is done
+                stamp = SearchIndex.stamp(file_path)
+                if self.search_index is not None and not in_cache_directory(info.rel_path):
+                    self.search_index.add(info.rel_path, stamp, content, semantic_data)
+                if self.vector_index is not None and not in_cache_directory(info.rel_path):
+                    self.vector_index.add(info.rel_path, stamp, content,
+                                          (semantic_data or {}).get('entities') or ())
             
             # Cache the result with profile awareness
-            self.cache.set_file_info(file_path, self._fileinfo_to_dict(info), self.profile_hash)
+            self.cache.set_file_info(file_path, self._fileinfo_to_dict(info, serialize=False), self.profile_hash)
             return info
             
         except Exception as e:
             print(f"Error scanning {file_path}: {e}")
             return None
     
+    def update_indexes(self, info: FileInfo):
+        """Add a file to the search and vector indexes unless indexed as of its current stamp"""
+        indexes = [index for index in (self.search_index, self.vector_index) if index is not None]
+        if not indexes or info.is_binary or info.size >= 10_000_000 or in_cache_directory(info.rel_path):
+            return
+        stamp = SearchIndex.stamp(info.path)
+        stale = [index for index in indexes if not index.is_current(info.rel_path, stamp)]
+        if not stale:
+            return
+        content = info.path.read_text(encoding='utf-8', errors='ignore')
+        self.instrumentation.count(BYTES_READ, info.size)
+        semantic_data = info.semantic_data or {}
+        if self.search_index in stale:
+            self.search_index.add(info.rel_path, stamp, content, semantic_data)
+        if self.vector_index in stale:
+            self.vector_index.add(info.rel_path, stamp, content, semantic_data.get('entities') or ())
+    
     def scan_directory(self, directory: Path, exclusion_spec: pathspec.PathSpec,
                       progress_callback=None) -> List[FileInfo]:
         """Scan directory in parallel"""
@@ -653,7 +746,7 @@ class UltraFileScanner:
                     futures.append(future)
         
         # Collect results
-        for i, future in enumerate(as_completed(futures)):
+        for i, future in enumerate(self.completed(futures)):
             result = future.result()
             if result:
                 all_files.append(result)
@@ -663,6 +756,17 @@ class UltraFileScanner:
         
         return all_files
     
+    def completed(self, futures: List) -> Iterator:
+        """Yield scan futures as they complete, cancelling the rest on cancellation"""
+        try:
+            for future in as_completed(futures):
+                self.cancel_token.raise_if_cancelled()
+                yield future
+        except ProcessingCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    
     def _is_binary(self, file_path: Path) -> bool:
         """Enhanced binary file detection"""
         # Check extension
@@ -707,39 +811,17 @@ class UltraFileScanner:
     
     def _serialize_semantic_data(self, semantic_data: Dict) -> Dict:
         """Convert semantic data to JSON-serializable format"""
-        if not semantic_data:
-            return None
-        
-        serialized = {}
-        for key, value in semantic_data.items():
-            if key == 'entities' and isinstance(value, list):
-                # Convert CodeEntity objects to dictionaries
-                serialized[key] = []
-                for entity in value:
-                    if hasattr(entity, '__dict__'):
-                        try:
-                            # Create a shallow copy of the dict to avoid iteration errors
-                            entity_dict = dict(entity.__dict__)
-                            # Convert set to list for JSON serialization
-                            if 'dependencies' in entity_dict and isinstance(entity_dict['dependencies'], set):
-                                entity_dict['dependencies'] = list(entity_dict['dependencies'])
-                            serialized[key].append(entity_dict)
-                        except Exception as e:
-                            # If dict iteration fails, try alternative serialization
-                            serialized[key].append(str(entity))
-                    else:
-                        serialized[key].append(entity)
-            else:
-                serialized[key] = value
-        
-        return serialized
+        return serialize_semantic_data(semantic_data)
     
-    def _fileinfo_to_dict(self, info: FileInfo) -> Dict:
-        """Convert FileInfo to dictionary for caching"""
-        # Convert semantic_data to JSON-serializable format
-        semantic_data = None
-        if info.semantic_data:
-            semantic_data = self._serialize_semantic_data(info.semantic_data)
+    def _fileinfo_to_dict(self, info: FileInfo, serialize: bool = True) -> Dict:
+        """Convert FileInfo to dictionary for caching
+        
+        With serialize=False the compact semantic data is shared rather than
+        converted, for the in-memory scan cache (see Cache.save_caches).
+        """
+        semantic_data = info.semantic_data or None
+        if semantic_data and serialize:
+            semantic_data = self._serialize_semantic_data(semantic_data)
         
         return {
             'rel_path': info.rel_path,
@@ -753,41 +835,60 @@ class UltraFileScanner:
             'content_hash': info.content_hash,
             'token_count': info.token_count,
             'semantic_data': semantic_data,
+            'query_relevance_score': info.query_relevance_score,
+            'minhash': info.minhash.hex() if info.minhash else None,
         }
     
     def _dict_to_fileinfo(self, data: Dict, file_path: Path, base_path: Path) -> FileInfo:
         """Convert dictionary to FileInfo"""
         return FileInfo(
             path=file_path,
-            rel_path=data['rel_path'],
+            rel_path=sys.intern(data['rel_path']),
             size=data['size'],
             is_binary=data['is_binary'],
             is_generated=data['is_generated'],
             is_critical=data['is_critical'],
             should_summarize=data['should_summarize'],
-            language=data.get('language'),
+            language=intern(data.get('language')),
             importance_score=data.get('importance_score', 0.5),
             content_hash=data.get('content_hash'),
             token_count=data.get('token_count'),
-            semantic_data=data.get('semantic_data'),
+            semantic_data=self._deserialize_semantic_data(data.get('semantic_data')),
+            query_relevance_score=data.get('query_relevance_score', 0.0),
+            minhash=bytes.fromhex(data['minhash']) if data.get('minhash') else None,
         )
+    
+    def _deserialize_semantic_data(self, semantic_data: Optional[Dict]) -> Optional[Dict]:
+        """Rebuild compact entity tables from serialized semantic data"""
+        return compact_semantic_data(semantic_data)
 
 class ContentProcessor:
     """Advanced content processing with semantic understanding"""
     def __init__(self, token_manager: TokenManager, code_analyzer: CodeAnalyzer, 
                  profile: ProcessingProfile = None, git_analyzer = None, llm_augmenter = None,
-                 action_block_generator = None):
+                 action_block_generator = None, cancel_token: CancellationToken = None,
+                 instrumentation: Instrumentation = None):
         self.token_manager = token_manager
         self.code_analyzer = code_analyzer
         self.profile = profile
         self.git_analyzer = git_analyzer
         self.llm_augmenter = llm_augmenter
         self.action_block_generator = action_block_generator
+        self.cancel_token = cancel_token or CancellationToken()
+        self.instrumentation = instrumentation or Instrumentation()
     
     def process_file(self, file_info: FileInfo, token_budget: int) -> Tuple[str, int]:
         """Process file content with intelligent truncation"""
+        self.cancel_token.raise_if_cancelled()
         try:
+            if self._should_sample(file_info, token_budget):
+                with MappedLines(file_info.path) as mapped:
+                    if mapped.regular and mapped.line_count() >= 3:
+                        return self._process_sampled_file(file_info, token_budget, mapped)
+            
             content = file_info.path.read_text(encoding='utf-8', errors='ignore')
+            self.instrumentation.count(BYTES_READ, file_info.size)
+            self.instrumentation.count(FILES_PROCESSED)
             
             # Handle special file types
             if file_info.should_summarize:
@@ -799,54 +900,13 @@ class ContentProcessor:
             
             # Extract TODOs and generate action blocks
             if self.action_block_generator:
-                todos = self._extract_todos(content, str(file_info.rel_path))
-                for todo in todos:
-                    self.action_block_generator.add_block(todo)
-                
-                # Generate Call Graph action blocks from semantic data
-                if file_info.semantic_data and 'entities' in file_info.semantic_data:
-                    for entity in file_info.semantic_data['entities']:
-                        if hasattr(entity, 'calls') and hasattr(entity, 'called_by'):
-                            call_node = CallGraphNode(
-                                file=str(file_info.rel_path),
-                                entity=entity.name,
-                                entity_type=entity.type,
-                                calls=entity.calls or [],
-                                called_by=entity.called_by or []
-                            )
-                            self.action_block_generator.add_block(call_node)
+                self._add_action_blocks(file_info, self._extract_todos(content, str(file_info.rel_path)))
             
             # Add git insights if enabled
             output_content = []
-            git_header = ""
-            
-            if self.profile and self.profile.enable_git_insights and self.git_analyzer:
-                git_info = self.git_analyzer.get_last_modified_info(str(file_info.rel_path))
-                if git_info and any(git_info.values()):
-                    change_freq = self.git_analyzer.get_change_frequency(str(file_info.rel_path))
-                    contributors = self.git_analyzer.get_recent_contributors(str(file_info.rel_path))
-                    
-                    git_header = f"""# Git Insights for {file_info.rel_path}
-# Last Modified: {git_info.get('date', 'Unknown')} by {git_info.get('author', 'Unknown')}
-# Commit: {git_info.get('commit_message', 'Unknown')} ({git_info.get('commit_hash', 'Unknown')})
-# Change Frequency (90d): {change_freq} commits
-# Recent Contributors: {', '.join(contributors) if contributors else 'Unknown'}
-# {'=' * 50}
-"""
-                    output_content.append(git_header)
-                    
-                    # Generate Git insight action block
-                    if self.action_block_generator:
-                        git_block = GitInsight(
-                            file=str(file_info.rel_path),
-                            last_mod_date=git_info.get('date', 'Unknown'),
-                            last_mod_author=git_info.get('author', 'Unknown'),
-                            last_commit=git_info.get('commit_message', 'Unknown'),
-                            commit_hash=git_info.get('commit_hash', 'Unknown')[:7],  # Short hash
-                            change_frequency_90d=change_freq,
-                            recent_contributors=contributors if contributors else []
-                        )
-                        self.action_block_generator.add_block(git_block)
+            git_header = self._git_insights_header(file_info)
+            if git_header:
+                output_content.append(git_header)
             
             # If content fits within budget, return as is
             adjusted_budget = token_budget - self.token_manager.count_tokens(git_header)
@@ -855,8 +915,7 @@ class ContentProcessor:
                 return '\n'.join(output_content), file_info.token_count + len(git_header.split())
             
             # Check if LLM summarization is enabled for long/complex files
-            if (self.profile and self.profile.enable_llm_summarization and 
-                self.llm_augmenter and self.llm_augmenter.is_available()):
+            if self._llm_summarization_enabled():
                 
                 # Criteria for LLM summarization
                 should_summarize = (
@@ -884,31 +943,140 @@ class ContentProcessor:
             truncated_content, tokens = self._apply_truncation_strategy(
                 content, file_info, adjusted_budget, strategy
             )
-            output_content.append(truncated_content)
-            
-            # Add LLM augmentation notes if enabled
-            if (self.profile and self.profile.enable_llm_proactive_augmentation and
-                self.llm_augmenter and self.llm_augmenter.is_available()):
-                
-                augmentation_notes = self._generate_augmentation_notes(
-                    truncated_content, file_info
-                )
-                if augmentation_notes:
-                    output_content.append(augmentation_notes)
-            
-            # Add function/method anchors for easier navigation  
-            if file_info.semantic_data and 'entities' in file_info.semantic_data:
-                # Find where the actual content is in output_content
-                for i, part in enumerate(output_content):
-                    if part == truncated_content:
-                        enriched_content = self._add_entity_anchors(truncated_content, file_info.semantic_data['entities'])
-                        output_content[i] = enriched_content  # Replace the content with anchored version
-                        break
-            
-            return '\n'.join(output_content), sum(self.token_manager.count_tokens(part) for part in output_content)
+            return self._finish_truncated(file_info, output_content, truncated_content)
         except Exception as e:
             return f"[Error reading file: {e}]", 50
     
+    def _llm_summarization_enabled(self) -> bool:
+        return bool(self.profile and self.profile.enable_llm_summarization and
+                    self.llm_augmenter and self.llm_augmenter.is_available())
+    
+    def _should_sample(self, file_info: FileInfo, token_budget: int) -> bool:
+        """Whether the file will be cut down to its first and last lines anyway
+        
+        True for large files that exceed the budget when their truncation
+        strategy falls back to _basic_truncate, so the middle never needs
+        to be read.
+        """
+        if (file_info.size < LARGE_FILE_BYTES or file_info.should_summarize or
+                file_info.token_count is None or file_info.token_count <= token_budget or
+                self._llm_summarization_enabled()):
+            return False
+        
+        strategy = self.profile.truncation_strategy if self.profile else 'semantic'
+        if strategy == 'middle_summarize':
+            return file_info.language not in MIDDLE_SUMMARIZE_LANGUAGES
+        if strategy in ('business_logic', 'semantic'):
+            return not file_info.semantic_data or (
+                strategy == 'semantic' and not file_info.semantic_data.get('entities')
+            )
+        return True
+    
+    def _process_sampled_file(self, file_info: FileInfo, token_budget: int,
+                              mapped: MappedLines) -> Tuple[str, int]:
+        """process_file for large files, decoding only the lines it emits"""
+        if self.action_block_generator:
+            todos = [
+                todo for line_number, line in mapped.lines_containing(TODO_MARKERS)
+                for todo in self._extract_todos(line, str(file_info.rel_path), first_line=line_number)
+            ]
+            self._add_action_blocks(file_info, todos)
+        
+        output_content = []
+        git_header = self._git_insights_header(file_info)
+        if git_header:
+            output_content.append(git_header)
+        adjusted_budget = token_budget - self.token_manager.count_tokens(git_header)
+        
+        with self.instrumentation.stage('truncate.sampled', file=str(file_info.rel_path)):
+            total_lines = mapped.line_count()
+            sample_lines = self._head_tail_size(total_lines)
+            truncated_content, tokens = self._head_tail_truncate(
+                mapped.head(sample_lines), mapped.tail(sample_lines), total_lines, adjusted_budget
+            )
+        self.instrumentation.count(BYTES_READ, mapped.bytes_decoded)
+        self.instrumentation.count(FILES_PROCESSED)
+        return self._finish_truncated(file_info, output_content, truncated_content)
+    
+    def _add_action_blocks(self, file_info: FileInfo, todos: List[TodoItem]):
+        """Add TODO and call graph action blocks for a file"""
+        for todo in todos:
+            self.action_block_generator.add_block(todo)
+        
+        # Generate Call Graph action blocks from semantic data
+        if file_info.semantic_data and 'entities' in file_info.semantic_data:
+            for entity in file_info.semantic_data['entities']:
+                if hasattr(entity, 'calls') and hasattr(entity, 'called_by'):
+                    call_node = CallGraphNode(
+                        file=str(file_info.rel_path),
+                        entity=entity.name,
+                        entity_type=entity.type,
+                        calls=entity.calls or [],
+                        called_by=entity.called_by or []
+                    )
+                    self.action_block_generator.add_block(call_node)
+    
+    def _git_insights_header(self, file_info: FileInfo) -> str:
+        """Git insights header for a file (adding its action block), or "" """
+        if not (self.profile and self.profile.enable_git_insights and self.git_analyzer):
+            return ""
+        
+        git_info = self.git_analyzer.get_last_modified_info(str(file_info.rel_path))
+        if not git_info or not any(git_info.values()):
+            return ""
+        
+        change_freq = self.git_analyzer.get_change_frequency(str(file_info.rel_path))
+        contributors = self.git_analyzer.get_recent_contributors(str(file_info.rel_path))
+        
+        git_header = f"""# Git Insights for {file_info.rel_path}
+# Last Modified: {git_info.get('date', 'Unknown')} by {git_info.get('author', 'Unknown')}
+# Commit: {git_info.get('commit_message', 'Unknown')} ({git_info.get('commit_hash', 'Unknown')})
+# Change Frequency (90d): {change_freq} commits
+# Recent Contributors: {', '.join(contributors) if contributors else 'Unknown'}
+# {'=' * 50}
+"""
+        
+        # Generate Git insight action block
+        if self.action_block_generator:
+            git_block = GitInsight(
+                file=str(file_info.rel_path),
+                last_mod_date=git_info.get('date', 'Unknown'),
+                last_mod_author=git_info.get('author', 'Unknown'),
+                last_commit=git_info.get('commit_message', 'Unknown'),
+                commit_hash=git_info.get('commit_hash', 'Unknown')[:7],  # Short hash
+                change_frequency_90d=change_freq,
+                recent_contributors=contributors if contributors else []
+            )
+            self.action_block_generator.add_block(git_block)
+        
+        return git_header
+    
+    def _finish_truncated(self, file_info: FileInfo, output_content: List[str],
+                          truncated_content: str) -> Tuple[str, int]:
+        """Append truncated content with augmentation notes and entity anchors"""
+        output_content.append(truncated_content)
+        
+        # Add LLM augmentation notes if enabled
+        if (self.profile and self.profile.enable_llm_proactive_augmentation and
+            self.llm_augmenter and self.llm_augmenter.is_available()):
+            
+            augmentation_notes = self._generate_augmentation_notes(
+                truncated_content, file_info
+            )
+            if augmentation_notes:
+                output_content.append(augmentation_notes)
+        
+        # Add function/method anchors for easier navigation  
+        if file_info.semantic_data and 'entities' in file_info.semantic_data:
+            # Find where the actual content is in output_content
+            for i, part in enumerate(output_content):
+                if part == truncated_content:
+                    enriched_content = self._add_entity_anchors(truncated_content, file_info.semantic_data['entities'])
+                    output_content[i] = enriched_content  # Replace the content with anchored version
+                    break
+        
+        return '\n'.join(output_content), sum(self.token_manager.count_tokens(part) for part in output_content)
+    
     def _add_entity_anchors(self, content: str, entities: List) -> str:
         """Add textual anchors for functions/methods/classes"""
         lines = content.splitlines()
@@ -948,7 +1116,7 @@ class ContentProcessor:
         
         return '\n'.join(anchored_lines)
     
-    def _extract_todos(self, content: str, file_path: str) -> List[TodoItem]:
+    def _extract_todos(self, content: str, file_path: str, first_line: int = 1) -> List[TodoItem]:
         """Extract TODO, FIXME, HACK, and NOTE comments from content"""
         todos = []
         lines = content.splitlines()
@@ -956,7 +1124,7 @@ class ContentProcessor:
         # Pattern to match TODO-like comments
         pattern = r'(?:#|//|/\*|\*)\s*(TODO|FIXME|HACK|NOTE)[:\s]+(.*?)(?:\*/)?$'
         
-        for i, line in enumerate(lines):
+        for i, line in enumerate(lines, start=first_line):
             match = re.search(pattern, line.strip(), re.IGNORECASE)
             if match:
                 todo_type = match.group(1).upper()
@@ -973,7 +1141,7 @@ class ContentProcessor:
                 
                 todos.append(TodoItem(
                     file=file_path,
-                    line=i + 1,
+                    line=i,
                     todo_type=todo_type,
                     text=text,
                     priority=priority
@@ -984,14 +1152,15 @@ class ContentProcessor:
     def _apply_truncation_strategy(self, content: str, file_info: FileInfo, 
                                   token_budget: int, strategy: str) -> Tuple[str, int]:
         """Apply the specified truncation strategy"""
-        if strategy == 'business_logic' and file_info.semantic_data:
-            return self._business_logic_truncate(content, file_info, token_budget)
-        elif strategy == 'middle_summarize':
-            return self._middle_summarize_truncate(content, file_info, token_budget)
-        elif strategy == 'semantic' and file_info.semantic_data:
-            return self._semantic_truncate(content, file_info, token_budget)
-        else:
-            return self._basic_truncate(content, token_budget)
+        with self.instrumentation.stage(f'truncate.{strategy}', file=str(file_info.rel_path)):
+            if strategy == 'business_logic' and file_info.semantic_data:
+                return self._business_logic_truncate(content, file_info, token_budget)
+            elif strategy == 'middle_summarize':
+                return self._middle_summarize_truncate(content, file_info, token_budget)
+            elif strategy == 'semantic' and file_info.semantic_data:
+                return self._semantic_truncate(content, file_info, token_budget)
+            else:
+                return self._basic_truncate(content, token_budget)
     
     def _generate_augmentation_notes(self, content: str, file_info: FileInfo) -> str:
         """Generate AI augmentation notes for critical code sections"""
@@ -1109,56 +1278,33 @@ class ContentProcessor:
         if not entities:
             return self._basic_truncate(content, token_budget)
         
-        # Sort entities by importance
-        entities.sort(key=lambda e: e.importance_score, reverse=True)
-        
         lines = content.splitlines()
-        included_lines = set()
-        current_tokens = 0
+        selection = LineSelection(self.token_manager.count_line_tokens(lines))
         
         # Always include imports/headers (first 20 lines typically)
-        header_lines = min(20, len(lines))
-        for i in range(header_lines):
-            included_lines.add(i)
+        selection.add(0, 20)
         
-        header_content = '\n'.join(lines[:header_lines])
-        current_tokens = self.token_manager.count_tokens(header_content)
+        # Include important entities, each with some context
+        self._select_entities(selection, entities, 3, token_budget * 0.9, token_budget)
         
-        # Include important entities
-        for entity in entities:
-            if current_tokens >= token_budget * 0.9:
+        return selection.render(lines), selection.tokens
+    
+    @staticmethod
+    def _select_entities(selection: LineSelection, entities: List, context: int,
+                         stop_at: float, fit_within: float):
+        """Add entities by descending importance, with `context` lines either
+        side, while the selection is under `stop_at` tokens and each fits
+        within `fit_within`"""
+        # sorted() copies; semantic data is shared with the scan cache
+        for entity in sorted(entities, key=lambda e: e.importance_score, reverse=True):
+            if selection.tokens >= stop_at:
                 break
             
-            # Include entity definition and some context
-            start = max(0, entity.line_start - 3)
-            end = min(len(lines), entity.line_end + 3)
-            
-            entity_lines = set(range(start, end))
-            new_lines = entity_lines - included_lines
-            
-            if new_lines:
-                new_content = '\n'.join(lines[i] for i in sorted(new_lines))
-                new_tokens = self.token_manager.count_tokens(new_content)
-                
-                if current_tokens + new_tokens <= token_budget:
-                    included_lines.update(new_lines)
-                    current_tokens += new_tokens
-        
-        # Build final content
-        result_lines = []
-        last_line = -1
-        
-        for line_num in sorted(included_lines):
-            if line_num > last_line + 1:
-                result_lines.append(f"\n... [Lines {last_line + 1}-{line_num - 1} omitted] ...\n")
-            result_lines.append(lines[line_num])
-            last_line = line_num
-        
-        if last_line < len(lines) - 1:
-            result_lines.append(f"\n... [Lines {last_line + 1}-{len(lines) - 1} omitted] ...\n")
-        
-        final_content = '\n'.join(result_lines)
-        return final_content, current_tokens
+            # line_start is 1-based, so line_start - 1 is the definition line
+            start = entity.line_start - 1 - context
+            end = entity.line_end + context
+            if selection.tokens + selection.new_tokens(start, end) <= fit_within:
+                selection.add(start, end)
     
     def _basic_truncate(self, content: str, token_budget: int) -> Tuple[str, int]:
         """Basic truncation with token awareness"""
@@ -1166,15 +1312,25 @@ class ContentProcessor:
         
         # Include first and last portions
         total_lines = len(lines)
-        head_lines = min(100, total_lines // 3)
-        tail_lines = min(100, total_lines // 3)
+        head_lines = tail_lines = self._head_tail_size(total_lines)
+        
+        return self._head_tail_truncate(lines[:head_lines], lines[-tail_lines:], total_lines, token_budget)
+    
+    @staticmethod
+    def _head_tail_size(total_lines: int) -> int:
+        """Lines basic truncation keeps from each end of a file"""
+        return min(100, total_lines // 3)
+    
+    def _head_tail_truncate(self, head: List[str], tail_content: List[str], total_lines: int,
+                            token_budget: int) -> Tuple[str, int]:
+        """Join the first and, if the budget allows, last lines of a file"""
+        head_lines = tail_lines = self._head_tail_size(total_lines)
         
         # Start with header
-        result = lines[:head_lines]
+        result = list(head)
         current_tokens = self.token_manager.count_tokens('\n'.join(result))
         
         # Add tail if budget allows
-        tail_content = lines[-tail_lines:]
         tail_tokens = self.token_manager.count_tokens('\n'.join(tail_content))
         
         if current_tokens + tail_tokens + 50 <= token_budget:  # 50 tokens for truncation message
@@ -1191,7 +1347,7 @@ class ContentProcessor:
         """Advanced truncation that keeps beginning/end intact and summarizes middle"""
         lines = content.splitlines()
         
-        if file_info.language not in ['python', 'javascript', 'typescript', 'java']:
+        if file_info.language not in MIDDLE_SUMMARIZE_LANGUAGES:
             return self._basic_truncate(content, token_budget)
         
         # Calculate proportions
@@ -1200,32 +1356,30 @@ class ContentProcessor:
         footer_ratio = 0.2  # 20% for exports/main logic
         
         header_lines = int(total_lines * header_ratio)
-        footer_lines = int(total_lines * footer_ratio)
+        footer_start = total_lines - int(total_lines * footer_ratio)
+        line_costs = LineSelection(self.token_manager.count_line_tokens(lines))
         
         # Build header
         result = lines[:header_lines]
-        current_tokens = self.token_manager.count_tokens('\n'.join(result))
+        current_tokens = line_costs.cost(0, header_lines)
         
         # Add footer if budget allows
-        footer_content = lines[-footer_lines:]
-        footer_tokens = self.token_manager.count_tokens('\n'.join(footer_content))
+        footer_tokens = line_costs.cost(footer_start, total_lines)
         
         if current_tokens + footer_tokens + 100 <= token_budget:
             # Add middle summary
-            middle_start = header_lines
-            middle_end = total_lines - footer_lines
             middle_summary = self._generate_middle_summary(
-                lines[middle_start:middle_end], 
+                lines[header_lines:footer_start], 
                 file_info,
                 (token_budget - current_tokens - footer_tokens - 100) // 2
             )
             
-            result.append(f"\n... [Middle section summary] ...\n")
-            result.append(middle_summary)
-            result.append(f"\n... [Continuing to end] ...\n")
-            result.extend(footer_content)
+            middle = [f"\n... [Middle section summary] ...\n", middle_summary, f"\n... [Continuing to end] ...\n"]
+            result.extend(middle)
+            result.extend(lines[footer_start:])
             
-            current_tokens = self.token_manager.count_tokens('\n'.join(result))
+            # Only the new text is counted; header and footer are priced per line
+            current_tokens += footer_tokens + self.token_manager.count_tokens('\n'.join(middle))
         
         return '\n'.join(result), current_tokens
     
@@ -1319,59 +1473,19 @@ class ContentProcessor:
                 business_logic.append(entity)
         
         # Build result prioritizing business logic
-        included_lines = set()
-        current_tokens = 0
+        selection = LineSelection(self.token_manager.count_line_tokens(lines))
         
         # Always include imports
         for entity in imports[:20]:  # Limit imports
-            included_lines.update(range(entity.line_start, entity.line_end + 1))
+            selection.add(entity.line_start - 1, entity.line_end)
         
         # Include business logic entities
-        for entity in sorted(business_logic, key=lambda e: e.importance_score, reverse=True):
-            if current_tokens >= token_budget * 0.8:
-                break
-            
-            start = max(0, entity.line_start - 2)
-            end = min(len(lines), entity.line_end + 2)
-            
-            new_lines = set(range(start, end))
-            test_content = '\n'.join(lines[i] for i in new_lines if i not in included_lines)
-            test_tokens = self.token_manager.count_tokens(test_content)
-            
-            if current_tokens + test_tokens <= token_budget * 0.9:
-                included_lines.update(new_lines)
-                current_tokens += test_tokens
+        self._select_entities(selection, business_logic, 2, token_budget * 0.8, token_budget * 0.9)
         
         # Fill remaining space with utilities if any
-        for entity in sorted(utilities, key=lambda e: e.importance_score, reverse=True):
-            if current_tokens >= token_budget * 0.95:
-                break
-            
-            start = max(0, entity.line_start - 1)
-            end = min(len(lines), entity.line_end + 1)
-            
-            new_lines = set(range(start, end))
-            test_content = '\n'.join(lines[i] for i in new_lines if i not in included_lines)
-            test_tokens = self.token_manager.count_tokens(test_content)
-            
-            if current_tokens + test_tokens <= token_budget:
-                included_lines.update(new_lines)
-                current_tokens += test_tokens
-        
-        # Build final content
-        result_lines = []
-        last_line = -1
-        
-        for line_num in sorted(included_lines):
-            if line_num > last_line + 1:
-                result_lines.append(f"\n... [Lines {last_line + 1}-{line_num - 1} omitted] ...\n")
-            result_lines.append(lines[line_num])
-            last_line = line_num
+        self._select_entities(selection, utilities, 1, token_budget * 0.95, token_budget)
         
-        if last_line < len(lines) - 1:
-            result_lines.append(f"\n... [Lines {last_line + 1}-{len(lines) - 1} omitted] ...\n")
-        
-        return '\n'.join(result_lines), current_tokens
+        return selection.render(lines), selection.tokens
     
     def _summarize_lockfile(self, content: str, filename: str) -> str:
         """Create a summary of lock files"""
@@ -1499,10 +1613,20 @@ class CodebaseAnalyzer:
 
 class UltraRepo2File:
     """Main class for ultra-optimized repository processing"""
-    def __init__(self, profile: ProcessingProfile):
+    def __init__(self, profile: ProcessingProfile, checkpoint_store: Optional[CheckpointStore] = None,
+                 checkpoint_interval: float = 30.0, cancel_token: Optional[CancellationToken] = None,
+                 instrumentation: Optional[Instrumentation] = None):
         self.profile = profile
+        # Checked once per file by every stage; cancel() stops processing with ProcessingCancelled
+        self.cancel_token = cancel_token or CancellationToken()
+        # Stage timings and hot-path counters; instrumentation.summary() after a run
+        self.instrumentation = instrumentation or Instrumentation()
+        # Stage outputs are saved here so a retried run can resume (see checkpoint.py)
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_interval = checkpoint_interval  # Seconds between partial-output checkpoints
         # Create token manager with model-aware budgeting
         self.token_manager = TokenManager(model=profile.model, budget=profile.token_budget)
+        self.token_manager.instrumentation = self.instrumentation
         
         # Create a profile-specific cache key using actual budget
         profile_key = f"{profile.model}_{self.token_manager.budget.total}_{profile.truncation_strategy}"
@@ -1511,14 +1635,21 @@ class UltraRepo2File:
         # Log actual token budget being used if it was adjusted
         if profile.token_budget and profile.token_budget != self.token_manager.budget.total:
             print(f"Note: Token budget adjusted from {profile.token_budget} to {self.token_manager.budget.total} based on {profile.model}'s context window")
+        # Parts are each bounded by the budget, so the selection spans all of them
+        self.part_budget = self.token_manager.budget.total
+        self.token_manager.budget.total *= max(profile.output_parts, 1)
         self.code_analyzer = CodeAnalyzer()
         self.git_analyzer = None  # Will be initialized when processing a git repo
         self.llm_augmenter = None  # Will be initialized if configured
         self.incremental_scanner = None  # Will be initialized for repo
+        self.symbol_graph = None  # Repository-wide import graph, opened per repository
         self.full_rescan = False  # Track if we should do a full rescan
         
         # Track skipped files for reporting (requirement S-1)
         self.skipped_files = []  # List of (path, reason) tuples
+        # Files and analysis of the last output, kept for patching it (see patch_output)
+        self.ranked_files: List[FileInfo] = []
+        self.codebase_analysis: Dict = {}
         
         # Initialize LLM augmenter if enabled
         if profile.enable_llm_summarization or profile.enable_llm_proactive_augmentation:
@@ -1527,7 +1658,8 @@ class UltraRepo2File:
                 provider = profile.llm_augmentation_model.split('-')[0].lower()
                 self.llm_augmenter = LLMAugmenter(
                     provider=provider,
-                    api_key_env_var=profile.llm_augmentation_api_key_env_var
+                    api_key_env_var=profile.llm_augmentation_api_key_env_var,
+                    cancel_token=self.cancel_token
                 )
                 if self.llm_augmenter.is_available():
                     print(f"LLM augmentation enabled with {provider}")
@@ -1544,9 +1676,11 @@ class UltraRepo2File:
             'action_block_filters': profile.action_block_filters
         })
         
-        self.scanner = UltraFileScanner(self.cache, self.token_manager, self.code_analyzer, self.profile)
+        self.scanner = UltraFileScanner(self.cache, self.token_manager, self.code_analyzer, self.profile,
+                                        self.cancel_token, self.instrumentation)
         self.processor = ContentProcessor(self.token_manager, self.code_analyzer, self.profile, 
-                                         self.git_analyzer, self.llm_augmenter, self.action_block_generator)
+                                         self.git_analyzer, self.llm_augmenter, self.action_block_generator,
+                                         self.cancel_token, self.instrumentation)
         self.codebase_analyzer = CodebaseAnalyzer(self.code_analyzer)
         self.manifest_generator = ManifestGenerator(self.token_manager, self.code_analyzer, self.action_block_generator)
     
@@ -1569,23 +1703,12 @@ class UltraRepo2File:
         print(f"Repository: {repo_path}")
         print()
         
-        # Initialize GitAnalyzer if enabled and it's a git repo
-        if self.profile.enable_git_insights:
-            self.git_analyzer = GitAnalyzer(repo_path)
-            if self.git_analyzer.is_git_repo():
-                print("Git repository detected - insights will be included")
-                self.processor.git_analyzer = self.git_analyzer
-            else:
-                print("Not a git repository - git insights disabled")
-                self.git_analyzer = None
+        self._init_git_analyzer(repo_path)
+        self._open_checkpoints()
+        self._open_search_index(repo_path)
+        self._open_symbol_graph(repo_path)
         
-        # Initialize IncrementalScanner for optimized scanning
-        try:
-            self.incremental_scanner = IncrementalScanner(repo_path)
-            print("Incremental scanner initialized for optimized performance")
-        except Exception as e:
-            print(f"Could not initialize incremental scanner: {e}")
-            self.incremental_scanner = None
+        self._open_incremental_scanner(repo_path)
         
         # Check and create AI guardrails file if needed
         self._check_and_create_ai_guardrails(repo_path)
@@ -1593,7 +1716,51 @@ class UltraRepo2File:
         # Load exclusion patterns
         exclusion_spec = self._load_exclusions(repo_path)
         
-        # Scan files with progress
+        checkpoint = self._load_checkpoint('scan')
+        if checkpoint is not None:
+            files = [
+                self.scanner._dict_to_fileinfo(data, repo_path / data['rel_path'], repo_path)
+                for data in checkpoint['files']
+            ]
+            print(f"Restored scan of {len(files)} files from checkpoint")
+        else:
+            with self.instrumentation.stage('scan'):
+                files = self._scan_repository(repo_path, exclusion_spec)
+            self.cancel_token.raise_if_cancelled()
+            self._save_checkpoint('scan', {
+                'files': [self.scanner._fileinfo_to_dict(info) for info in files]
+            })
+        
+        print(f"Found {len(files)} files to process")
+        
+        self._render_output(repo_path, output_path, files, exclusion_spec, start_time)
+    
+    def scan_repository(self, repo_path: Path) -> List[Dict]:
+        """Scan the whole repository once, for rendering several outputs (see render_targets)
+        
+        Returns serialized FileInfo dicts, as scan_files does.
+        """
+        self._open_incremental_scanner(repo_path)
+        exclusion_spec = self._load_exclusions(repo_path)
+        with self.instrumentation.stage('scan'):
+            files = self._scan_repository(repo_path, exclusion_spec)
+        self.cancel_token.raise_if_cancelled()
+        
+        with self.instrumentation.stage('cache_save'):
+            self.cache.save_caches()
+        return [self.scanner._fileinfo_to_dict(info) for info in files]
+    
+    def _open_incremental_scanner(self, repo_path: Path):
+        """Initialize IncrementalScanner for optimized scanning"""
+        try:
+            self.incremental_scanner = IncrementalScanner(repo_path)
+            print("Incremental scanner initialized for optimized performance")
+        except Exception as e:
+            print(f"Could not initialize incremental scanner: {e}")
+            self.incremental_scanner = None
+    
+    def _scan_repository(self, repo_path: Path, exclusion_spec: pathspec.PathSpec) -> List[FileInfo]:
+        """Scan the whole repository, incrementally when possible"""
         print("Scanning files...")
         def progress_callback(current, total):
             if current % 100 == 0:
@@ -1603,7 +1770,8 @@ class UltraRepo2File:
         if self.incremental_scanner and not self.full_rescan:
             try:
                 print("Using incremental scanner for optimized performance...")
-                changed_files = self.incremental_scanner.get_changed_files()
+                with self.instrumentation.stage('incremental_diff'):
+                    changed_files = self.incremental_scanner.get_changed_files()
                 if changed_files is not None:
                     print(f"Detected {len(changed_files)} changed files since last scan")
                     # Perform incremental scan on changed files only
@@ -1618,105 +1786,500 @@ class UltraRepo2File:
             # Fall back to regular scanner
             files = self.scanner.scan_directory(repo_path, exclusion_spec, progress_callback)
         
-        print(f"Found {len(files)} files to process")
+        return files
+    
+    def list_repository_files(self, repo_path: Path) -> List[Tuple[str, int]]:
+        """List (relative path, size) of every file a scan would visit"""
+        exclusion_spec = self._load_exclusions(repo_path)
+        listing = []
+        
+        for root, dirs, files in os.walk(repo_path, topdown=True):
+            rel_root = Path(root).relative_to(repo_path)
+            dirs[:] = sorted(d for d in dirs if not exclusion_spec.match_file(str(rel_root / d)))
+            
+            for file_name in sorted(files):
+                rel_path = rel_root / file_name
+                if exclusion_spec.match_file(str(rel_path)):
+                    continue
+                try:
+                    listing.append((str(rel_path), (Path(root) / file_name).stat().st_size))
+                except OSError:
+                    continue
+        
+        return listing
+    
+    def scan_files(self, repo_path: Path, rel_paths: List[str]) -> List[Dict]:
+        """Scan a subset of the repository (the map step of a sharded run)
         
-        # Filter and sort files
-        files = self._filter_and_sort_files(files)
-        print(f"After filtering: {len(files)} files")
+        Returns serialized FileInfo dicts so results can be shipped between
+        workers and handed to process_scanned_files.
+        """
+        with self.instrumentation.stage('scan'):
+            futures = [
+                self.scanner.executor.submit(self.scanner.scan_file, repo_path / rel_path, repo_path)
+                for rel_path in rel_paths
+            ]
+            
+            scanned = []
+            for future in self.scanner.completed(futures):
+                info = future.result()
+                if info:
+                    scanned.append(self.scanner._fileinfo_to_dict(info))
+        
+        with self.instrumentation.stage('cache_save'):
+            self.cache.save_caches()
+        return scanned
+    
+    def process_scanned_files(self, repo_path: Path, output_path: Path, scanned_files: List[Dict]):
+        """Build the output from files scanned elsewhere (the reduce step of a sharded run)"""
+        start_time = time.time()
         
-        # Analyze codebase
-        print("\nAnalyzing codebase structure...")
-        codebase_analysis = self.codebase_analyzer.analyze_codebase(files)
+        print(f"Reducing {len(scanned_files)} pre-scanned files...")
+        print(f"Model: {self.profile.model}")
+        print(f"Token Budget: {self.token_manager.budget.total:,}")
+        print(f"Repository: {repo_path}")
+        print()
         
-        # Process files within token budget
-        print("\nProcessing files...")
-        output_parts = []
+        self._init_git_analyzer(repo_path)
+        self._open_checkpoints()
+        self._open_search_index(repo_path)
+        self._open_symbol_graph(repo_path)
+        self._check_and_create_ai_guardrails(repo_path)
+        exclusion_spec = self._load_exclusions(repo_path)
         
-        # Add header
-        header = self._generate_header(codebase_analysis, repo_path)
-        header_tokens = self.token_manager.count_tokens(header)
-        self.token_manager.budget.reserve('header', header_tokens)
-        output_parts.append(header)
+        files = [
+            self.scanner._dict_to_fileinfo(data, repo_path / data['rel_path'], repo_path)
+            for data in scanned_files
+        ]
         
-        # Reserve a placeholder for the manifest (we'll generate it after processing files)
-        manifest_placeholder_index = None
-        if self.profile.generate_manifest and (self.profile.model == 'gemini-1.5-pro' or self.profile.token_budget > 500000):
-            print("\nReserving space for hierarchical manifest...")
-            output_parts.append("[MANIFEST_PLACEHOLDER]")
-            manifest_placeholder_index = len(output_parts) - 1
+        self._render_output(repo_path, output_path, files, exclusion_spec, start_time)
+    
+    def _init_git_analyzer(self, repo_path: Path):
+        """Initialize GitAnalyzer if enabled and it's a git repo"""
+        if self.profile.enable_git_insights:
+            self.git_analyzer = GitAnalyzer(repo_path)
+            if self.git_analyzer.is_git_repo():
+                print("Git repository detected - insights will be included")
+                self.processor.git_analyzer = self.git_analyzer
+            else:
+                print("Not a git repository - git insights disabled")
+                self.git_analyzer = None
+    
+    def _open_search_index(self, repo_path: Path):
+        """Load the repository's search and vector indexes when the profile has a query or vibe to score"""
+        self.scanner.search_index = None
+        self.scanner.vector_index = None
+        if not (self.profile.intended_query or self.profile.vibe_statement):
+            return
+        repo_key = hashlib.sha256(str(Path(repo_path).resolve()).encode()).hexdigest()[:16]
+        self.scanner.search_index = SearchIndex(self.cache.cache_dir / f'search_index_{repo_key}.json')
+        try:
+            self.scanner.vector_index = IncrementalScanner(repo_path).open_vector_index()
+        except OSError as e:
+            print(f"Could not open similarity index: {e}")
+    
+    def _open_symbol_graph(self, repo_path: Path):
+        """Load the repository's import graph unless graph importance is disabled"""
+        self.symbol_graph = None
+        if self.profile.graph_importance_weight <= 0:
+            return
+        repo_key = hashlib.sha256(str(Path(repo_path).resolve()).encode()).hexdigest()[:16]
+        self.symbol_graph = SymbolGraph(self.cache.cache_dir / f'symbol_graph_{repo_key}.json')
+    
+    def _apply_graph_importance(self, files: List[FileInfo]):
+        """Blend each code file's importance with its PageRank in the import graph
         
-        # Add directory structure
-        tree_structure = self._generate_tree_structure(repo_path, exclusion_spec)
-        tree_tokens = self.token_manager.count_tokens(tree_structure)
+        Files changed since the graph was saved are re-added; files the scan
+        did not analyze (incremental scans) are analyzed here first.
+        """
+        graph = self.symbol_graph
+        if graph is None:
+            return
         
-        if self.token_manager.budget.remaining >= tree_tokens:
-            self.token_manager.budget.reserve('tree', tree_tokens)
-            output_parts.append(tree_structure)
+        with self.instrumentation.stage('symbol_graph'):
+            code_files = [info for info in files
+                          if not info.is_binary and self.scanner._is_code_file(info.path)]
+            graph.retain(info.rel_path for info in code_files)
+            for info in code_files:
+                self.cancel_token.raise_if_cancelled()
+                try:
+                    stamp = SearchIndex.stamp(info.path)
+                    if graph.is_current(info.rel_path, stamp):
+                        continue
+                    semantic_data = info.semantic_data
+                    if not semantic_data or 'entities' not in semantic_data:
+                        content = info.path.read_text(encoding='utf-8', errors='ignore')
+                        self.instrumentation.count(BYTES_READ, info.size)
+                        semantic_data = self.code_analyzer.analyze_file(info.path, content)
+                    graph.add(info.rel_path, stamp, semantic_data)
+                except OSError as e:
+                    print(f"Error adding {info.rel_path} to the import graph: {e}")
+            
+            importance = graph.importance()
+            graph.save()
+            weight = self.profile.graph_importance_weight
+            for info in code_files:
+                if info.rel_path in importance:
+                    info.importance_score = (1 - weight) * info.importance_score + weight * importance[info.rel_path]
+    
+    def _apply_query_relevance(self, files: List[FileInfo]):
+        """Score the intended query against the search index and boost matching files
+        
+        Files the scan did not index (incremental or sharded scans, older
+        caches) are indexed here first.
+        """
+        index = self.scanner.search_index
+        if index is None:
+            return
+        
+        with self.instrumentation.stage('search_index'):
+            vector_index = self.scanner.vector_index
+            # Also drops the scanner's own cache files, indexed by older versions
+            indexed = [info.rel_path for info in files if not in_cache_directory(info.rel_path)]
+            index.retain(indexed)
+            if vector_index is not None:
+                vector_index.retain(indexed)
+            for info in files:
+                self.cancel_token.raise_if_cancelled()
+                try:
+                    self.scanner.update_indexes(info)
+                except OSError as e:
+                    print(f"Error indexing {info.rel_path}: {e}")
+            index.save()
+            if vector_index is not None:
+                vector_index.save()
+            
+            if not self.profile.intended_query:
+                return
+            relevance = index.relevance(self.profile.intended_query)
+            for info in files:
+                info.query_relevance_score = relevance.get(info.rel_path, 0.0)
+                # Query relevance can boost score by up to 50%
+                info.importance_score = min(1.0, info.importance_score + info.query_relevance_score * 0.5)
+    
+    def _find_near_duplicates(self, files: List[FileInfo]) -> Dict[str, Tuple[FileInfo, float]]:
+        """Map each duplicate or near duplicate to (representative, similarity)
+        
+        Files are matched in output order, so a representative always comes
+        before the files that refer to it. Signatures missing from the scan
+        (incremental scans, older caches) are computed here.
+        """
+        if not self.profile.deduplicate_files:
+            return {}
+        
+        with self.instrumentation.stage('dedupe'):
+            index = NearDuplicateIndex()
+            by_path = {}
+            by_hash = {}
+            duplicates = {}
+            for info in files:
+                if info.is_binary:
+                    continue
+                by_path[info.rel_path] = info
+                # A reference line would be no shorter than a tiny file
+                if info.size < MIN_DEDUPE_BYTES:
+                    continue
+                if info.content_hash:
+                    first = by_hash.setdefault(info.content_hash, info)
+                    if first is not info:
+                        duplicates[info.rel_path] = (first, 1.0)
+                        continue
+                if info.minhash is None and info.size < 10_000_000:
+                    try:
+                        content = info.path.read_text(encoding='utf-8', errors='ignore')
+                    except OSError:
+                        continue
+                    self.instrumentation.count(BYTES_READ, info.size)
+                    info.minhash = minhash_signature(content)
+                if info.minhash is None:
+                    continue
+                match = index.add(info.rel_path, info.minhash)
+                if match is not None:
+                    duplicates[info.rel_path] = (by_path[match[0]], match[1])
+        
+        if duplicates:
+            print(f"Found {len(duplicates)} duplicate or near-duplicate files")
+        return duplicates
+    
+    def _render_duplicate(self, file_info: FileInfo, representative: FileInfo, similarity: float,
+                          budget: int) -> Optional[Tuple[str, int]]:
+        """A reference to, or diff against, a representative emitted untruncated
+        
+        Returns None when the diff would not be much smaller than the file,
+        in which case the file is rendered normally.
+        """
+        try:
+            content = file_info.path.read_text(encoding='utf-8', errors='ignore')
+            original = representative.path.read_text(encoding='utf-8', errors='ignore')
+        except OSError:
+            return None
+        
+        if content == original:
+            text = f"[Identical to {representative.rel_path} - content omitted]"
+            return text, self.token_manager.count_tokens(text)
+        
+        diff = '\n'.join(difflib.unified_diff(
+            original.splitlines(), content.splitlines(),
+            fromfile=str(representative.rel_path), tofile=str(file_info.rel_path), n=2, lineterm=''))
+        text = (f"[Near-duplicate of {representative.rel_path} ({similarity:.0%} similar) - "
+                f"differences only]\n```diff\n{diff.rstrip()}\n```")
+        tokens = self.token_manager.count_tokens(text)
+        if tokens > budget or tokens * 2 > (file_info.token_count or self.token_manager.count_tokens(content)):
+            return None
+        return text, tokens
+    
+    def _open_checkpoints(self):
+        """Resume from existing checkpoints, discarding any left by a different profile"""
+        self._render_chunks = 0
+        self._saved_parts = 0
+        self._saved_blocks = 0
+        self._last_checkpoint = time.time()
+        if self.checkpoint_store is None:
+            return
+        
+        fingerprint = profile_fingerprint(self.profile)
+        meta = self.checkpoint_store.load('meta')
+        if meta and meta.get('fingerprint') == fingerprint:
+            print("Resuming from checkpoints of a previous attempt")
+            return
+        
+        self.checkpoint_store.clear()
+        self._save_checkpoint('meta', {'fingerprint': fingerprint})
+    
+    def _load_checkpoint(self, name: str) -> Optional[Any]:
+        if self.checkpoint_store is None:
+            return None
+        return self.checkpoint_store.load(name)
+    
+    def _save_checkpoint(self, name: str, data: Any) -> bool:
+        """Save a checkpoint; failing to checkpoint never fails the run"""
+        if self.checkpoint_store is None:
+            return False
+        try:
+            self.checkpoint_store.save(name, data)
+            return True
+        except Exception as e:
+            print(f"Warning: could not save {name} checkpoint: {e}")
+            return False
+    
+    def _restore_analysis(self, files: List[FileInfo], checkpoint: Dict) -> Optional[List[FileInfo]]:
+        """Re-apply a checkpointed filter and sort to freshly loaded files"""
+        by_path = {info.rel_path: info for info in files}
+        restored = []
+        for rel_path, importance_score in checkpoint['order']:
+            info = by_path.get(rel_path)
+            if info is None:
+                return None
+            info.importance_score = importance_score
+            restored.append(info)
+        self.skipped_files = [tuple(entry) for entry in checkpoint['skipped_files']]
+        return restored
+    
+    def _checkpoint_render(self, output_parts: List[str], next_index: int, state: Dict):
+        """Save output written since the last checkpoint, then the render loop state
+        
+        Output is saved in append-only chunks so each checkpoint costs only
+        what was written since the previous one.
+        """
+        blocks = self.action_block_generator.blocks
+        chunk_saved = self._save_checkpoint(f'render-{self._render_chunks}', {
+            'parts': output_parts[self._saved_parts:],
+            'action_blocks': [serialize_action_block(block) for block in blocks[self._saved_blocks:]]
+        })
+        if not chunk_saved:
+            return
+        
+        budget = self.token_manager.budget
+        state_saved = self._save_checkpoint('render', dict(
+            state,
+            chunks=self._render_chunks + 1,
+            next_index=next_index,
+            budget={
+                'used': budget.used,
+                'reserved': budget.reserved,
+                'allocations': [asdict(allocation) for allocation in budget.allocations]
+            },
+            skipped_files=self.skipped_files
+        ))
+        if state_saved:
+            self._render_chunks += 1
+            self._saved_parts = len(output_parts)
+            self._saved_blocks = len(blocks)
+        self._last_checkpoint = time.time()
+    
+    def _restore_render(self, checkpoint: Dict) -> Optional[List[str]]:
+        """Rebuild output parts, action blocks and budget from a render checkpoint"""
+        output_parts = []
+        blocks = []
+        for chunk_index in range(checkpoint['chunks']):
+            chunk = self._load_checkpoint(f'render-{chunk_index}')
+            if chunk is None:
+                return None
+            output_parts.extend(chunk['parts'])
+            blocks.extend(filter(None, map(deserialize_action_block, chunk['action_blocks'])))
+        
+        self.action_block_generator.blocks = blocks
+        budget = self.token_manager.budget
+        budget.used = checkpoint['budget']['used']
+        budget.reserved = dict(checkpoint['budget']['reserved'])
+        budget.allocations = [TokenAllocation(**allocation) for allocation in checkpoint['budget']['allocations']]
+        self.skipped_files = [tuple(entry) for entry in checkpoint['skipped_files']]
+        
+        self._render_chunks = checkpoint['chunks']
+        self._saved_parts = len(output_parts)
+        self._saved_blocks = len(blocks)
+        return output_parts
+    
+    def _render_output(self, repo_path: Path, output_path: Path, files: List[FileInfo],
+                       exclusion_spec: pathspec.PathSpec, start_time: float):
+        """Analyze scanned files and write the output within the token budget"""
+        # A processor may render repeatedly (watch mode); each output starts from an empty budget
+        self.token_manager.budget = TokenBudget(total=self.token_manager.budget.total)
+        self.skipped_files = []
+        self.action_block_generator.blocks = []
+        
+        checkpoint = self._load_checkpoint('analysis')
+        restored = self._restore_analysis(files, checkpoint) if checkpoint is not None else None
+        if restored is not None:
+            files = restored
+            codebase_analysis = checkpoint['codebase_analysis']
+            print(f"Restored analysis of {len(files)} files from checkpoint")
         else:
-            output_parts.append("[Directory structure omitted due to token budget]")
+            self._apply_graph_importance(files)
+            self._apply_query_relevance(files)
+            
+            # Filter and sort files
+            with self.instrumentation.stage('filter'):
+                files = self._filter_and_sort_files(files)
+            print(f"After filtering: {len(files)} files")
+            
+            # Analyze codebase
+            print("\nAnalyzing codebase structure...")
+            with self.instrumentation.stage('analyze_codebase'):
+                codebase_analysis = self.codebase_analyzer.analyze_codebase(files)
+            self._save_checkpoint('analysis', {
+                'order': [(info.rel_path, info.importance_score) for info in files],
+                'codebase_analysis': codebase_analysis,
+                'skipped_files': self.skipped_files
+            })
         
-        # Process individual files
-        output_parts.append("\nFile Contents:\n" + "="*50 + "\n")
+        self.ranked_files = files
+        self.codebase_analysis = codebase_analysis
         
-        # Track token offsets for each file
-        file_offset_map = {}
-        current_token_offset = sum(self.token_manager.count_tokens(part) for part in output_parts)
+        # Process files within token budget
+        print("\nProcessing files...")
+        # Output checkpoints are only valid for the file order they were written in
+        checkpoint = self._load_checkpoint('render') if restored is not None else None
+        output_parts = self._restore_render(checkpoint) if checkpoint is not None else None
+        if output_parts is not None:
+            manifest_placeholder_index = checkpoint['manifest_placeholder_index']
+            file_offset_map = checkpoint['file_offset_map']
+            current_token_offset = checkpoint['current_token_offset']
+            processed_count = checkpoint['processed_count']
+            emitted_whole = set(checkpoint.get('emitted_whole', ()))
+            start_index = checkpoint['next_index']
+            print(f"Resuming output at file {start_index}/{len(files)} from checkpoint")
+        else:
+            output_parts, manifest_placeholder_index = self._render_preamble(
+                repo_path, exclusion_spec, codebase_analysis)
+            
+            # Track token offsets for each file
+            file_offset_map = {}
+            current_token_offset = sum(self.token_manager.count_tokens(part) for part in output_parts)
+            processed_count = 0
+            # Files emitted untruncated, which near-duplicates may be rendered against
+            emitted_whole = set()
+            start_index = 0
+        
+        def checkpoint_render(next_index: int):
+            self._checkpoint_render(output_parts, next_index, {
+                'manifest_placeholder_index': manifest_placeholder_index,
+                'file_offset_map': file_offset_map,
+                'current_token_offset': current_token_offset,
+                'processed_count': processed_count,
+                'emitted_whole': sorted(emitted_whole)
+            })
         
-        processed_count = 0
-        for i, file_info in enumerate(files):
-            if self.token_manager.budget.remaining < 1000:  # Reserve some tokens for footer
-                print(f"Token budget exhausted at file {i}/{len(files)}")
-                # Track remaining files as skipped due to token budget
-                for remaining_file in files[i:]:
-                    self.skipped_files.append((remaining_file.rel_path, "Token budget exhausted"))
-                break
-            
-            # Get remaining budget for this file
-            remaining_budget = min(
-                self.token_manager.budget.remaining - 1000,
-                self.profile.max_file_size
-            )
-            
-            # Track offset for this file
-            file_offset_map[str(file_info.rel_path)] = current_token_offset
-            
-            # Process file
-            content, tokens_used = self.processor.process_file(file_info, remaining_budget)
+        if self._entity_selection_query():
+            # Rendered in one pass; a render checkpoint means it is already done
+            if start_index == 0:
+                with self.instrumentation.stage('render_entities'):
+                    processed_count, current_token_offset = self._render_entities(
+                        files, output_parts, file_offset_map, current_token_offset)
+            start_index = len(files)
+        
+        duplicates = self._find_near_duplicates(files) if start_index < len(files) else {}
+        
+        with self.instrumentation.stage('render'):
+            for i, file_info in enumerate(files[start_index:], start=start_index):
+                if self.token_manager.budget.remaining < 1000:  # Reserve some tokens for footer
+                    print(f"Token budget exhausted at file {i}/{len(files)}")
+                    # Track remaining files as skipped due to token budget
+                    for remaining_file in files[i:]:
+                        self.skipped_files.append((remaining_file.rel_path, "Token budget exhausted"))
+                    break
             
-            if tokens_used > 0:
-                file_header = f"\n[[FILE_START: {file_info.rel_path}]]\n"
-                file_header += f"File: {file_info.rel_path}\n"
-                file_header += f"Language: {file_info.language or 'Unknown'}\n"
-                file_header += f"Size: {file_info.size:,} bytes | Tokens: {tokens_used:,}\n"
-                file_header += "-" * 40 + "\n"
-                
-                # Add inline action blocks if configured
-                action_blocks_prefix = ""
-                if (self.action_block_generator and 
-                    self.action_block_generator.format in ['inline', 'both']):
-                    inline_blocks = self.action_block_generator.generate_inline_blocks(str(file_info.rel_path))
-                    if inline_blocks:
-                        action_blocks_prefix = '\n'.join(inline_blocks) + '\n\n'
+                # Get remaining budget for this file
+                remaining_budget = min(
+                    self.token_manager.budget.remaining - 1000,
+                    self.profile.max_file_size
+                )
+                if self.profile.output_parts > 1:
+                    # No file takes more than half a part, so parts pack well
+                    remaining_budget = min(remaining_budget, self.part_budget // 2)
+            
+                # Track offset for this file
+                file_offset_map[str(file_info.rel_path)] = current_token_offset
+            
+                # Near-duplicates of a file emitted in full are rendered against it
+                rendered = None
+                duplicate = duplicates.get(file_info.rel_path)
+                if duplicate is not None and duplicate[0].rel_path in emitted_whole:
+                    rendered = self._render_duplicate(file_info, duplicate[0], duplicate[1], remaining_budget)
+                    if rendered is not None:
+                        self.instrumentation.count(DUPLICATES_REFERENCED)
                 
-                file_output = file_header + action_blocks_prefix + content + "\n"
-                file_tokens = self.token_manager.count_tokens(file_output)
+                # Process file
+                if rendered is not None:
+                    content, tokens_used = rendered
+                else:
+                    with self.instrumentation.stage('process_file', file=str(file_info.rel_path)):
+                        content, tokens_used = self.processor.process_file(file_info, remaining_budget)
+            
+                if tokens_used > 0:
+                    file_output = self._render_file_block(file_info, content, tokens_used)
+                    file_tokens = self.token_manager.count_tokens(file_output)
                 
-                if self.token_manager.budget.remaining >= file_tokens:
-                    output_parts.append(file_output)
-                    self.token_manager.budget.allocate(file_info.rel_path, file_tokens, file_info.importance_score)
-                    processed_count += 1
+                    if self.token_manager.budget.remaining >= file_tokens:
+                        output_parts.append(file_output)
+                        self.token_manager.budget.allocate(file_info.rel_path, file_tokens, file_info.importance_score)
+                        processed_count += 1
+                        # Truncated, sampled and summarized content falls short of the file's token count
+                        if (rendered is None and not file_info.should_summarize and
+                                file_info.token_count is not None and tokens_used >= file_info.token_count):
+                            emitted_whole.add(file_info.rel_path)
                     
-                    # Update current offset for next file
-                    current_token_offset += file_tokens
+                        # Update current offset for next file
+                        current_token_offset += file_tokens
                     
-                    if processed_count % 10 == 0:
-                        print(f"Processed {processed_count} files...")
+                        if processed_count % 10 == 0:
+                            print(f"Processed {processed_count} files...")
+            
+                if (self.checkpoint_store is not None and
+                        time.time() - self._last_checkpoint >= self.checkpoint_interval):
+                    checkpoint_render(i + 1)
+        
+        if self.checkpoint_store is not None:
+            checkpoint_render(len(files))
         
         # Generate manifest with accurate token offsets
         if manifest_placeholder_index is not None:
             print("\nGenerating hierarchical manifest with token locations...")
-            manifest_text, _ = self.manifest_generator.generate_manifest(
-                files, codebase_analysis, file_offset_map=file_offset_map)
+            with self.instrumentation.stage('manifest'):
+                # Token offsets only hold within a single output
+                manifest_text, _ = self.manifest_generator.generate_manifest(
+                    files, codebase_analysis,
+                    file_offset_map=file_offset_map if self.profile.output_parts <= 1 else None)
             manifest_tokens = self.token_manager.count_tokens(manifest_text)
             
             if self.token_manager.budget.remaining >= manifest_tokens:
@@ -1725,16 +2288,36 @@ class UltraRepo2File:
             else:
                 output_parts[manifest_placeholder_index] = "[Manifest omitted due to token budget]"
         
-        # Add footer
-        footer = self._generate_footer(codebase_analysis, processed_count, len(files))
-        footer_tokens = self.token_manager.count_tokens(footer)
-        
-        if self.token_manager.budget.remaining >= footer_tokens:
-            output_parts.append(footer)
-        
-        # Write output
-        final_output = '\n'.join(output_parts)
-        output_path.write_text(final_output, encoding='utf-8')
+        if self.profile.output_parts > 1:
+            with self.instrumentation.stage('write'):
+                processed_count, part_paths = self._write_output_parts(
+                    output_path, output_parts, manifest_placeholder_index, codebase_analysis, len(files))
+            processing_stats = self._processing_stats(processed_count, len(files))
+        else:
+            part_paths = None
+            # Add footer
+            footer = self._generate_footer(codebase_analysis, processed_count, len(files))
+            footer_tokens = self.token_manager.count_tokens(footer)
+            
+            footer_index = None
+            if self.token_manager.budget.remaining >= footer_tokens:
+                output_parts.append(footer)
+                footer_index = len(output_parts) - 1
+            
+            processing_stats = self._processing_stats(processed_count, len(files))
+            
+            # Write output, and its index for consumers that want parts of it
+            with self.instrumentation.stage('write'):
+                write_output(output_path, output_parts,
+                             self._output_sections(output_parts, manifest_placeholder_index, footer_index),
+                             {**self._output_metadata(processing_stats), 'token_offsets': file_offset_map})
+        
+        if self.profile.write_context_pack:
+            with self.instrumentation.stage('context_pack'):
+                pack_path = self._write_context_pack(output_path, output_parts, files,
+                                                     manifest_placeholder_index, codebase_analysis,
+                                                     processing_stats)
+            print(f"Context pack written to: {pack_path}")
         
         # Generate structured output if action blocks are enabled
         if self.action_block_generator and self.action_block_generator.enabled:
@@ -1747,10 +2330,7 @@ class UltraRepo2File:
             
             structured_output['codebase_analysis'] = serializable_analysis
             structured_output['processing_stats'] = {
-                'files_processed': processed_count,
-                'total_files': len(files),
-                'tokens_used': self.token_manager.budget.used,
-                'token_budget': self.token_manager.budget.total,
+                **processing_stats,
                 'processing_time_seconds': time.time() - start_time
             }
             
@@ -1761,15 +2341,398 @@ class UltraRepo2File:
             print(f"Structured analysis written to: {structured_path}")
         
         # Save cache
-        self.cache.save_caches()
+        with self.instrumentation.stage('cache_save'):
+            self.cache.save_caches()
         
         # Print summary
         elapsed_time = time.time() - start_time
         print(f"\nProcessing complete in {elapsed_time:.1f} seconds")
-        print(f"Output written to: {output_path}")
+        if part_paths:
+            print(f"Output written to {len(part_paths)} parts: {', '.join(str(path) for path in part_paths)}")
+        else:
+            print(f"Output written to: {output_path}")
         print(f"Files processed: {processed_count}/{len(files)}")
         print(f"Total tokens used: {self.token_manager.budget.used:,}/{self.token_manager.budget.total:,}")
         print(f"Token utilization: {self.token_manager.budget.used/self.token_manager.budget.total*100:.1f}%")
+        print(self.instrumentation.format_summary())
+    
+    def _write_context_pack(self, output_path: Path, output_parts: List[str], files: List[FileInfo],
+                            manifest_index: Optional[int], codebase_analysis: Dict,
+                            processing_stats: Dict) -> Path:
+        """Write every ranked file, not only those that fit, to <output stem>.r2fpack"""
+        # Header, directory tree and divider; the manifest's offsets only hold for this render
+        tree_index = (manifest_index or 0) + 1
+        preamble = '\n'.join([output_parts[0], *output_parts[tree_index:tree_index + 2]])
+        analysis = {key: sorted(value) if isinstance(value, set) else value
+                    for key, value in codebase_analysis.items()}
+        
+        blocks_by_file = {}
+        if self.action_block_generator and self.action_block_generator.enabled:
+            for block in self.action_block_generator.blocks:
+                blocks_by_file.setdefault(block.file, []).append(block.to_dict())
+        
+        pack_path = output_path.parent / f"{output_path.stem}.r2fpack"
+        metadata = {
+            'preamble_tokens': self.token_manager.count_tokens(preamble),
+            'stats': processing_stats,
+            'codebase_analysis': analysis,
+        }
+        with ContextPackWriter(pack_path, preamble, metadata) as pack:
+            for info in files:
+                self.cancel_token.raise_if_cancelled()
+                if info.is_binary:
+                    continue
+                try:
+                    content = info.path.read_text(encoding='utf-8', errors='ignore')
+                except OSError as e:
+                    print(f"Error reading {info.rel_path}: {e}")
+                    continue
+                self.instrumentation.count(BYTES_READ, info.size)
+                rel_path = str(info.rel_path)
+                entities = (info.semantic_data or {}).get('entities') or ()
+                pack.add(
+                    rel_path, content,
+                    tokens=info.token_count or self.token_manager.count_tokens(content),
+                    importance=info.importance_score,
+                    language=info.language,
+                    size=info.size,
+                    entities=[[entity.name, entity.type, entity.line_start, entity.line_end]
+                              for entity in entities],
+                    action_blocks=blocks_by_file.get(rel_path, []),
+                    inline_blocks=(self.action_block_generator.generate_inline_blocks(rel_path)
+                                   if self.action_block_generator else []),
+                )
+        return pack_path
+    
+    def _render_file_block(self, file_info: FileInfo, content: str, tokens_used: int) -> str:
+        """A file's block in the output: header, inline action blocks, content and end marker"""
+        file_header = f"\n[[FILE_START: {file_info.rel_path}]]\n"
+        file_header += f"File: {file_info.rel_path}\n"
+        file_header += f"Language: {file_info.language or 'Unknown'}\n"
+        file_header += f"Size: {file_info.size:,} bytes | Tokens: {tokens_used:,}\n"
+        file_header += "-" * 40 + "\n"
+        
+        # Add inline action blocks if configured
+        action_blocks_prefix = ""
+        if (self.action_block_generator and 
+            self.action_block_generator.format in ['inline', 'both']):
+            inline_blocks = self.action_block_generator.generate_inline_blocks(str(file_info.rel_path))
+            if inline_blocks:
+                action_blocks_prefix = '\n'.join(inline_blocks) + '\n\n'
+        
+        file_output = file_header + action_blocks_prefix + content + "\n"
+        file_output += f"[[FILE_END: {file_info.rel_path}]]\n"
+        return file_output
+    
+    def patch_output(self, repo_path: Path, output_path: Path, changed: List[Dict], removed: List[str]) -> bool:
+        """Update the last output in place for rescanned and deleted files (watch mode)
+        
+        Blocks of changed files are re-rendered and swapped in, blocks of
+        removed files dropped, and the manifest regenerated; nothing else is
+        re-rendered. Files not in the output stay out until the next full
+        render. Returns False, with the output untouched, when only a full
+        render will do: no current index, parts or entity selection, or the
+        changed blocks no longer fit the budget.
+        """
+        if self.profile.output_parts > 1 or self._entity_selection_query():
+            return False
+        output_index = OutputIndex.load(output_path)
+        if output_index is None or output_index.get('token_offsets') is None:
+            return False
+        
+        stats = dict(output_index.get('stats'))
+        used = stats['tokens_used']
+        blocks = {}
+        deltas = {}
+        infos = {}
+        for data in changed:
+            rel_path = data['rel_path']
+            old_block = output_index.file_block(rel_path)
+            if old_block is None:
+                continue
+            info = self.scanner._dict_to_fileinfo(data, repo_path / rel_path, repo_path)
+            old_tokens = self.token_manager.count_tokens(old_block)
+            available = stats['token_budget'] - used + old_tokens
+            self.action_block_generator.blocks = [
+                block for block in self.action_block_generator.blocks if block.file != rel_path]
+            with self.instrumentation.stage('process_file', file=rel_path):
+                content, tokens_used = self.processor.process_file(
+                    info, min(available - 1000, self.profile.max_file_size))
+            if tokens_used <= 0:
+                return False
+            block = self._render_file_block(info, content, tokens_used)
+            new_tokens = self.token_manager.count_tokens(block)
+            if new_tokens > available:
+                return False
+            used += new_tokens - old_tokens
+            blocks[rel_path] = block
+            deltas[rel_path] = new_tokens - old_tokens
+            infos[rel_path] = info
+        for rel_path in removed:
+            old_block = output_index.file_block(rel_path)
+            if old_block is not None:
+                blocks[rel_path] = None
+                deltas[rel_path] = -self.token_manager.count_tokens(old_block)
+                used += deltas[rel_path]
+        if not blocks:
+            return True
+        
+        # Token offsets of later blocks move by the size changes before them
+        dropped = {rel_path for rel_path, block in blocks.items() if block is None}
+        offsets = {}
+        shift = 0
+        for rel_path, offset in output_index.get('token_offsets').items():
+            if rel_path not in dropped:
+                offsets[rel_path] = offset + shift
+            shift += deltas.get(rel_path, 0)
+        self.ranked_files = [infos.get(info.rel_path, info) for info in self.ranked_files
+                             if info.rel_path not in dropped]
+        
+        sections = {}
+        manifest = output_index.section('manifest')
+        if manifest is not None and not manifest.startswith('[Manifest omitted'):
+            with self.instrumentation.stage('manifest'):
+                sections['manifest'], _ = self.manifest_generator.generate_manifest(
+                    self.ranked_files, self.codebase_analysis, file_offset_map=offsets)
+        
+        stats['tokens_used'] = used
+        stats['files_processed'] -= len(dropped)
+        with self.instrumentation.stage('write'):
+            output_index.patch(blocks, sections, {'stats': stats, 'token_offsets': offsets})
+        return True
+    
+    def _processing_stats(self, processed_count: int, total_files: int) -> Dict:
+        return {
+            'files_processed': processed_count,
+            'total_files': total_files,
+            'tokens_used': self.token_manager.budget.used,
+            'token_budget': self.token_manager.budget.total,
+        }
+    
+    def _output_metadata(self, processing_stats: Dict) -> Dict:
+        """What the output index records besides byte ranges"""
+        return {
+            'stats': processing_stats,
+            'skipped_files': self.skipped_files,
+            'vibe_statement': self.profile.vibe_statement,
+            'source_commit': self.git_analyzer.get_head_sha() if self.git_analyzer else None,
+        }
+    
+    def _write_output_parts(self, output_path: Path, output_parts: List[str], manifest_index: Optional[int],
+                            codebase_analysis: Dict, total_files: int) -> Tuple[int, List[Path]]:
+        """Split the file blocks into token-bounded parts and write them in parallel
+        
+        Part 1 keeps the header, manifest, tree and footer; every part has the
+        parts index. Returns the number of files written and the part paths.
+        """
+        count = self.profile.output_parts
+        tree_index = (manifest_index or 0) + 1
+        preamble, divider = output_parts[:tree_index + 1], output_parts[tree_index + 1]
+        blocks = {}
+        for part in output_parts[tree_index + 2:]:
+            rel_path = block_path(part)
+            if rel_path is not None:
+                blocks[rel_path] = part
+        allocated = {str(allocation.file_path): allocation.allocated_tokens
+                     for allocation in self.token_manager.budget.allocations}
+        tokens = {rel_path: allocated.get(rel_path) or self.token_manager.count_tokens(block)
+                  for rel_path, block in blocks.items()}
+        edges = {}
+        if self.symbol_graph is not None:
+            edges = {rel_path: self.symbol_graph.edges(rel_path) for rel_path in blocks}
+        
+        # The index and footer depend on the plan; replan until they fit what was reserved
+        preamble_tokens = sum(self.token_manager.count_tokens(part) for part in preamble)
+        divider_tokens = self.token_manager.count_tokens(divider)
+        skipped_files = list(self.skipped_files)
+        index_reserve = footer_reserve = 0
+        while True:
+            capacities = [self.part_budget - index_reserve - divider_tokens] * count
+            capacities[0] -= preamble_tokens + footer_reserve
+            parts, unplaced = plan_parts(list(tokens.items()), capacities, edges)
+            parts = parts[:1] + [part for part in parts[1:] if part]
+            self.skipped_files = skipped_files + [
+                (rel_path, f"Did not fit in {count} output parts") for rel_path in unplaced]
+            footer = self._generate_footer(codebase_analysis, len(blocks) - len(unplaced), total_files)
+            index_tokens = self.token_manager.count_tokens(parts_index(parts, tokens, len(parts)))
+            footer_tokens = self.token_manager.count_tokens(footer)
+            if index_tokens <= index_reserve and footer_tokens <= footer_reserve:
+                break
+            index_reserve = max(index_reserve, index_tokens)
+            footer_reserve = max(footer_reserve, footer_tokens)
+        
+        metadata = self._output_metadata(self._processing_stats(len(blocks) - len(unplaced), total_files))
+        jobs = []
+        for number, part in enumerate(parts, start=1):
+            index = parts_index(parts, tokens, number)
+            if number == 1:
+                part_outputs = [*preamble, index, divider, *(blocks[rel_path] for rel_path in part), footer]
+                sections = self._output_sections(part_outputs, manifest_index, len(part_outputs) - 1)
+                sections['parts'] = (tree_index + 1, 0, len(index))
+            else:
+                part_outputs = [index, divider, *(blocks[rel_path] for rel_path in part)]
+                sections = {'parts': (0, 0, len(index))}
+            jobs.append((part_path(output_path, number), part_outputs, sections,
+                         {**metadata, 'part': number, 'parts': len(parts)}))
+        
+        with ThreadPoolExecutor(max_workers=min(len(jobs), mp.cpu_count())) as executor:
+            for future in as_completed([executor.submit(write_output, *job) for job in jobs]):
+                future.result()
+        return len(blocks) - len(unplaced), [job[0] for job in jobs]
+    
+    @staticmethod
+    def _output_sections(output_parts: List[str], manifest_index: Optional[int],
+                         footer_index: Optional[int]) -> Dict[str, Tuple[int, int, int]]:
+        """Named (part, start, end) character spans of the output, for its index"""
+        header = output_parts[0]
+        sections = {'header': (0, 0, len(header))}
+        
+        # Vibe coder sections run to the next section or the processing notes
+        markers = [(name, header.find(marker)) for name, marker in (
+            ('planner_primer', 'SECTION 1: FOR AI PLANNING AGENT'),
+            ('coder_context', 'SECTION 2: FOR AI CODING AGENT'),
+            (None, '## Processing Notes'))]
+        markers = sorted((start, name) for name, start in markers if start != -1)
+        for (start, name), (end, _) in zip(markers, markers[1:] + [(len(header), None)]):
+            if name:
+                sections[name] = (0, start, end)
+        
+        if manifest_index is not None:
+            sections['manifest'] = (manifest_index, 0, len(output_parts[manifest_index]))
+        # The directory tree follows the header and manifest (see _render_preamble)
+        tree_index = (manifest_index or 0) + 1
+        sections['tree'] = (tree_index, 0, len(output_parts[tree_index]))
+        
+        if footer_index is not None:
+            footer = output_parts[footer_index]
+            sections['footer'] = (footer_index, 0, len(footer))
+            skipped_start = footer.find('## Skipped / Truncated Files')
+            if skipped_start != -1:
+                skipped_end = footer.find('Generated by UltraRepo2File', skipped_start)
+                sections['skipped_files'] = (footer_index, skipped_start,
+                                             skipped_end if skipped_end != -1 else len(footer))
+        return sections
+    
+    def _entity_selection_query(self) -> str:
+        """The query entities are selected for, or '' when selecting whole files"""
+        if self.profile.selection_granularity != 'entity':
+            return ''
+        query = self.profile.intended_query or self.profile.vibe_statement
+        if not query or self.scanner.search_index is None:
+            print("Entity selection needs an intended query or vibe statement; selecting whole files")
+            return ''
+        return query
+    
+    def _render_entities(self, files: List[FileInfo], output_parts: List[str], file_offset_map: Dict[str, int],
+                         current_token_offset: int) -> Tuple[int, int]:
+        """Select the functions and classes most relevant to the query across all files
+        
+        Selected entities are grouped by file, files ordered by their best
+        entity, each entity between FUNCTION_START/FUNCTION_END anchors.
+        Returns the number of files written and the new token offset.
+        """
+        query = self._entity_selection_query()
+        relevance = self.scanner.search_index.relevance(query)
+        candidates = [
+            info for info in files
+            if relevance.get(info.rel_path, 0.0) > 0 and info.semantic_data and info.semantic_data.get('entities')
+        ]
+        candidates.sort(key=lambda info: (-relevance[info.rel_path], info.rel_path))
+        candidates = candidates[:MAX_ENTITY_CANDIDATE_FILES]
+        
+        units = []
+        sources = {}
+        unit_counts = {}
+        for info in candidates:
+            self.cancel_token.raise_if_cancelled()
+            try:
+                content = info.path.read_text(encoding='utf-8', errors='ignore')
+            except OSError as e:
+                print(f"Error reading {info.rel_path}: {e}")
+                continue
+            self.instrumentation.count(BYTES_READ, info.size)
+            lines = content.splitlines()
+            file_tokens = info.token_count or self.token_manager.count_tokens(content)
+            units_in_file = file_units(info.rel_path, lines, info.semantic_data['entities'], file_tokens)
+            for unit in units_in_file:
+                sources[unit.key] = '\n'.join(lines[unit.line_start - 1:unit.line_end])
+            units.extend(units_in_file)
+            unit_counts[info.rel_path] = len(units_in_file)
+        
+        score_units(units, sources, query, {info.rel_path: info.importance_score for info in candidates})
+        selected = select_units(units, self.token_manager.budget.remaining - 1000)
+        print(f"Selected {len(selected)} of {len(units)} entities from {len(candidates)} candidate files")
+        
+        by_file: Dict[str, List] = {}
+        for unit in selected:
+            by_file.setdefault(unit.rel_path, []).append(unit)
+        infos = {info.rel_path: info for info in candidates}
+        
+        processed_count = 0
+        for rel_path, file_selected in by_file.items():
+            info = infos[rel_path]
+            blocks = [
+                f"[[FUNCTION_START: {rel_path}::{unit.name}]]\n"
+                f"{unit.type.capitalize()} {unit.name} | Lines {unit.line_start}-{unit.line_end}\n"
+                f"{sources[unit.key]}\n"
+                f"[[FUNCTION_END: {rel_path}::{unit.name}]]"
+                for unit in sorted(file_selected, key=lambda unit: unit.line_start)
+            ]
+            file_output = f"\n[[FILE_START: {rel_path}]]\n"
+            file_output += f"File: {rel_path}\n"
+            file_output += f"Language: {info.language or 'Unknown'}\n"
+            file_output += (f"Size: {info.size:,} bytes | "
+                            f"Entities: {len(file_selected)} of {unit_counts[rel_path]} selected\n")
+            file_output += "-" * 40 + "\n"
+            file_output += '\n\n'.join(blocks) + "\n"
+            file_output += f"[[FILE_END: {rel_path}]]\n"
+            file_tokens = self.token_manager.count_tokens(file_output)
+            
+            # Estimates can run over; keep the footer reserve
+            if self.token_manager.budget.remaining - 1000 < file_tokens:
+                self.skipped_files.append((rel_path, "Token budget exhausted"))
+                continue
+            file_offset_map[rel_path] = current_token_offset
+            output_parts.append(file_output)
+            self.token_manager.budget.allocate(rel_path, file_tokens, info.importance_score)
+            processed_count += 1
+            current_token_offset += file_tokens
+        
+        return processed_count, current_token_offset
+    
+    def _render_preamble(self, repo_path: Path, exclusion_spec: pathspec.PathSpec,
+                         codebase_analysis: Dict) -> Tuple[List[str], Optional[int]]:
+        """Header, manifest placeholder and directory tree that precede the file contents"""
+        output_parts = []
+        
+        # Add header
+        header = self._generate_header(codebase_analysis, repo_path)
+        header_tokens = self.token_manager.count_tokens(header)
+        self.token_manager.budget.reserve('header', header_tokens)
+        output_parts.append(header)
+        
+        # Reserve a placeholder for the manifest (we'll generate it after processing files)
+        manifest_placeholder_index = None
+        if self.profile.generate_manifest and (self.profile.model == 'gemini-1.5-pro' or self.profile.token_budget > 500000):
+            print("\nReserving space for hierarchical manifest...")
+            output_parts.append("[MANIFEST_PLACEHOLDER]")
+            manifest_placeholder_index = len(output_parts) - 1
+        
+        # Add directory structure
+        with self.instrumentation.stage('tree'):
+            tree_structure = self._generate_tree_structure(repo_path, exclusion_spec)
+        tree_tokens = self.token_manager.count_tokens(tree_structure)
+        
+        if self.token_manager.budget.remaining >= tree_tokens:
+            self.token_manager.budget.reserve('tree', tree_tokens)
+            output_parts.append(tree_structure)
+        else:
+            output_parts.append("[Directory structure omitted due to token budget]")
+        
+        # Process individual files
+        output_parts.append("\nFile Contents:\n" + "="*50 + "\n")
+        
+        return output_parts, manifest_placeholder_index
     
     def _check_and_create_ai_guardrails(self, repo_path: Path):
         """Check for ai_guardrails.md and create if missing and configured"""
@@ -1811,6 +2774,9 @@ class UltraRepo2File:
         # Add custom patterns from profile
         patterns.extend(self.profile.exclude_patterns)
         
+        # The scanner's caches (embeddings, ASTs) live inside the repository
+        patterns.append(f"/{SCANNER_CACHE_DIRECTORY}")
+        
         return pathspec.PathSpec.from_lines('gitwildmatch', patterns)
     
     def _filter_and_sort_files(self, files: List[FileInfo]) -> List[FileInfo]:
@@ -1888,6 +2854,10 @@ class UltraRepo2File:
         header.append("- Content is intelligently truncated to fit token budget")
         header.append("- Binary and auto-generated files are excluded")
         header.append("- Lock files are summarized")
+        head_sha = self.git_analyzer.get_head_sha() if self.git_analyzer else None
+        if head_sha:
+            # Iteration briefs diff from here (see extract_content_from_previous_output)
+            header.append(f"- Source commit: {head_sha}")
         header.append("")
         
         return '\n'.join(header)
@@ -1927,6 +2897,22 @@ class UltraRepo2File:
             except Exception as e:
                 print(f"Error generating focus areas: {e}")
         
+        search_index = self.scanner.search_index
+        if self.profile.vibe_statement and search_index is not None:
+            matches = search_index.top(self.profile.vibe_statement, 5)
+            if matches:
+                section.append("- Files Most Related to Your Vibe Statement (keyword search):")
+                for rel_path, relevance in matches:
+                    section.append(f"  - {rel_path} (relevance {relevance:.2f})")
+        
+        vector_index = self.scanner.vector_index
+        if self.profile.vibe_statement and vector_index is not None:
+            entities = vector_index.similar_entities(self.profile.vibe_statement, 5)
+            if entities:
+                section.append("- Code Most Similar to Your Vibe Statement:")
+                for rel_path, name, similarity in entities:
+                    section.append(f"  - {name} in {rel_path} (similarity {similarity:.2f})")
+        
         # Add Git insights summary if available
         if self.git_analyzer and analysis.get('recent_activity'):
             section.extend([
@@ -2118,37 +3104,181 @@ class UltraRepo2File:
         return '\n'.join(footer)
     
     def extract_content_from_previous_output(self, previous_output_path: Path) -> Dict:
-        """Extract content from previous repo2file output"""
+        """Extract content from previous repo2file output
+        
+        Reads only the needed sections when the output has an index (see
+        output_index.py); older outputs are scanned whole.
+        """
+        output_index = OutputIndex.load(previous_output_path)
+        if output_index is not None:
+            file_blocks = {rel_path: output_index.file_content(rel_path) for rel_path in output_index.files}
+            return {
+                "vibe_statement": output_index.get("vibe_statement") or "",
+                "planner_output": (output_index.section("planner_primer") or "").strip(),
+                "file_blocks": file_blocks,
+                "raw_content": None,  # Not read; use OutputIndex for other sections
+                "base_sha": output_index.get("source_commit")
+            }
+        
         with open(previous_output_path, 'r', encoding='utf-8') as f:
             content = f.read()
         
         # Extract vibes/goals
-        vibe_pattern = r"My Vibe / Primary Goal:.+?(?=\n\n)"
+        vibe_pattern = r"(?:My Vibe / Primary Goal:|INITIAL FEATURE VIBE/GOAL:)(.+?)(?=\n\n)"
         vibe_match = re.search(vibe_pattern, content, re.DOTALL)
-        vibe_statement = vibe_match.group(0).replace("My Vibe / Primary Goal:", "").strip() if vibe_match else ""
+        vibe_statement = vibe_match.group(1).strip() if vibe_match else ""
         
         # Extract planner output
         planner_start = content.find("SECTION 1: FOR AI PLANNING AGENT")
-        planner_end = content.find("SECTION 2: FOR AI CODER") if "SECTION 2: FOR AI CODER" in content else len(content)
+        planner_end = content.find("SECTION 2: FOR AI CODING AGENT")
+        if planner_end == -1:
+            planner_end = len(content)
         planner_output = content[planner_start:planner_end].strip() if planner_start != -1 else ""
         
         # Extract key files and their content
         file_blocks = {}
-        file_pattern = r"\[\[FILE_START:(.*?)\]\](.+?)\[\[FILE_END\]\]"
+        file_pattern = r"\[\[FILE_START:(.*?)\]\](.+?)\[\[FILE_END(?::[^\]]*)?\]\]"
         for match in re.finditer(file_pattern, content, re.DOTALL):
             file_path = match.group(1).strip()
             file_content = match.group(2).strip()
             file_blocks[file_path] = file_content
         
+        # Commit the output was generated from, if it was a git repository
+        sha_match = re.search(r"^- Source commit: ([0-9a-f]{7,40})$", content, re.MULTILINE)
+        
         return {
             "vibe_statement": vibe_statement,
             "planner_output": planner_output,
             "file_blocks": file_blocks,
-            "raw_content": content
+            "raw_content": content,
+            "base_sha": sha_match.group(1) if sha_match else None
         }
     
-    def generate_iteration_brief(self, repo_path: Path, session_data: Dict, user_feedback: str = "") -> str:
-        """Generate iteration brief (Section C) for Gemini planner"""
+    def _related_to_changes(self, repo_path: Path, changed_files: List[str],
+                            limit: int = 10) -> List[Tuple[str, str, float]]:
+        """(file, changed file, similarity) of unchanged files most similar to changed ones
+        
+        Uses the similarity index left by earlier runs; nothing is indexed here.
+        """
+        try:
+            scanner = IncrementalScanner(repo_path)
+            if not scanner.embeddings_cache_file.exists():
+                return []
+            vector_index = scanner.open_vector_index()
+        except OSError:
+            return []
+        if vector_index is None:
+            return []
+        
+        changed = set(changed_files)
+        best: Dict[str, Tuple[str, float]] = {}
+        for changed_file in changed_files[:20]:
+            for rel_path, similarity in vector_index.related_files(changed_file, limit):
+                if rel_path not in changed and similarity > best.get(rel_path, ('', 0.0))[1]:
+                    best[rel_path] = (changed_file, similarity)
+        ranked = sorted(best.items(), key=lambda item: -item[1][1])[:limit]
+        return [(rel_path, changed_file, similarity) for rel_path, (changed_file, similarity) in ranked]
+    
+    def _iteration_snapshot(self, repo_path: Path, base_sha: str, head_sha: Optional[str] = None,
+                            mentioned: List[str] = ()) -> List[str]:
+        """Changed hunks, outlines of their one-hop neighbours, and nothing else
+        
+        Only changed and neighbouring files are scanned, from the file cache
+        when it is current; the import graph saved by earlier runs is brought
+        up to date for the changed files alone. See iteration_context.py.
+        """
+        try:
+            changes = diff_changes(repo_path, base_sha, head_sha)
+        except (subprocess.CalledProcessError, OSError) as e:
+            return [f"Could not diff against {base_sha}: {e}"]
+        if not changes:
+            return [f"No changes since {base_sha}."]
+        
+        with self.instrumentation.stage('iteration_snapshot'):
+            changed = {change.rel_path: change for change in changes}
+            infos = {}
+            for rel_path in list(changed) + [path for path in mentioned if path not in changed]:
+                file_path = repo_path / rel_path
+                if file_path.is_file():
+                    info = self.scanner.scan_file(file_path, repo_path)
+                    if info is not None:
+                        infos[rel_path] = info
+            
+            # path -> how it relates to the change
+            neighbours: Dict[str, List[str]] = {path: ["mentioned in feedback"]
+                                                for path in mentioned if path in infos and path not in changed}
+            self._open_symbol_graph(repo_path)
+            graph = self.symbol_graph
+            if graph is not None and len(graph):
+                graph.discard([change.rel_path for change in changes if change.status == 'D'] +
+                              [change.old_path for change in changes if change.old_path])
+                for rel_path in changed:
+                    info = infos.get(rel_path)
+                    if info is not None and not info.is_binary and self.scanner._is_code_file(info.path):
+                        graph.add(rel_path, SearchIndex.stamp(info.path), info.semantic_data)
+                for rel_path in changed:
+                    for target in graph.edges(rel_path):
+                        neighbours.setdefault(target, []).append(f"used by {rel_path}")
+                    for source in graph.dependents(rel_path):
+                        neighbours.setdefault(source, []).append(f"uses {rel_path}")
+                graph.save()
+            for rel_path in changed:
+                neighbours.pop(rel_path, None)
+            ranked = sorted(neighbours, key=lambda path: (-len(neighbours[path]), path))[:MAX_NEIGHBOURS]
+        
+        snapshot = [f"### Changed Files ({len(changes)} since {base_sha[:12]}):"]
+        for change in changes:
+            renamed = f" (from {change.old_path})" if change.old_path else ""
+            snapshot.append(f"- {change.rel_path}{renamed} [{change.status}] +{change.additions}/-{change.deletions}")
+        snapshot.append("")
+        
+        snapshot.append("### Changed Hunks:")
+        budget = self.profile.iteration_snapshot_budget
+        for change in changes:
+            snapshot.append(f"#### {change.rel_path} [{change.status}]")
+            if change.binary:
+                snapshot.append("(binary file)")
+                continue
+            if change.status == 'D':
+                snapshot.append(f"(deleted, {change.deletions} lines)")
+                continue
+            diff = change.diff
+            tokens = self.token_manager.count_tokens(diff)
+            if tokens > budget:
+                snapshot.append(f"(diff omitted: {tokens:,} tokens exceed the remaining snapshot budget)")
+                continue
+            budget -= tokens
+            snapshot.extend(["```diff", diff, "```"])
+        snapshot.append("")
+        
+        if ranked:
+            snapshot.append("### Neighbouring Files (unchanged; outline from cached analysis):")
+            for rel_path in ranked:
+                snapshot.append(f"- {rel_path} ({'; '.join(neighbours[rel_path])})")
+                info = infos.get(rel_path) or self.scanner.scan_file(repo_path / rel_path, repo_path)
+                if info is not None and info.semantic_data:
+                    snapshot.extend(outline(info.semantic_data.get('entities')))
+            if len(neighbours) > len(ranked):
+                snapshot.append(f"- ... and {len(neighbours) - len(ranked)} more")
+            snapshot.append("")
+        elif graph is None or not len(graph):
+            snapshot.append("(No import graph saved for this repository yet; neighbours appear after a full run.)")
+            snapshot.append("")
+        
+        snapshot.append(f"All other files are unchanged since {base_sha[:12]}; "
+                        f"their content is as in the previous context.")
+        return snapshot
+    
+    def generate_iteration_brief(self, repo_path: Path, session_data: Dict, user_feedback: str = "",
+                                 base_sha: Optional[str] = None, head_sha: Optional[str] = None) -> str:
+        """Generate iteration brief (Section C) for Gemini planner
+        
+        The code snapshot covers the diff from base_sha (default: the
+        session's 'base_sha', else HEAD~1) to head_sha (default: the working
+        tree) and the files one import away from it; see _iteration_snapshot.
+        """
+        base_sha = base_sha or session_data.get("base_sha")
+        diff_summary = None
         brief = []
         brief.append("=" * 50)
         brief.append("SECTION 3: ITERATION CONTEXT FOR AI PLANNING AGENT")
@@ -2174,7 +3304,7 @@ class UltraRepo2File:
             diff_summarizer = GitDiffSummarizer(repo_path)
             
             # Get colored diff summary
-            diff_summary = diff_summarizer.get_diff_summary(color=True)
+            diff_summary = diff_summarizer.get_diff_summary(base_sha, head_sha or 'HEAD', color=True)
             
             brief.append("## GIT DIFF SUMMARY SINCE LAST PLANNING:")
             brief.append(f"- Files changed: {len(diff_summary.files_changed)}")
@@ -2206,6 +3336,13 @@ class UltraRepo2File:
                 if len(diff_summary.detailed_changes) > 10:
                     brief.append(f"- ... and {len(diff_summary.detailed_changes) - 10} more files")
                 brief.append("")
+                
+                related = self._related_to_changes(repo_path, [f.get('file', '') for f in diff_summary.detailed_changes])
+                if related:
+                    brief.append("### Related Files (similar content, not changed):")
+                    for rel_path, changed_file, similarity in related:
+                        brief.append(f"- {rel_path} (similar to {changed_file}, {similarity:.2f})")
+                    brief.append("")
             
             if diff_summary.functions_modified:
                 brief.append("### Key Modified Functions:")
@@ -2216,7 +3353,7 @@ class UltraRepo2File:
                 brief.append("")
         
         # Test Results if available
-        if diff_summary.test_results:
+        if diff_summary and diff_summary.test_results:
             test_results = diff_summary.test_results
             brief.append("## TEST RESULTS:")
             
@@ -2251,41 +3388,12 @@ class UltraRepo2File:
         brief.append("## FOCUSED CURRENT CODE SNAPSHOT:")
         brief.append("")
         
-        # Generate focused snapshot of changed files
-        if diff_summary.detailed_changes:
-            changed_files = [f['file'] for f in diff_summary.detailed_changes]
-            
-            # Add files mentioned in user feedback
-            if user_feedback:
-                import re
-                # Look for file paths in feedback
-                potential_files = re.findall(r'[\w/]+\.\w+', user_feedback)
-                changed_files.extend(potential_files)
-            
-            # Remove duplicates and filter to existing files
-            unique_files = list(set(changed_files))
-            existing_files = []
-            for file_path in unique_files:
-                full_path = repo_path / file_path
-                if full_path.exists():
-                    existing_files.append(full_path)
-            
-            # Generate mini manifest for these files
-            if existing_files:
-                brief.append("### Files included in this snapshot:")
-                for file_path in existing_files[:10]:  # Limit to 10 files
-                    rel_path = file_path.relative_to(repo_path)
-                    brief.append(f"- {rel_path}")
-                brief.append("")
-                
-                # Now generate actual content (limited by token budget)
-                # This is where we'd run a focused version of the manifest generation
-                brief.append("### File Contents:")
-                brief.append("```")
-                brief.append("[File content generation would go here - limited by iteration_code_snapshot_budget]")
-                brief.append("```")
-            else:
-                brief.append("No changed files found for focused snapshot.")
+        if diff_summary is not None:
+            # Files mentioned in user feedback are outlined with the neighbours
+            mentioned = re.findall(r'[\w/]+\.\w+', user_feedback) if user_feedback else []
+            brief.extend(self._iteration_snapshot(repo_path, base_sha or 'HEAD~1', head_sha, mentioned))
+        else:
+            brief.append("Not a git repository; no changes to snapshot.")
         
         brief.append("")
         brief.append("## REQUEST FOR NEXT PLANNING ITERATION:")
@@ -2298,6 +3406,89 @@ class UltraRepo2File:
         
         return '\n'.join(brief)
 
+def render_targets(repo_path: Path, targets: List[RenderTarget],
+                   cancel_token: Optional[CancellationToken] = None,
+                   instrumentation: Optional[Instrumentation] = None) -> List[UltraRepo2File]:
+    """Scan the repository once, then render every target from that snapshot
+    
+    Targets may differ in model, budget, truncation strategy and header
+    sections (the vibe statement adds the planner primer, planner output the
+    coder header); only ranking and rendering are repeated per target. The
+    scan excludes what every target excludes, and each target drops the
+    rest of its own exclusions from the snapshot.
+    """
+    first = targets[0].profile
+    scan_profile = replace(
+        first,
+        exclude_patterns=[pattern for pattern in first.exclude_patterns
+                          if all(pattern in target.profile.exclude_patterns for target in targets)],
+        deduplicate_files=any(target.profile.deduplicate_files for target in targets))
+    scanner = UltraRepo2File(scan_profile, cancel_token=cancel_token, instrumentation=instrumentation)
+    snapshot = scanner.scan_repository(repo_path)
+    print(f"Scanned {len(snapshot)} files once for {len(targets)} targets")
+    
+    processors = []
+    for target in targets:
+        processor = UltraRepo2File(target.profile, cancel_token=scanner.cancel_token,
+                                   instrumentation=scanner.instrumentation)
+        exclusion_spec = processor._load_exclusions(repo_path)
+        scanned = [data for data in snapshot if not exclusion_spec.match_file(data['rel_path'])]
+        if processor.token_manager.encoding != scanner.token_manager.encoding:
+            # Counted with another tokenizer; recounted as the target renders
+            scanned = [{**data, 'token_count': None} for data in scanned]
+        processor.process_scanned_files(repo_path, target.output_path, scanned)
+        processors.append(processor)
+    return processors
+
+def parse_target(spec: str, base: ProcessingProfile) -> RenderTarget:
+    """A target from 'PATH[,model=M][,budget=N][,truncation=S][,sections=planner|coder|all]'
+    
+    Unset keys keep base's values. sections=planner drops the planner
+    output (no coder header), sections=coder drops the vibe statement (no
+    planner primer).
+    """
+    output_path, *options = spec.split(',')
+    overrides = {}
+    for option in options:
+        key, _, value = option.partition('=')
+        if key == 'model':
+            overrides['model'] = value
+        elif key == 'budget':
+            overrides['token_budget'] = int(value)
+        elif key == 'truncation':
+            overrides['truncation_strategy'] = value
+        elif key == 'sections' and value in ('planner', 'coder', 'all'):
+            if value == 'planner':
+                overrides['planner_output'] = None
+            elif value == 'coder':
+                overrides['vibe_statement'] = None
+        else:
+            raise ValueError(f"Invalid target option '{option}' in '{spec}'")
+    return RenderTarget(replace(base, **overrides), Path(output_path))
+
+def plan_shards(files: List[Tuple[str, int]], max_shard_bytes: int,
+                max_shard_files: int) -> List[List[str]]:
+    """Split (relative path, size) pairs into shards bounded by bytes and file count
+    
+    Files keep their path order so a shard covers neighbouring directories.
+    A single file larger than max_shard_bytes gets a shard of its own.
+    """
+    shards = []
+    current = []
+    current_bytes = 0
+    
+    for rel_path, size in files:
+        if current and (current_bytes + size > max_shard_bytes or len(current) >= max_shard_files):
+            shards.append(current)
+            current = []
+            current_bytes = 0
+        current.append(rel_path)
+        current_bytes += size
+    
+    if current:
+        shards.append(current)
+    return shards
+
 def main_iterate():
     """Main entry point for iteration mode"""
     try:
@@ -2308,6 +3499,8 @@ def main_iterate():
         previous_output_path = None
         user_feedback_file = None
         output_path = Path("iteration-brief.md")
+        base_sha = None  # Default: the commit recorded in the previous output
+        full_context = False
         
         i = 2  # Skip 'dump_ultra.py' and 'iterate'
         while i < len(sys.argv):
@@ -2324,6 +3517,12 @@ def main_iterate():
             elif arg == '--output' and i + 1 < len(sys.argv):
                 output_path = Path(sys.argv[i + 1])
                 i += 2
+            elif arg == '--since' and i + 1 < len(sys.argv):
+                base_sha = sys.argv[i + 1]
+                i += 2
+            elif arg == '--full-context':
+                full_context = True
+                i += 1
             else:
                 i += 1
         
@@ -2367,7 +3566,8 @@ def main_iterate():
         iteration_brief = processor.generate_iteration_brief(
             current_repo_path,
             previous_content,
-            user_feedback
+            user_feedback,
+            base_sha=base_sha
         )
         
         # Write output
@@ -2376,6 +3576,10 @@ def main_iterate():
         
         print(f"Iteration brief written to: {output_path}")
         
+        # The brief already carries the changed code; a full render is opt-in
+        if not full_context:
+            return
+        
         # Also generate a new repo2file output with the updated context
         print("\nGenerating updated repo2file output...")
         new_output_path = output_path.with_stem(f"{output_path.stem}-repo2file")
@@ -2419,11 +3623,22 @@ def main():
             print("  --vibe TEXT        High-level goal/vibe statement for Gemini planner")
             print("  --planner TEXT     AI planner output to integrate into coder context")
             print("  --git-insights     Enable git history insights")
+            print("  --no-dedupe        Render near-duplicate files in full")
+            print("  --pack             Also write a random-access context pack (<output stem>.r2fpack)")
+            print("  --parts N          Split the output into N parts of --budget tokens each (<output stem>_partK)")
+            print("  --granularity MODE Select whole files (file, default) or functions and classes (entity) for the query")
+            print("  --target SPEC      Also render SPEC = PATH[,model=M][,budget=N][,truncation=S][,sections=planner|coder|all]")
+            print("                     from the same scan; repeatable")
+            print("  --checkpoint-dir DIR  Save stage checkpoints to DIR and resume from them if present")
+            print("  --metrics-file PATH   Write stage timings and counters as JSON to PATH")
+            print("  --profile-dir DIR     Profile CPU and memory per stage and write the profiles to DIR")
             print("\nIteration Mode Options:")
             print("  --current-repo-path PATH      Current repository path")
             print("  --previous-repo2file-output PATH   Previous repo2file output to compare")
             print("  --user-feedback-file PATH     Optional file with user feedback")
             print("  --output PATH                 Output file for iteration brief (default: iteration-brief.md)")
+            print("  --since SHA                   Diff from SHA (default: the commit recorded in the previous output)")
+            print("  --full-context                Also regenerate the full repo2file output")
             print("\nExamples:")
             print("  python dump_ultra.py ./myrepo output.txt")
             print("  python dump_ultra.py ./myrepo output.txt --model claude-3 --budget 200000")
@@ -2479,6 +3694,10 @@ def main():
                 i += 1
         
         # Then process other arguments (which may override profile settings)
+        checkpoint_dir = None
+        metrics_file = None
+        profile_dir = None
+        target_specs = []
         i = 3
         while i < len(sys.argv):
             arg = sys.argv[i]
@@ -2525,17 +3744,74 @@ def main():
             elif arg == '--git-insights':
                 profile.enable_git_insights = True
                 i += 1
+            elif arg == '--no-dedupe':
+                profile.deduplicate_files = False
+                i += 1
+            elif arg == '--pack':
+                profile.write_context_pack = True
+                i += 1
+            elif arg == '--parts' and i + 1 < len(sys.argv):
+                profile.output_parts = int(sys.argv[i + 1])
+                i += 2
+            elif arg == '--granularity' and i + 1 < len(sys.argv):
+                if sys.argv[i + 1] not in SELECTION_GRANULARITIES:
+                    raise ValueError(f"Invalid --granularity '{sys.argv[i + 1]}' "
+                                     f"(choose from {', '.join(SELECTION_GRANULARITIES)})")
+                profile.selection_granularity = sys.argv[i + 1]
+                i += 2
+            elif arg == '--target' and i + 1 < len(sys.argv):
+                target_specs.append(sys.argv[i + 1])
+                i += 2
             elif arg == '--rules' and i + 1 < len(sys.argv):
                 # Accept comma-separated list of rule filenames
                 rule_files = sys.argv[i + 1].split(',')
                 profile.selected_rules = rule_files
                 i += 2
+            elif arg == '--checkpoint-dir' and i + 1 < len(sys.argv):
+                checkpoint_dir = Path(sys.argv[i + 1])
+                i += 2
+            elif arg == '--metrics-file' and i + 1 < len(sys.argv):
+                metrics_file = Path(sys.argv[i + 1])
+                i += 2
+            elif arg == '--profile-dir' and i + 1 < len(sys.argv):
+                profile_dir = Path(sys.argv[i + 1])
+                i += 2
             else:
                 i += 1
         
         # Process repository
-        processor = UltraRepo2File(profile)
-        processor.process_repository(repo_path, output_path)
+        checkpoint_store = LocalCheckpointStore(checkpoint_dir) if checkpoint_dir else None
+        profiler = StageProfiler() if profile_dir else None
+        if target_specs and checkpoint_store:
+            # Stage checkpoints describe a single output
+            print("Note: --checkpoint-dir is ignored with --target")
+            checkpoint_store = None
+        targets = [RenderTarget(profile, output_path)]
+        targets.extend(parse_target(spec, profile) for spec in target_specs)
+        
+        def run() -> UltraRepo2File:
+            if len(targets) > 1:
+                # Targets share one instrumentation, so the first one's metrics cover the run
+                return render_targets(repo_path, targets, instrumentation=profiler)[0]
+            processor = UltraRepo2File(profile, checkpoint_store=checkpoint_store, instrumentation=profiler)
+            processor.process_repository(repo_path, output_path)
+            return processor
+        
+        if profiler:
+            with profiler:
+                processor = run()
+            profiler.write(profile_dir)
+            print(f"Stage profiles written to: {profile_dir}")
+        else:
+            processor = run()
+        
+        if metrics_file:
+            with open(metrics_file, 'w') as f:
+                json.dump(processor.instrumentation.summary(), f, indent=2)
+        
+        # The output is complete; a rerun should start fresh
+        if checkpoint_store:
+            checkpoint_store.clear()
     
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)
@@ -0,0 +1,104 @@
+"""
+Entity-granular context selection
+
+For a query, the most useful context is often a few dozen functions spread
+over many files, while whole-file selection spends most of the budget on
+code around them. In entity mode every function, method and method-less
+class of the candidate files becomes a unit: units are scored against the
+query with BM25 (matches in the qualified name, such as Class.method,
+weigh most), weighted by their file's importance, and picked
+greedily by score per estimated token until the budget is spent.
+
+Token estimates are pro-rated from the file's token count, which the scan
+already computed; only selected units are counted exactly when rendered.
+"""
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from .search_index import SearchIndex
+
+# Entity types rendered as units; classes only when they have no methods
+UNIT_TYPES = {'function', 'method', 'class', 'interface', 'type'}
+# Regex analyzers only know where an entity starts; it is taken to run to
+# the next entity, but no further than this
+MAX_INFERRED_LINES = 200
+# Share of a unit's score that comes from its file's importance
+FILE_IMPORTANCE_WEIGHT = 0.3
+# Added to each unit's estimate for its anchors and line-range note
+ANCHOR_TOKENS = 25
+
+
+@dataclass(slots=True)
+class EntityUnit:
+    rel_path: str
+    name: str
+    type: str
+    line_start: int  # 1-based, inclusive
+    line_end: int
+    tokens: int  # Estimated
+    score: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.rel_path}::{self.name}"
+
+
+def entity_spans(entities: Iterable, total_lines: int) -> List[Tuple[str, str, int, int]]:
+    """(name, type, first line, last line) of the units among a file's entities
+
+    Methods are units of their own, so classes with methods are left out;
+    entities whose end is unknown run to the next entity's start.
+    """
+    entities = [entity for entity in entities if entity.type in UNIT_TYPES]
+    classes_with_methods = {entity.name.split('.', 1)[0] for entity in entities if entity.type == 'method'}
+    starts = sorted({entity.line_start for entity in entities})
+    spans = []
+    for entity in entities:
+        if entity.type == 'class' and entity.name in classes_with_methods:
+            continue
+        start, end = entity.line_start, entity.line_end
+        if end <= start:
+            following = [line for line in starts if line > start]
+            end = min(following[0] - 1 if following else total_lines, start + MAX_INFERRED_LINES - 1)
+        spans.append((entity.name, entity.type, start, min(end, total_lines)))
+    return spans
+
+
+def file_units(rel_path: str, lines: Sequence[str], entities: Iterable, file_tokens: int) -> List[EntityUnit]:
+    """Units of one file with token estimates pro-rated by characters"""
+    total_chars = sum(len(line) + 1 for line in lines) or 1
+    units = []
+    for name, entity_type, start, end in entity_spans(entities, len(lines)):
+        chars = sum(len(line) + 1 for line in lines[start - 1:end])
+        tokens = math.ceil(file_tokens * chars / total_chars) + ANCHOR_TOKENS
+        units.append(EntityUnit(rel_path, name, entity_type, start, end, tokens))
+    return units
+
+
+def score_units(units: List[EntityUnit], sources: Dict[str, str], query: str,
+                file_importance: Dict[str, float]):
+    """Set each unit's score from query relevance and its file's importance"""
+    # Keyed by qualified name, which the index weighs like a path, but not by
+    # file path: every entity of refunds.py would match "refund"
+    index = SearchIndex()
+    for position, unit in enumerate(units):
+        index.add(f"{unit.name} #{position}", '', sources[unit.key])
+    relevance = index.relevance(query)
+    for position, unit in enumerate(units):
+        unit_relevance = relevance.get(f"{unit.name} #{position}", 0.0)
+        importance = file_importance.get(unit.rel_path, 0.5)
+        unit.score = unit_relevance * (1 - FILE_IMPORTANCE_WEIGHT + FILE_IMPORTANCE_WEIGHT * importance)
+
+
+def select_units(units: Iterable[EntityUnit], budget: int) -> List[EntityUnit]:
+    """Relevant units by score per token (square-rooted, so tiny stubs don't
+    crowd out substantial matches) until the estimated budget is spent"""
+    ranked = sorted((unit for unit in units if unit.score > 0),
+                    key=lambda unit: (-unit.score / math.sqrt(unit.tokens), unit.key))
+    selected = []
+    for unit in ranked:
+        if unit.tokens <= budget:
+            selected.append(unit)
+            budget -= unit.tokens
+    return selected
@@ -0,0 +1,206 @@
+"""
+Compact storage for per-file semantic data
+
+CodeAnalyzer produces one CodeEntity per class, function and method, each
+with its own set and lists. The scanner keeps these for every file until
+processing starts, and again in serialized form in the scan cache, which on
+large repositories adds up to hundreds of megabytes. Scan results are
+therefore compacted into an EntityTable: parallel columns of interned strings
+and arrays, with CodeEntity objects only built when an entity is accessed.
+"""
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .code_analyzer import CodeEntity
+
+LIST_COLUMNS = ('dependencies', 'calls', 'called_by')
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    """sys.intern that passes through None and non-strings"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class StringLists:
+    """A column of string lists flattened into one tuple plus offsets"""
+    __slots__ = ('_offsets', '_values')
+
+    def __init__(self, offsets: Iterable[int], values: Iterable[str]):
+        self._offsets = array('I', offsets)
+        self._values = tuple(intern(value) for value in values)
+
+    @classmethod
+    def from_lists(cls, lists: Iterable[Iterable[str]]) -> 'StringLists':
+        offsets = [0]
+        values = []
+        for strings in lists:
+            values.extend(strings)
+            offsets.append(len(values))
+        return cls(offsets, values)
+
+    @classmethod
+    def from_serialized(cls, data: Union[Dict[str, List], List[List[str]]]) -> 'StringLists':
+        if isinstance(data, dict):
+            return cls(data['offsets'], data['values'])
+        return cls.from_lists(data)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, index: int) -> List[str]:
+        return list(self._values[self._offsets[index]:self._offsets[index + 1]])
+
+    def to_serialized(self) -> Dict[str, List]:
+        return {'offsets': self._offsets.tolist(), 'values': list(self._values)}
+
+
+class EntityTable(Sequence):
+    """Read-only, column-oriented sequence of a file's CodeEntity records
+
+    Indexing and iteration materialize fresh CodeEntity objects; mutating
+    them does not change the table.
+    """
+    __slots__ = ('names', 'types', 'line_starts', 'line_ends', 'importance_scores',
+                 'docstrings', 'dependencies', 'calls', 'called_by')
+
+    def __init__(self, names, types, line_starts, line_ends, importance_scores, docstrings,
+                 dependencies, calls, called_by):
+        self.names = tuple(intern(name) for name in names)
+        self.types = tuple(intern(entity_type) for entity_type in types)
+        self.line_starts = array('i', line_starts)
+        self.line_ends = array('i', line_ends)
+        self.importance_scores = array('d', importance_scores)
+        # Mostly None; kept as a tuple only when a file has any docstring
+        docstrings = tuple(docstrings)
+        self.docstrings = docstrings if any(docstrings) else None
+        self.dependencies = dependencies
+        self.calls = calls
+        self.called_by = called_by
+
+    @classmethod
+    def from_entities(cls, entities: Iterable[Union[CodeEntity, Dict[str, Any]]]) -> 'EntityTable':
+        """Build from CodeEntity objects or their dict form (older caches)"""
+        records = []
+        for entity in entities:
+            if isinstance(entity, dict):
+                record = entity
+            elif isinstance(entity, CodeEntity):
+                record = {name: getattr(entity, name) for name in CodeEntity.__dataclass_fields__}
+            else:
+                continue
+            if not all(key in record for key in ('name', 'type', 'line_start', 'line_end')):
+                continue
+            records.append(record)
+
+        return cls(
+            [r['name'] for r in records],
+            [r['type'] for r in records],
+            [r['line_start'] for r in records],
+            [r['line_end'] for r in records],
+            [r.get('importance_score') or 0.0 for r in records],
+            [r.get('docstring') for r in records],
+            *(StringLists.from_lists(r.get(column) or () for r in records) for column in LIST_COLUMNS)
+        )
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List]) -> 'EntityTable':
+        count = len(columns['name'])
+        return cls(
+            columns['name'],
+            columns['type'],
+            columns['line_start'],
+            columns['line_end'],
+            columns.get('importance_score') or [0.0] * count,
+            columns.get('docstring') or [None] * count,
+            *(StringLists.from_serialized(columns[column]) if columns.get(column)
+              else StringLists([0] * (count + 1), ()) for column in LIST_COLUMNS)
+        )
+
+    def to_columns(self) -> Dict[str, List]:
+        """JSON-serializable column form, the inverse of from_columns"""
+        return {
+            'name': list(self.names),
+            'type': list(self.types),
+            'line_start': self.line_starts.tolist(),
+            'line_end': self.line_ends.tolist(),
+            'importance_score': self.importance_scores.tolist(),
+            'docstring': list(self.docstrings) if self.docstrings else None,
+            'dependencies': self.dependencies.to_serialized(),
+            'calls': self.calls.to_serialized(),
+            'called_by': self.called_by.to_serialized(),
+        }
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('entity index out of range')
+        return self._materialize(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._materialize(i)
+
+    def _materialize(self, index: int) -> CodeEntity:
+        return CodeEntity(
+            name=self.names[index],
+            type=self.types[index],
+            line_start=self.line_starts[index],
+            line_end=self.line_ends[index],
+            dependencies=set(self.dependencies.get(index)),
+            importance_score=self.importance_scores[index],
+            calls=self.calls.get(index),
+            called_by=self.called_by.get(index),
+            docstring=self.docstrings[index] if self.docstrings else None,
+        )
+
+
+def compact_semantic_data(semantic_data: Optional[Dict]) -> Optional[Dict]:
+    """Semantic data with entities in an EntityTable and names interned
+
+    Accepts CodeAnalyzer output as well as serialized semantic data, where
+    entities are either columns (see EntityTable.to_columns) or, in caches
+    written before compaction, a list of dicts.
+    """
+    if not semantic_data:
+        return semantic_data
+
+    compacted = dict(semantic_data)
+    entities = semantic_data.get('entities')
+    if isinstance(entities, dict):
+        compacted['entities'] = EntityTable.from_columns(entities)
+    elif isinstance(entities, list):
+        compacted['entities'] = EntityTable.from_entities(entities)
+
+    if isinstance(semantic_data.get('imports'), list):
+        compacted['imports'] = [intern(name) for name in semantic_data['imports']]
+    if 'language' in semantic_data:
+        compacted['language'] = intern(semantic_data['language'])
+    return compacted
+
+
+def json_default(value):
+    """`default` hook for json.dump of structures holding EntityTables"""
+    if isinstance(value, EntityTable):
+        return value.to_columns()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def serialize_semantic_data(semantic_data: Optional[Dict]) -> Optional[Dict]:
+    """JSON-serializable form of (compacted) semantic data"""
+    if not semantic_data:
+        return None
+
+    entities = semantic_data.get('entities')
+    if isinstance(entities, EntityTable):
+        return {**semantic_data, 'entities': entities.to_columns()}
+    if isinstance(entities, list):
+        return {**semantic_data, 'entities': EntityTable.from_entities(entities).to_columns()}
+    return dict(semantic_data)
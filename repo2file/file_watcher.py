@@ -0,0 +1,206 @@
+"""
+File change notification for watch mode
+
+On Linux the working tree is watched with inotify (through libc, so there
+is nothing to install): one watch per directory, added as directories
+appear. Elsewhere, or when inotify cannot be initialized, the tree is
+polled by stat. Either way wait() returns the repository-relative paths
+touched since the last call, once no further event has arrived for the
+debounce interval, so an editor's save (write to a temporary file, then
+rename) or a `git checkout` arrives as one batch.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    INOTIFY_AVAILABLE = sys.platform.startswith('linux')
+except (OSError, AttributeError):
+    INOTIFY_AVAILABLE = False
+
+# Version control internals change on every git command
+IGNORED_DIRECTORIES = {'.git', '.hg', '.svn'}
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+DEBOUNCE_SECONDS = 0.2
+POLL_INTERVAL = 0.5
+
+
+class FileWatcher:
+    """Base of the watchers; subclasses implement _poll"""
+
+    def __init__(self, root: Path, is_excluded: Callable[[str], bool]):
+        self.root = Path(root)
+        self.is_excluded = is_excluded
+
+    def wait(self, debounce: float = DEBOUNCE_SECONDS, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        """Relative paths touched, after debounce seconds without further events
+
+        Returns an empty set on timeout, and None when events were lost
+        (queue overflow) and the whole tree should be treated as touched.
+        """
+        touched = self._poll(timeout)
+        if not touched:
+            return touched
+        while True:
+            more = self._poll(debounce)
+            if more is None:
+                return None
+            if not more:
+                return touched
+            touched |= more
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> 'FileWatcher':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        raise NotImplementedError
+
+    def _walk(self, rel_dir: str = ''):
+        """(relative directory, file names) of rel_dir and every directory below it not excluded"""
+        for root, dirs, files in os.walk(self.root / rel_dir):
+            rel_root = os.path.relpath(root, self.root)
+            rel_root = '' if rel_root == '.' else rel_root
+            dirs[:] = [d for d in dirs if d not in IGNORED_DIRECTORIES
+                       and not self.is_excluded(os.path.join(rel_root, d))]
+            yield rel_root, [name for name in files if not self.is_excluded(os.path.join(rel_root, name))]
+
+
+class InotifyWatcher(FileWatcher):
+    """Watches every directory of the tree with one inotify descriptor"""
+
+    def __init__(self, root: Path, is_excluded: Callable[[str], bool]):
+        super().__init__(root, is_excluded)
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        self._directories: Dict[int, str] = {}
+        self._add_tree('')
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_tree(self, rel_dir: str) -> Set[str]:
+        """Watch rel_dir and the directories below it; returns the files found there"""
+        found = set()
+        for rel_root, names in self._walk(rel_dir):
+            wd = _libc.inotify_add_watch(self._fd, os.fsencode(self.root / rel_root), WATCH_MASK)
+            if wd < 0:
+                # Removed meanwhile, or out of watches (fs.inotify.max_user_watches)
+                if ctypes.get_errno() == errno.ENOSPC:
+                    raise OSError(errno.ENOSPC, "Out of inotify watches; raise fs.inotify.max_user_watches")
+                continue
+            self._directories[wd] = rel_root
+            found.update(os.path.join(rel_root, name) for name in names)
+        return found
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        touched = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return touched
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_IGNORED:
+                    self._directories.pop(wd, None)
+                    continue
+                rel_dir = self._directories.get(wd)
+                if rel_dir is None or not name:
+                    continue
+                rel_path = os.path.join(rel_dir, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if os.path.basename(rel_path) in IGNORED_DIRECTORIES or self.is_excluded(rel_path):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files may land in a new directory before its watch exists
+                        touched |= self._add_tree(rel_path)
+                    elif mask & IN_MOVED_FROM:
+                        touched.add(rel_path)
+                elif not self.is_excluded(rel_path):
+                    touched.add(rel_path)
+
+
+class PollingWatcher(FileWatcher):
+    """Compares stat snapshots of the tree every POLL_INTERVAL seconds"""
+
+    def __init__(self, root: Path, is_excluded: Callable[[str], bool], interval: float = POLL_INTERVAL):
+        super().__init__(root, is_excluded)
+        self.interval = interval
+        self._stats = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        for rel_root, names in self._walk():
+            for name in names:
+                rel_path = os.path.join(rel_root, name)
+                try:
+                    stat = os.stat(self.root / rel_path)
+                except OSError:
+                    continue
+                stats[rel_path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _poll(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self._snapshot()
+            touched = {rel_path for rel_path in stats.keys() | self._stats.keys()
+                       if stats.get(rel_path) != self._stats.get(rel_path)}
+            self._stats = stats
+            if touched:
+                return touched
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else
+                       max(0.0, min(self.interval, deadline - time.monotonic())))
+
+
+def open_watcher(root: Path, is_excluded: Callable[[str], bool]) -> FileWatcher:
+    """An inotify watcher where available, else a polling one"""
+    if INOTIFY_AVAILABLE:
+        try:
+            return InotifyWatcher(root, is_excluded)
+        except OSError as e:
+            print(f"Could not watch with inotify ({e}); polling instead")
+    return PollingWatcher(root, is_excluded)
@@ -12,10 +12,19 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Written into the repository by every scan; never part of the scanned content
+CACHE_DIRECTORY = '.betterrepo2file_cache'
+
+
+def in_cache_directory(rel_path: str) -> bool:
+    """Whether a repository-relative path is inside the scanner's cache directory"""
+    return Path(rel_path).parts[:1] == (CACHE_DIRECTORY,)
+
+
 class IncrementalScanner:
     def __init__(self, repo_path: str):
         self.repo_path = Path(repo_path).resolve()
-        self.cache_dir = self.repo_path / '.betterrepo2file_cache'
+        self.cache_dir = self.repo_path / CACHE_DIRECTORY
         self.last_scan_file = self.cache_dir / 'last_scan_sha.txt'
         self.ast_cache_file = self.cache_dir / 'ast_cache.json'
         self.embeddings_cache_file = self.cache_dir / 'embeddings_cache.json'
@@ -175,7 +184,7 @@ class IncrementalScanner:
         # Skip common non-code files
         excluded_patterns = {
             '.git/', '__pycache__/', 'node_modules/', '.pytest_cache/',
-            '.next/', 'dist/', 'build/', 'coverage/', '.nyc_output/'
+            '.next/', 'dist/', 'build/', 'coverage/', '.nyc_output/', f'{CACHE_DIRECTORY}/'
         }
         
         for pattern in excluded_patterns:
@@ -238,6 +247,18 @@ class IncrementalScanner:
                 return lang
         return 'unknown'
     
+    def open_vector_index(self):
+        """The repository's similarity index, kept next to the embeddings cache file
+        
+        Returns None when numpy is not installed.
+        """
+        from .vector_index import NUMPY_AVAILABLE, VectorIndex
+        if not NUMPY_AVAILABLE:
+            logger.warning("numpy not available; similarity index disabled")
+            return None
+        self.ensure_cache_dir()
+        return VectorIndex(self.embeddings_cache_file)
+    
     def load_ast_cache(self) -> Dict:
         """Load cached ASTs from disk"""
         if self.ast_cache_file.exists():
@@ -0,0 +1,107 @@
+"""
+Stage timings and hot-path counters for repository processing
+
+The engine runs both as a CLI subprocess and inside Celery workers, so it
+does not depend on OpenTelemetry. It records into an Instrumentation object
+instead; the app exports the summary through its MetricsManager and can pass
+a span factory so stages also show up as trace spans.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Optional
+
+# Counters incremented on the hot path
+TOKENS_ENCODED = 'tokens_encoded'
+ENCODE_CALLS = 'encode_calls'
+BYTES_READ = 'bytes_read'
+FILES_SCANNED = 'files_scanned'
+FILES_PROCESSED = 'files_processed'
+FILE_CACHE_HITS = 'file_cache_hits'
+FILE_CACHE_MISSES = 'file_cache_misses'
+TOKEN_CACHE_HITS = 'token_cache_hits'
+TOKEN_CACHE_MISSES = 'token_cache_misses'
+DUPLICATES_REFERENCED = 'duplicates_referenced'
+
+
+class StageStats:
+    """Aggregated timings of one stage"""
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+class Instrumentation:
+    """Records stage durations and counters for one processing run
+
+    Thread-safe: the scanner pool records from its worker threads.
+    `span_factory(name, attributes)` must return a context manager; it is
+    entered around every stage.
+    """
+
+    def __init__(self, span_factory: Optional[Callable[[str, Dict[str, Any]], ContextManager]] = None):
+        self.span_factory = span_factory
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **attributes):
+        start = time.perf_counter()
+        try:
+            if self.span_factory is None:
+                yield
+            else:
+                with self.span_factory(f"repo2file.{name}", attributes):
+                    yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.stages.setdefault(name, StageStats()).add(duration)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stage_total(self, name: str) -> float:
+        stats = self.stages.get(name)
+        return stats.total if stats else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-serializable stage timings, counters and derived rates"""
+        with self._lock:
+            stages = {
+                name: {'count': stats.count, 'total_s': stats.total, 'max_s': stats.max}
+                for name, stats in self.stages.items()
+            }
+            counters = dict(self.counters)
+
+        rates = {}
+        scan_time = stages.get('scan', {}).get('total_s', 0)
+        if scan_time > 0:
+            rates['files_per_second'] = counters.get(FILES_SCANNED, 0) / scan_time
+        for cache, hits, misses in (('file_cache', FILE_CACHE_HITS, FILE_CACHE_MISSES),
+                                    ('token_cache', TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES)):
+            lookups = counters.get(hits, 0) + counters.get(misses, 0)
+            if lookups:
+                rates[f'{cache}_hit_rate'] = counters.get(hits, 0) / lookups
+
+        return {'stages': stages, 'counters': counters, 'rates': rates}
+
+    def format_summary(self) -> str:
+        """Human-readable stage breakdown, slowest first"""
+        summary = self.summary()
+        lines = ["Stage timings:"]
+        for name, stats in sorted(summary['stages'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f"  {name:<28} {stats['total_s']:8.2f}s  x{stats['count']:<6} max {stats['max_s']:.3f}s")
+        for name, value in sorted(summary['rates'].items()):
+            lines.append(f"  {name:<28} {value:8.2f}")
+        return '\n'.join(lines)
@@ -0,0 +1,116 @@
+"""
+Diff-scoped context for iteration briefs
+
+After a coding iteration only a handful of files have changed, so Section C
+needs the changes themselves rather than a fresh render of the repository.
+The diff since the session's last SHA is read with one `git diff`; changed
+files contribute their hunks, the files they import or are imported by
+(one hop in the symbol graph) contribute an outline from their cached
+semantic data, and every other file is left to the previous context. The
+work done is proportional to the change, not to the repository.
+"""
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+# Entity types listed in a neighbour's outline
+OUTLINE_TYPES = {'class', 'function', 'method', 'interface', 'type'}
+MAX_OUTLINE_ENTITIES = 12
+# Neighbours outlined, most connected to the change first
+MAX_NEIGHBOURS = 20
+
+
+@dataclass(slots=True)
+class FileChange:
+    rel_path: str  # Path after the change; the old path for deletions
+    status: str  # 'A', 'M', 'D' or 'R'
+    old_path: Optional[str] = None  # Before a rename
+    hunks: List[List[str]] = field(default_factory=list)  # Lines of each hunk, @@ header first
+    additions: int = 0
+    deletions: int = 0
+    binary: bool = False
+
+    @property
+    def diff(self) -> str:
+        return '\n'.join(line for hunk in self.hunks for line in hunk)
+
+
+def diff_changes(repo_path: Path, base_sha: str, head_sha: Optional[str] = None,
+                 context_lines: int = 3) -> List[FileChange]:
+    """Changes from base_sha to head_sha, or to the working tree
+
+    Raises subprocess.CalledProcessError when git cannot diff the range.
+    """
+    command = ['git', '-c', 'core.quotepath=off', 'diff', '--no-color', '--no-ext-diff',
+               '--find-renames', f'-U{context_lines}', base_sha]
+    if head_sha:
+        command.append(head_sha)
+    result = subprocess.run(command, cwd=repo_path, capture_output=True, text=True,
+                            errors='replace', check=True)
+    return parse_unified_diff(result.stdout)
+
+
+def parse_unified_diff(text: str) -> List[FileChange]:
+    """Files, statuses and hunks of `git diff` output"""
+    changes = []
+    change = None
+    hunk = None
+    for line in text.splitlines():
+        if line.startswith('diff --git '):
+            change = FileChange(_header_path(line[len('diff --git '):]), 'M')
+            changes.append(change)
+            hunk = None
+        elif change is None:
+            continue
+        elif hunk is not None and line[:1] in (' ', '+', '-', '\\'):
+            hunk.append(line)
+            if line.startswith('+'):
+                change.additions += 1
+            elif line.startswith('-'):
+                change.deletions += 1
+        elif line.startswith('@@'):
+            hunk = [line]
+            change.hunks.append(hunk)
+        elif line.startswith('new file mode'):
+            change.status = 'A'
+        elif line.startswith('deleted file mode'):
+            change.status = 'D'
+        elif line.startswith('rename from '):
+            change.status = 'R'
+            change.old_path = line[len('rename from '):]
+        elif line.startswith('rename to '):
+            change.rel_path = line[len('rename to '):]
+        elif line.startswith('+++ ') and line != '+++ /dev/null':
+            change.rel_path = line[len('+++ b/'):]
+        elif line.startswith('--- ') and change.status == 'D' and line != '--- /dev/null':
+            change.rel_path = line[len('--- a/'):]
+        elif line.startswith('Binary files '):
+            change.binary = True
+    return changes
+
+
+def _header_path(paths: str) -> str:
+    """The path of a 'diff --git a/path b/path' header
+
+    Headers are ambiguous when paths contain ' b/'; the ---/+++ lines that
+    follow correct the path for all but binary files and pure renames,
+    which carry their own rename lines.
+    """
+    half = (len(paths) - len('a/ b/')) // 2
+    if paths[2 + half:] == f' b/{paths[2:2 + half]}':
+        return paths[2:2 + half]
+    return paths.split(' b/', 1)[-1]
+
+
+def outline(entities: Optional[Iterable]) -> List[str]:
+    """One line per definition, for files shown without their content"""
+    lines = []
+    definitions = sorted((entity for entity in entities or () if entity.type in OUTLINE_TYPES),
+                         key=lambda entity: entity.line_start)
+    for entity in definitions:
+        if len(lines) == MAX_OUTLINE_ENTITIES:
+            lines.append('  - ...')
+            break
+        lines.append(f"  - {entity.type} {entity.name} (line {entity.line_start})")
+    return lines
@@ -0,0 +1,147 @@
+"""
+Head/tail sampling of large text files
+
+Truncating a large file only keeps its first and last lines, yet reading it
+with read_text() and splitlines() decodes and splits every byte. MappedLines
+memory-maps the file instead: line boundaries are located from either end
+with find/rfind, and only the regions that end up in the output are decoded.
+Counting lines and locating TODO markers still touch every page, but as
+byte scans in C rather than through decoded strings.
+"""
+import mmap
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Files below this size are cheaper to read whole
+LARGE_FILE_BYTES = 256 * 1024
+
+# Separators str.splitlines() honours besides \n and \r\n (bare \r is checked
+# separately). Files containing any of them would be split differently than
+# by newline, so they are not sampled.
+IRREGULAR_SEPARATORS = (b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\xc2\x85',
+                        b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+COUNT_CHUNK_BYTES = 1 << 20
+
+
+class MappedLines:
+    """Lazily split, read-only view of a file's lines
+
+    Lines are those of `path.read_text(errors='ignore').splitlines()` for
+    files whose lines end in \\n or \\r\\n; check `regular` before sampling.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.bytes_decoded = 0
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._line_count: Optional[int] = None
+
+    def __enter__(self) -> 'MappedLines':
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._map = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self._map) if self._map is not None else 0
+
+    @property
+    def regular(self) -> bool:
+        """Whether every line ends in \\n or \\r\\n (or the file is empty)"""
+        if self._map is None:
+            return True
+        if any(self._map.find(separator) != -1 for separator in IRREGULAR_SEPARATORS):
+            return False
+        if self._map.find(b'\r') == -1:
+            return True
+        return self._count(b'\r') == self._count(b'\r\n')
+
+    def line_count(self) -> int:
+        if self._line_count is None:
+            size = len(self)
+            count = self._count(b'\n')
+            # A final line without a newline still counts
+            if size and self._map[size - 1] != ord('\n'):
+                count += 1
+            self._line_count = count
+        return self._line_count
+
+    def head(self, count: int) -> List[str]:
+        """The first `count` lines"""
+        if count <= 0 or self._map is None:
+            return []
+        end = 0
+        for _ in range(count):
+            newline = self._map.find(b'\n', end)
+            if newline == -1:
+                end = len(self)
+                break
+            end = newline + 1
+        return self._decode(0, end)
+
+    def tail(self, count: int) -> List[str]:
+        """The last `count` lines"""
+        if count <= 0 or self._map is None:
+            return []
+        size = len(self)
+        # A trailing newline terminates the last line rather than starting one
+        start = size - 1 if self._map[size - 1] == ord('\n') else size
+        for _ in range(count):
+            start = self._map.rfind(b'\n', 0, start)
+            if start == -1:
+                break
+        return self._decode(start + 1, size)
+
+    def lines_containing(self, words: Iterable[bytes]) -> Iterator[Tuple[int, str]]:
+        """(1-based line number, line) of lines containing any of the
+        lowercase ASCII `words`, ignoring case"""
+        if self._map is None:
+            return
+        size = len(self)
+        line_number, start = 1, 0
+        while start < size:
+            # Chunks end on a line boundary so lines are never split
+            end = self._map.find(b'\n', min(start + COUNT_CHUNK_BYTES, size) - 1)
+            end = size if end == -1 else end + 1
+            chunk = self._map[start:end]
+            lowered = chunk.lower()
+
+            line_starts = set()
+            for word in words:
+                position = lowered.find(word)
+                while position != -1:
+                    line_starts.add(lowered.rfind(b'\n', 0, position) + 1)
+                    position = lowered.find(word, position + len(word))
+
+            counted_to = 0
+            for line_start in sorted(line_starts):
+                line_number += chunk.count(b'\n', counted_to, line_start)
+                counted_to = line_start
+                line_end = chunk.find(b'\n', line_start)
+                if line_end == -1:
+                    line_end = len(chunk)
+                yield line_number, ''.join(self._decode(start + line_start, start + line_end))
+
+            line_number += chunk.count(b'\n', counted_to)
+            start = end
+
+    def _count(self, sub: bytes) -> int:
+        """Occurrences of `sub` in the file, scanned in chunks"""
+        count = 0
+        for start in range(0, len(self), COUNT_CHUNK_BYTES):
+            # Extend each chunk so matches starting at its end are counted once
+            count += self._map[start:start + COUNT_CHUNK_BYTES + len(sub) - 1].count(sub)
+        return count
+
+    def _decode(self, start: int, end: int) -> List[str]:
+        self.bytes_decoded += end - start
+        return self._map[start:end].decode('utf-8', errors='ignore').splitlines()
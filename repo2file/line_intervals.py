@@ -0,0 +1,84 @@
+"""
+Line interval selection for truncation strategies
+
+Semantic and business-logic truncation keep a file's most important
+entities, each with a few lines of context, until the token budget is
+spent. Entity ranges overlap (methods sit inside classes, context runs into
+neighbours), so what an entity adds is only the part not selected yet.
+LineSelection keeps the selection as sorted, disjoint line intervals and
+prices lines from per-line token counts summed once into a prefix array:
+pricing or adding an entity is a bisect plus a walk over the intervals it
+overlaps, and no text is joined or re-encoded until the result is rendered.
+"""
+import bisect
+from itertools import accumulate
+from typing import List, Sequence, Tuple
+
+
+class LineSelection:
+    """Selected lines of a file as sorted, disjoint [start, end) intervals
+
+    Line numbers are 0-based; ranges outside the file are clipped to it.
+    """
+
+    def __init__(self, line_tokens: Sequence[int]):
+        self.line_count = len(line_tokens)
+        self.tokens = 0
+        # _prefix[i] is the token cost of lines [0, i)
+        self._prefix = [0, *accumulate(line_tokens)]
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def cost(self, start: int, end: int) -> int:
+        """Token cost of lines [start, end), selected or not"""
+        start, end = self._clip(start, end)
+        return self._prefix[end] - self._prefix[start] if start < end else 0
+
+    def new_tokens(self, start: int, end: int) -> int:
+        """Tokens that selecting lines [start, end) would add"""
+        start, end = self._clip(start, end)
+        if start >= end:
+            return 0
+        first, last = self._touching(start, end)
+        covered = sum(self.cost(max(start, self._starts[i]), min(end, self._ends[i]))
+                      for i in range(first, last))
+        return self.cost(start, end) - covered
+
+    def add(self, start: int, end: int) -> int:
+        """Select lines [start, end) and return the tokens they added"""
+        added = self.new_tokens(start, end)
+        start, end = self._clip(start, end)
+        if start >= end:
+            return 0
+        # Merge with every interval it overlaps or adjoins
+        first, last = self._touching(start, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+        self.tokens += added
+        return added
+
+    def intervals(self) -> List[Tuple[int, int]]:
+        return list(zip(self._starts, self._ends))
+
+    def render(self, lines: Sequence[str]) -> str:
+        """The selected lines, with each run of omitted lines marked"""
+        result = []
+        previous_end = 0
+        for start, end in zip(self._starts, self._ends):
+            if start > previous_end:
+                result.append(f"\n... [Lines {previous_end}-{start - 1} omitted] ...\n")
+            result.extend(lines[start:end])
+            previous_end = end
+        if previous_end < self.line_count:
+            result.append(f"\n... [Lines {previous_end}-{self.line_count - 1} omitted] ...\n")
+        return '\n'.join(result)
+
+    def _clip(self, start: int, end: int) -> Tuple[int, int]:
+        return max(0, start), min(self.line_count, end)
+
+    def _touching(self, start: int, end: int) -> Tuple[int, int]:
+        """Index range of the intervals overlapping or adjoining [start, end)"""
+        return bisect.bisect_left(self._ends, start), bisect.bisect_right(self._starts, end)
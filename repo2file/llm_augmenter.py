@@ -117,7 +117,8 @@ class LLMAugmenter:
     def __init__(self, 
                  provider: str = "gemini",
                  api_key_env_var: Optional[str] = None,
-                 enable_cache: bool = True):
+                 enable_cache: bool = True,
+                 cancel_token=None):
         """
         Initialize the LLM augmenter
         
@@ -125,9 +126,11 @@ class LLMAugmenter:
             provider: LLM provider name ("gemini", "openai")
             api_key_env_var: Environment variable name for API key
             enable_cache: Whether to cache responses
+            cancel_token: Optional CancellationToken checked before each API call
         """
         self.provider_name = provider
         self.enable_cache = enable_cache
+        self.cancel_token = cancel_token
         self.token_usage = {
             'input_tokens': 0,
             'output_tokens': 0,
@@ -166,6 +169,9 @@ class LLMAugmenter:
         if not self.provider.is_available():
             return ""
         
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        
         if self.enable_cache:
             response = self._cached_generate(prompt, max_tokens, temperature)
         else:
@@ -0,0 +1,110 @@
+"""
+Near-duplicate detection for scanned files
+
+Vendored copies, generated clients and copy-pasted modules are often almost,
+but not exactly, identical, so the exact content hash misses them. Every
+text file gets a one-permutation MinHash signature of its line shingles
+(pairs of consecutive non-trivial lines, whitespace-stripped) during the
+scan. Signatures are split into LSH bands; files sharing a band are
+candidates, and a candidate whose estimated Jaccard similarity reaches the
+threshold is a near duplicate of the earlier file.
+
+Signatures are NUM_BINS 32-bit values packed into bytes, so they are cheap
+to keep on every FileInfo and to store in the scan cache.
+"""
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+NUM_BINS = 64
+BANDS = 8
+ROWS_PER_BAND = NUM_BINS // BANDS
+BIN_BITS = 6  # log2(NUM_BINS)
+EMPTY = 0xFFFFFFFF  # Bin no shingle hashed into
+BAND_BYTES = ROWS_PER_BAND * 4
+EMPTY_BAND = b'\xff' * BAND_BYTES
+
+DEFAULT_THRESHOLD = 0.8
+# Smaller files are cheaper to emit than to reference
+MIN_BYTES = 512
+# Lines this short ("}", "end", "])") carry no signal
+MIN_LINE_CHARS = 3
+
+
+def minhash_signature(content: str) -> Optional[bytes]:
+    """MinHash signature of content's line shingles, None if it has too few lines"""
+    minimums = [EMPTY] * NUM_BINS
+    previous = None
+    shingles = 0
+    for line in content.splitlines():
+        line = line.strip()
+        if len(line) < MIN_LINE_CHARS:
+            continue
+        encoded = line.encode('utf-8', errors='ignore')
+        if previous is not None:
+            # crc32 of the two lines concatenated, then scrambled so bins and values are independent
+            shingle = (zlib.crc32(encoded, previous) * 0x9E3779B1) & 0xFFFFFFFF
+            bin_index = shingle & (NUM_BINS - 1)
+            value = shingle >> BIN_BITS
+            if value < minimums[bin_index]:
+                minimums[bin_index] = value
+            shingles += 1
+        previous = zlib.crc32(encoded)
+    if shingles < ROWS_PER_BAND:
+        return None
+    return array('I', minimums).tobytes()
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    a, b = array('I'), array('I')
+    a.frombytes(first)
+    b.frombytes(second)
+    matches = filled = 0
+    for x, y in zip(a, b):
+        if x == EMPTY and y == EMPTY:
+            continue
+        filled += 1
+        if x == y:
+            matches += 1
+    return matches / filled if filled else 0.0
+
+
+class NearDuplicateIndex:
+    """LSH buckets of representative signatures
+
+    Files are added in output order; each one either matches an earlier
+    representative or becomes a representative itself, so a cluster is
+    always anchored on the file emitted first.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._buckets: Dict[bytes, List[str]] = {}
+        self._signatures: Dict[str, bytes] = {}
+
+    def add(self, key: str, signature: bytes) -> Optional[Tuple[str, float]]:
+        """(representative, similarity) for a near duplicate; otherwise key becomes a representative"""
+        bands = []
+        for band in range(BANDS):
+            chunk = signature[band * BAND_BYTES:(band + 1) * BAND_BYTES]
+            if chunk != EMPTY_BAND:
+                bands.append(bytes([band]) + chunk)
+
+        best = None
+        seen = set()
+        for band_key in bands:
+            for candidate in self._buckets.get(band_key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                score = similarity(signature, self._signatures[candidate])
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (candidate, score)
+        if best is not None:
+            return best
+
+        self._signatures[key] = signature
+        for band_key in bands:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
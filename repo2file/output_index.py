@@ -0,0 +1,184 @@
+"""
+Byte-offset index of a rendered output
+
+Outputs run to many megabytes, while their consumers (iteration briefs, the
+web app's result view) want a few pieces: one file's block, the manifest,
+the token stats. Every run writes `<output>.index.json` next to the output
+with the byte range of each named section and file block, plus the run's
+stats and skipped files. OutputIndex seeks to a range and decodes only
+that, instead of reading and regex-scanning the whole text, and patch()
+swaps changed file blocks in without re-rendering the rest (watch mode).
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.index.json'
+FILE_START = '[[FILE_START: '
+FILE_END = '[[FILE_END: '
+
+
+def index_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + INDEX_SUFFIX)
+
+
+def block_path(part: str) -> Optional[str]:
+    """The path of a file block (a part starting with a FILE_START marker), else None"""
+    marker = part.find(FILE_START, 0, len(FILE_START) + 1)  # After a leading newline
+    if marker == -1:
+        return None
+    return part[marker + len(FILE_START):part.index(']]', marker)]
+
+
+def write_output(output_path: Path, parts: List[str], sections: Dict[str, Tuple[int, int, int]],
+                 metadata: Dict[str, Any]) -> Dict:
+    """Write parts joined by newlines, then the index of their byte ranges
+
+    sections maps a name to a (part, start, end) span of characters within
+    one part. File blocks are the parts that start with a FILE_START marker.
+    """
+    part_sections: Dict[int, List[Tuple[str, int, int]]] = {}
+    for name, (part_index, start, end) in sections.items():
+        part_sections.setdefault(part_index, []).append((name, start, end))
+
+    byte_ranges = {}
+    files = {}
+    offset = 0
+    with open(output_path, 'wb') as f:
+        for part_index, part in enumerate(parts):
+            if part_index:
+                f.write(b'\n')
+                offset += 1
+            data = part.encode('utf-8')
+            f.write(data)
+            for name, start, end in part_sections.get(part_index, ()):
+                start_byte = offset + len(part[:start].encode('utf-8'))
+                byte_ranges[name] = [start_byte, start_byte + len(part[start:end].encode('utf-8'))]
+            rel_path = block_path(part)
+            if rel_path is not None:
+                files[rel_path] = [offset + part.index(FILE_START), offset + len(data)]
+            offset += len(data)
+
+    stat = output_path.stat()
+    index = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sections': byte_ranges,
+        'files': files,
+        **metadata,
+    }
+    with open(index_path(output_path), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+class OutputIndex:
+    """Random access to the sections and file blocks of an indexed output"""
+
+    def __init__(self, output_path: Path, data: Dict):
+        self.output_path = Path(output_path)
+        self.data = data
+
+    @classmethod
+    def load(cls, output_path: Path) -> Optional['OutputIndex']:
+        """The output's index, or None if it has none or was modified since"""
+        output_path = Path(output_path)
+        try:
+            with open(index_path(output_path), 'r') as f:
+                data = json.load(f)
+            stat = output_path.stat()
+        except (OSError, ValueError):
+            return None
+        if (data.get('version') != INDEX_VERSION or data.get('size') != stat.st_size
+                or data.get('mtime_ns') != stat.st_mtime_ns):
+            return None
+        return cls(output_path, data)
+
+    @property
+    def files(self) -> List[str]:
+        """Paths of the file blocks, in output order"""
+        return list(self.data['files'])
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """A metadata value recorded with the index, such as 'stats'"""
+        return self.data.get(key, default)
+
+    def section(self, name: str) -> Optional[str]:
+        byte_range = self.data['sections'].get(name)
+        return self._read(*byte_range) if byte_range else None
+
+    def file_block(self, rel_path: str) -> Optional[str]:
+        """A file's block, from its FILE_START marker to its FILE_END marker"""
+        byte_range = self.data['files'].get(rel_path)
+        return self._read(*byte_range) if byte_range else None
+
+    def file_content(self, rel_path: str) -> Optional[str]:
+        """A file's block without its markers"""
+        block = self.file_block(rel_path)
+        if block is None:
+            return None
+        end = block.rfind(FILE_END)
+        return block[block.index(']]') + 2:end if end != -1 else len(block)].strip()
+
+    def patch(self, blocks: Dict[str, Optional[str]], sections: Dict[str, str],
+              metadata: Dict[str, Any]) -> 'OutputIndex':
+        """Rewrite the output with some file blocks and sections replaced, and reindex it
+
+        A block of None is removed along with the newlines before it. Other
+        bytes are copied from the old output unchanged. Replaced sections
+        must not contain other indexed ranges (the manifest, not the header).
+        """
+        edits = []  # (start, end, replacement, kind, name)
+        with open(self.output_path, 'rb') as src:
+            for rel_path, block in blocks.items():
+                start, end = self.data['files'][rel_path]
+                if block is None:
+                    src.seek(max(start - 2, 0))
+                    before = src.read(start - max(start - 2, 0))
+                    start -= len(before) - len(before.rstrip(b'\n'))
+                    edits.append((start, end, b'', 'files', rel_path))
+                else:
+                    data = block[block.index(FILE_START):].encode('utf-8')
+                    edits.append((start, end, data, 'files', rel_path))
+            for name, text in sections.items():
+                start, end = self.data['sections'][name]
+                edits.append((start, end, text.encode('utf-8'), 'sections', name))
+            edits.sort()
+
+            temp_path = self.output_path.with_name(self.output_path.name + '.tmp')
+            with open(temp_path, 'wb') as dst:
+                position = 0
+                for start, end, data, _, _ in edits:
+                    src.seek(position)
+                    dst.write(src.read(start - position))
+                    dst.write(data)
+                    position = end
+                src.seek(position)
+                while chunk := src.read(1 << 20):
+                    dst.write(chunk)
+
+        def shifted(offset: int) -> int:
+            return offset + sum(len(data) - (end - start) for start, end, data, _, _ in edits if end <= offset)
+
+        index = {kind: {name: [shifted(start), shifted(end)] for name, (start, end) in self.data[kind].items()}
+                 for kind in ('files', 'sections')}
+        for start, end, data, kind, name in edits:
+            if kind == 'files' and blocks[name] is None:
+                del index[kind][name]
+            else:
+                index[kind][name] = [shifted(start), shifted(start) + len(data)]
+
+        os.replace(temp_path, self.output_path)
+        stat = self.output_path.stat()
+        data = {**self.data, **metadata, **index, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        with open(index_path(self.output_path), 'w') as f:
+            json.dump(data, f)
+        return OutputIndex(self.output_path, data)
+
+    def _read(self, start: int, end: int) -> str:
+        with open(self.output_path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start).decode('utf-8', errors='replace')
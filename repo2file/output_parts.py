@@ -0,0 +1,112 @@
+"""
+Token-bounded output parts
+
+A repository that doesn't fit a 128k window can still be fed in batches.
+With ProcessingProfile.output_parts = N the run selects up to N times the
+token budget and splits the file blocks into N parts of at most token_budget
+tokens each. Files that import or call each other are kept in the same part
+where they fit: blocks are merged into clusters along the import graph,
+strongest edges first, then along directories, as long as a cluster fits a
+part, and clusters are placed into parts in rank order. Every part carries
+an index of which files are in which part; the first part also carries the
+header, manifest, tree and footer.
+"""
+import posixpath
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Link between files in the same directory, weaker than any import or call edge
+SIBLING_WEIGHT = 0.1
+
+
+def part_path(output_path: Path, number: int) -> Path:
+    """output.txt -> output_part1.txt"""
+    return output_path.parent / f"{output_path.stem}_part{number}{output_path.suffix}"
+
+
+def plan_parts(blocks: List[Tuple[str, int]], capacities: List[int],
+               edges: Dict[str, Dict[str, float]]) -> Tuple[List[List[str]], List[str]]:
+    """Assign (path, tokens) blocks, best ranked first, to parts of the given capacities
+
+    edges maps a path to the paths it imports or calls into, with weights.
+    Returns the paths of each part, in rank order, and the paths that fit
+    in no part.
+    """
+    rank = {rel_path: i for i, (rel_path, _) in enumerate(blocks)}
+    tokens = dict(blocks)
+    largest = max(capacities, default=0)
+
+    links = []
+    for rel_path, _ in blocks:
+        for target, weight in edges.get(rel_path, {}).items():
+            if target in rank and target != rel_path:
+                links.append((weight, rel_path, target))
+    last_in_directory = {}
+    for rel_path, _ in blocks:
+        directory = posixpath.dirname(rel_path)
+        if directory in last_in_directory:
+            links.append((SIBLING_WEIGHT, last_in_directory[directory], rel_path))
+        last_in_directory[directory] = rel_path
+    links.sort(key=lambda link: (-link[0], rank[link[1]], rank[link[2]]))
+
+    # Union-find over blocks; a merge must still fit the largest part
+    parent = {rel_path: rel_path for rel_path in rank}
+    cluster_tokens = dict(tokens)
+
+    def root(rel_path: str) -> str:
+        while parent[rel_path] != rel_path:
+            parent[rel_path] = parent[parent[rel_path]]
+            rel_path = parent[rel_path]
+        return rel_path
+
+    for _, source, target in links:
+        a, b = root(source), root(target)
+        if a != b and cluster_tokens[a] + cluster_tokens[b] <= largest:
+            if rank[b] < rank[a]:
+                a, b = b, a
+            parent[b] = a
+            cluster_tokens[a] += cluster_tokens.pop(b)
+
+    clusters: Dict[str, List[str]] = {}
+    for rel_path, _ in blocks:
+        clusters.setdefault(root(rel_path), []).append(rel_path)
+
+    parts: List[List[str]] = [[] for _ in capacities]
+    free = list(capacities)
+
+    def place(group: List[str]) -> bool:
+        size = sum(tokens[rel_path] for rel_path in group)
+        for i, room in enumerate(free):
+            if size <= room:
+                parts[i].extend(group)
+                free[i] -= size
+                return True
+        return False
+
+    # Clusters in order of their best rank; one that fits no part whole is split up
+    unplaced = []
+    for members in clusters.values():
+        if not place(members):
+            unplaced.extend(rel_path for rel_path in members if not place([rel_path]))
+
+    for part in parts:
+        part.sort(key=rank.__getitem__)
+    return parts, sorted(unplaced, key=rank.__getitem__)
+
+
+def parts_index(parts: List[List[str]], tokens: Dict[str, int], number: int) -> str:
+    """The index part `number` opens with: which files each part holds, by directory"""
+    lines = [f"## Output Part {number} of {len(parts)}",
+             "Part 1 holds the project overview, directory tree and processing summary.", ""]
+    for part_number, part in enumerate(parts, start=1):
+        current = " (this part)" if part_number == number else ""
+        lines.append(f"Part {part_number}{current}: {len(part)} files, "
+                     f"{sum(tokens[rel_path] for rel_path in part):,} tokens")
+        by_directory: Dict[str, List[str]] = {}
+        for rel_path in sorted(part):
+            directory, name = posixpath.split(rel_path)
+            by_directory.setdefault(directory, []).append(name)
+        for directory, names in by_directory.items():
+            lines.append(f"  - {directory or '.'}/: {', '.join(names)}")
+    lines.append("")
+    return '\n'.join(lines)
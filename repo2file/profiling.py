@@ -0,0 +1,229 @@
+"""
+On-demand CPU and memory profiling of processing stages
+
+StageProfiler is an Instrumentation that additionally samples the Python
+stacks of all threads (the scanner works in a thread pool, which a
+deterministic profiler attached to the main thread would not see) and takes
+tracemalloc snapshots around each top-level stage. Samples are attributed to
+the innermost stage running at the time.
+
+write() produces:
+    profile.json       per-stage top functions and allocation sites
+    profile.collapsed  folded stacks ("stage;outer;...;inner count") for
+                       flamegraph.pl or speedscope
+"""
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .instrumentation import Instrumentation
+
+NO_STAGE = '(no stage)'
+# Innermost frames in these modules mean the thread is blocked, not working
+IDLE_MODULES = ('threading.py', 'queue.py', 'selectors.py')
+# Allocation sites that belong to the profiler or the import system
+IGNORED_ALLOCATION_FILES = {tracemalloc.__file__, '<frozen importlib._bootstrap>', '<unknown>'}
+# Thread pool workers wait for work inside a C call, so their innermost
+# Python frame is the worker loop itself
+IDLE_FUNCTIONS = {(os.path.join('concurrent', 'futures', 'thread.py'), '_worker')}
+
+FunctionKey = Tuple[str, str, int]  # (name, filename, first line)
+
+
+class StageProfiler(Instrumentation):
+    """Instrumentation that also profiles CPU time and allocations per stage"""
+
+    def __init__(self, span_factory=None, interval: float = 0.005, memory_top: int = 15,
+                 max_depth: int = 64):
+        super().__init__(span_factory)
+        self.interval = interval
+        self.memory_top = memory_top
+        self.max_depth = max_depth
+        self._stage_stack: List[str] = []
+        self._stacks: Dict[str, Counter] = {}
+        self._memory: Dict[str, Dict[str, Any]] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._bookkeeping = threading.Event()  # Set while snapshotting; not sampled
+        self._started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name='stage-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self) -> 'StageProfiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name: str, **attributes):
+        outermost = not self._stage_stack
+        self._stage_stack.append(name)
+        before = None
+        if outermost and tracemalloc.is_tracing():
+            self._bookkeeping.set()
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            self._bookkeeping.clear()
+        try:
+            with super().stage(name, **attributes):
+                yield
+        finally:
+            self._stage_stack.pop()
+            if before is not None:
+                self._bookkeeping.set()
+                try:
+                    self._record_memory(name, before)
+                finally:
+                    self._bookkeeping.clear()
+
+    def _record_memory(self, stage: str, before: tracemalloc.Snapshot):
+        peak = tracemalloc.get_traced_memory()[1]
+        diff = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+
+        entry = self._memory.setdefault(stage, {'peak_bytes': 0, 'sites': Counter(), 'counts': Counter()})
+        entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+        for stat in diff:
+            frame = stat.traceback[0]
+            if stat.size_diff <= 0 or frame.filename in IGNORED_ALLOCATION_FILES:
+                continue
+            location = f"{_short_path(frame.filename)}:{frame.lineno}"
+            entry['sites'][location] += stat.size_diff
+            entry['counts'][location] += stat.count_diff
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self._bookkeeping.is_set():
+                continue
+            stage = self._stage_stack[-1] if self._stage_stack else NO_STAGE
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self._stacks.setdefault(stage, Counter())[tuple(stack)] += 1
+
+    def profile_summary(self, top: int = 20) -> Dict[str, Any]:
+        """Top functions by cumulative and self time, per stage and overall"""
+        overall_cumulative, overall_self, overall_samples = Counter(), Counter(), 0
+        stages = {}
+        for stage, stacks in self._stacks.items():
+            cumulative, own = _function_counts(stacks)
+            samples = sum(stacks.values())
+            overall_cumulative.update(cumulative)
+            overall_self.update(own)
+            overall_samples += samples
+            stages[stage] = {
+                'samples': samples,
+                'seconds': samples * self.interval,
+                'top_cumulative': _top_functions(cumulative, own, samples, self.interval, top),
+            }
+
+        for stage, memory in self._memory.items():
+            entry = stages.setdefault(stage, {'samples': 0, 'seconds': 0.0, 'top_cumulative': []})
+            entry['memory'] = {
+                'peak_bytes': memory['peak_bytes'],
+                'top_allocations': [
+                    {'location': location, 'size_diff': size, 'count_diff': memory['counts'][location]}
+                    for location, size in memory['sites'].most_common(self.memory_top)
+                ],
+            }
+
+        return {
+            'interval': self.interval,
+            'samples': overall_samples,
+            'top_functions': _top_functions(overall_cumulative, overall_self, overall_samples,
+                                            self.interval, top),
+            'stages': stages,
+            'timings': self.summary(),
+        }
+
+    def write(self, directory: Path) -> Dict[str, Path]:
+        """Write the profile artifacts to a directory, returning them by name"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        summary_path = directory / 'profile.json'
+        with open(summary_path, 'w') as f:
+            json.dump(self.profile_summary(), f, indent=2)
+
+        collapsed_path = directory / 'profile.collapsed'
+        with open(collapsed_path, 'w') as f:
+            for stage, stacks in sorted(self._stacks.items()):
+                for stack, count in stacks.items():
+                    frames = ';'.join(_format_function(key) for key in stack)
+                    f.write(f"{stage};{frames} {count}\n")
+
+        return {'profile.json': summary_path, 'profile.collapsed': collapsed_path}
+
+
+def _is_idle(code) -> bool:
+    if os.path.basename(code.co_filename) in IDLE_MODULES:
+        return True
+    return any(code.co_name == name and code.co_filename.endswith(path) for path, name in IDLE_FUNCTIONS)
+
+
+def _function_counts(stacks: Counter) -> Tuple[Counter, Counter]:
+    cumulative, own = Counter(), Counter()
+    for stack, count in stacks.items():
+        if not stack:
+            continue
+        # Recursive functions count once per sample
+        for key in set(stack):
+            cumulative[key] += count
+        own[stack[-1]] += count
+    return cumulative, own
+
+
+def _top_functions(cumulative: Counter, own: Counter, samples: int, interval: float,
+                   top: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            'function': _format_function(key),
+            'cumulative_seconds': count * interval,
+            'cumulative_fraction': count / samples if samples else 0.0,
+            'self_seconds': own.get(key, 0) * interval,
+        }
+        for key, count in cumulative.most_common(top)
+    ]
+
+
+def _format_function(key: FunctionKey) -> str:
+    name, filename, line = key
+    return f"{name} ({_short_path(filename)}:{line})"
+
+
+def _short_path(filename: str) -> str:
+    """Strip the longest sys.path prefix so locations stay readable"""
+    best = ''
+    for entry in sys.path:
+        if entry and filename.startswith(entry.rstrip(os.sep) + os.sep) and len(entry) > len(best):
+            best = entry.rstrip(os.sep) + os.sep
+    return filename[len(best):]
@@ -0,0 +1,194 @@
+"""
+Persistent BM25 index over a repository's files
+
+Query relevance used to be computed per file during the scan by checking
+query words against the first 5000 characters and the entity names, and
+recomputed for every query. SearchIndex instead keeps the term frequencies
+of every file (path, identifiers, docstrings and full content) keyed by path
+and stat stamp, so a rescan only re-tokenizes changed files, and scores any
+query against the whole repository with BM25.
+"""
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+INDEX_VERSION = 1
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Occurrences in these fields count this many times over plain content
+PATH_WEIGHT = 3
+IDENTIFIER_WEIGHT = 2
+DOCSTRING_WEIGHT = 1
+
+WORD_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9]*')
+CAMEL_CASE_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'were', 'into', 'not',
+    'but', 'its', 'our', 'your', 'all', 'any', 'can', 'has', 'have', 'how', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'would', 'should', 'could', 'there', 'then',
+    'than', 'them', 'they', 'want', 'need', 'make', 'like', 'also', 'some', 'more', 'very',
+    'self', 'none', 'true', 'false', 'return', 'def', 'var', 'let', 'const', 'import',
+}
+
+# Tried in order; the first leaving a stem of MIN_STEM characters is removed
+SUFFIXES = ('ations', 'ation', 'ating', 'ated', 'ates', 'ate', 'ings', 'ing', 'ers', 'er',
+            'ies', 'ed', 'es', 's')
+MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    """Strip one common English suffix so related word forms match"""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            # queries -> query
+            return word[:-3] + 'y' if suffix == 'ies' else word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed words of text, with identifiers split on case and underscores"""
+    terms = []
+    for word in WORD_PATTERN.findall(text):
+        parts = CAMEL_CASE_PATTERN.findall(word) if not word.islower() else [word]
+        for part in parts:
+            part = part.lower()
+            if len(part) > 2 and part not in STOPWORDS:
+                terms.append(stem(part))
+    return terms
+
+
+class SearchIndex:
+    """Inverted index of a repository's files, scored with BM25
+
+    Documents are keyed by path relative to the repository, and carry the
+    stamp (size and mtime) they were indexed at. Thread-safe: the scanner
+    adds documents from its worker threads.
+    """
+
+    def __init__(self, index_file: Optional[Path] = None):
+        self.index_file = Path(index_file) if index_file else None
+        self._documents: Dict[str, Dict] = {}  # path -> {'stamp', 'length', 'terms'}
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {path: frequency}
+        self._total_length = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        if self.index_file:
+            self.load()
+
+    @staticmethod
+    def stamp(path: Path) -> str:
+        stat = path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, rel_path: str) -> bool:
+        return rel_path in self._documents
+
+    def is_current(self, rel_path: str, stamp: str) -> bool:
+        document = self._documents.get(rel_path)
+        return document is not None and document['stamp'] == stamp
+
+    def add(self, rel_path: str, stamp: str, content: str, semantic_data: Optional[Dict] = None):
+        """Index (or re-index) one file"""
+        terms = Counter(tokenize(content))
+        for term in tokenize(rel_path):
+            terms[term] += PATH_WEIGHT
+        for entity in (semantic_data or {}).get('entities') or ():
+            for term in tokenize(getattr(entity, 'name', None) or ''):
+                terms[term] += IDENTIFIER_WEIGHT
+            for term in tokenize(getattr(entity, 'docstring', None) or ''):
+                terms[term] += DOCSTRING_WEIGHT
+
+        with self._lock:
+            self._remove(rel_path)
+            self._insert(rel_path, {'stamp': stamp, 'length': sum(terms.values()), 'terms': dict(terms)})
+            self._dirty = True
+
+    def retain(self, rel_paths: Iterable[str]):
+        """Drop documents of files that are no longer in the repository"""
+        keep = set(rel_paths)
+        with self._lock:
+            for rel_path in [path for path in self._documents if path not in keep]:
+                self._remove(rel_path)
+                self._dirty = True
+
+    def score(self, query: str) -> Dict[str, float]:
+        """BM25 score of every document matching at least one query term"""
+        if not self._documents:
+            return {}
+        document_count = len(self._documents)
+        average_length = self._total_length / document_count or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for rel_path, frequency in postings.items():
+                length = self._documents[rel_path]['length']
+                norm = K1 * (1 - B + B * length / average_length)
+                scores[rel_path] = scores.get(rel_path, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+        return scores
+
+    def relevance(self, query: str) -> Dict[str, float]:
+        """Scores scaled to 0-1 relative to the best match"""
+        scores = self.score(query)
+        best = max(scores.values(), default=0.0)
+        if best <= 0:
+            return {}
+        return {rel_path: score / best for rel_path, score in scores.items()}
+
+    def top(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """The `limit` best matching paths with their relevance"""
+        ranked = sorted(self.relevance(query).items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        for rel_path, document in data.get('documents', {}).items():
+            self._insert(rel_path, document)
+
+    def save(self):
+        """Write the index if anything changed since it was loaded"""
+        if not self.index_file or not self._dirty:
+            return
+        with self._lock:
+            data = {'version': INDEX_VERSION, 'documents': self._documents}
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.index_file, 'w') as f:
+                json.dump(data, f)
+            self._dirty = False
+
+    def _insert(self, rel_path: str, document: Dict):
+        self._documents[rel_path] = document
+        self._total_length += document['length']
+        for term, frequency in document['terms'].items():
+            self._postings.setdefault(term, {})[rel_path] = frequency
+
+    def _remove(self, rel_path: str):
+        document = self._documents.pop(rel_path, None)
+        if document is None:
+            return
+        self._total_length -= document['length']
+        for term in document['terms']:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(rel_path, None)
+                if not postings:
+                    del self._postings[term]
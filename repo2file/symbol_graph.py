@@ -0,0 +1,460 @@
+"""
+Repository-wide symbol table and import graph
+
+CodeAnalyzer only sees one file at a time, and calculate_file_importance
+guesses a file's importance from its own contents. SymbolGraph keeps the
+imports, calls and top-level definitions of every code file, keyed by path
+and stat stamp, and resolves them across the repository into a weighted
+file graph:
+
+- an import edge to the file an import names, matched on the longest known
+  module path (Python and Java dotted names, JavaScript relative paths);
+- a call edge to the file defining a called name, when exactly one such file
+  is imported by the caller or in its directory (same package), and to an
+  imported module called through by name.
+
+Importance is the PageRank of that graph, computed with numpy when it is
+installed. Updates are incremental: only changed files, and files whose
+imports or calls mention a module or name that appeared or disappeared, are
+re-resolved.
+"""
+import json
+import math
+import posixpath
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+GRAPH_VERSION = 1
+
+IMPORT_WEIGHT = 1.0
+CALL_WEIGHT = 0.5  # Per distinct name called in the target file
+
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-9
+
+# Entity types that define a name other files can call
+DEFINITION_TYPES = {'class', 'function', 'interface', 'type'}
+PACKAGE_FILES = {'__init__', 'index'}
+# Path prefixes of JavaScript aliases for the source root
+ALIAS_PREFIXES = ('@/', '~/')
+# Call prefixes that never name another file
+SELF_NAMES = {'self', 'cls', 'this', 'super'}
+
+
+@lru_cache(maxsize=1 << 17)
+def module_keys(rel_path: str) -> Tuple[str, ...]:
+    """Dotted suffixes a file can be imported by, longest first
+
+    'src/shop/billing/__init__.py' -> ('src.shop.billing', 'shop.billing', 'billing')
+    """
+    parts = posixpath.splitext(rel_path.replace('\\', '/'))[0].split('/')
+    if len(parts) > 1 and parts[-1] in PACKAGE_FILES:
+        parts = parts[:-1]
+    return tuple('.'.join(parts[i:]) for i in range(len(parts)))
+
+
+def import_candidates(rel_path: str, name: str) -> Tuple[str, ...]:
+    """Module keys an import could refer to, longest first"""
+    if name.startswith('.') and '/' in name:
+        # JavaScript relative import
+        directory = posixpath.dirname(rel_path.replace('\\', '/'))
+        target = posixpath.normpath(posixpath.join(directory, name))
+        if target.startswith('..'):
+            return ()
+        return module_keys(target + '.js')[:1]
+    return _module_prefixes(name)
+
+
+@lru_cache(maxsize=1 << 17)
+def _module_prefixes(name: str) -> Tuple[str, ...]:
+    for prefix in ALIAS_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    parts = [part for part in name.replace('/', '.').split('.') if part]
+    # 'pkg.module.Symbol' may name a symbol in pkg.module
+    return tuple('.'.join(parts[:i]) for i in range(len(parts), 0, -1))
+
+
+def called_name(call: str) -> Tuple[Optional[str], bool]:
+    """Name a call resolves through, and whether it may be a defined name
+
+    helper() and Parser.parse() call the defined names helper and Parser;
+    models.load() can only call into an imported module, since lowercase
+    qualifiers are mostly local variables (config.get(), logger.info()).
+    """
+    head, dot, _ = call.partition('.')
+    if head in SELF_NAMES:
+        return None, False
+    return head, not dot or head[:1].isupper()
+
+
+def pagerank(size: int, sources, targets, weights, nodes=None) -> List[float]:
+    """PageRank of a weighted directed graph given as parallel edge sequences
+
+    nodes, if given, lists the node numbers in use; the others must have no
+    edges and get rank 0. Rank of dangling nodes is spread evenly.
+    """
+    if size == 0:
+        return []
+    if NUMPY_AVAILABLE:
+        return _pagerank_numpy(size, sources, targets, weights, nodes).tolist()
+
+    nodes = range(size) if nodes is None else nodes
+    teleport = 1.0 / len(nodes) if len(nodes) else 0.0
+    out_weight = [0.0] * size
+    for source, weight in zip(sources, weights):
+        out_weight[source] += weight
+    rank = [0.0] * size
+    for node in nodes:
+        rank[node] = teleport
+    for _ in range(MAX_ITERATIONS):
+        dangling = sum(rank[node] for node in nodes if out_weight[node] == 0)
+        new_rank = [0.0] * size
+        for node in nodes:
+            new_rank[node] = (1 - DAMPING) * teleport + DAMPING * dangling * teleport
+        for source, target, weight in zip(sources, targets, weights):
+            new_rank[target] += DAMPING * rank[source] * weight / out_weight[source]
+        delta = sum(abs(a - b) for a, b in zip(new_rank, rank))
+        rank = new_rank
+        if delta < TOLERANCE:
+            break
+    return rank
+
+
+def _pagerank_numpy(size: int, sources, targets, weights, nodes=None) -> 'np.ndarray':
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    teleport = np.zeros(size)
+    if nodes is None:
+        teleport[:] = 1.0 / size
+    elif len(nodes):
+        teleport[np.asarray(nodes, dtype=np.int64)] = 1.0 / len(nodes)
+    out_weight = np.bincount(sources, weights=weights, minlength=size)
+    transition = weights / out_weight[sources] if len(sources) else weights
+    dangling = (out_weight == 0) & (teleport > 0)
+    rank = teleport.copy()
+    for _ in range(MAX_ITERATIONS):
+        new_rank = np.bincount(targets, weights=rank[sources] * transition, minlength=size)
+        new_rank = DAMPING * (new_rank + rank[dangling].sum() * teleport) + (1 - DAMPING) * teleport
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < TOLERANCE:
+            break
+    return rank
+
+
+class SymbolGraph:
+    """Cross-file import and call graph of a repository's code files
+
+    Thread-safe for updates, like the search index.
+    """
+
+    def __init__(self, graph_file: Optional[Path] = None):
+        self.graph_file = Path(graph_file) if graph_file else None
+        # path -> {'stamp', 'defines', 'imports', 'calls', 'qualifiers', 'edges'}
+        self._files: Dict[str, Dict] = {}
+        self._modules: Dict[str, Set[str]] = {}  # module key -> paths
+        self._symbols: Dict[str, Set[str]] = {}  # defined name -> paths
+        self._pending: Set[str] = set()  # Paths whose edges need resolving
+        self._changed_keys: Set[str] = set()  # Module keys and names that gained or lost a file
+        # path -> keys its resolution consulted; None until needed after a load
+        self._references: Optional[Dict[str, frozenset]] = {}
+        # Node numbers stay fixed while a file is in the graph, so each file's
+        # edges are converted to node arrays once, not on every ranking
+        self._node_ids: Dict[str, int] = {}
+        self._free_ids: List[int] = []
+        self._node_targets: Dict[str, 'np.ndarray'] = {}
+        self._node_weights: Dict[str, 'np.ndarray'] = {}
+        self._ranks: Optional[Dict[str, float]] = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        if self.graph_file:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, rel_path: str) -> bool:
+        return rel_path in self._files
+
+    def is_current(self, rel_path: str, stamp: str) -> bool:
+        entry = self._files.get(rel_path)
+        return entry is not None and entry['stamp'] == stamp
+
+    def add(self, rel_path: str, stamp: str, semantic_data: Optional[Dict]):
+        """Record (or replace) a file's definitions, imports and calls"""
+        semantic_data = semantic_data or {}
+        defines = set()
+        calls = set()
+        qualifiers = set()
+        for entity in semantic_data.get('entities') or ():
+            if entity.type in DEFINITION_TYPES and '.' not in entity.name:
+                defines.add(entity.name)
+            for call in entity.calls or ():
+                name, defined = called_name(call)
+                if defined:
+                    calls.add(name)
+                elif name:
+                    qualifiers.add(name)
+        entry = {
+            'stamp': stamp,
+            'defines': sorted(defines),
+            'imports': sorted(set(semantic_data.get('imports') or ())),
+            'calls': sorted(calls - defines),
+            'qualifiers': sorted(qualifiers - calls),
+            'edges': {},
+        }
+        with self._lock:
+            previous = self._files.get(rel_path)
+            self._remove(rel_path, mark=False)
+            self._insert(rel_path, entry, mark=False)
+            # Only names the file started or stopped defining affect other files
+            if previous is None:
+                self._changed_keys.update(module_keys(rel_path))
+                self._changed_keys.update(entry['defines'])
+            else:
+                self._changed_keys.update(set(previous['defines']).symmetric_difference(entry['defines']))
+            self._pending.add(rel_path)
+            self._dirty = True
+
+    def retain(self, rel_paths: Iterable[str]):
+        """Drop files that are no longer in the repository"""
+        keep = set(rel_paths)
+        with self._lock:
+            for rel_path in [path for path in self._files if path not in keep]:
+                self._remove(rel_path)
+                self._dirty = True
+
+    def discard(self, rel_paths: Iterable[str]):
+        """Drop the given files, for updates that know what was deleted"""
+        with self._lock:
+            for rel_path in rel_paths:
+                if rel_path in self._files:
+                    self._remove(rel_path)
+                    self._dirty = True
+
+    def edges(self, rel_path: str) -> Dict[str, float]:
+        """Files rel_path imports or calls into, with edge weights"""
+        with self._lock:
+            self._resolve()
+            entry = self._files.get(rel_path)
+            return dict(entry['edges']) if entry else {}
+
+    def dependents(self, rel_path: str) -> List[str]:
+        """Files that import or call into rel_path"""
+        with self._lock:
+            self._resolve()
+            return sorted(path for path, entry in self._files.items() if rel_path in entry['edges'])
+
+    def ranks(self) -> Dict[str, float]:
+        """PageRank of every file, scaled so the average file scores 1"""
+        with self._lock:
+            self._resolve()
+            if self._ranks is None:
+                paths = list(self._node_ids)
+                nodes = [self._node_ids[path] for path in paths]
+                size = len(self._node_ids) + len(self._free_ids)
+                rank = pagerank(size, *self._edge_lists(paths, nodes), nodes=nodes)
+                self._ranks = {path: rank[node] * len(paths) for path, node in zip(paths, nodes)}
+            return self._ranks
+
+    def _edge_lists(self, paths: List[str], nodes: List[int]):
+        """Sources, targets and weights of all edges as node numbers"""
+        if not NUMPY_AVAILABLE:
+            sources, targets, weights = [], [], []
+            for path, node in zip(paths, nodes):
+                for target, weight in self._files[path]['edges'].items():
+                    sources.append(node)
+                    targets.append(self._node_ids[target])
+                    weights.append(weight)
+            return sources, targets, weights
+
+        # Arrays are not tracked by the garbage collector, unlike lists, which
+        # matters with millions of loaded objects alive
+        targets, weights = [], []
+        for path in paths:
+            file_targets = self._node_targets.get(path)
+            if file_targets is None:
+                edges = self._files[path]['edges']
+                file_targets = self._node_targets[path] = np.fromiter(
+                    (self._node_ids[target] for target in edges), np.int64, len(edges))
+                self._node_weights[path] = np.fromiter(edges.values(), np.float64, len(edges))
+            targets.append(file_targets)
+            weights.append(self._node_weights[path])
+        if not targets:
+            return [], [], []
+        counts = [len(file_targets) for file_targets in targets]
+        return (np.repeat(np.asarray(nodes, dtype=np.int64), counts),
+                np.concatenate(targets), np.concatenate(weights))
+
+    def importance(self) -> Dict[str, float]:
+        """Ranks mapped to 0-1 on a log scale relative to the most central file"""
+        ranks = self.ranks()
+        best = max(ranks.values(), default=0.0)
+        if best <= 0:
+            return {}
+        scale = math.log1p(best)
+        return {path: math.log1p(rank) / scale for path, rank in ranks.items()}
+
+    def load(self):
+        try:
+            with open(self.graph_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != GRAPH_VERSION:
+            return
+        for rel_path, entry in data.get('files', {}).items():
+            self._insert(rel_path, entry, mark=False)
+        self._references = None if self._files else {}
+        self._pending.update(data.get('pending', ()))
+        self._changed_keys.update(data.get('changed_keys', ()))
+
+    def save(self):
+        """Write the graph if anything changed since it was loaded"""
+        if not self.graph_file or not self._dirty:
+            return
+        with self._lock:
+            data = {
+                'version': GRAPH_VERSION,
+                'files': self._files,
+                'pending': sorted(self._pending),
+                'changed_keys': sorted(self._changed_keys),
+            }
+            self.graph_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.graph_file, 'w') as f:
+                # dumps uses the C encoder; dump to a file does not
+                f.write(json.dumps(data))
+            self._dirty = False
+
+    def _insert(self, rel_path: str, entry: Dict, mark: bool = True):
+        self._files[rel_path] = entry
+        self._node_ids[rel_path] = self._free_ids.pop() if self._free_ids else len(self._node_ids)
+        keys = module_keys(rel_path)
+        for key in keys:
+            self._modules.setdefault(key, set()).add(rel_path)
+        for name in entry['defines']:
+            self._symbols.setdefault(name, set()).add(rel_path)
+        if mark:
+            self._changed_keys.update(keys)
+            self._changed_keys.update(entry['defines'])
+        self._ranks = None
+
+    def _remove(self, rel_path: str, mark: bool = True):
+        entry = self._files.pop(rel_path, None)
+        if entry is None:
+            return
+        keys = module_keys(rel_path)
+        for key in keys:
+            self._discard(self._modules, key, rel_path)
+        for name in entry['defines']:
+            self._discard(self._symbols, name, rel_path)
+        if mark:
+            self._changed_keys.update(keys)
+            self._changed_keys.update(entry['defines'])
+        if self._references is not None:
+            self._references.pop(rel_path, None)
+        self._pending.discard(rel_path)
+        self._free_ids.append(self._node_ids.pop(rel_path))
+        self._node_targets.pop(rel_path, None)
+        self._ranks = None
+
+    @staticmethod
+    def _discard(table: Dict[str, Set[str]], key: str, rel_path: str):
+        paths = table.get(key)
+        if paths is not None:
+            paths.discard(rel_path)
+            if not paths:
+                del table[key]
+
+    def _resolve(self):
+        """Re-resolve edges of changed files and of files referring to changed keys"""
+        changed = self._changed_keys
+        if changed:
+            if self._references is None:
+                self._references = {path: self._reference_keys(path, entry) for path, entry in self._files.items()}
+            # Includes every file with an edge into a removed file
+            for rel_path, keys in self._references.items():
+                if not keys.isdisjoint(changed):
+                    self._pending.add(rel_path)
+            self._changed_keys = set()
+        if not self._pending:
+            return
+        for rel_path in self._pending:
+            entry = self._files.get(rel_path)
+            if entry is None:
+                continue
+            entry['edges'] = self._resolve_edges(rel_path, entry)
+            self._node_targets.pop(rel_path, None)
+            if self._references is not None:
+                self._references[rel_path] = self._reference_keys(rel_path, entry)
+        self._pending = set()
+        self._ranks = None
+        self._dirty = True
+
+    def _reference_keys(self, rel_path: str, entry: Dict) -> frozenset:
+        keys = set(entry['calls'])
+        keys.update(entry['qualifiers'])
+        for name in entry['imports']:
+            keys.update(import_candidates(rel_path, name))
+        return frozenset(keys)
+
+    def _resolve_edges(self, rel_path: str, entry: Dict) -> Dict[str, float]:
+        edges: Dict[str, float] = {}
+        for name in entry['imports']:
+            for key in import_candidates(rel_path, name):
+                paths = self._modules.get(key)
+                if paths:
+                    target = self._closest(rel_path, paths)
+                    if target is not None and target != rel_path:
+                        edges[target] = IMPORT_WEIGHT
+                    break
+        imported = set(edges)
+        # models.Order() after `from shop import models` calls into the module itself
+        imported_modules = {module_keys(path)[-1]: path for path in imported} if imported else {}
+        for name in entry['qualifiers']:
+            if name in imported_modules:
+                edges[imported_modules[name]] += CALL_WEIGHT
+        directory = posixpath.dirname(rel_path)
+        for name in entry['calls']:
+            paths = self._symbols.get(name)
+            if not paths:
+                continue
+            # Definitions are only visible through an import or within the same package
+            paths = {path for path in paths if path in imported or posixpath.dirname(path) == directory}
+            if len(paths) == 1:
+                target = next(iter(paths))
+                if target != rel_path:
+                    edges[target] = edges.get(target, 0.0) + CALL_WEIGHT
+        return edges
+
+    @staticmethod
+    def _closest(rel_path: str, paths: Set[str]) -> Optional[str]:
+        """The candidate sharing the most leading directories with rel_path, None on a tie"""
+        if len(paths) == 1:
+            return next(iter(paths))
+        parts = rel_path.split('/')
+
+        def shared(path: str) -> int:
+            count = 0
+            for a, b in zip(parts, path.split('/')):
+                if a != b:
+                    break
+                count += 1
+            return count
+
+        scored = sorted(((shared(path), path) for path in paths), reverse=True)
+        if scored[0][0] == scored[1][0]:
+            return None
+        return scored[0][1]
@@ -11,6 +11,8 @@ from dataclasses import dataclass, field
 from pathlib import Path
 import json
 
+from .instrumentation import ENCODE_CALLS, TOKENS_ENCODED
+
 # Model configurations with context windows
 MODEL_CONFIGS = {
     # OpenAI models
@@ -113,8 +115,12 @@ class TokenManager:
                 except:
                     self.encoder = None
         
+        # Token counts are interchangeable between managers with the same encoding
+        self.encoding = self.encoder.name if self.encoder else model_config['encoding']
         self.budget = TokenBudget(total=budget)
         self.cache: Dict[str, int] = {}
+        # Optional Instrumentation (see instrumentation.py) counting encoder work
+        self.instrumentation = None
     
     def _get_model_config(self, model: str) -> Dict:
         """Get model configuration with fallback"""
@@ -146,6 +152,7 @@ class TokenManager:
                 count = len(self.encoder.encode(text))
                 if cache_key:
                     self.cache[cache_key] = count
+                self._record_encode(count)
                 return count
             except:
                 pass
@@ -154,8 +161,29 @@ class TokenManager:
         count = len(text) // 3
         if cache_key:
             self.cache[cache_key] = count
+        self._record_encode(count)
         return count
     
+    def count_line_tokens(self, lines: List[str]) -> List[int]:
+        """Token count of each line, encoded as one batch"""
+        if self.encoder and lines:
+            try:
+                counts = [len(tokens) for tokens in self.encoder.encode_ordinary_batch(lines)]
+                self._record_encode(sum(counts))
+                return counts
+            except:
+                pass
+
+        # Character-based estimate, each line with its newline, rounded up
+        counts = [(len(line) + 3) // 3 for line in lines]
+        self._record_encode(sum(counts))
+        return counts
+
+    def _record_encode(self, count: int):
+        if self.instrumentation is not None:
+            self.instrumentation.count(ENCODE_CALLS)
+            self.instrumentation.count(TOKENS_ENCODED, count)
+    
     def allocate_for_file(self, file_path: str, content: str, priority: float) -> Tuple[str, bool]:
         """Allocate tokens for a file and return potentially truncated content"""
         tokens_needed = self.count_tokens(content, cache_key=file_path)
@@ -0,0 +1,302 @@
+"""
+Local similarity index of files and code entities
+
+A model-free stand-in for embeddings: every file and every entity (class,
+function, method) becomes a hashing-trick term-frequency vector, stored as a
+row of a memory-mapped float32 matrix. Rows are keyed by the git blob SHA of
+the file content, so renamed or duplicated files share a row and unchanged
+files are never re-vectorized. Terms are weighted by IDF at query time,
+which keeps rows valid as the repository changes; similarity is the cosine
+of the TF-IDF vectors, computed for all rows with one matrix product.
+
+Files on disk, next to IncrementalScanner's embeddings cache file:
+    embeddings_cache.json   path -> blob, blob -> rows, document frequencies
+    embeddings_files.f32    one row per distinct file content
+    embeddings_entities.f32 one row per entity
+"""
+import hashlib
+import json
+import math
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from .search_index import tokenize
+
+INDEX_VERSION = 1
+DEFAULT_DIMENSIONS = 512
+INITIAL_ROWS = 256
+# Rows per block when recomputing norms, bounding temporary memory
+NORM_BLOCK_ROWS = 16384
+
+
+def blob_sha(data: bytes) -> str:
+    """SHA git assigns to a blob with this content"""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class RowStore:
+    """Growable float32 matrix in a memory-mapped file; freed rows are reused"""
+
+    def __init__(self, path: Path, dimensions: int, size: int = 0, free: Iterable[int] = ()):
+        self.path = Path(path)
+        self.dimensions = dimensions
+        self.size = size  # Rows in use or freed; everything past is unallocated
+        self.free = list(free)
+        capacity = max(INITIAL_ROWS, size)
+        if self.path.exists():
+            capacity = max(capacity, self.path.stat().st_size // (4 * dimensions))
+        self._open(capacity)
+
+    def _open(self, capacity: int):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            if f.tell() < capacity * self.dimensions * 4:
+                f.truncate(capacity * self.dimensions * 4)
+        self.capacity = capacity
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dimensions))
+
+    def allocate(self) -> int:
+        if self.free:
+            return self.free.pop()
+        if self.size == self.capacity:
+            self.matrix.flush()
+            del self.matrix
+            self._open(self.capacity * 2)
+        self.size += 1
+        return self.size - 1
+
+    def release(self, row: int):
+        self.matrix[row] = 0
+        self.free.append(row)
+
+    def rows(self) -> 'np.ndarray':
+        return self.matrix[:self.size]
+
+    def flush(self):
+        self.matrix.flush()
+
+
+class VectorIndex:
+    """Hashing-trick TF-IDF vectors of a repository's files and entities
+
+    Thread-safe for updates; the scanner indexes files from its worker threads.
+    """
+
+    def __init__(self, metadata_file: Path, dimensions: int = DEFAULT_DIMENSIONS):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for the vector index")
+        self.metadata_file = Path(metadata_file)
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        metadata = self._load_metadata()
+        self._files: Dict[str, Dict] = metadata.get('files', {})  # path -> {'stamp', 'blob'}
+        self._blobs: Dict[str, Dict] = metadata.get('blobs', {})  # blob -> {'row', 'entities'}
+        self._df = np.array(metadata.get('df') or [0] * dimensions, dtype=np.float64)
+        directory = self.metadata_file.parent
+        self._file_rows = RowStore(directory / 'embeddings_files.f32', dimensions,
+                                   metadata.get('file_rows', 0), metadata.get('free_file_rows', ()))
+        self._entity_rows = RowStore(directory / 'embeddings_entities.f32', dimensions,
+                                     metadata.get('entity_rows', 0), metadata.get('free_entity_rows', ()))
+        self._norms: Dict[str, Optional[np.ndarray]] = {'files': None, 'entities': None}
+        self._row_owners()
+
+    def _load_metadata(self) -> Dict:
+        try:
+            with open(self.metadata_file, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if metadata.get('version') != INDEX_VERSION or metadata.get('dimensions') != self.dimensions:
+            return {}
+        return metadata
+
+    def _row_owners(self):
+        """Reverse maps from rows to the paths and entities they belong to"""
+        paths_by_blob: Dict[str, List[str]] = {}
+        for rel_path, entry in self._files.items():
+            paths_by_blob.setdefault(entry['blob'], []).append(rel_path)
+        self._paths_by_blob = paths_by_blob
+        self._blob_by_file_row = {blob['row']: sha for sha, blob in self._blobs.items()}
+        self._entity_by_row = {
+            row: (sha, name) for sha, blob in self._blobs.items() for name, row in blob['entities']
+        }
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def is_current(self, rel_path: str, stamp: str) -> bool:
+        entry = self._files.get(rel_path)
+        return entry is not None and entry['stamp'] == stamp
+
+    def vectorize(self, text: str) -> 'np.ndarray':
+        """Sublinear term frequencies hashed into `dimensions` buckets"""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term, count in Counter(tokenize(text)).items():
+            vector[zlib.crc32(term.encode()) % self.dimensions] += 1 + math.log(count)
+        return vector
+
+    def add(self, rel_path: str, stamp: str, content: str, entities: Iterable = ()):
+        """Index (or re-index) one file and its entities"""
+        sha = blob_sha(content.encode('utf-8', errors='ignore'))
+        with self._lock:
+            previous = self._files.get(rel_path)
+            self._files[rel_path] = {'stamp': stamp, 'blob': sha}
+            self._dirty = True
+            if previous and previous['blob'] == sha:
+                return
+            if previous:
+                self._unlink(rel_path, previous['blob'])
+            self._paths_by_blob.setdefault(sha, []).append(rel_path)
+            if sha in self._blobs:
+                return
+
+        # Vectorize outside the lock; only new content gets here
+        file_vector = self.vectorize(f"{rel_path}\n{content}")
+        lines = content.splitlines()
+        entity_vectors = []
+        for entity in entities:
+            name = getattr(entity, 'name', None)
+            if not name:
+                continue
+            source = '\n'.join(lines[max(0, entity.line_start - 1):entity.line_end])
+            entity_vectors.append((name, self.vectorize(f"{name}\n{entity.docstring or ''}\n{source}")))
+
+        with self._lock:
+            if sha in self._blobs:
+                return
+            row = self._file_rows.allocate()
+            self._file_rows.matrix[row] = file_vector
+            self._df += file_vector > 0
+            entity_rows = []
+            for name, vector in entity_vectors:
+                entity_row = self._entity_rows.allocate()
+                self._entity_rows.matrix[entity_row] = vector
+                entity_rows.append([name, entity_row])
+                self._entity_by_row[entity_row] = (sha, name)
+            self._blobs[sha] = {'row': row, 'entities': entity_rows}
+            self._blob_by_file_row[row] = sha
+            self._norms = {'files': None, 'entities': None}
+
+    def retain(self, rel_paths: Iterable[str]):
+        """Drop files that are no longer in the repository"""
+        keep = set(rel_paths)
+        with self._lock:
+            for rel_path in [path for path in self._files if path not in keep]:
+                self._unlink(rel_path, self._files.pop(rel_path)['blob'])
+                self._dirty = True
+
+    def _unlink(self, rel_path: str, sha: str):
+        """Forget that rel_path had blob sha, freeing its rows if no other path has it"""
+        paths = self._paths_by_blob.get(sha, [])
+        if rel_path in paths:
+            paths.remove(rel_path)
+        if paths:
+            return
+        self._paths_by_blob.pop(sha, None)
+        blob = self._blobs.pop(sha, None)
+        if blob is None:
+            return
+        self._df -= self._file_rows.matrix[blob['row']] > 0
+        self._file_rows.release(blob['row'])
+        self._blob_by_file_row.pop(blob['row'], None)
+        for _, entity_row in blob['entities']:
+            self._entity_rows.release(entity_row)
+            self._entity_by_row.pop(entity_row, None)
+        self._norms = {'files': None, 'entities': None}
+
+    def _idf(self) -> 'np.ndarray':
+        documents = len(self._blobs)
+        return (np.log((documents + 1) / (self._df + 1)) + 1).astype(np.float32)
+
+    def _scores(self, kind: str, vector: 'np.ndarray') -> 'np.ndarray':
+        """Cosine similarity of the TF-IDF form of vector with every row"""
+        store = self._file_rows if kind == 'files' else self._entity_rows
+        idf = self._idf()
+        weights = idf * idf
+        rows = store.rows()
+        norms = self._norms[kind]
+        if norms is None or len(norms) != len(rows):
+            norms = np.empty(len(rows), dtype=np.float32)
+            for start in range(0, len(rows), NORM_BLOCK_ROWS):
+                block = rows[start:start + NORM_BLOCK_ROWS]
+                norms[start:start + len(block)] = np.sqrt((block * block) @ weights)
+            self._norms[kind] = norms
+        query_norm = float(np.linalg.norm(vector * idf))
+        if query_norm == 0 or not len(rows):
+            return np.zeros(len(rows), dtype=np.float32)
+        scores = rows @ (vector * weights)
+        np.divide(scores, norms * query_norm, out=scores, where=norms > 0)
+        return scores
+
+    @staticmethod
+    def _top_rows(scores: 'np.ndarray', limit: int) -> List[int]:
+        if limit <= 0 or not len(scores):
+            return []
+        limit = min(limit, len(scores))
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+        return [int(row) for row in candidates[np.argsort(-scores[candidates])] if scores[row] > 0]
+
+    def similar_files(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Files most similar to a free-text query"""
+        return self._files_for_rows(self._scores('files', self.vectorize(query)), limit)
+
+    def related_files(self, rel_path: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Files most similar to an indexed file, excluding it and its duplicates"""
+        entry = self._files.get(rel_path)
+        if entry is None or entry['blob'] not in self._blobs:
+            return []
+        row = self._blobs[entry['blob']]['row']
+        scores = self._scores('files', np.array(self._file_rows.matrix[row]))
+        scores[row] = 0
+        return self._files_for_rows(scores, limit)
+
+    def similar_entities(self, query: str, limit: int = 10) -> List[Tuple[str, str, float]]:
+        """(path, entity name, similarity) of entities most similar to a query"""
+        scores = self._scores('entities', self.vectorize(query))
+        results = []
+        for row in self._top_rows(scores, limit * 2):
+            sha, name = self._entity_by_row.get(row, (None, None))
+            paths = self._paths_by_blob.get(sha)
+            if paths:
+                results.append((min(paths), name, float(scores[row])))
+        return results[:limit]
+
+    def _files_for_rows(self, scores: 'np.ndarray', limit: int) -> List[Tuple[str, float]]:
+        results = []
+        for row in self._top_rows(scores, limit):
+            for rel_path in sorted(self._paths_by_blob.get(self._blob_by_file_row.get(row), ())):
+                results.append((rel_path, float(scores[row])))
+        return results[:limit]
+
+    def save(self):
+        """Flush the matrices and write the metadata if anything changed"""
+        if not self._dirty:
+            return
+        with self._lock:
+            self._file_rows.flush()
+            self._entity_rows.flush()
+            metadata = {
+                'version': INDEX_VERSION,
+                'dimensions': self.dimensions,
+                'files': self._files,
+                'blobs': self._blobs,
+                'df': self._df.tolist(),
+                'file_rows': self._file_rows.size,
+                'free_file_rows': self._file_rows.free,
+                'entity_rows': self._entity_rows.size,
+                'free_entity_rows': self._entity_rows.free,
+            }
+            with open(self.metadata_file, 'w') as f:
+                json.dump(metadata, f)
+            self._dirty = False
@@ -0,0 +1,105 @@
+"""
+Watch mode: keep an output current while the working tree changes
+
+A WatchSession scans the repository once and keeps the scan (serialized
+FileInfo dicts, as the sharded map step produces) in memory. When files
+change it rescans only those, so only they are re-tokenized and
+re-analyzed, and then patches their blocks and the manifest into the
+existing output (UltraRepo2File.patch_output). New files, or changes that
+no longer fit the budget, re-render the output from the in-memory scan,
+which still skips scanning the unchanged files.
+"""
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from .dump_ultra import UltraRepo2File, ProcessingProfile
+from .file_watcher import DEBOUNCE_SECONDS, FileWatcher, open_watcher
+from .incremental_scanner import in_cache_directory
+from .output_index import INDEX_SUFFIX
+
+
+class WatchSession:
+    """A processor and its in-memory scan of one repository"""
+
+    def __init__(self, repo_path: Path, output_path: Path, profile: ProcessingProfile):
+        self.repo_path = Path(repo_path).resolve()
+        self.output_path = Path(output_path).resolve()
+        self.processor = UltraRepo2File(profile)
+        self.snapshot: Dict[str, Dict] = {}
+        # The output, its parts (<stem>_partN), analysis JSON and context pack
+        stem, suffix = re.escape(self.output_path.stem), re.escape(self.output_path.suffix)
+        self._own_names = re.compile(
+            rf"(?:{re.escape(self.output_path.name)}|{stem}_part\d+{suffix}|"
+            rf"{stem}_analysis\.json|{stem}\.r2fpack)"
+            # Each output's index, and the temporary files OutputIndex.patch writes
+            rf"(?:{re.escape(INDEX_SUFFIX)}|\.tmp)?")
+
+    def start(self):
+        """Scan the repository and write the first output"""
+        self.snapshot = {data['rel_path']: data for data in self.processor.scan_repository(self.repo_path)}
+        self._render()
+
+    def update(self, touched: Optional[Iterable[str]]) -> str:
+        """Bring the output up to date with touched paths (None: anything may have changed)
+
+        Returns 'patched', 'rendered' or 'unchanged'.
+        """
+        if touched is None:
+            self.start()
+            return 'rendered'
+
+        exclusion_spec = self.processor._load_exclusions(self.repo_path)
+        touched = {rel_path for rel_path in touched
+                   if not self._is_own_file(rel_path) and not exclusion_spec.match_file(rel_path)}
+        existing = sorted(rel_path for rel_path in touched if (self.repo_path / rel_path).is_file())
+        # A touched path that is gone may have been a directory
+        removed = [rel_path for rel_path in self.snapshot
+                   if rel_path not in existing and any(
+                       rel_path == path or rel_path.startswith(path + '/') for path in touched)]
+        if not existing and not removed:
+            return 'unchanged'
+
+        changed = self.processor.scan_files(self.repo_path, existing) if existing else []
+        added = [data for data in changed if data['rel_path'] not in self.snapshot]
+        for data in changed:
+            self.snapshot[data['rel_path']] = data
+        for rel_path in removed:
+            del self.snapshot[rel_path]
+
+        if not added and self.processor.patch_output(self.repo_path, self.output_path, changed, removed):
+            return 'patched'
+        self._render()
+        return 'rendered'
+
+    def run(self, debounce: float = DEBOUNCE_SECONDS,
+            on_update: Optional[Callable[[str, int, float], None]] = None,
+            watcher: Optional[FileWatcher] = None):
+        """Update the output after every batch of changes until interrupted
+
+        on_update receives the update's result, the number of paths touched
+        (0 after lost events) and the seconds it took.
+        """
+        exclusion_spec = self.processor._load_exclusions(self.repo_path)
+        watcher = watcher or open_watcher(
+            self.repo_path, lambda rel_path: self._is_own_file(rel_path) or exclusion_spec.match_file(rel_path))
+        with watcher:
+            while True:
+                touched = watcher.wait(debounce)
+                if touched is not None and not touched:
+                    continue
+                started = time.monotonic()
+                result = self.update(touched)
+                if on_update:
+                    on_update(result, len(touched or ()), time.monotonic() - started)
+
+    def _render(self):
+        self.processor.process_scanned_files(self.repo_path, self.output_path, list(self.snapshot.values()))
+
+    def _is_own_file(self, rel_path: str) -> bool:
+        """Whether rel_path is written by the session: the output, its sidecars, or the scanner cache"""
+        if in_cache_directory(rel_path):
+            return True
+        path = self.repo_path / rel_path
+        return path.parent == self.output_path.parent and self._own_names.fullmatch(path.name) is not None
@@ -3,6 +3,7 @@ Interactive workflow wizard for the Vibe Coder workflow
 """
 import os
 import sys
+from dataclasses import replace
 from pathlib import Path
 from typing import Optional
 from rich.console import Console
@@ -34,6 +35,9 @@ class WorkflowWizard:
         '*.exe', '*.dll', '*.so', '*.dylib',
     ]
     
+    # Always excluded from the Stage A scan, on top of the profile's exclusions
+    SCAN_EXCLUSIONS = ['.git', '__pycache__', 'node_modules', '.venv', 'venv']
+    
     # Large file threshold (requirement N-1)
     MAX_FILE_SIZE = 1048576  # 1 MiB
     
@@ -256,21 +260,19 @@ class WorkflowWizard:
         sections.append("PROJECT OVERVIEW & KEY AREAS:")
         
         # Use processor to analyze repo
-        from repo2file.dump_ultra import CodebaseAnalyzer
+        from repo2file.dump_ultra import CodebaseAnalyzer, UltraRepo2File
         analyzer = CodebaseAnalyzer(processor.code_analyzer)
         
-        # Quick scan for analysis
-        from repo2file.dump_ultra import UltraFileScanner, Cache, ExclusionSpec
-        import pathspec
-        
-        cache = Cache()
-        scanner = UltraFileScanner(cache, processor.token_manager, processor.code_analyzer, processor.profile)
-        
-        # Basic exclusion patterns
-        patterns = ['.git', '__pycache__', 'node_modules', '.venv', 'venv']
-        exclusion_spec = pathspec.PathSpec.from_lines('gitwildmatch', patterns)
-        
-        files = scanner.scan_directory(self.repo_path, exclusion_spec)
+        # Scan with the processor's exclusions plus the default ones
+        scan_profile = replace(processor.profile, exclude_patterns=[
+            *processor.profile.exclude_patterns,
+            *(pattern for pattern in self.SCAN_EXCLUSIONS if pattern not in processor.profile.exclude_patterns)
+        ])
+        scanner = UltraRepo2File(scan_profile)
+        files = [
+            scanner.scanner._dict_to_fileinfo(data, self.repo_path / data['rel_path'], self.repo_path)
+            for data in scanner.scan_repository(self.repo_path)
+        ]
         analysis = analyzer.analyze_codebase(files)
         
         # Add analysis results
@@ -0,0 +1,127 @@
+"""Tests for cost-aware admission control"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import redis
+from flask import Flask
+
+from app.config import get_config
+from app.admission import (
+    AdmissionRejected, CostEstimate, CostEstimateCache, FairShareLimiter, TIER_COSTS,
+    admission_rejected_response, estimate_directory, estimate_job_cost
+)
+
+
+class TestCostEstimate(unittest.TestCase):
+    """Test size tiers and directory estimates"""
+
+    def test_tiers(self):
+        config = get_config()
+        self.assertEqual(CostEstimate(10, 1024).tier, 'small')
+        self.assertEqual(CostEstimate(config.ADMISSION_SMALL_MAX_FILES + 1, 1024).tier, 'medium')
+        self.assertEqual(CostEstimate(10, config.ADMISSION_MEDIUM_MAX_BYTES + 1).tier, 'large')
+        # Unknown size goes to the middle tier
+        self.assertEqual(CostEstimate().queue, 'repo_medium')
+
+    def test_estimate_directory_skips_git(self):
+        path = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(path, '.git'))
+            with open(os.path.join(path, '.git', 'index'), 'wb') as f:
+                f.write(b'x' * 1000)
+            with open(os.path.join(path, 'main.py'), 'w') as f:
+                f.write("print('hi')\n")
+            estimate = estimate_directory(path)
+            self.assertEqual((estimate.file_count, estimate.total_bytes), (1, 12))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestCostEstimateCache(unittest.TestCase):
+    """Test that unmeasured inputs are admitted at once and measured in the background"""
+
+    def setUp(self):
+        self.redis_client = redis.Redis.from_url(get_config().REDIS_URL, decode_responses=True)
+        for key in self.redis_client.keys("test_cost_estimate:*"):
+            self.redis_client.delete(key)
+        self.cache = CostEstimateCache(self.redis_client, prefix="test_cost_estimate:")
+        self.path = tempfile.mkdtemp()
+        for i in range(3):
+            with open(os.path.join(self.path, f"m{i}.py"), 'w') as f:
+                f.write("print('hi')\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_miss_returns_unknown_then_stores_estimate(self):
+        first = estimate_job_cost('local_path', self.path, estimate_cache=self.cache)
+        self.assertEqual((first.source, first.tier), ('unknown', 'medium'))
+
+        deadline = time.monotonic() + 5
+        estimate = first
+        while estimate.source == 'unknown' and time.monotonic() < deadline:
+            time.sleep(0.05)
+            estimate = self.cache.estimate('local_path', self.path)
+        self.assertEqual((estimate.file_count, estimate.total_bytes, estimate.source), (3, 36, 'listing'))
+        self.assertEqual(estimate.tier, 'small')
+
+    def test_unmeasurable_inputs_are_not_scheduled(self):
+        self.assertEqual(estimate_job_cost('minio_file', 'uploads/x.zip', estimate_cache=self.cache).tier, 'medium')
+        self.assertEqual(self.redis_client.keys("test_cost_estimate:*"), [])
+
+
+class TestFairShareLimiter(unittest.TestCase):
+    """Test per-client in-flight caps and priorities against Redis"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis_client = redis.Redis.from_url(get_config().REDIS_URL, decode_responses=True)
+
+    def setUp(self):
+        for key in self.redis_client.keys("test_fair_share:*"):
+            self.redis_client.delete(key)
+        self.limiter = FairShareLimiter(self.redis_client, prefix="test_fair_share:")
+        self.limiter.max_inflight_cost = 30
+        self.limiter.units_per_priority_step = 10
+
+    def test_inflight_cap_and_release(self):
+        large = TIER_COSTS['large']
+        self.limiter.admit('alice', 'job-1', large)
+
+        # Over the cap while job-1 runs, but other clients are unaffected
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.limiter.admit('alice', 'job-2', large)
+        # Told to retry soon, not when job-1's hour-long deadline passes
+        self.assertGreater(ctx.exception.retry_after, 0)
+        self.assertLessEqual(ctx.exception.retry_after, get_config().FAIR_SHARE_RETRY_AFTER)
+        self.limiter.admit('bob', 'job-3', large)
+
+        self.limiter.release('alice', 'job-1')
+        self.limiter.admit('alice', 'job-2', large)
+
+    def test_heavy_users_get_lower_priority(self):
+        self.assertEqual(self.limiter.admit('alice', 'job-1', TIER_COSTS['large']), 0)
+        self.limiter.release('alice', 'job-1')
+        self.assertEqual(self.limiter.admit('alice', 'job-2', TIER_COSTS['small']), 2)
+        self.assertEqual(self.limiter.admit('bob', 'job-3', TIER_COSTS['small']), 0)
+
+
+    def test_rejection_response(self):
+        app = Flask(__name__)
+        app.register_error_handler(AdmissionRejected, admission_rejected_response)
+
+        @app.route('/submit')
+        def submit():
+            raise AdmissionRejected("Too much work in flight", retry_after=12)
+
+        response = app.test_client().get('/submit')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '12')
+        self.assertEqual(response.get_json(), {'error': 'Too much work in flight', 'retry_after': 12})
+
+
+if __name__ == '__main__':
+    unittest.main()
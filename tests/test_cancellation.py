@@ -0,0 +1,89 @@
+"""Tests for cooperative cancellation of repository processing"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from repo2file.cancellation import CancellationToken, ProcessingCancelled, run_process
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+
+
+class TestCancellationToken(unittest.TestCase):
+    """Test the token and cancellable child processes"""
+
+    def test_external_check_is_throttled(self):
+        calls = []
+        token = CancellationToken(check=lambda: calls.append(1) or len(calls) >= 2, poll_interval=60)
+        self.assertFalse(token.cancelled)
+        self.assertFalse(token.cancelled)
+        self.assertEqual(len(calls), 1)
+
+        token.poll_interval = 0
+        self.assertTrue(token.cancelled)
+        with self.assertRaises(ProcessingCancelled):
+            token.raise_if_cancelled()
+
+    def test_run_process_kills_child_on_cancel(self):
+        token = CancellationToken()
+        threading.Timer(0.2, token.cancel).start()
+
+        started = time.monotonic()
+        with self.assertRaises(ProcessingCancelled):
+            run_process([sys.executable, '-c', 'import time; time.sleep(30)'], token, poll_interval=0.1)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_run_process_output(self):
+        result = run_process([sys.executable, '-c', 'print("ok")'], text=True)
+        self.assertEqual((result.returncode, result.stdout.strip()), (0, 'ok'))
+
+
+class TestEngineCancellation(unittest.TestCase):
+    """Test that a cancelled token stops the engine at file granularity"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        for i in range(4):
+            with open(os.path.join(self.repo, f"module_{i}.py"), 'w') as f:
+                f.write(f"def handler_{i}(x):\n    return x + {i}\n")
+        self.profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def test_cancel_during_render(self):
+        repo_path = Path(self.repo)
+        scanner = UltraRepo2File(self.profile)
+        scanned = scanner.scan_files(repo_path, [p for p, _ in scanner.list_repository_files(repo_path)])
+
+        token = CancellationToken()
+        processor = UltraRepo2File(self.profile, cancel_token=token)
+        processed = []
+        process_file = processor.processor.process_file
+
+        def tracked(file_info, token_budget):
+            result = process_file(file_info, token_budget)
+            processed.append(file_info.rel_path)
+            token.cancel()
+            return result
+
+        processor.processor.process_file = tracked
+        output_path = repo_path / 'output.txt'
+        with self.assertRaises(ProcessingCancelled):
+            processor.process_scanned_files(repo_path, output_path, scanned)
+        self.assertEqual(len(processed), 1)
+        self.assertFalse(output_path.exists())
+
+    def test_cancelled_scan_skips_files(self):
+        token = CancellationToken()
+        token.cancel()
+        processor = UltraRepo2File(self.profile, cancel_token=token)
+        with self.assertRaises(ProcessingCancelled):
+            processor.scan_files(Path(self.repo), [f"module_{i}.py" for i in range(4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
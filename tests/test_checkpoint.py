@@ -0,0 +1,89 @@
+"""Tests for stage checkpoints and resumed processing"""
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.checkpoint import LocalCheckpointStore
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+
+
+class TestCheckpointResume(unittest.TestCase):
+    """Test that a run interrupted mid-output resumes where it stopped"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.work = tempfile.mkdtemp()
+        for i in range(6):
+            with open(os.path.join(self.repo, f"module_{i}.py"), 'w') as f:
+                f.write(f"def handler_{i}(x):\n    return x + {i}\n")
+        self.profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4')
+        self.store = LocalCheckpointStore(Path(self.work) / 'checkpoints')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def _scan(self):
+        processor = UltraRepo2File(self.profile)
+        repo_path = Path(self.repo)
+        listing = processor.list_repository_files(repo_path)
+        return processor.scan_files(repo_path, [p for p, _ in listing])
+
+    def _track_files(self, processor, fail_after=None):
+        """Record files handed to the content processor, optionally failing partway"""
+        processed = []
+        process_file = processor.processor.process_file
+
+        def tracked(file_info, token_budget):
+            if fail_after is not None and len(processed) == fail_after:
+                raise RuntimeError("worker lost")
+            processed.append(file_info.rel_path)
+            return process_file(file_info, token_budget)
+
+        processor.processor.process_file = tracked
+        return processed
+
+    def test_resume_after_interruption(self):
+        scanned = self._scan()
+        repo_path = Path(self.repo)
+        output_path = Path(self.work) / 'output.txt'
+
+        first = UltraRepo2File(self.profile, checkpoint_store=self.store, checkpoint_interval=0)
+        first_files = self._track_files(first, fail_after=3)
+        with self.assertRaises(RuntimeError):
+            first.process_scanned_files(repo_path, output_path, scanned)
+        self.assertEqual(len(first_files), 3)
+
+        second = UltraRepo2File(self.profile, checkpoint_store=self.store)
+        second_files = self._track_files(second)
+        second.process_scanned_files(repo_path, output_path, scanned)
+
+        # Only the files the first attempt did not finish are processed again
+        self.assertEqual(len(second_files), 3)
+        self.assertFalse(set(first_files) & set(second_files))
+
+        output = output_path.read_text(encoding='utf-8')
+        self.assertEqual(output.count("File Contents:"), 1)
+        for i in range(6):
+            self.assertEqual(output.count(f"def handler_{i}(x):"), 1)
+
+    def test_profile_change_discards_checkpoints(self):
+        scanned = self._scan()
+        repo_path = Path(self.repo)
+        output_path = Path(self.work) / 'output.txt'
+
+        UltraRepo2File(self.profile, checkpoint_store=self.store).process_scanned_files(
+            repo_path, output_path, scanned)
+        self.assertIsNotNone(self.store.load('render'))
+
+        changed = ProcessingProfile(name='default', token_budget=50000, model='gpt-4')
+        processor = UltraRepo2File(changed, checkpoint_store=self.store)
+        processed = self._track_files(processor)
+        processor.process_scanned_files(repo_path, output_path, scanned)
+        self.assertEqual(len(processed), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
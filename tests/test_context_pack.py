@@ -0,0 +1,87 @@
+"""Tests for the context pack output"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.context_pack import ContextPack, ContextPackError, ContextPackWriter
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+
+FILES = {
+    'app.py': 'def greet(name):\n    return f"Grüße, {name} ✓"\n',
+    'util/strings.py': 'def shout(text):\n    return text.upper() + "!"\n',
+    'util/numbers.py': 'def double(x):\n    return x * 2\n' * 40,
+}
+
+
+class TestContextPack(unittest.TestCase):
+    """Test writing a pack during a run, reading files by path and re-rendering"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                    write_context_pack=True)
+        processor = UltraRepo2File(profile)
+        processor.cache.cache_dir = self.work
+        scanned = processor.scan_files(self.repo, list(FILES))
+        processor.process_scanned_files(self.repo, self.work / 'output.txt', scanned)
+        self.pack_path = self.work / 'output.r2fpack'
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_read_by_path(self):
+        with ContextPack(self.pack_path) as pack:
+            self.assertEqual(len(pack), 3)
+            self.assertEqual(pack.read('app.py'), FILES['app.py'])
+            self.assertEqual(pack.read('util/numbers.py'), FILES['util/numbers.py'])
+            entry = pack.entry('util/strings.py')
+            self.assertEqual(entry['language'], 'python')
+            self.assertIn(['shout', 'function', 1, 2], entry['entities'])
+            self.assertEqual(pack.index['stats']['files_processed'], 3)
+            self.assertNotIn('missing.py', pack)
+
+    def test_render_within_budget(self):
+        with ContextPack(self.pack_path) as pack:
+            full = pack.render(100000)
+            self.assertIn('File Contents:', full)
+            self.assertIn('[[FILE_START: app.py]]', full)
+            self.assertIn('[[FILE_END: util/numbers.py]]', full)
+
+            subset = pack.render(100000, ['util/strings.py'])
+            self.assertIn('[[FILE_START: util/strings.py]]', subset)
+            self.assertNotIn('[[FILE_START: app.py]]', subset)
+
+            budget = pack.index['preamble_tokens'] + pack.entry('app.py')['tokens'] + 50
+            small = pack.render(budget, ['app.py', 'util/numbers.py'])
+            self.assertIn('Grüße', small)
+            self.assertNotIn('[[FILE_START: util/numbers.py]]', small)
+            self.assertIn('[1 files omitted to fit', small)
+
+    def test_rejects_other_files(self):
+        not_a_pack = self.work / 'output.txt'
+        with self.assertRaises(ContextPackError):
+            ContextPack(not_a_pack)
+
+        truncated = self.work / 'truncated.r2fpack'
+        truncated.write_bytes(self.pack_path.read_bytes()[:-4])
+        with self.assertRaises(ContextPackError):
+            ContextPack(truncated)
+
+    def test_failed_write_leaves_no_file(self):
+        path = self.work / 'failed.r2fpack'
+        with self.assertRaises(RuntimeError):
+            with ContextPackWriter(path) as pack:
+                pack.add('a.py', 'x = 1\n')
+                raise RuntimeError('cancelled')
+        self.assertFalse(path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
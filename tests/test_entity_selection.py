@@ -0,0 +1,86 @@
+"""Tests for entity-granular context selection"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.code_analyzer import CodeEntity
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.entity_selection import entity_spans
+
+FILLER = ''.join(f'''
+def format_row_{i}(row):
+    """Format row {i} of the report"""
+    return ", ".join(str(cell) for cell in row[{i}:])
+''' for i in range(40))
+
+FILES = {
+    'billing/refunds.py': '''
+class RefundProcessor:
+    def refund_payment(self, payment_id):
+        """Refund a cancelled payment"""
+        return self.gateway.refund(payment_id)
+
+    def audit_log(self):
+        return []
+''' + FILLER,
+    'billing/gateway.py': '''
+def send_refund(payment_id, amount):
+    """Ask the payment provider to refund a payment"""
+    return post("/refunds", {"payment": payment_id, "amount": amount})
+''' + FILLER,
+    'reports/export.py': FILLER,
+}
+
+
+class TestEntitySelection(unittest.TestCase):
+    """Test that entity mode picks matching functions across files"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_inferred_spans(self):
+        entities = [
+            CodeEntity(name='Cart', type='class', line_start=1, line_end=1),
+            CodeEntity(name='total', type='function', line_start=5, line_end=5),
+            CodeEntity(name='Item', type='class', line_start=2, line_end=4),
+            CodeEntity(name='Item.price', type='method', line_start=3, line_end=4),
+        ]
+        self.assertEqual(entity_spans(entities, 9), [
+            ('Cart', 'class', 1, 1),
+            ('total', 'function', 5, 9),
+            ('Item.price', 'method', 3, 4),
+        ])
+
+    def test_selects_matching_entities(self):
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                    intended_query='refund a payment', selection_granularity='entity')
+        processor = UltraRepo2File(profile)
+        processor.cache.cache_dir = self.work
+        scanned = processor.scan_files(self.repo, list(FILES))
+        output = self.work / 'output.txt'
+        processor.process_scanned_files(self.repo, output, scanned)
+
+        text = output.read_text()
+        self.assertIn('[[FUNCTION_START: billing/refunds.py::RefundProcessor.refund_payment]]', text)
+        self.assertIn('[[FUNCTION_START: billing/gateway.py::send_refund]]', text)
+        self.assertIn('return self.gateway.refund(payment_id)\n'
+                      '[[FUNCTION_END: billing/refunds.py::RefundProcessor.refund_payment]]', text)
+        # refund_payment, and audit_log through its class name
+        self.assertIn('Entities: 2 of 42 selected', text)
+        # Whole files are not emitted
+        self.assertNotIn('format_row_3', text)
+        self.assertNotIn('reports/export.py]]', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for compact per-file semantic data"""
+import json
+import unittest
+from pathlib import Path
+
+from repo2file.code_analyzer import CodeAnalyzer, CodeEntity
+from repo2file.entity_table import (
+    EntityTable, compact_semantic_data, serialize_semantic_data, json_default
+)
+
+SOURCE = '''
+import os
+
+class Store:
+    """Key/value store"""
+    def get(self, key):
+        return self.load(key)
+
+    def load(self, key):
+        return os.path.join("data", key)
+
+def main():
+    return Store().get("x")
+'''
+
+
+class TestEntityTable(unittest.TestCase):
+    """Test that compaction preserves entities across serialization"""
+
+    def setUp(self):
+        self.analysis = CodeAnalyzer().analyze_file(Path('store.py'), SOURCE)
+        self.entities = list(self.analysis['entities'])
+
+    def assertSameEntities(self, table):
+        self.assertEqual(len(table), len(self.entities))
+        for original, restored in zip(self.entities, table):
+            self.assertEqual(original, restored)
+
+    def test_round_trip_through_json(self):
+        compacted = compact_semantic_data(self.analysis)
+        self.assertIsInstance(compacted['entities'], EntityTable)
+        self.assertSameEntities(compacted['entities'])
+
+        restored = compact_semantic_data(json.loads(json.dumps(serialize_semantic_data(compacted))))
+        self.assertSameEntities(restored['entities'])
+        self.assertEqual(restored['imports'], self.analysis['imports'])
+
+        # Caches holding compacted data serialize to the same columns
+        self.assertEqual(json.loads(json.dumps(compacted, default=json_default))['entities'],
+                         serialize_semantic_data(compacted)['entities'])
+
+    def test_legacy_entity_dicts(self):
+        legacy = [
+            {**{name: getattr(e, name) for name in CodeEntity.__dataclass_fields__},
+             'dependencies': sorted(e.dependencies)}
+            for e in self.entities
+        ] + ['<unparseable entity>']
+        restored = compact_semantic_data({**self.analysis, 'entities': legacy})
+        self.assertSameEntities(restored['entities'])
+
+    def test_materialized_entities_are_copies(self):
+        table = compact_semantic_data(self.analysis)['entities']
+        index = table.names.index('Store.get')
+        method = table[index]
+        self.assertIn('self.load', method.calls)
+        method.calls.append('mutated')
+        self.assertNotIn('mutated', table[index].calls)
+        self.assertEqual([e.name for e in table[:2]], [e.name for e in self.entities[:2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
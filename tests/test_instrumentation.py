@@ -0,0 +1,78 @@
+"""Tests for engine stage timings and counters"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.instrumentation import Instrumentation
+from repo2file.profiling import StageProfiler
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test that a processing run reports its stages and hot-path counters"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.work = tempfile.mkdtemp()
+        for i in range(4):
+            with open(os.path.join(self.repo, f"module_{i}.py"), 'w') as f:
+                f.write(f"def handler_{i}(x):\n    return x + {i}\n")
+        self.profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_stages_and_counters(self):
+        spans = []
+
+        @contextmanager
+        def span_factory(name, attributes):
+            spans.append(name)
+            yield
+
+        instrumentation = Instrumentation(span_factory)
+        processor = UltraRepo2File(self.profile, instrumentation=instrumentation)
+        repo_path = Path(self.repo)
+        scanned = processor.scan_files(repo_path, [p for p, _ in processor.list_repository_files(repo_path)])
+        processor.process_scanned_files(repo_path, Path(self.work) / 'output.txt', scanned)
+
+        summary = instrumentation.summary()
+        for stage in ('scan', 'analyze_codebase', 'tree', 'write', 'cache_save'):
+            self.assertIn(stage, summary['stages'])
+        self.assertEqual(summary['stages']['process_file']['count'], 4)
+        self.assertIn('repo2file.process_file', spans)
+
+        counters = summary['counters']
+        self.assertEqual(counters['files_scanned'], 4)
+        self.assertEqual(counters['files_processed'], 4)
+        self.assertGreater(counters['encode_calls'], 0)
+        self.assertGreater(counters['tokens_encoded'], 0)
+        self.assertGreater(counters['bytes_read'], 0)
+        self.assertIn('files_per_second', summary['rates'])
+
+    def test_stage_profiler_artifacts(self):
+        profiler = StageProfiler(interval=0.001)
+        processor = UltraRepo2File(self.profile, instrumentation=profiler)
+        repo_path = Path(self.repo)
+        with profiler:
+            scanned = processor.scan_files(repo_path, [p for p, _ in processor.list_repository_files(repo_path)])
+            processor.process_scanned_files(repo_path, Path(self.work) / 'output.txt', scanned)
+
+        artifacts = profiler.write(Path(self.work) / 'profile')
+        self.assertEqual(set(artifacts), {'profile.json', 'profile.collapsed'})
+        with open(artifacts['profile.json']) as f:
+            summary = json.load(f)
+        # Memory is tracked around top-level stages only; per-file stages are nested in render
+        self.assertIn('memory', summary['stages']['scan'])
+        self.assertIn('memory', summary['stages']['render'])
+        self.assertNotIn('memory', summary['stages'].get('process_file', {}))
+        self.assertEqual(summary['timings']['stages']['process_file']['count'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Tests for diff-scoped iteration context"""
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.iteration_context import parse_unified_diff
+
+FILES = {
+    'shop/models.py': '''
+class Order:
+    def total(self):
+        return sum(line.price for line in self.lines)
+''',
+    'shop/pricing.py': '''
+from shop.models import Order
+
+def apply_discount(order: Order, percent):
+    return order.total() * (1 - percent / 100)
+''',
+    'shop/checkout.py': '''
+from shop.pricing import apply_discount
+
+def checkout(cart):
+    return apply_discount(cart.order, cart.discount)
+''',
+    'scripts/report.py': '''
+def main():
+    print("report")
+''',
+}
+
+DIFF = '''diff --git a/old name.py b/new name.py
+similarity index 90%
+rename from old name.py
+rename to new name.py
+--- a/old name.py
++++ b/new name.py
+@@ -1,2 +1,2 @@
+-x = 1
++x = 2
+ y = 3
+diff --git a/gone.py b/gone.py
+deleted file mode 100644
+--- a/gone.py
++++ /dev/null
+@@ -1 +0,0 @@
+-z = 1
+diff --git a/logo.png b/logo.png
+new file mode 100644
+Binary files /dev/null and b/logo.png differ
+'''
+
+
+class TestIterationContext(unittest.TestCase):
+    """Test diff parsing and the snapshot of changes and their neighbours"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        self.git('init', '-q')
+        self.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def git(self, *args) -> str:
+        return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                              cwd=self.repo, capture_output=True, text=True, check=True).stdout.strip()
+
+    def commit(self) -> str:
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'change')
+        return self.git('rev-parse', 'HEAD')
+
+    def processor(self) -> UltraRepo2File:
+        processor = UltraRepo2File(ProcessingProfile(name='default', token_budget=100000, model='gpt-4'))
+        processor.cache.cache_dir = self.work
+        return processor
+
+    def test_parse_unified_diff(self):
+        renamed, deleted, binary = parse_unified_diff(DIFF)
+        self.assertEqual((renamed.rel_path, renamed.old_path, renamed.status), ('new name.py', 'old name.py', 'R'))
+        self.assertEqual((renamed.additions, renamed.deletions), (1, 1))
+        self.assertEqual(renamed.diff, '@@ -1,2 +1,2 @@\n-x = 1\n+x = 2\n y = 3')
+        self.assertEqual((deleted.rel_path, deleted.status), ('gone.py', 'D'))
+        self.assertEqual((binary.rel_path, binary.status, binary.binary), ('logo.png', 'A', True))
+
+    def test_snapshot_covers_change_and_neighbours(self):
+        # A full run leaves the import graph behind
+        processor = self.processor()
+        scanned = processor.scan_files(self.repo, list(FILES))
+        processor.process_scanned_files(self.repo, self.work / 'output.txt', scanned)
+
+        base_sha = self.git('rev-parse', 'HEAD')
+        (self.repo / 'shop/pricing.py').write_text(FILES['shop/pricing.py'].replace('percent / 100', 'percent / 100.0'))
+        self.commit()
+
+        snapshot = '\n'.join(self.processor()._iteration_snapshot(self.repo, base_sha))
+        self.assertIn(f'### Changed Files (1 since {base_sha[:12]}):', snapshot)
+        self.assertIn('+    return order.total() * (1 - percent / 100.0)', snapshot)
+        self.assertIn('- shop/models.py (used by shop/pricing.py)\n  - class Order (line 2)', snapshot)
+        self.assertIn('- shop/checkout.py (uses shop/pricing.py)', snapshot)
+        self.assertNotIn('scripts/report.py', snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Tests for head/tail sampling of large files"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.action_blocks import ActionBlockGenerator
+from repo2file.code_analyzer import CodeAnalyzer
+from repo2file.dump_ultra import ContentProcessor, FileInfo, ProcessingProfile
+from repo2file.large_file import LARGE_FILE_BYTES, MappedLines
+from repo2file.token_manager import TokenManager
+
+
+class TestLargeFileSampling(unittest.TestCase):
+    """Test that sampling a large file matches truncating its full content"""
+
+    def setUp(self):
+        self.work = Path(tempfile.mkdtemp())
+        self.profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                         truncation_strategy='semantic')
+        self.token_manager = TokenManager('gpt-4', 100000)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def write(self, name: str, lines, newline='\n', trailing=True) -> Path:
+        path = self.work / name
+        text = newline.join(lines) + (newline if trailing else '')
+        path.write_bytes(text.encode('utf-8'))
+        return path
+
+    def processor(self) -> ContentProcessor:
+        actions = ActionBlockGenerator({'enable_action_blocks': True, 'action_block_types': ['TODO_ITEM']})
+        return ContentProcessor(self.token_manager, CodeAnalyzer(), self.profile,
+                                action_block_generator=actions)
+
+    def file_info(self, path: Path) -> FileInfo:
+        content = path.read_text(encoding='utf-8', errors='ignore')
+        return FileInfo(path=path, rel_path=path.name, size=path.stat().st_size,
+                        is_binary=False, is_generated=False, is_critical=False,
+                        should_summarize=False, token_count=self.token_manager.count_tokens(content))
+
+    def assertMatchesFullRead(self, path: Path, budget: int):
+        info = self.file_info(path)
+        self.assertGreaterEqual(info.size, LARGE_FILE_BYTES)
+
+        sampled = self.processor()
+        self.assertTrue(sampled._should_sample(info, budget))
+        with MappedLines(path) as mapped:
+            self.assertTrue(mapped.regular)
+        output = sampled.process_file(info, budget)
+
+        # Same file through the read_text() path
+        full = self.processor()
+        full._should_sample = lambda *args: False
+        self.assertEqual(output, full.process_file(info, budget))
+        self.assertTrue(sampled.action_block_generator.blocks)
+        self.assertEqual([(t.line, t.text) for t in sampled.action_block_generator.blocks],
+                         [(t.line, t.text) for t in full.action_block_generator.blocks])
+
+    def test_sampled_output_matches_basic_truncation(self):
+        lines = [f"INSERT INTO events VALUES ({i}, 'payload {i}');" for i in range(20000)]
+        lines[5] = ''
+        lines[19990] = ''
+        lines[7000] = '/* TODO: split this fixture */'
+        lines[12000] = '# FIXME: duplicated rows'
+        lines[12001] = 'a NOTE that is not a comment'
+        self.assertMatchesFullRead(self.write('fixture.sql', lines), budget=5000)
+        self.assertMatchesFullRead(self.write('fixture_crlf.sql', lines, '\r\n', trailing=False), budget=5000)
+        # Too small a budget for the tail
+        self.assertMatchesFullRead(self.write('tight.sql', lines), budget=1000)
+
+    def test_irregular_separators_are_read_whole(self):
+        lines = [f"2024-01-01 event {i}" for i in range(20000)]
+        lines[100] += '\x0cpage break'
+        path = self.write('events.log', lines)
+        with MappedLines(path) as mapped:
+            self.assertFalse(mapped.regular)
+
+        text, _ = self.processor().process_file(self.file_info(path), 5000)
+        self.assertIn('[19801 lines omitted]', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
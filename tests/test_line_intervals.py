@@ -0,0 +1,51 @@
+"""Tests for interval-based truncation"""
+import unittest
+from pathlib import Path
+
+from repo2file.code_analyzer import CodeEntity
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile, FileInfo
+from repo2file.line_intervals import LineSelection
+
+CONTENT = '\n'.join(f'line_{i:03d} = {i}' for i in range(200))
+
+
+class TestLineIntervals(unittest.TestCase):
+    """Test interval merging, pricing and truncation built on it"""
+
+    def test_selection_merges_and_prices_new_lines(self):
+        selection = LineSelection([1] * 10)
+        self.assertEqual(selection.add(2, 4), 2)
+        self.assertEqual(selection.add(6, 8), 2)
+        self.assertEqual(selection.new_tokens(3, 7), 2)
+        self.assertEqual(selection.add(-5, 3), 2)
+        self.assertEqual(selection.intervals(), [(0, 4), (6, 8)])
+        self.assertEqual(selection.add(4, 6), 2)
+        self.assertEqual(selection.add(9, 20), 1)
+        self.assertEqual(selection.intervals(), [(0, 8), (9, 10)])
+        self.assertEqual(selection.tokens, 9)
+        self.assertEqual(selection.render([str(i) for i in range(10)]),
+                         '0\n1\n2\n3\n4\n5\n6\n7\n\n... [Lines 8-8 omitted] ...\n\n9')
+
+    def test_semantic_truncate_keeps_important_entities(self):
+        processor = UltraRepo2File(ProcessingProfile(name='default', token_budget=100000, model='gpt-4'))
+        entities = [
+            CodeEntity(name='minor', type='function', line_start=60, line_end=70, importance_score=0.1),
+            CodeEntity(name='major', type='function', line_start=150, line_end=160, importance_score=0.9),
+        ]
+        file_info = FileInfo(path=Path('big.py'), rel_path='big.py', size=len(CONTENT), is_binary=False,
+                             is_generated=False, is_critical=False, should_summarize=False,
+                             language='python', semantic_data={'entities': entities})
+        budget = processor.token_manager.count_tokens('\n'.join(CONTENT.splitlines()[:50]))
+
+        text, tokens = processor.processor._semantic_truncate(CONTENT, file_info, budget)
+        self.assertLessEqual(tokens, budget)
+        self.assertIn('line_000', text)
+        self.assertIn('line_155', text)
+        self.assertNotIn('line_065', text)
+        self.assertIn('[Lines 20-145 omitted]', text)
+        # The cached entity order is left alone
+        self.assertEqual([entity.name for entity in entities], ['minor', 'major'])
+
+
+if __name__ == '__main__':
+    unittest.main()
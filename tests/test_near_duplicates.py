@@ -0,0 +1,125 @@
+"""Tests for near-duplicate detection and rendering"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.near_duplicates import NearDuplicateIndex, minhash_signature, similarity
+
+CLIENT = ''.join(
+    f'''
+def get_resource_{i}(session, resource_id):
+    """Fetch resource {i} by id"""
+    response = session.get(f"/api/v1/resource_{i}/{{resource_id}}")
+    return response.json()
+''' for i in range(30))
+
+OTHER = ''.join(
+    f'''
+class Handler{i}:
+    def handle(self, event):
+        self.queue.put(("event_{i}", event.payload))
+''' for i in range(30))
+
+
+class TestNearDuplicates(unittest.TestCase):
+    """Test signatures, LSH matching and rendering against the representative"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_index_matches_near_duplicates_only(self):
+        edited = CLIENT.replace('Fetch resource 7 by id', 'Fetch resource 7 by its id')
+        original, near, other = (minhash_signature(text) for text in (CLIENT, edited, OTHER))
+        self.assertEqual(similarity(original, original), 1.0)
+        self.assertGreater(similarity(original, near), 0.9)
+        self.assertLess(similarity(original, other), 0.1)
+        self.assertIsNone(minhash_signature('x = 1\ny = 2\n'))
+
+        index = NearDuplicateIndex()
+        self.assertIsNone(index.add('client.py', original))
+        self.assertIsNone(index.add('handlers.py', other))
+        match = index.add('vendor/client.py', near)
+        self.assertEqual(match[0], 'client.py')
+
+    def _render(self, files, truncated=()):
+        """Render files with client.py as the representative; returns (processor, scan, sections by path)
+
+        Files in truncated are cut to their first lines as if over budget.
+        """
+        for rel_path, content in files.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+        # Equal scores keep scan order; make the representative deterministic
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                    priority_boost={'client.py': 0.1})
+        processor = UltraRepo2File(profile)
+        processor.cache.cache_dir = self.work
+        scanned = processor.scan_files(self.repo, list(files))
+        output = self.work / 'output.txt'
+        process_file = processor.processor.process_file
+
+        def truncating_process_file(file_info, token_budget):
+            if file_info.rel_path in truncated:
+                return CLIENT[:200], 50
+            return process_file(file_info, token_budget)
+
+        with mock.patch.object(processor.processor, 'process_file', truncating_process_file):
+            processor.process_scanned_files(self.repo, output, scanned)
+
+        return processor, scanned, {
+            section.split(']]', 1)[0]: section
+            for section in output.read_text().split('[[FILE_START: ')[1:]
+        }
+
+    def test_duplicates_render_as_references(self):
+        processor, scanned, sections = self._render({
+            'client.py': CLIENT,
+            'vendor/client.py': CLIENT,
+            'vendor/client_v2.py': CLIENT.replace('resource_12', 'resource_twelve'),
+            'handlers.py': OTHER,
+        })
+        self.assertTrue(all(entry['minhash'] for entry in scanned))
+        self.assertIn('def get_resource_29', sections['client.py'])
+        self.assertIn('[Identical to client.py - content omitted]', sections['vendor/client.py'])
+        near = sections['vendor/client_v2.py']
+        self.assertIn('[Near-duplicate of client.py', near)
+        self.assertIn('+    response = session.get(f"/api/v1/resource_twelve/{resource_id}")', near)
+        self.assertNotIn('def get_resource_29', near)
+        self.assertIn('class Handler29', sections['handlers.py'])
+        self.assertEqual(processor.instrumentation.counters['duplicates_referenced'], 2)
+
+    def test_truncated_representative_is_not_referenced(self):
+        processor, _, sections = self._render({
+            'client.py': CLIENT,
+            'vendor/client.py': CLIENT,
+            'vendor/client_v2.py': CLIENT.replace('resource_12', 'resource_twelve'),
+        }, truncated={'client.py'})
+
+        self.assertNotIn('def get_resource_29', sections['client.py'])
+        self.assertIn('def get_resource_29', sections['vendor/client.py'])
+        self.assertIn('def get_resource_29', sections['vendor/client_v2.py'])
+        self.assertNotIn('duplicates_referenced', processor.instrumentation.counters)
+
+    def test_tiny_identical_files_are_emitted(self):
+        _, _, sections = self._render({
+            'client.py': CLIENT,
+            'a/__init__.py': 'VERSION = 1\n',
+            'b/__init__.py': 'VERSION = 1\n',
+        })
+        self.assertIn('VERSION = 1', sections['a/__init__.py'])
+        self.assertIn('VERSION = 1', sections['b/__init__.py'])
+        self.assertNotIn('Identical to', sections['b/__init__.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
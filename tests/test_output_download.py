@@ -0,0 +1,133 @@
+"""Tests for output download responses: negotiation, ranges and conditional requests"""
+import gzip
+import hashlib
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask
+from werkzeug.http import http_date
+
+from app.output_download import output_download_response
+
+CONTENT = ''.join(f"line {i}: the quick brown fox\n" for i in range(2000)).encode('utf-8')
+LAST_MODIFIED = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+class StubStorageManager:
+    """Serves one output stored gzip-compressed, as StorageManager would"""
+
+    def __init__(self):
+        self.stored = gzip.compress(CONTENT, mtime=0)
+
+    def get_object_info(self, object_name):
+        return {
+            'size': len(self.stored),
+            'etag': hashlib.md5(self.stored).hexdigest(),
+            'last_modified': LAST_MODIFIED,
+            'encoding': 'gzip',
+            'uncompressed_size': len(CONTENT),
+            'content_sha256': hashlib.sha256(CONTENT).hexdigest(),
+        }
+
+    def open_download_stream(self, object_name, accept_gzip=False, byte_range=None, object_info=None):
+        data = self.stored if accept_gzip else CONTENT
+        if byte_range is not None:
+            data = data[byte_range[0]:byte_range[1]]
+        return iter([data]), ('gzip' if accept_gzip else None), len(data)
+
+
+class TestOutputDownload(unittest.TestCase):
+    """Test output_download_response through a Flask test client"""
+
+    def setUp(self):
+        self.storage = StubStorageManager()
+        app = Flask(__name__)
+        app.add_url_rule('/download', 'download',
+                         lambda: output_download_response(self.storage, 'outputs/job-1/output.txt'))
+        self.client = app.test_client()
+
+    def get(self, **headers):
+        return self.client.get('/download', headers=headers)
+
+    def test_full_download(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertEqual(response.headers['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+        gzipped = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzipped.status_code, 200)
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.data), CONTENT)
+
+    def test_distinct_etags_per_representation(self):
+        identity_etag = self.get().headers['ETag']
+        gzip_etag = self.get(**{'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.assertNotEqual(identity_etag, gzip_etag)
+
+        # A validator for one representation does not match the other
+        self.assertEqual(self.get(**{'If-None-Match': gzip_etag}).status_code, 200)
+        self.assertEqual(self.get(**{'If-None-Match': identity_etag, 'Accept-Encoding': 'gzip'}).status_code, 200)
+
+    def test_single_range(self):
+        response = self.get(Range='bytes=10-29')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[10:30])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 10-29/{len(CONTENT)}')
+
+        suffix = self.get(Range='bytes=-5')
+        self.assertEqual(suffix.status_code, 206)
+        self.assertEqual(suffix.data, CONTENT[-5:])
+
+    def test_range_over_gzip_representation(self):
+        stored = self.storage.stored
+        response = self.get(Range='bytes=0-99', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.data, stored[:100])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 0-99/{len(stored)}')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f'bytes={len(CONTENT) + 10}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_multi_range_falls_back_to_full_response(self):
+        response = self.get(Range='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+        self.assertNotIn('Content-Range', response.headers)
+
+    def test_if_range_etag(self):
+        etag = self.get().headers['ETag']
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': etag}).status_code, 206)
+
+        stale = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.data, CONTENT)
+
+    def test_if_range_date(self):
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': http_date(LAST_MODIFIED)}).status_code, 206)
+
+        before = http_date(LAST_MODIFIED - timedelta(days=1))
+        stale = self.get(Range='bytes=0-9', **{'If-Range': before})
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.data, CONTENT)
+
+    def test_not_modified(self):
+        etag = self.get().headers['ETag']
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        self.assertEqual(self.get(**{'If-Modified-Since': http_date(LAST_MODIFIED)}).status_code, 304)
+        earlier = http_date(LAST_MODIFIED - timedelta(seconds=1))
+        self.assertEqual(self.get(**{'If-Modified-Since': earlier}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests for the output index sidecar"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.output_index import OutputIndex, index_path
+
+FILES = {
+    'app.py': 'def greet(name):\n    return f"Grüße, {name} ✓"\n',
+    'util/strings.py': 'def shout(text):\n    return text.upper() + "!"\n',
+    'logo.png': '\x89PNG\r\n\x1a\n\x00\x00',
+}
+
+
+class TestOutputIndex(unittest.TestCase):
+    """Test byte ranges of sections and file blocks, and reading through them"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                    vibe_statement='Friendlier greetings')
+        self.processor = UltraRepo2File(profile)
+        self.processor.cache.cache_dir = self.work
+        scanned = self.processor.scan_files(self.repo, list(FILES))
+        self.output = self.work / 'output.txt'
+        self.processor.process_scanned_files(self.repo, self.output, scanned)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_sections_and_file_blocks(self):
+        output_index = OutputIndex.load(self.output)
+        self.assertIsNotNone(output_index)
+        self.assertEqual(sorted(output_index.files), ['app.py', 'util/strings.py'])
+
+        block = output_index.file_block('app.py')
+        self.assertTrue(block.startswith('[[FILE_START: app.py]]'))
+        self.assertTrue(block.endswith('[[FILE_END: app.py]]\n'))
+        self.assertIn('Grüße, {name} ✓', output_index.file_content('app.py'))
+        self.assertTrue(output_index.file_content('app.py').endswith('✓"'))
+
+        self.assertTrue(output_index.section('planner_primer').startswith('SECTION 1: FOR AI PLANNING AGENT'))
+        self.assertTrue(output_index.section('footer').lstrip().startswith('=' * 50))
+        self.assertIn('logo.png', output_index.section('skipped_files'))
+        self.assertEqual(output_index.get('stats')['files_processed'], 2)
+
+        previous = self.processor.extract_content_from_previous_output(self.output)
+        self.assertEqual(previous['vibe_statement'], 'Friendlier greetings')
+        self.assertIn('return text.upper()', previous['file_blocks']['util/strings.py'])
+
+    def test_stale_index_falls_back_to_scanning(self):
+        with open(self.output, 'a', encoding='utf-8') as f:
+            f.write('\nEdited by hand\n')
+        self.assertTrue(index_path(self.output).exists())
+        self.assertIsNone(OutputIndex.load(self.output))
+
+        previous = self.processor.extract_content_from_previous_output(self.output)
+        self.assertEqual(previous['vibe_statement'], 'Friendlier greetings')
+        self.assertIn('Grüße', previous['file_blocks']['app.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
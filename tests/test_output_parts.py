@@ -0,0 +1,92 @@
+"""Tests for splitting the output into token-bounded parts"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.output_index import OutputIndex
+from repo2file.output_parts import part_path, plan_parts
+
+
+def module(name: str, imports=()) -> str:
+    lines = [f"from {target} import *" for target in imports]
+    lines += [f"def {name}_{i}(value):\n    return value + {i}\n" for i in range(100)]
+    return '\n'.join(lines)
+
+
+FILES = {
+    'core/models.py': module('model'),
+    'core/storage.py': module('store', ['core.models']),
+    'api/views.py': module('view', ['api.forms']),
+    'api/forms.py': module('form'),
+    'cli/main.py': module('command'),
+}
+
+
+class TestOutputParts(unittest.TestCase):
+    """Test part planning and the parts written by a run"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_plan_keeps_imports_together(self):
+        blocks = [('a.py', 40), ('x/b.py', 40), ('c.py', 40), ('y/d.py', 40), ('huge.py', 500)]
+        edges = {'a.py': {'y/d.py': 1.0}, 'x/b.py': {'c.py': 1.0}}
+        parts, unplaced = plan_parts(blocks, [100, 100, 100], edges)
+        self.assertEqual(parts, [['a.py', 'y/d.py'], ['x/b.py', 'c.py'], []])
+        self.assertEqual(unplaced, ['huge.py'])
+
+        # A cluster that fits no part whole is split up
+        parts, unplaced = plan_parts(blocks[:4], [90, 50], edges)
+        self.assertEqual(parts, [['a.py', 'y/d.py'], ['x/b.py']])
+        self.assertEqual(unplaced, ['c.py'])
+
+    def test_run_writes_bounded_parts(self):
+        profile = ProcessingProfile(name='default', token_budget=4000, model='gpt-4', output_parts=3)
+        processor = UltraRepo2File(profile)
+        scanned = processor.scan_files(self.repo, list(FILES))
+        output = self.work / 'output.txt'
+        processor.process_scanned_files(self.repo, output, scanned)
+
+        self.assertFalse(output.exists())
+        paths = [part_path(output, number) for number in range(1, 4) if part_path(output, number).exists()]
+        self.assertGreater(len(paths), 1)
+        seen = []
+        for number, path in enumerate(paths, start=1):
+            text = path.read_text()
+            self.assertLessEqual(processor.token_manager.count_tokens(text), 4000)
+            output_index = OutputIndex.load(path)
+            self.assertEqual(output_index.get('part'), number)
+            self.assertIn(f'## Output Part {number} of', output_index.section('parts'))
+            seen.extend(output_index.files)
+        self.assertEqual(len(seen), len(set(seen)))
+
+        first = OutputIndex.load(part_path(output, 1))
+        self.assertTrue(first.section('footer').lstrip().startswith('=' * 50))
+        self.assertEqual(first.get('stats')['files_processed'], len(seen))
+        # Imports stay together
+        for importer, imported in (('core/storage.py', 'core/models.py'), ('api/views.py', 'api/forms.py')):
+            if importer in seen and imported in seen:
+                self.assertEqual(self.part_of(output, importer), self.part_of(output, imported))
+
+    def part_of(self, output: Path, rel_path: str) -> int:
+        number = 1
+        while part_path(output, number).exists():
+            if rel_path in OutputIndex.load(part_path(output, number)).files:
+                return number
+            number += 1
+        return 0
+
+
+if __name__ == '__main__':
+    unittest.main()
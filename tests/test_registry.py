@@ -0,0 +1,138 @@
+"""Tests for the shared job/session registry"""
+import queue
+import unittest
+
+import redis
+
+from app.config import get_config
+from app.registry import InMemoryJobRegistry, RedisJobRegistry, END_OF_STREAM
+
+
+class TestInMemoryJobRegistry(unittest.TestCase):
+    """Test the in-memory registry used in place of Redis"""
+
+    def setUp(self):
+        self.registry = InMemoryJobRegistry()
+
+    def test_job_lifecycle(self):
+        """Test creating, updating and looking up jobs by session"""
+        self.registry.create_job('job-1', {'status': 'processing', 'session_id': 's1'})
+        self.registry.create_job('job-2', {'status': 'processing', 'session_id': None})
+
+        self.registry.update_job('job-1', status='completed', result={'copy_text': 'x'})
+
+        job = self.registry.get_job('job-1')
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['result'], {'copy_text': 'x'})
+        self.assertEqual(self.registry.job_ids_for_session('s1'), ['job-1'])
+        self.assertFalse(self.registry.job_exists('missing'))
+
+    def test_progress_queue(self):
+        """Test progress events are delivered in order and time out when empty"""
+        self.registry.create_job('job-1', {'status': 'processing'})
+        q = self.registry.progress_queue('job-1')
+        q.put({'phase': 'analyzing'})
+        q.put(END_OF_STREAM)
+
+        consumer = self.registry.progress_queue('job-1')
+        self.assertEqual(consumer.get(timeout=1), {'phase': 'analyzing'})
+        self.assertEqual(consumer.get(timeout=1), END_OF_STREAM)
+        with self.assertRaises(queue.Empty):
+            consumer.get(timeout=0.01)
+
+    def test_session_updates_are_isolated_copies(self):
+        """Test sessions are stored by value, like the Redis backend"""
+        session = {'id': 's1', 'iterations': [], 'current_phase': 'started'}
+        self.registry.save_session('s1', session)
+        session['iterations'].append({'iteration_number': 1})
+
+        self.assertEqual(self.registry.get_session('s1')['iterations'], [])
+
+        self.registry.update_session('s1', {'current_phase': 'processing_A'})
+        stored = self.registry.get_session('s1')
+        self.assertEqual(stored['current_phase'], 'processing_A')
+        self.assertEqual(stored['id'], 's1')
+
+
+class TestRedisJobRegistry(unittest.TestCase):
+    """Test that registries on separate connections (web workers) share state"""
+
+    PREFIX = 'test_registry:'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis_url = get_config().REDIS_URL
+        cls.redis_client = redis.Redis.from_url(cls.redis_url)
+
+    def setUp(self):
+        for key in self.redis_client.keys(f"{self.PREFIX}*"):
+            self.redis_client.delete(key)
+        # One registry per worker, each with its own connection, as create_registry builds them
+        self.worker_a = RedisJobRegistry(redis.Redis.from_url(self.redis_url), prefix=self.PREFIX)
+        self.worker_b = RedisJobRegistry(redis.Redis.from_url(self.redis_url), prefix=self.PREFIX)
+
+    def test_status_and_result_across_workers(self):
+        """Test a job started on one worker can be looked up and finished on another"""
+        self.worker_a.create_job('job-1', {'status': 'processing', 'session_id': 's1', 'progress': 0})
+        self.worker_a.create_job('job-2', {'status': 'processing', 'session_id': 's1'})
+
+        self.assertEqual(self.worker_b.get_job('job-1')['status'], 'processing')
+        self.assertEqual(sorted(self.worker_b.job_ids_for_session('s1')), ['job-1', 'job-2'])
+
+        self.worker_b.update_job('job-1', status='completed', result={'copy_text': 'x', 'tokens': 12})
+        job = self.worker_a.get_job('job-1')
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['result'], {'copy_text': 'x', 'tokens': 12})
+        self.assertEqual(job['progress'], 0)
+
+        # Updates never resurrect unknown jobs
+        self.worker_b.update_job('missing', status='completed')
+        self.assertFalse(self.worker_a.job_exists('missing'))
+
+    def test_progress_order_across_workers(self):
+        """Test events from one worker reach another's consumer in order"""
+        self.worker_a.create_job('job-1', {'status': 'processing'})
+        producer = self.worker_a.progress_queue('job-1')
+        for phase in ('scanning', 'analyzing', 'writing'):
+            producer.put({'phase': phase})
+        producer.put(END_OF_STREAM)
+
+        consumer = self.worker_b.progress_queue('job-1')
+        events = [consumer.get(timeout=1) for _ in range(4)]
+        self.assertEqual(events, [{'phase': 'scanning'}, {'phase': 'analyzing'},
+                                  {'phase': 'writing'}, END_OF_STREAM])
+        with self.assertRaises(queue.Empty):
+            consumer.get(timeout=1)
+
+    def test_loop_sessions_across_workers(self):
+        """Test loop session updates are visible to every worker"""
+        self.worker_a.save_session('s1', {'id': 's1', 'iterations': [], 'current_phase': 'started'})
+        self.worker_b.update_session('s1', {'current_phase': 'processing_A'})
+
+        stored = self.worker_a.get_session('s1')
+        self.assertEqual(stored['current_phase'], 'processing_A')
+        self.assertEqual(stored['iterations'], [])
+        self.assertFalse(self.worker_b.session_exists('s2'))
+
+    def test_save_session_replaces_like_in_memory(self):
+        """Test keys left out of a saved session are removed, as the in-memory registry does"""
+        for registry in (self.worker_a, InMemoryJobRegistry()):
+            registry.save_session('s1', {'id': 's1', 'current_phase': 'started', 'planner_output': 'plan'})
+            registry.save_session('s1', {'id': 's1', 'current_phase': 'processing_B'})
+            self.assertEqual(registry.get_session('s1'), {'id': 's1', 'current_phase': 'processing_B'})
+
+    def test_update_job_refreshes_ttl(self):
+        """Test updates keep a job alive, and never recreate one that expired"""
+        self.worker_a.create_job('job-1', {'status': 'processing'})
+        key = f"{self.PREFIX}job:job-1"
+        self.redis_client.expire(key, 5)
+        self.worker_b.update_job('job-1', status='completed')
+        self.assertGreater(self.redis_client.ttl(key), 5)
+
+        self.redis_client.delete(key)
+        self.worker_b.update_job('job-1', progress=100)
+        self.assertFalse(self.redis_client.exists(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
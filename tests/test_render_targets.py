@@ -0,0 +1,74 @@
+"""Tests for rendering several outputs from one scan"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import ProcessingProfile, RenderTarget, parse_target, render_targets
+from repo2file.instrumentation import Instrumentation
+
+FILES = {
+    'app.py': 'from util import shout\n\ndef main():\n    print(shout("hi"))\n',
+    'util.py': 'def shout(text):\n    return text.upper() + "!"\n',
+    'docs/notes.md': '# Notes\n\nNothing to see here.\n',
+}
+
+
+class TestRenderTargets(unittest.TestCase):
+    """Test that targets share a scan and differ in budget, model and sections"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_parse_target(self):
+        base = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                 vibe_statement='Louder', planner_output='Add exclamation marks')
+        target = parse_target('coder.txt,model=claude-3,budget=50000,truncation=basic,sections=coder', base)
+        self.assertEqual(target.output_path, Path('coder.txt'))
+        self.assertEqual((target.profile.model, target.profile.token_budget), ('claude-3', 50000))
+        self.assertEqual(target.profile.truncation_strategy, 'basic')
+        self.assertIsNone(target.profile.vibe_statement)
+        self.assertEqual(target.profile.planner_output, 'Add exclamation marks')
+        self.assertEqual(base.model, 'gpt-4')
+
+        self.assertIsNone(parse_target('planner.txt,sections=planner', base).profile.planner_output)
+        with self.assertRaises(ValueError):
+            parse_target('out.txt,colour=blue', base)
+
+    def test_one_scan_for_all_targets(self):
+        planner = ProcessingProfile(name='default', token_budget=100000, model='gemini-1.5-pro',
+                                    vibe_statement='Louder')
+        coder = ProcessingProfile(name='default', token_budget=50000, model='claude-3',
+                                  planner_output='Add exclamation marks', exclude_patterns=['docs/'])
+        instrumentation = Instrumentation()
+        processors = render_targets(self.repo, [
+            RenderTarget(planner, self.work / 'planner.txt'),
+            RenderTarget(coder, self.work / 'coder.txt'),
+        ], instrumentation=instrumentation)
+
+        self.assertEqual(instrumentation.summary()['stages']['scan']['count'], 1)
+        self.assertEqual([processor.token_manager.budget.total for processor in processors], [100000, 50000])
+
+        planner_output = (self.work / 'planner.txt').read_text()
+        self.assertIn('SECTION 1: FOR AI PLANNING AGENT', planner_output)
+        self.assertNotIn('SECTION 2: FOR AI CODING AGENT', planner_output)
+        self.assertIn('[[FILE_START: docs/notes.md]]', planner_output)
+
+        coder_output = (self.work / 'coder.txt').read_text()
+        self.assertIn('SECTION 2: FOR AI CODING AGENT', coder_output)
+        self.assertNotIn('SECTION 1: FOR AI PLANNING AGENT', coder_output)
+        self.assertIn('[[FILE_START: util.py]]', coder_output)
+        self.assertNotIn('docs/notes.md', coder_output)
+
+
+if __name__ == '__main__':
+    unittest.main()
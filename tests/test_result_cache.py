@@ -0,0 +1,135 @@
+"""Tests for the content-addressed result cache"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import redis
+
+from app.config import get_config
+from app.result_cache import ResultCache, build_cache_key, hash_directory
+
+
+class TestCacheKey(unittest.TestCase):
+    """Test cache key construction"""
+
+    def test_key_ignores_non_output_options(self):
+        """Session IDs and option ordering must not change the address"""
+        a = build_cache_key('commit:x@abc', 'ultra', 'text',
+                            {'file_types': ['py', 'js'], 'session_id': 's1', 'profile': ''})
+        b = build_cache_key('commit:x@abc', 'ultra', 'text',
+                            {'session_id': 's2', 'file_types': ['js', 'py']})
+        self.assertEqual(a, b)
+
+    def test_key_ignores_explicit_defaults(self):
+        """Sending a flag's default must hit the same entry as omitting it"""
+        omitted = build_cache_key('commit:x@abc', 'ultra', 'text', {'token_budget': 0})
+        explicit = build_cache_key('commit:x@abc', 'ultra', 'text',
+                                   {'token_budget': 0, 'include_tests': False, 'semantic_analysis': False})
+        self.assertEqual(omitted, explicit)
+        self.assertNotEqual(omitted, build_cache_key('commit:x@abc', 'ultra', 'text', {}))
+        self.assertNotEqual(omitted, build_cache_key('commit:x@abc', 'ultra', 'text',
+                                                     {'token_budget': 0, 'include_tests': True}))
+
+    def test_key_changes_with_snapshot_and_mode(self):
+        """Different commits or modes must not share entries"""
+        base = build_cache_key('commit:x@abc', 'ultra', 'text', {})
+        self.assertNotEqual(base, build_cache_key('commit:x@def', 'ultra', 'text', {}))
+        self.assertNotEqual(base, build_cache_key('commit:x@abc', 'smart', 'text', {}))
+
+    def test_hash_directory_is_content_based(self):
+        """Identical uploads hash the same regardless of write order or mtime"""
+        dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        try:
+            for d, names in zip(dirs, (['a.py', 'b.py'], ['b.py', 'a.py'])):
+                for name in names:
+                    with open(os.path.join(d, name), 'w') as f:
+                        f.write(f"# {name}\n")
+            self.assertEqual(hash_directory(dirs[0]), hash_directory(dirs[1]))
+
+            with open(os.path.join(dirs[1], 'a.py'), 'a') as f:
+                f.write("x = 1\n")
+            self.assertNotEqual(hash_directory(dirs[0]), hash_directory(dirs[1]))
+        finally:
+            for d in dirs:
+                shutil.rmtree(d)
+
+
+class TestResultCacheRedis(unittest.TestCase):
+    """Test result storage and single-flight claims against Redis"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis_client = redis.Redis.from_url(get_config().REDIS_URL, decode_responses=True)
+        cls.cache = ResultCache(cls.redis_client, prefix="test_result_cache:")
+
+    def setUp(self):
+        for key in self.redis_client.keys("test_result_cache:*"):
+            self.redis_client.delete(key)
+
+    def test_single_flight(self):
+        """Second identical submission joins the first until it is released"""
+        self.assertIsNone(self.cache.claim('k', 'job-1'))
+        self.assertEqual(self.cache.claim('k', 'job-2'), 'job-1')
+
+        # Only the owner can release the claim
+        self.cache.release('k', 'job-2')
+        self.assertEqual(self.cache.claim('k', 'job-3'), 'job-1')
+
+        self.cache.release('k', 'job-1')
+        self.assertIsNone(self.cache.claim('k', 'job-3'))
+
+    def test_store_and_get(self):
+        """Stored results round-trip"""
+        result = {'job_id': 'job-1', 'output_files': {'output.txt': 'outputs/job-1/output.txt'}}
+        self.assertIsNone(self.cache.get('k'))
+        self.cache.store('k', result)
+        self.assertEqual(self.cache.get('k'), result)
+        self.cache.invalidate('k')
+        self.assertIsNone(self.cache.get('k'))
+
+
+class TestUnpinnedCommitRelease(unittest.TestCase):
+    """Test a job whose branch moved on stops holding its single-flight claim"""
+
+    def setUp(self):
+        self.redis_client = redis.Redis.from_url(get_config().REDIS_URL, decode_responses=True)
+        self.cache = ResultCache(self.redis_client)
+        self.cache_key = 'test-unpinned-commit'
+        self.cache.release(self.cache_key, 'job-unpinned')
+        self.repo = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.cache.release(self.cache_key, 'job-unpinned')
+        shutil.rmtree(self.repo)
+
+    def test_claim_released_before_processing(self):
+        from app import tasks
+        from repo2file.cancellation import ProcessingCancelled
+
+        self.assertIsNone(self.cache.claim(self.cache_key, 'job-unpinned'))
+        claim_during_processing = []
+
+        def run_process(*args, **kwargs):
+            # Identical submissions must no longer be deduped onto this job
+            claim_during_processing.append(self.cache.claim(self.cache_key, 'job-next'))
+            self.cache.release(self.cache_key, 'job-next')
+            raise ProcessingCancelled()
+
+        with mock.patch.object(tasks, 'storage_manager_from_config'), \
+                mock.patch.object(tasks, 'prepare_input_repository', return_value=(self.repo, False)), \
+                mock.patch.object(tasks, 'run_process', side_effect=run_process):
+            result = tasks.process_repository_task.apply(
+                args=('local_path', self.repo),
+                kwargs={'additional_options': {'cache_key': self.cache_key, 'expected_commit': 'abc123'}},
+                task_id='job-unpinned',
+            ).get()
+
+        self.assertEqual(result['error_type'], 'ProcessingCancelled')
+        self.assertEqual(claim_during_processing, [None])
+        self.assertIsNone(self.cache.get(self.cache_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Tests for the BM25 query relevance index"""
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile
+from repo2file.search_index import SearchIndex, tokenize
+
+FILES = {
+    'billing/refunds.py': '''
+class RefundProcessor:
+    """Issue refunds for cancelled payments"""
+    def refund_payment(self, payment_id):
+        return self.gateway.refund(payment_id)
+''',
+    'billing/invoices.py': '''
+def render_invoice(order):
+    return f"Invoice for {order.id}"
+''',
+    'auth/session.py': '''
+def create_session(user):
+    """Log a user in"""
+    return {"user": user.id}
+''',
+    'README.md': 'Shop backend with billing and authentication.\n',
+}
+
+
+class TestSearchIndex(unittest.TestCase):
+    """Test BM25 scoring and incremental index maintenance"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def build_index(self, index_file=None) -> SearchIndex:
+        index = SearchIndex(index_file)
+        for rel_path in FILES:
+            path = self.repo / rel_path
+            index.add(rel_path, SearchIndex.stamp(path), path.read_text())
+        return index
+
+    def test_tokenize_splits_identifiers(self):
+        self.assertEqual(tokenize('getUserName refund_payments HTTPServer'),
+                         ['get', 'user', 'name', 'refund', 'payment', 'http', 'serv'])
+
+    def test_ranking_and_incremental_updates(self):
+        index_file = self.work / 'index.json'
+        index = self.build_index(index_file)
+        self.assertEqual(index.top('refunding cancelled payments')[0], ('billing/refunds.py', 1.0))
+        self.assertNotIn('auth/session.py', index.relevance('refunding cancelled payments'))
+
+        index.save()
+        reloaded = SearchIndex(index_file)
+        self.assertEqual(reloaded.score('user session'), index.score('user session'))
+
+        # Changed files are re-indexed, deleted ones dropped
+        session = self.repo / 'auth/session.py'
+        session.write_text('def refund_session(user):\n    return refund(user)\n')
+        os.utime(session, ns=(0, 0))
+        self.assertFalse(reloaded.is_current('auth/session.py', SearchIndex.stamp(session)))
+        reloaded.add('auth/session.py', SearchIndex.stamp(session), session.read_text())
+        reloaded.retain(['billing/refunds.py', 'auth/session.py'])
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual(set(reloaded.relevance('refund')), {'billing/refunds.py', 'auth/session.py'})
+        self.assertEqual(reloaded.score('invoice'), {})
+
+    def test_query_boosts_matching_files(self):
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4',
+                                    intended_query='refund a cancelled payment',
+                                    vibe_statement='Let users log in with a session')
+        processor = UltraRepo2File(profile)
+        processor.cache.cache_dir = self.work
+        scanned = processor.scan_files(self.repo, list(FILES))
+        output = self.work / 'output.txt'
+        processor.process_scanned_files(self.repo, output, scanned)
+
+        self.assertTrue(list(self.work.glob('search_index_*.json')))
+        text = output.read_text()
+        self.assertEqual(text.split('[[FILE_START: ', 2)[1].split(']]')[0], 'billing/refunds.py')
+        self.assertIn('Files Most Related to Your Vibe Statement', text)
+        self.assertIn('  - auth/session.py (relevance 1.00)', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
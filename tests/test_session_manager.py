@@ -0,0 +1,104 @@
+"""Tests for the Redis hash session store"""
+import json
+import unittest
+
+import redis
+
+from app.config import get_config
+from app.session_manager import SessionManager
+
+
+class TestSessionManager(unittest.TestCase):
+    """Test field-level updates, compression, listing and legacy migration"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis_client = redis.Redis.from_url(get_config().REDIS_URL, decode_responses=True)
+        cls.session_manager = SessionManager(cls.redis_client, prefix="test_session_manager:")
+
+    def setUp(self):
+        for key in self.redis_client.keys("test_session_manager:*"):
+            self.redis_client.delete(key)
+
+    def test_session_field_level_updates(self):
+        """Test that updates only touch the given fields"""
+        session_id = self.session_manager.create_session()
+
+        self.session_manager.update_session(session_id, {"a": 1})
+        self.session_manager.update_session(session_id, {"b": [1, 2]})
+
+        session_data = self.session_manager.get_session(session_id)
+        self.assertEqual(session_data['data'], {"a": 1, "b": [1, 2]})
+
+        # Stored as a hash with one field per data key
+        key = f"{self.session_manager.prefix}{session_id}"
+        self.assertEqual(self.redis_client.type(key), "hash")
+
+        self.session_manager.delete_session_data(session_id, "a")
+        self.assertIsNone(self.session_manager.get_session_data(session_id, "a"))
+        self.assertEqual(self.session_manager.get_session_data(session_id, "b"), [1, 2])
+
+    def test_session_large_field_compression(self):
+        """Test that large fields are compressed and round-trip intact"""
+        session_id = self.session_manager.create_session()
+        planner_output = "## Plan\n" + "- step\n" * 5000
+
+        self.session_manager.set_session_data(session_id, "planner_output", planner_output)
+
+        key = f"{self.session_manager.prefix}{session_id}"
+        raw = self.redis_client.hget(key, "d:planner_output")
+        self.assertTrue(raw.startswith("zlib:"))
+        self.assertLess(len(raw), len(planner_output))
+
+        retrieved = self.session_manager.get_session_data(session_id, "planner_output")
+        self.assertEqual(retrieved, planner_output)
+
+    def test_list_sessions(self):
+        """Test SCAN-based listing and pruning of expired index entries"""
+        session_ids = {self.session_manager.create_session() for _ in range(5)}
+
+        listed = {s['id'] for s in self.session_manager.list_sessions()}
+        self.assertEqual(listed, session_ids)
+
+        # Expire one session behind the manager's back
+        expired_id = session_ids.pop()
+        self.redis_client.delete(f"{self.session_manager.prefix}{expired_id}")
+
+        listed = {s['id'] for s in self.session_manager.list_sessions()}
+        self.assertEqual(listed, session_ids)
+        self.assertFalse(
+            self.redis_client.sismember(self.session_manager.index_key, expired_id)
+        )
+
+    def test_legacy_session_is_migrated(self):
+        """Test that a session stored as a JSON string is converted on read"""
+        key = f"{self.session_manager.prefix}legacy"
+        self.redis_client.set(key, json.dumps({
+            'id': 'legacy', 'created_at': '2024-01-01T00:00:00', 'data': {'vibe': 'calm'}
+        }))
+
+        self.assertEqual(self.session_manager.get_session_data('legacy', 'vibe'), 'calm')
+        self.assertEqual(self.redis_client.type(key), "hash")
+        self.assertEqual(self.session_manager.get_session('legacy')['created_at'], '2024-01-01T00:00:00')
+
+    def test_legacy_session_is_migrated_on_write(self):
+        """Test that writes and deletes to an unread JSON string session migrate it first"""
+        key = f"{self.session_manager.prefix}legacy"
+        self.redis_client.set(key, json.dumps({
+            'id': 'legacy', 'created_at': '2024-01-01T00:00:00', 'data': {'vibe': 'calm', 'plan': 'p'}
+        }))
+
+        self.session_manager.set_session_data('legacy', 'stage', 'B')
+        self.assertEqual(self.redis_client.type(key), "hash")
+        session_data = self.session_manager.get_session('legacy')
+        self.assertEqual(session_data['data'], {'vibe': 'calm', 'plan': 'p', 'stage': 'B'})
+        self.assertEqual(session_data['created_at'], '2024-01-01T00:00:00')
+
+        self.redis_client.delete(key)
+        self.redis_client.set(key, json.dumps({'id': 'legacy', 'data': {'vibe': 'calm', 'plan': 'p'}}))
+        self.session_manager.delete_session_data('legacy', 'plan')
+        self.assertEqual(self.session_manager.get_session('legacy')['data'], {'vibe': 'calm'})
+
+
+if __name__ == '__main__':
+    unittest.main()
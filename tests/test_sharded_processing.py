@@ -0,0 +1,64 @@
+"""Tests for sharded (map-reduce) repository processing"""
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import UltraRepo2File, ProcessingProfile, plan_shards
+
+
+class TestPlanShards(unittest.TestCase):
+    """Test splitting a file listing into bounded shards"""
+
+    def test_shards_respect_byte_and_file_limits(self):
+        files = [(f"src/f{i}.py", 100) for i in range(10)]
+        shards = plan_shards(files, max_shard_bytes=350, max_shard_files=100)
+        self.assertEqual([len(s) for s in shards], [3, 3, 3, 1])
+
+        shards = plan_shards(files, max_shard_bytes=10_000, max_shard_files=4)
+        self.assertEqual([len(s) for s in shards], [4, 4, 2])
+
+        # Every file lands in exactly one shard, in order
+        self.assertEqual([p for s in shards for p in s], [p for p, _ in files])
+
+    def test_oversized_file_gets_its_own_shard(self):
+        files = [("a.py", 10), ("big.bin", 1000), ("b.py", 10)]
+        self.assertEqual(plan_shards(files, 100, 100), [["a.py"], ["big.bin"], ["b.py"]])
+
+
+class TestShardedScan(unittest.TestCase):
+    """Test that scanning in shards and reducing matches a single scan"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        for i in range(6):
+            with open(os.path.join(self.repo, f"module_{i}.py"), 'w') as f:
+                f.write(f"def handler_{i}(x):\n    return x + {i}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def test_scan_then_reduce(self):
+        profile = ProcessingProfile(name='default', token_budget=100000, model='gpt-4')
+        processor = UltraRepo2File(profile)
+        repo_path = Path(self.repo)
+
+        listing = processor.list_repository_files(repo_path)
+        shards = plan_shards(listing, max_shard_bytes=10_000, max_shard_files=2)
+        self.assertEqual(len(shards), 3)
+
+        scanned = []
+        for rel_paths in shards:
+            scanned.extend(UltraRepo2File(profile).scan_files(repo_path, rel_paths))
+        self.assertEqual(sorted(d['rel_path'] for d in scanned), sorted(p for p, _ in listing))
+
+        output_path = repo_path / 'output.txt'
+        processor.process_scanned_files(repo_path, output_path, scanned)
+        output = output_path.read_text(encoding='utf-8')
+        for i in range(6):
+            self.assertIn(f"def handler_{i}(x):", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Tests for gzip-at-rest storage of job outputs"""
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from app.storage_manager import (
+    CONTENT_SHA256_METADATA_KEY, ENCODING_METADATA_KEY, GZIP_ENCODING,
+    UNCOMPRESSED_SIZE_METADATA_KEY, StorageManager
+)
+
+
+class FakeObject:
+    """What stat_object and fget_object return"""
+
+    def __init__(self, data, metadata, content_type):
+        self.data = data
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.last_modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.metadata = dict(metadata or {}, **{'Content-Type': content_type})
+
+
+class FakeResponse:
+    """What get_object returns: a readable body with response headers"""
+
+    def __init__(self, data, headers):
+        self._data = data
+        self._position = 0
+        self.headers = headers
+        self.closed = False
+
+    def read(self, amount=None):
+        end = len(self._data) if amount is None else self._position + amount
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """In-memory stand-in for the parts of the MinIO client StorageManager uses"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def bucket_exists(self, bucket_name):
+        return True
+
+    def put_object(self, bucket_name, object_name, data, length, content_type='application/octet-stream',
+                   metadata=None, part_size=0, num_parallel_uploads=1):
+        self.objects[object_name] = FakeObject(data.read(length), metadata, content_type)
+
+    def stat_object(self, bucket_name, object_name):
+        return self.objects[object_name]
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0):
+        obj = self.objects[object_name]
+        data = obj.data[offset:offset + length if length else None]
+        return FakeResponse(data, dict(obj.metadata, **{'Content-Length': str(len(data))}))
+
+    def fget_object(self, bucket_name, object_name, file_path):
+        obj = self.objects[object_name]
+        with open(file_path, 'wb') as f:
+            f.write(obj.data)
+        return obj
+
+
+class TestStorageCompression(unittest.TestCase):
+    """Test compressed uploads, their metadata, and both download paths"""
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.content = ''.join(f"line {i}: the quick brown fox\n" for i in range(5000)).encode('utf-8')
+        self.source = os.path.join(self.work, 'output.txt')
+        with open(self.source, 'wb') as f:
+            f.write(self.content)
+
+        self.storage = StorageManager(config={'MINIO_BUCKET_NAME': 'test', 'MINIO_PART_SIZE': 5 * 1024 * 1024})
+        self.storage._client = FakeMinio()
+        self.storage.upload_file_compressed(self.source, 'outputs/job-1/output.txt')
+        self.storage.upload_data(b'raw bytes', 'outputs/job-1/raw.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_upload_is_gzip_at_rest(self):
+        stored = self.storage.client.objects['outputs/job-1/output.txt']
+        self.assertEqual(gzip.decompress(stored.data), self.content)
+        self.assertLess(stored.size, len(self.content))
+        self.assertEqual(stored.metadata[ENCODING_METADATA_KEY], GZIP_ENCODING)
+        self.assertEqual(stored.metadata['Content-Type'], 'text/plain; charset=utf-8')
+
+    def test_object_info_metadata(self):
+        info = self.storage.get_object_info('outputs/job-1/output.txt')
+        self.assertEqual(info['encoding'], GZIP_ENCODING)
+        self.assertEqual(info['uncompressed_size'], len(self.content))
+        self.assertEqual(info['content_sha256'], hashlib.sha256(self.content).hexdigest())
+        stored = self.storage.client.objects['outputs/job-1/output.txt']
+        self.assertEqual(stored.metadata[UNCOMPRESSED_SIZE_METADATA_KEY], str(len(self.content)))
+        self.assertEqual(stored.metadata[CONTENT_SHA256_METADATA_KEY], info['content_sha256'])
+
+        raw = self.storage.get_object_info('outputs/job-1/raw.bin')
+        self.assertIsNone(raw['encoding'])
+        self.assertEqual(raw['uncompressed_size'], len(b'raw bytes'))
+
+    def test_passthrough_download(self):
+        stream, encoding, length = self.storage.open_download_stream(
+            'outputs/job-1/output.txt', accept_gzip=True, chunk_size=4096)
+        body = b''.join(stream)
+        self.assertEqual(encoding, GZIP_ENCODING)
+        self.assertEqual(length, len(body))
+        self.assertEqual(gzip.decompress(body), self.content)
+
+    def test_decompressing_download(self):
+        stream, encoding, length = self.storage.open_download_stream(
+            'outputs/job-1/output.txt', accept_gzip=False, chunk_size=4096)
+        self.assertIsNone(encoding)
+        self.assertEqual(length, len(self.content))
+        self.assertEqual(b''.join(stream), self.content)
+
+        stream, encoding, length = self.storage.open_download_stream(
+            'outputs/job-1/output.txt', byte_range=(100, 60000), chunk_size=4096)
+        self.assertEqual((encoding, length), (None, 59900))
+        self.assertEqual(b''.join(stream), self.content[100:60000])
+
+    def test_internal_reads_decode_transparently(self):
+        self.assertEqual(b''.join(self.storage.download_stream('outputs/job-1/output.txt', chunk_size=4096)),
+                         self.content)
+        self.assertEqual(self.storage.download_data('outputs/job-1/output.txt'), self.content)
+        self.assertEqual(self.storage.download_data('outputs/job-1/raw.bin'), b'raw bytes')
+
+        target = os.path.join(self.work, 'downloaded.txt')
+        self.storage.download_file('outputs/job-1/output.txt', target)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(target + '.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
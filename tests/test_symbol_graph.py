@@ -0,0 +1,105 @@
+"""Tests for the repository-wide import graph"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.code_analyzer import CodeAnalyzer
+from repo2file.symbol_graph import SymbolGraph, import_candidates, module_keys, pagerank
+
+FILES = {
+    'shop/models.py': '''
+class Order:
+    def total(self):
+        return sum(line.price for line in self.lines)
+''',
+    'shop/pricing.py': '''
+from shop.models import Order
+
+def apply_discount(order: Order, percent):
+    return order.total() * (1 - percent / 100)
+''',
+    'shop/checkout.py': '''
+from .pricing import apply_discount
+from shop import models
+
+def checkout(cart):
+    order = models.Order()
+    return apply_discount(order, cart.discount)
+''',
+    'scripts/report.py': '''
+def main():
+    print(format_report(load_rows()))
+''',
+    'web/src/components/Cart.js': '''
+import { formatPrice } from '../utils/format';
+import React from 'react';
+''',
+    'web/src/utils/format.js': '''
+export function formatPrice(cents) { return (cents / 100).toFixed(2); }
+''',
+}
+
+
+class TestSymbolGraph(unittest.TestCase):
+    """Test cross-file resolution, PageRank and incremental updates"""
+
+    def setUp(self):
+        self.work = Path(tempfile.mkdtemp())
+        self.analyzer = CodeAnalyzer()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def add(self, graph, rel_path, content, stamp='1:1'):
+        graph.add(rel_path, stamp, self.analyzer.analyze_file(Path(rel_path), content))
+
+    def build(self, graph_file=None) -> SymbolGraph:
+        graph = SymbolGraph(graph_file)
+        for rel_path, content in FILES.items():
+            self.add(graph, rel_path, content)
+        return graph
+
+    def test_module_resolution(self):
+        self.assertEqual(module_keys('shop/__init__.py'), ('shop',))
+        self.assertEqual(import_candidates('web/src/components/Cart.js', '../utils/format'),
+                         ('web.src.utils.format',))
+        self.assertEqual(import_candidates('a.py', 'shop.models.Order'),
+                         ('shop.models.Order', 'shop.models', 'shop'))
+        self.assertEqual(pagerank(2, [0], [1], [1.0])[1] > 0.5, True)
+
+    def test_edges_and_ranking(self):
+        graph = self.build()
+        self.assertEqual(graph.edges('shop/pricing.py'), {'shop/models.py': 1.0})
+        # Relative import resolved by suffix; models.Order() resolves through the import
+        self.assertEqual(graph.edges('shop/checkout.py'), {'shop/pricing.py': 1.5, 'shop/models.py': 1.5})
+        self.assertEqual(graph.edges('web/src/components/Cart.js'), {'web/src/utils/format.js': 1.0})
+        self.assertEqual(graph.dependents('shop/models.py'), ['shop/checkout.py', 'shop/pricing.py'])
+
+        importance = graph.importance()
+        self.assertEqual(max(importance, key=importance.get), 'shop/models.py')
+        self.assertGreater(importance['shop/pricing.py'], importance['shop/checkout.py'])
+        self.assertGreater(importance['web/src/utils/format.js'], importance['web/src/components/Cart.js'])
+
+    def test_incremental_updates_persist(self):
+        graph_file = self.work / 'graph.json'
+        graph = self.build(graph_file)
+        graph.ranks()
+        graph.save()
+
+        reloaded = SymbolGraph(graph_file)
+        self.assertEqual(reloaded.ranks(), graph.ranks())
+        self.assertTrue(reloaded.is_current('shop/models.py', '1:1'))
+
+        # A new file defining a called name gains a call edge from its caller
+        self.add(reloaded, 'scripts/formatting.py', 'def format_report(rows):\n    return rows\n')
+        self.assertEqual(reloaded.edges('scripts/report.py'), {'scripts/formatting.py': 0.5})
+
+        # Deleting a file removes the edges into it
+        reloaded.retain(path for path in FILES if path != 'shop/models.py')
+        self.assertEqual(reloaded.edges('shop/pricing.py'), {})
+        self.assertEqual(reloaded.edges('shop/checkout.py'), {'shop/pricing.py': 1.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests for the local similarity index"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.code_analyzer import CodeAnalyzer
+from repo2file.dump_ultra import ProcessingProfile, UltraRepo2File
+from repo2file.incremental_scanner import CACHE_DIRECTORY, IncrementalScanner
+from repo2file.vector_index import NUMPY_AVAILABLE, VectorIndex, blob_sha
+
+FILES = {
+    'billing/refunds.py': '''
+class RefundProcessor:
+    """Issue refunds for cancelled payments"""
+    def refund_payment(self, payment_id):
+        return self.gateway.refund(payment_id, reason="cancelled")
+''',
+    'billing/chargebacks.py': '''
+def dispute_payment(payment_id):
+    """Open a chargeback dispute for a payment"""
+    return gateway.refund(payment_id, reason="dispute")
+''',
+    'auth/session.py': '''
+def create_session(user):
+    """Log a user in and start a session"""
+    return {"user": user.id, "session": new_token()}
+''',
+}
+
+
+@unittest.skipUnless(NUMPY_AVAILABLE, "numpy not installed")
+class TestVectorIndex(unittest.TestCase):
+    """Test similarity queries and incremental updates keyed by blob"""
+
+    def setUp(self):
+        self.work = Path(tempfile.mkdtemp())
+        self.metadata_file = self.work / 'embeddings_cache.json'
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def build(self) -> VectorIndex:
+        index = VectorIndex(self.metadata_file, dimensions=256)
+        analyzer = CodeAnalyzer()
+        for rel_path, content in FILES.items():
+            entities = analyzer.analyze_file(Path(rel_path), content)['entities']
+            index.add(rel_path, '1:1', content, entities)
+        return index
+
+    def test_blob_sha_matches_git(self):
+        # git hash-object of "hello\n"
+        self.assertEqual(blob_sha(b'hello\n'), 'ce013625030ba8dba906f756967f9e9ca394464a')
+
+    def test_queries(self):
+        index = self.build()
+        self.assertEqual(index.similar_files('refund a cancelled payment', 1)[0][0], 'billing/refunds.py')
+        self.assertEqual([path for path, _ in index.related_files('billing/refunds.py', 1)],
+                         ['billing/chargebacks.py'])
+        path, name, similarity = index.similar_entities('start a user session', 1)[0]
+        self.assertEqual((path, name), ('auth/session.py', 'create_session'))
+        self.assertTrue(0 < similarity <= 1.0001)
+
+    def test_incremental_updates_persist(self):
+        index = self.build()
+        # Same content under another path shares the row
+        index.add('billing/refunds_copy.py', '1:1', FILES['billing/refunds.py'])
+        self.assertEqual(index._file_rows.size, 3)
+        index.save()
+
+        reloaded = VectorIndex(self.metadata_file, dimensions=256)
+        self.assertEqual(reloaded.similar_files('refund cancelled', 2), index.similar_files('refund cancelled', 2))
+        self.assertTrue(reloaded.is_current('auth/session.py', '1:1'))
+
+        # Changed content frees the old row for reuse; deleted files drop out
+        reloaded.add('auth/session.py', '2:2', 'def logout(user):\n    end_session(user)\n')
+        reloaded.retain(['billing/refunds.py', 'auth/session.py'])
+        self.assertEqual(reloaded._file_rows.size, 3)
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual([path for path, _ in reloaded.related_files('billing/refunds.py')], [])
+        self.assertEqual(reloaded.similar_files('logout', 1)[0][0], 'auth/session.py')
+
+
+@unittest.skipUnless(NUMPY_AVAILABLE, "numpy not installed")
+class TestScannerCacheExcluded(unittest.TestCase):
+    """Test the index files written into the repository are never scanned back in"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        self.work = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.work)
+
+    def test_second_run_ignores_cache_directory(self):
+        for run in range(2):
+            processor = UltraRepo2File(ProcessingProfile(
+                name='default', token_budget=100000, model='gpt-4', vibe_statement='refund cancelled payments'))
+            processor.cache.cache_dir = self.work
+            processor.process_repository(self.repo, self.work / 'output.txt')
+        self.assertTrue((self.repo / CACHE_DIRECTORY / 'embeddings_cache.json').exists())
+
+        output = (self.work / 'output.txt').read_text()
+        self.assertNotIn(CACHE_DIRECTORY, output)
+        index = IncrementalScanner(self.repo).open_vector_index()
+        self.assertEqual(len(index), len(FILES))
+        self.assertEqual(index.similar_files('refund cancelled payments', 1)[0][0], 'billing/refunds.py')
+
+
+if __name__ == '__main__':
+    unittest.main()
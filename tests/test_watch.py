@@ -0,0 +1,89 @@
+"""Tests for watch mode: patching the output as files change"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from repo2file.dump_ultra import ProcessingProfile
+from repo2file.file_watcher import open_watcher
+from repo2file.output_index import OutputIndex
+from repo2file.watch import WatchSession
+
+FILES = {
+    'app.py': 'from util import shout\n\ndef main():\n    print(shout("hi"))\n',
+    'util.py': 'def shout(text):\n    return text.upper() + "!"\n',
+    'lib/helpers.py': 'def whisper(text):\n    return text.lower()\n',
+}
+
+
+class TestWatch(unittest.TestCase):
+    """Test that changes patch only their blocks and the manifest, and additions re-render"""
+
+    def setUp(self):
+        self.repo = Path(tempfile.mkdtemp())
+        for rel_path, content in FILES.items():
+            path = self.repo / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        self.output = self.repo / 'context.txt'
+        profile = ProcessingProfile(name='watch', token_budget=100000, model='gemini-1.5-pro')
+        self.session = WatchSession(self.repo, self.output, profile)
+        self.session.start()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def test_modified_file_is_patched(self):
+        before = OutputIndex.load(self.output)
+        app_block = before.file_block('app.py')
+        (self.repo / 'util.py').write_text('def shout(text):\n    return text.upper() + "!!!"\n')
+
+        self.assertEqual(self.session.update({'util.py', 'context.txt'}), 'patched')
+        output_index = OutputIndex.load(self.output)
+        self.assertIsNotNone(output_index)
+        self.assertIn('"!!!"', output_index.file_content('util.py'))
+        self.assertEqual(output_index.file_block('app.py'), app_block)
+        self.assertEqual(output_index.files, before.files)
+        self.assertIn('util.py', output_index.section('manifest'))
+
+    def test_deleted_file_is_dropped(self):
+        processed = OutputIndex.load(self.output).get('stats')['files_processed']
+        shutil.rmtree(self.repo / 'lib')
+
+        self.assertEqual(self.session.update({'lib'}), 'patched')
+        output_index = OutputIndex.load(self.output)
+        self.assertNotIn('lib/helpers.py', output_index.files)
+        self.assertNotIn('lib/helpers.py', output_index.section('manifest'))
+        self.assertEqual(output_index.get('stats')['files_processed'], processed - 1)
+        self.assertNotIn('whisper', self.output.read_text())
+
+    def test_new_file_renders(self):
+        (self.repo / 'extra.py').write_text('VALUE = 42\n')
+        self.assertEqual(self.session.update({'extra.py'}), 'rendered')
+        self.assertIn('extra.py', OutputIndex.load(self.output).files)
+        self.assertEqual(self.session.update({'context.txt.index.json'}), 'unchanged')
+
+    def test_own_files(self):
+        for rel_path in ('context.txt', 'context.txt.index.json', 'context.txt.tmp', 'context_analysis.json',
+                         'context.r2fpack', 'context_part2.txt', 'context_part2.txt.index.json',
+                         '.betterrepo2file_cache/embeddings.db'):
+            self.assertTrue(self.session._is_own_file(rel_path), rel_path)
+        for rel_path in ('contexts.py', 'context.py', 'context_part2.py', 'lib/context.txt'):
+            self.assertFalse(self.session._is_own_file(rel_path), rel_path)
+
+    def test_file_sharing_output_prefix_is_patched(self):
+        (self.repo / 'contexts.py').write_text('CONTEXTS = []\n')
+        self.assertEqual(self.session.update({'contexts.py'}), 'rendered')
+        (self.repo / 'contexts.py').write_text('CONTEXTS = ["watch"]\n')
+        self.assertEqual(self.session.update({'contexts.py'}), 'patched')
+        self.assertIn('"watch"', OutputIndex.load(self.output).file_content('contexts.py'))
+
+    def test_watcher_reports_writes(self):
+        with open_watcher(self.repo, self.session._is_own_file) as watcher:
+            (self.repo / 'util.py').write_text('def shout(text):\n    return text\n')
+            self.session._render()
+            self.assertEqual(watcher.wait(debounce=0.1, timeout=2), {'util.py'})
+
+
+if __name__ == '__main__':
+    unittest.main()